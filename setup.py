@@ -7,10 +7,16 @@ setup(
     url="https://github.com/bruno-zizi/URLShortener",
     author="Bruno Zizi",
     author_email="bruno.zizi@email.com",
-    packages=["urlshortener", "urlshortener.algorithms", "urlshortener.repository"],
+    packages=[
+        "urlshortener",
+        "urlshortener.algorithms",
+        "urlshortener.bench",
+        "urlshortener.repository",
+    ],
     python_requires=">=3.10.1,<3.12",
     install_requires=[
         "pymongo == 4.6.1",
+        "motor == 3.3.2",
         "pytest == 8.0.0",
         "black == 24.1.1",
         "typer == 0.9.0",
@@ -18,5 +24,6 @@ setup(
         "setuptools == 69.0.3",
         "freezegun==1.4.0",
     ],
-    entry_points={"console_scripts": ["urlshortener = urlshortener.cli:run"]},
+    extras_require={"xxhash": ["xxhash == 3.4.1"]},
+    entry_points={"console_scripts": ["urlshortener = urlshortener.entrypoint:run"]},
 )
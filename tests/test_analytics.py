@@ -0,0 +1,114 @@
+import pytest
+
+from urlshortener.algorithms.sha256 import Sha256ShorteningAlgorithm
+from urlshortener.analytics import ClickAggregator, CountMinSketch
+from urlshortener.repository.click_stats_repository import (
+    InMemoryClickStatsRepository,
+)
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.repository.sqlite_click_stats_repository import (
+    SqliteClickStatsRepository,
+)
+from urlshortener.settings import ShortenerSettings
+from urlshortener.url_shortener import URLShortener
+
+
+class FailingClickStatsRepository(InMemoryClickStatsRepository):
+
+    def add_clicks(self, clicks: dict[str, int]):
+        raise ConnectionError("stats unavailable")
+
+
+def aggregator(repository, **kwargs) -> ClickAggregator:
+    options = dict(
+        flush_interval=3600, max_keys=10, top_keys=3, sketch_width=1024, sketch_depth=4
+    )
+    options.update(kwargs)
+    return ClickAggregator(repository, **options)
+
+
+def test_count_min_sketch_never_underestimates():
+    sketch = CountMinSketch(width=64, depth=4)
+    counts = {f"key-{i}": i % 7 + 1 for i in range(200)}
+
+    for key, count in counts.items():
+        sketch.add(key, count)
+
+    total = sum(counts.values())
+    for key, count in counts.items():
+        estimate = sketch.add(key, 0)
+        assert count <= estimate <= count + total
+
+
+def test_clicks_are_counted_exactly_and_flushed():
+    repository = InMemoryClickStatsRepository()
+    with aggregator(repository) as clicks:
+        for _ in range(3):
+            clicks.record("https://s.io/a")
+        clicks.record("https://s.io/b")
+        clicks.flush()
+        clicks.record("https://s.io/a")
+
+    assert repository.get_top_short_urls(5) == [
+        ("https://s.io/a", 4),
+        ("https://s.io/b", 1),
+    ]
+
+
+def test_heavy_hitters_of_the_tail_are_flushed():
+    repository = InMemoryClickStatsRepository()
+    with aggregator(repository, max_keys=2, top_keys=2) as clicks:
+        clicks.record("https://s.io/exact-1")
+        clicks.record("https://s.io/exact-2")
+        for i in range(100):
+            clicks.record(f"https://s.io/cold-{i}")
+            if i % 2:
+                clicks.record("https://s.io/hot")
+
+        assert len(clicks._heavy_hitters) == 2
+
+    hot = repository.get_clicks(["https://s.io/hot"])["https://s.io/hot"]
+    assert hot >= 50
+    assert repository.get_clicks(["https://s.io/exact-1"]) == {
+        "https://s.io/exact-1": 1
+    }
+    assert len(repository.get_top_short_urls(10)) == 4
+
+
+def test_failed_flushes_are_dropped():
+    with aggregator(FailingClickStatsRepository()) as clicks:
+        clicks.record("https://s.io/a")
+        clicks.flush()
+
+        assert not clicks._counts
+
+
+def test_expands_and_redirects_are_recorded():
+    repository = InMemoryClickStatsRepository()
+    algorithm = Sha256ShorteningAlgorithm()
+    with aggregator(repository) as clicks:
+        shortener = URLShortener(
+            repository=InMemoryURLRepository(ShortenerSettings(expiration_offset=60)),
+            clicks=clicks,
+        )
+        short_url = shortener.minify("https://www.example.com/", algorithm)
+
+        shortener.expand(short_url, algorithm)
+        shortener.resolve(short_url, algorithm)
+        shortener.expand_batch([short_url], algorithm)
+        shortener.expand("https://www.example.com/unknown", algorithm)
+
+    assert repository.get_top_short_urls(5) == [(short_url, 3)]
+
+
+@pytest.mark.parametrize("flushes", [1, 2])
+def test_sqlite_click_stats(tmp_path, flushes):
+    settings = ShortenerSettings(sqlite_path=str(tmp_path / "urls.db"))
+    with SqliteClickStatsRepository(settings) as repository:
+        for _ in range(flushes):
+            repository.add_clicks({"https://s.io/a": 2, "https://s.io/b": 5})
+
+        assert repository.get_top_short_urls(1) == [("https://s.io/b", 5 * flushes)]
+        assert repository.get_clicks(["https://s.io/a", "https://s.io/c"]) == {
+            "https://s.io/a": 2 * flushes
+        }
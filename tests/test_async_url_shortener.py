@@ -0,0 +1,216 @@
+import asyncio
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+
+import pytest
+from freezegun import freeze_time
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from urlshortener.algorithms.sha256 import Sha256ShorteningAlgorithm
+from urlshortener.async_url_shortener import AsyncURLShortener
+from urlshortener.repository.async_mongo_repository import AsyncMongoURLRepository
+from urlshortener.repository.memory_repository import AsyncInMemoryURLRepository
+from urlshortener.repository.mongo_repository import IndexMigrationError
+from urlshortener.repository.repository import ShortURLCollisionError
+from urlshortener.settings import ShortenerSettings
+
+
+@pytest.fixture()
+def repository():
+    return AsyncInMemoryURLRepository(ShortenerSettings(expiration_offset=60))
+
+
+class TestAsyncURLShortener:
+
+    def test_minify_then_expand(self, repository):
+        shortener = AsyncURLShortener(repository)
+        algorithm = Sha256ShorteningAlgorithm()
+
+        async def scenario():
+            short_url = await shortener.minify(
+                "https://www.example.com/test?q=123", algorithm
+            )
+            return short_url, await shortener.expand(short_url, algorithm)
+
+        short_url, original_url = asyncio.run(scenario())
+
+        assert short_url == "https://www.example.com/88cc9b88"
+        assert original_url == "https://www.example.com/test?q=123"
+
+    def test_minify_url_already_minified(self, repository):
+        shortener = AsyncURLShortener(repository)
+        algorithm = Mock(wraps=Sha256ShorteningAlgorithm())
+
+        async def scenario():
+            first = await shortener.minify("https://www.example.com/a", algorithm)
+            second = await shortener.minify("https://www.example.com/a", algorithm)
+            return first, second
+
+        first, second = asyncio.run(scenario())
+
+        assert first == second
+        # the second code was not stored: the url was already mapped
+        algorithm.release.assert_called_once()
+
+    def test_taken_codes_are_rehashed(self, repository):
+        shortener = AsyncURLShortener(repository, fixed_domain="https://s.io/")
+        algorithm = Sha256ShorteningAlgorithm()
+        taken = f"https://s.io/{algorithm.shorten('https://www.example.com/a')}"
+
+        async def scenario():
+            await repository.save_url_mapping(
+                "https://www.example.com/b", taken, "sha256"
+            )
+            return await shortener.minify("https://www.example.com/a", algorithm)
+
+        short_url = asyncio.run(scenario())
+
+        assert short_url == (
+            f"https://s.io/{algorithm.rehash('https://www.example.com/a', 1)}"
+        )
+
+    def test_gives_up_after_max_collision_retries(self):
+        repository = AsyncMock()
+        repository.get_or_create_short_url.side_effect = ShortURLCollisionError("")
+        shortener = AsyncURLShortener(repository, max_collision_retries=2)
+
+        with pytest.raises(ShortURLCollisionError):
+            asyncio.run(
+                shortener.minify(
+                    "https://www.example.com/a", Sha256ShorteningAlgorithm()
+                )
+            )
+
+        assert repository.get_or_create_short_url.await_count == 3
+
+    def test_in_memory_codes_are_unique(self, repository):
+        async def scenario():
+            await repository.save_url_mapping("https://a.com/", "s/abc", "sha256")
+            await repository.save_url_mapping("https://b.com/", "s/abc", "sha256")
+
+        with pytest.raises(ShortURLCollisionError):
+            asyncio.run(scenario())
+
+    def test_expired_url_is_not_expanded(self, repository):
+        shortener = AsyncURLShortener(repository, fixed_domain="https://s.io/")
+        algorithm = Sha256ShorteningAlgorithm()
+
+        with freeze_time("2024-01-01 00:00:00"):
+            short_url = asyncio.run(
+                shortener.minify("https://www.example.com/a", algorithm)
+            )
+        with freeze_time("2024-01-01 00:01:01"):
+            result = asyncio.run(shortener.expand(short_url, algorithm))
+
+        assert short_url.startswith("https://s.io/")
+        assert result == "not found or expired"
+
+    def test_concurrent_expands_share_one_loop(self, repository):
+        shortener = AsyncURLShortener(repository)
+        algorithm = Sha256ShorteningAlgorithm()
+
+        async def scenario():
+            urls = [f"https://www.example.com/{i}" for i in range(100)]
+            short_urls = await asyncio.gather(
+                *(shortener.minify(url, algorithm) for url in urls)
+            )
+            expanded = await asyncio.gather(
+                *(shortener.expand(short_url, algorithm) for short_url in short_urls)
+            )
+            return urls, expanded
+
+        urls, expanded = asyncio.run(scenario())
+
+        assert expanded == urls
+
+    def test_minify_url_invalid_algorithm(self, repository):
+        shortener = AsyncURLShortener(repository)
+
+        with pytest.raises(ValueError):
+            asyncio.run(shortener.minify("https://www.example.com", None))
+
+
+class TestAsyncMongoURLRepository:
+
+    @freeze_time("2024-01-01")
+    @patch("urlshortener.repository.async_mongo_repository.AsyncIOMotorClient")
+    def test_can_retrieve_original_url(self, mock_client):
+        mock_db = MagicMock()
+        mock_db.list_collection_names = AsyncMock(return_value=["urls"])
+        mock_collection = MagicMock()
+        mock_collection.create_index = AsyncMock()
+        mock_collection.find_one = AsyncMock(
+            return_value={"original_url": "https://www.example.com"}
+        )
+        mock_db.__getitem__.return_value = mock_collection
+        mock_client.return_value.__getitem__.return_value = mock_db
+        settings = ShortenerSettings(mongo_url_collection="urls")
+
+        async def scenario():
+            async with AsyncMongoURLRepository(settings) as repository:
+                return await repository.get_original_url("abc123", "BASE64")
+
+        assert asyncio.run(scenario()) == "https://www.example.com"
+        mock_collection.find_one.assert_awaited_once_with(
+            {
+                "short_url": "abc123",
+                "expiration_time": {"$gt": datetime(2024, 1, 1)},
+                "algorithm": "BASE64",
+            },
+            projection={"_id": False, "original_url": True},
+        )
+
+    @freeze_time("2024-01-01")
+    @patch("urlshortener.repository.async_mongo_repository.AsyncIOMotorClient")
+    def test_get_or_create_short_url_detects_collisions(self, mock_client):
+        mock_db = MagicMock()
+        mock_db.list_collection_names = AsyncMock(return_value=["urls"])
+        mock_collection = MagicMock()
+        mock_collection.create_index = AsyncMock()
+        mock_collection.find_one_and_update = AsyncMock(
+            side_effect=[
+                None,
+                DuplicateKeyError(
+                    "duplicate", 11000, {"keyPattern": {"algorithm": 1, "short_url": 1}}
+                ),
+            ]
+        )
+        mock_db.__getitem__.return_value = mock_collection
+        mock_client.return_value.__getitem__.return_value = mock_db
+        settings = ShortenerSettings(mongo_url_collection="urls")
+
+        async def scenario():
+            async with AsyncMongoURLRepository(settings) as repository:
+                created = await repository.get_or_create_short_url(
+                    "https://www.example.com/a", "abc123", "BASE64"
+                )
+                with pytest.raises(ShortURLCollisionError):
+                    await repository.get_or_create_short_url(
+                        "https://www.example.com/b", "abc123", "BASE64"
+                    )
+                return created
+
+        assert asyncio.run(scenario()) == ("abc123", True)
+
+    @patch("urlshortener.repository.async_mongo_repository.AsyncIOMotorClient")
+    def test_init_fails_on_the_indexes_of_older_versions(self, mock_client):
+        mock_db = MagicMock()
+        mock_db.list_collection_names = AsyncMock(return_value=["urls"])
+        mock_collection = MagicMock()
+        mock_collection.create_index = AsyncMock(
+            side_effect=OperationFailure("Index already exists", code=85)
+        )
+        mock_db.__getitem__.return_value = mock_collection
+        mock_client.return_value.__getitem__.return_value = mock_db
+        repository = AsyncMongoURLRepository(
+            ShortenerSettings(mongo_url_collection="urls")
+        )
+
+        with pytest.raises(IndexMigrationError):
+            asyncio.run(repository.initialize())
+
+    def test_repo_not_initialized_raises_an_error(self):
+        repository = AsyncMongoURLRepository(ShortenerSettings())
+
+        with pytest.raises(Exception):
+            asyncio.run(repository.get_short_url("http://www.example.com", "BASE64"))
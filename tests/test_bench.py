@@ -0,0 +1,41 @@
+from urlshortener.bench.runner import compare, measure, percentile
+from urlshortener.bench.workloads import WORKLOADS, zipf_keys
+
+
+class TestBench:
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+
+        assert percentile(samples, 0.50) == 51
+        assert percentile(samples, 0.99) == 100
+        assert percentile([], 0.99) == 0.0
+
+    def test_every_workload_can_be_measured(self):
+        for name, workload in WORKLOADS.items():
+            result = measure(name, workload, iterations=50, warmup=5)
+
+            assert result["name"] == name
+            assert result["operations"] == 50
+            assert result["ops_per_sec"] > 0
+            assert result["p50_us"] <= result["p95_us"] <= result["p99_us"]
+
+    def test_zipf_keys_favour_first_keys(self):
+        keys = zipf_keys(list(range(100)), count=10000, exponent=1.1)
+
+        assert keys.count(0) > keys.count(1) > keys.count(50)
+
+    def test_compare_reports_throughput_regressions(self):
+        baseline = [
+            {"name": "expand", "ops_per_sec": 1000},
+            {"name": "minify", "ops_per_sec": 1000},
+        ]
+        results = [
+            {"name": "expand", "ops_per_sec": 950},
+            {"name": "minify", "ops_per_sec": 800},
+            {"name": "new", "ops_per_sec": 1},
+        ]
+
+        regressions = compare(results, baseline, threshold=0.1)
+
+        assert regressions == ["minify: 800 ops/s < 1000 ops/s baseline"]
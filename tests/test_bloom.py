@@ -0,0 +1,133 @@
+from unittest.mock import Mock
+
+import pytest
+from freezegun import freeze_time
+
+from urlshortener.bloom import ScalableBloomFilter
+from urlshortener.repository.bloom_repository import BloomFilteredURLRepository
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.repository.repository import URLMapping
+from urlshortener.settings import ShortenerSettings
+
+
+class TestScalableBloomFilter:
+
+    def test_has_no_false_negatives_past_its_capacity(self):
+        bloom_filter = ScalableBloomFilter(capacity=100, error_rate=0.01)
+        keys = [f"https://s.io/{i}" for i in range(1000)]
+        for key in keys:
+            bloom_filter.add(key)
+
+        assert all(key in bloom_filter for key in keys)
+
+    def test_false_positive_rate_stays_below_error_rate(self):
+        bloom_filter = ScalableBloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(5000):
+            bloom_filter.add(f"issued-{i}")
+
+        false_positives = sum(f"unknown-{i}" in bloom_filter for i in range(10000))
+
+        assert false_positives / 10000 < 0.01
+
+    def test_add_reports_known_keys(self):
+        bloom_filter = ScalableBloomFilter(capacity=10, error_rate=0.01)
+
+        assert bloom_filter.add("a") is True
+        assert bloom_filter.add("a") is False
+        assert len(bloom_filter) == 1
+
+    def test_round_trips_through_bytes(self):
+        bloom_filter = ScalableBloomFilter(capacity=10, error_rate=0.01)
+        for i in range(50):
+            bloom_filter.add(str(i))
+
+        restored = ScalableBloomFilter.from_bytes(bloom_filter.to_bytes())
+
+        assert all(str(i) in restored for i in range(50))
+        assert len(restored) == len(bloom_filter)
+        assert (restored.capacity, restored.error_rate) == (10, 0.01)
+
+    def test_rejects_foreign_data(self):
+        with pytest.raises(ValueError):
+            ScalableBloomFilter.from_bytes(b"\0" * 64)
+
+
+class TestBloomFilteredURLRepository:
+
+    @pytest.fixture()
+    def settings(self, tmp_path):
+        return ShortenerSettings(
+            bloom_capacity=100,
+            bloom_path=str(tmp_path / "short_urls.bloom"),
+            bloom_refresh_interval=3600,
+        )
+
+    def test_unknown_short_url_does_not_reach_the_backend(self, settings):
+        backend = Mock(wraps=InMemoryURLRepository(settings))
+        with BloomFilteredURLRepository(backend, settings) as repository:
+            repository.save_url_mapping("https://www.example.com", "s/abc", "sha256")
+
+            assert repository.get_original_url("s/abc", "sha256")
+            assert repository.get_mapping_by_short_url("s/unknown", "sha256") is None
+            assert repository.get_original_urls(["s/unknown"], "sha256") == {}
+
+        backend.get_mapping_by_short_url.assert_not_called()
+        backend.get_original_urls.assert_not_called()
+
+    def test_is_built_from_the_backend(self, settings):
+        backend = InMemoryURLRepository(settings)
+        backend.save_url_mapping("https://www.example.com", "s/abc", "sha256")
+
+        with BloomFilteredURLRepository(backend, settings) as repository:
+            assert repository.get_original_url("s/abc", "sha256")
+
+    def test_restart_only_scans_recent_mappings(self, settings):
+        backend = Mock(wraps=InMemoryURLRepository(settings))
+        with freeze_time("2024-01-01"):
+            with BloomFilteredURLRepository(backend, settings) as repository:
+                repository.save_url_mapping("https://a.com", "s/a", "sha256")
+
+        with freeze_time("2024-01-02"):
+            with BloomFilteredURLRepository(backend, settings) as repository:
+                assert repository.get_mapping_by_short_url("s/a", "sha256")
+
+        first_scan, second_scan = backend.iter_url_mappings.call_args_list
+        assert first_scan.args == (settings.batch_size, None)
+        assert second_scan.args[1] is not None
+
+    def test_picks_up_mappings_of_other_processes_after_refresh(self, settings):
+        settings.bloom_refresh_interval = 0
+        backend = InMemoryURLRepository(settings)
+        with BloomFilteredURLRepository(backend, settings) as repository:
+            backend.save_url_mapping("https://www.example.com", "s/abc", "sha256")
+
+            assert repository.get_original_url("s/abc", "sha256")
+
+    def test_picks_up_mappings_restored_by_other_processes(self, settings):
+        settings.bloom_refresh_interval = 0
+        backend = InMemoryURLRepository(settings)
+        with freeze_time("2024-01-02"):
+            with BloomFilteredURLRepository(backend, settings) as repository:
+                # e.g. by import-snapshot, with a creation time before the scans
+                backend.restore_url_mappings(
+                    [
+                        URLMapping(
+                            "https://www.example.com",
+                            "s/abc",
+                            "sha256",
+                            1735689600,
+                            1672531200,
+                        )
+                    ]
+                )
+
+                assert repository.get_original_url("s/abc", "sha256")
+
+    def test_ignores_an_unreadable_file(self, settings):
+        with open(settings.bloom_path, "wb") as stream:
+            stream.write(b"garbage")
+        backend = InMemoryURLRepository(settings)
+        backend.save_url_mapping("https://www.example.com", "s/abc", "sha256")
+
+        with BloomFilteredURLRepository(backend, settings) as repository:
+            assert repository.get_original_url("s/abc", "sha256")
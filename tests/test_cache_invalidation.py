@@ -0,0 +1,187 @@
+import queue
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from freezegun import freeze_time
+from pymongo.errors import OperationFailure
+
+from urlshortener.repository.caching_repository import CachingURLRepository
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.repository.mongo_repository import (
+    MappingChangeStream,
+    MongoURLRepository,
+    to_url_mapping,
+)
+from urlshortener.repository.repository import MAPPINGS_RESET, URLMapping
+from urlshortener.settings import ShortenerSettings
+
+LIVE = 2**40
+
+
+def _settings(**overrides) -> ShortenerSettings:
+    return ShortenerSettings(
+        expiration_offset=60,
+        cache_invalidation_poll_interval=0.01,
+        cache_invalidation_batch_interval=0.01,
+        **overrides,
+    )
+
+
+def _eventually(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+class FakeChangeStream:
+    """Replays the changes put in `changes`, the way MappingChangeStream does."""
+
+    def __init__(self, changes: queue.Queue, resume_after):
+        self._changes = changes
+        self.resume_after = resume_after
+        self.resume_token = resume_after
+
+    def try_next(self):
+        try:
+            change = self._changes.get(timeout=0.01)
+        except queue.Empty:
+            return None
+        if isinstance(change, Exception):
+            raise change
+        self.resume_token = {"_data": id(change)}
+        return change
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class WatchedRepository(InMemoryURLRepository):
+    def __init__(self, settings: ShortenerSettings):
+        super().__init__(settings)
+        self.changes = queue.Queue()
+        self.streams = []
+
+    def watch_url_mappings(self, resume_after: dict = None, max_await_ms: int = 1000):
+        self.streams.append(FakeChangeStream(self.changes, resume_after))
+        return self.streams[-1]
+
+
+def test_writes_of_another_node_are_polled():
+    settings = _settings()
+    backend = InMemoryURLRepository(settings)
+    with (
+        CachingURLRepository(backend, settings, change_source=backend) as node,
+        CachingURLRepository(backend, settings) as other_node,
+    ):
+        other_node.save_url_mapping("https://a.com/", "https://s.io/old", "sha256")
+        assert node.get_short_url("https://a.com/", "sha256") == "https://s.io/old"
+
+        other_node.save_url_mapping("https://a.com/", "https://s.io/new", "sha256")
+
+        _eventually(
+            lambda: node.get_short_url("https://a.com/", "sha256") == "https://s.io/new"
+        )
+
+
+def test_streamed_changes_are_evicted_in_batches():
+    settings = _settings()
+    backend = WatchedRepository(settings)
+    with CachingURLRepository(backend, settings, change_source=backend) as cache:
+        backend.save_url_mapping("https://a.com/1", "https://s.io/1", "sha256")
+        backend.save_url_mapping("https://a.com/2", "https://s.io/2", "sha256")
+        assert cache.get_original_url("https://s.io/1", "sha256") == "https://a.com/1"
+        assert cache.get_original_url("https://s.io/2", "sha256") == "https://a.com/2"
+        cache.invalidate_mappings = MagicMock(wraps=cache.invalidate_mappings)
+
+        for mapping in backend.iter_url_mappings(batch_size=10):
+            backend.changes.put(mapping)
+
+        _eventually(lambda: cache.stats()["entries"] == 0)
+        cache.invalidate_mappings.assert_called_once()
+
+
+def test_reset_clears_the_cache():
+    settings = _settings()
+    backend = WatchedRepository(settings)
+    with CachingURLRepository(backend, settings, change_source=backend) as cache:
+        backend.save_url_mapping("https://a.com/", "https://s.io/1", "sha256")
+        assert cache.get_original_url("https://s.io/1", "sha256")
+
+        backend.changes.put(MAPPINGS_RESET)
+
+        _eventually(lambda: cache.stats()["entries"] == 0)
+
+
+def test_broken_stream_is_resumed_after_the_last_change():
+    settings = _settings()
+    backend = WatchedRepository(settings)
+    mapping = URLMapping("https://a.com/", "https://s.io/1", "sha256", LIVE, 0)
+    with CachingURLRepository(backend, settings, change_source=backend) as cache:
+        backend.changes.put(mapping)
+        _eventually(lambda: cache._invalidator.resume_token is not None)
+        backend.changes.put(ConnectionError("connection reset"))
+
+        _eventually(lambda: len(backend.streams) == 2)
+        assert backend.streams[0].resume_after is None
+        assert backend.streams[1].resume_after == {"_data": id(mapping)}
+
+
+def test_cached_entries_are_bounded_by_max_staleness():
+    settings = _settings(cache_max_staleness=2)
+    backend = MagicMock(wraps=InMemoryURLRepository(settings))
+    cache = CachingURLRepository(backend, settings)
+    with freeze_time("2024-01-01 00:00:00"):
+        cache.save_url_mapping("https://a.com/", "https://s.io/1", "sha256")
+        assert cache.get_original_url("https://s.io/1", "sha256")
+        assert cache.get_original_url("https://s.io/1", "sha256")
+    backend.get_mapping_by_short_url.assert_called_once()
+
+    with freeze_time("2024-01-01 00:00:03"):
+        assert cache.get_original_url("https://s.io/1", "sha256")
+    assert backend.get_mapping_by_short_url.call_count == 2
+
+
+class TestMappingChangeStream:
+
+    def test_changes_are_decoded(self):
+        stream = MagicMock()
+        stream.try_next.side_effect = [
+            {
+                "ns": {"coll": "urls"},
+                "fullDocument": {
+                    "_id": "id",
+                    "original_url": "https://a.com/",
+                    "short_url": "https://s.io/1",
+                    "algorithm": "sha256",
+                    "expiration_time": 20,
+                    "creation_time": 10,
+                },
+            },
+            {"ns": {"coll": "urls"}, "fullDocument": None},
+            {"ns": {"coll": "counters"}, "documentKey": {"_id": "urls.resets"}},
+            None,
+        ]
+        changes = MappingChangeStream(stream, "urls", to_url_mapping)
+
+        assert changes.try_next() == URLMapping(
+            "https://a.com/", "https://s.io/1", "sha256", 20, 10
+        )
+        assert changes.try_next() is None
+        assert changes.try_next() == MAPPINGS_RESET
+        assert changes.try_next() is None
+
+    def test_standalone_servers_cannot_be_watched(self):
+        repository = MongoURLRepository(ShortenerSettings())
+        repository._url_collection = MagicMock()
+        repository._counter_collection = MagicMock()
+        repository._url_collection.database.watch.side_effect = OperationFailure(
+            "The $changeStream stage is only supported on replica sets", code=40573
+        )
+
+        with pytest.raises(NotImplementedError):
+            repository.watch_url_mappings()
@@ -0,0 +1,106 @@
+from unittest.mock import MagicMock
+
+from freezegun import freeze_time
+
+from urlshortener.repository.caching_repository import CachingURLRepository
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.settings import ShortenerSettings
+
+
+def _caching_repository(**settings_overrides):
+    settings = ShortenerSettings(expiration_offset=60, **settings_overrides)
+    backend = MagicMock(wraps=InMemoryURLRepository(settings))
+    return CachingURLRepository(backend, settings), backend
+
+
+class TestCachingURLRepository:
+
+    def test_hot_short_url_is_served_from_cache(self):
+        repository, backend = _caching_repository()
+        repository.save_url_mapping("https://www.example.com", "abc123", "base-64")
+
+        assert repository.get_original_url("abc123", "base-64") == (
+            "https://www.example.com"
+        )
+        assert repository.get_original_url("abc123", "base-64") == (
+            "https://www.example.com"
+        )
+
+        backend.get_mapping_by_short_url.assert_called_once_with("abc123", "base-64")
+        assert repository.hits == 1
+        assert repository.misses == 1
+
+    def test_expired_mapping_is_not_served_from_cache(self):
+        repository, backend = _caching_repository()
+        with freeze_time("2024-01-01 00:00:00"):
+            repository.save_url_mapping("https://www.example.com", "abc123", "base-64")
+            assert repository.get_original_url("abc123", "base-64")
+
+        with freeze_time("2024-01-01 00:01:01"):
+            assert repository.get_original_url("abc123", "base-64") is None
+
+        assert backend.get_mapping_by_short_url.call_count == 2
+
+    def test_unknown_short_url_is_negatively_cached(self):
+        repository, backend = _caching_repository(cache_negative_ttl=5)
+
+        with freeze_time("2024-01-01 00:00:00"):
+            assert repository.get_original_url("unknown", "base-64") is None
+            assert repository.get_original_url("unknown", "base-64") is None
+        backend.get_mapping_by_short_url.assert_called_once()
+
+        with freeze_time("2024-01-01 00:00:06"):
+            assert repository.get_original_url("unknown", "base-64") is None
+        assert backend.get_mapping_by_short_url.call_count == 2
+
+    def test_save_invalidates_cached_entries(self):
+        repository, _ = _caching_repository()
+        assert repository.get_original_url("abc123", "base-64") is None
+        repository.save_url_mapping("https://www.example.com", "abc123", "base-64")
+        assert repository.get_short_url("https://www.example.com", "base-64") == (
+            "abc123"
+        )
+
+        repository.save_url_mapping("https://www.example.com", "def456", "base-64")
+
+        assert repository.get_original_url("abc123", "base-64") is None
+        assert repository.get_original_url("def456", "base-64") == (
+            "https://www.example.com"
+        )
+        assert repository.get_short_url("https://www.example.com", "base-64") == (
+            "def456"
+        )
+
+    def test_reset_clears_the_cache(self):
+        repository, _ = _caching_repository()
+        repository.save_url_mapping("https://www.example.com", "abc123", "base-64")
+        assert repository.get_original_url("abc123", "base-64")
+
+        repository.reset()
+
+        assert repository.get_original_url("abc123", "base-64") is None
+
+    def test_least_recently_used_entries_are_evicted(self):
+        repository, backend = _caching_repository(cache_max_entries=2)
+        for code in ["a", "b", "c"]:
+            repository.save_url_mapping(f"https://www.example.com/{code}", code, "x")
+            repository.get_original_url(code, "x")
+
+        repository.get_original_url("a", "x")
+
+        assert repository.evictions == 2
+        assert backend.get_mapping_by_short_url.call_count == 4
+
+    def test_batch_lookup_only_loads_misses(self):
+        repository, backend = _caching_repository()
+        repository.save_url_mapping("https://www.example.com/a", "a", "x")
+        repository.save_url_mapping("https://www.example.com/b", "b", "x")
+        repository.get_original_url("a", "x")
+
+        result = repository.get_original_urls(["a", "b"], "x")
+
+        backend.get_original_urls.assert_called_once_with(["b"], "x")
+        assert result == {
+            "a": "https://www.example.com/a",
+            "b": "https://www.example.com/b",
+        }
@@ -4,8 +4,28 @@ import pytest
 import typer
 
 from urlshortener.algorithms.sha256 import Sha256ShorteningAlgorithm
-from urlshortener.cli import main
+from urlshortener.batch import OutputFormat
+from urlshortener.cli import (
+    build_index,
+    export_snapshot,
+    fill_key_pool,
+    import_snapshot,
+    import_urls,
+    main,
+    migrate,
+    purge,
+    rebalance,
+    stats,
+)
+from urlshortener.mmap_index import MmapIndex
 from urlshortener.repository.mongo_repository import MongoURLRepository
+from urlshortener.repository.repository import ShortURLCollisionError
+from urlshortener.repository.sqlite_click_stats_repository import (
+    SqliteClickStatsRepository,
+)
+from urlshortener.repository.sqlite_repository import SqliteURLRepository
+from urlshortener.settings import ShortenerSettings
+from urlshortener.snapshot import SnapshotFormat
 
 
 @pytest.fixture()
@@ -23,7 +43,7 @@ def mock_mongo_repository(monkeypatch):
 @pytest.fixture(scope="function")
 def mock_url_shortener():
     fake_shortener = MagicMock()
-    with patch("urlshortener.cli.URLShortener") as url_shortener_mock:
+    with patch("urlshortener.factory.URLShortener") as url_shortener_mock:
         url_shortener_mock.return_value = fake_shortener
         yield fake_shortener
 
@@ -31,7 +51,9 @@ def mock_url_shortener():
 @pytest.fixture()
 def mock_algorithm_factory():
     fake_factory = MagicMock()
-    with patch("urlshortener.cli.ShorteningAlgorithmFactory") as algorithm_factory_mock:
+    with patch(
+        "urlshortener.factory.ShorteningAlgorithmFactory"
+    ) as algorithm_factory_mock:
         algorithm_factory_mock.return_value = fake_factory
         fake_factory.get.return_value = Sha256ShorteningAlgorithm()
         yield fake_factory
@@ -81,6 +103,42 @@ class TestCLI:
         )
         mock_url_shortener.expand.assert_not_called()
 
+    def test_minify_without_a_free_code_fails(
+        self, capsys, mock_mongo_repository, mock_url_shortener, mock_algorithm_factory
+    ):
+        mock_url_shortener.minify.side_effect = ShortURLCollisionError("no free code")
+
+        with pytest.raises(typer.Exit) as exc_info:
+            main(url_to_minify="https://www.example.com/lorem/ipsum")
+
+        assert exc_info.value.exit_code == 1
+        assert capsys.readouterr().err == "Error: no free code\n"
+
+    def test_minify_batch_reports_urls_without_a_free_code(
+        self,
+        tmp_path,
+        capsys,
+        mock_mongo_repository,
+        mock_url_shortener,
+        mock_algorithm_factory,
+    ):
+        mock_url_shortener.minify_batch.side_effect = ShortURLCollisionError(
+            "no free code", original_urls=["https://www.example.com/b"]
+        )
+        mock_url_shortener.minify.side_effect = [
+            "https://www.example.com/1",
+            ShortURLCollisionError("no free code"),
+        ]
+        urls_file = tmp_path / "urls.txt"
+        urls_file.write_text("https://www.example.com/a\nhttps://www.example.com/b\n")
+
+        main(minify_file=str(urls_file))
+
+        assert capsys.readouterr().out.splitlines() == [
+            "https://www.example.com/a\thttps://www.example.com/1",
+            "https://www.example.com/b\terror: No free short url found",
+        ]
+
     def test_shortener_expand_is_invoked(
         self, mock_mongo_repository, mock_url_shortener, mock_algorithm_factory
     ):
@@ -93,3 +151,166 @@ class TestCLI:
             short_url="https://www.example.com/a1RRsfs", algorithm=the_algorithm
         )
         mock_url_shortener.minify.assert_not_called()
+
+    def test_shortener_minify_batch_is_invoked(
+        self,
+        tmp_path,
+        capsys,
+        mock_mongo_repository,
+        mock_url_shortener,
+        mock_algorithm_factory,
+    ):
+        the_algorithm = Sha256ShorteningAlgorithm()
+        mock_algorithm_factory.get.return_value = the_algorithm
+        mock_url_shortener.minify_batch.return_value = {
+            "https://www.example.com/a": "https://www.example.com/1"
+        }
+        urls_file = tmp_path / "urls.txt"
+        urls_file.write_text("https://www.example.com/a\n\nnot-a-url\n")
+
+        main(minify_file=str(urls_file), output_format=OutputFormat.NDJSON)
+
+        mock_url_shortener.minify_batch.assert_called_once_with(
+            urls=["https://www.example.com/a"], algorithm=the_algorithm
+        )
+        assert capsys.readouterr().out.splitlines() == [
+            '{"url": "https://www.example.com/a", '
+            '"short_url": "https://www.example.com/1"}',
+            '{"url": "not-a-url", "error": "\'not-a-url\' is not a valid URL"}',
+        ]
+
+    def test_shortener_expand_batch_is_invoked(
+        self,
+        tmp_path,
+        capsys,
+        mock_mongo_repository,
+        mock_url_shortener,
+        mock_algorithm_factory,
+    ):
+        mock_url_shortener.expand_batch.return_value = {
+            "https://www.example.com/1": "https://www.example.com/a"
+        }
+        urls_file = tmp_path / "urls.txt"
+        urls_file.write_text("https://www.example.com/1\nhttps://www.example.com/2\n")
+
+        main(expand_file=str(urls_file), batch_size=1)
+
+        assert mock_url_shortener.expand_batch.call_count == 2
+        assert capsys.readouterr().out.splitlines() == [
+            "https://www.example.com/1\thttps://www.example.com/a",
+            "https://www.example.com/2\tnot found or expired",
+        ]
+
+    def test_migrate_command(self, mock_mongo_repository, capsys):
+        mock_mongo_repository.migrate_indexes.return_value = 3
+        mock_mongo_repository.migrate_expiration_dates.return_value = 42
+
+        migrate(batch_size=10)
+
+        mock_mongo_repository.migrate_indexes.assert_called_once_with(batch_size=10)
+        mock_mongo_repository.migrate_expiration_dates.assert_called_once_with(
+            batch_size=10
+        )
+        assert capsys.readouterr().out == (
+            "3 duplicate url mappings deleted\n42 url mappings migrated\n"
+        )
+
+    def test_purge_command(self, monkeypatch, tmp_path, capsys):
+        monkeypatch.setenv("urlshortener_storage_backend", "sqlite")
+        monkeypatch.setenv("urlshortener_sqlite_path", str(tmp_path / "urls.db"))
+
+        purge(batch_size=10)
+
+        assert capsys.readouterr().out == "0 expired url mappings purged\n"
+
+    def test_purge_command_requires_sqlite(self):
+        with pytest.raises(typer.BadParameter):
+            purge(batch_size=10)
+
+    def test_import_command(self, monkeypatch, tmp_path, capsys):
+        monkeypatch.setenv("urlshortener_storage_backend", "sqlite")
+        monkeypatch.setenv("urlshortener_sqlite_path", str(tmp_path / "urls.db"))
+        monkeypatch.setenv("urlshortener_shortening_algorithm", "sha256")
+        path = tmp_path / "urls.txt"
+        path.write_text("https://a.com/\nhttps://b.com/\nhttps://a.com/\n")
+
+        import_urls(
+            path=str(path),
+            work_dir=None,
+            workers=1,
+            write_workers=2,
+            partitions=2,
+            batch_size=10,
+        )
+
+        assert capsys.readouterr().out == (
+            "2 url mappings created, 0 existing, 0 rehashed, 0 invalid, 0 failed\n"
+        )
+
+    def test_rebalance_command_requires_shards(self):
+        with pytest.raises(typer.BadParameter):
+            rebalance(batch_size=10)
+
+    def test_stats_command(self, monkeypatch, tmp_path, capsys):
+        monkeypatch.setenv("urlshortener_storage_backend", "sqlite")
+        monkeypatch.setenv("urlshortener_sqlite_path", str(tmp_path / "urls.db"))
+        with SqliteClickStatsRepository(ShortenerSettings()) as repository:
+            repository.add_clicks({"https://s.io/a": 2, "https://s.io/b": 5})
+
+        stats(short_urls=None, top=1)
+        stats(short_urls=["https://s.io/a", "https://s.io/c"], top=10)
+
+        assert capsys.readouterr().out == (
+            "5\thttps://s.io/b\n2\thttps://s.io/a\n0\thttps://s.io/c\n"
+        )
+
+    def test_fill_key_pool_command(self, monkeypatch, tmp_path, capsys):
+        monkeypatch.setenv("urlshortener_storage_backend", "sqlite")
+        monkeypatch.setenv("urlshortener_sqlite_path", str(tmp_path / "urls.db"))
+
+        fill_key_pool(depth=100)
+        fill_key_pool(depth=150)
+
+        assert capsys.readouterr().out == (
+            "100 codes added, 100 free\n50 codes added, 150 free\n"
+        )
+
+    def test_export_and_import_snapshot_commands(self, monkeypatch, tmp_path, capsys):
+        monkeypatch.setenv("urlshortener_storage_backend", "sqlite")
+        monkeypatch.setenv("urlshortener_sqlite_path", str(tmp_path / "urls.db"))
+        with SqliteURLRepository(ShortenerSettings()) as repository:
+            repository.save_url_mappings(
+                {
+                    "https://a.com/": "https://s.io/a",
+                    "https://b.com/": "https://s.io/b",
+                },
+                "sha256",
+            )
+        path = str(tmp_path / "urls.snapshot")
+
+        export_snapshot(path=path, snapshot_format=SnapshotFormat.BINARY, batch_size=1)
+        monkeypatch.setenv("urlshortener_sqlite_path", str(tmp_path / "copy.db"))
+        import_snapshot(path=path, write_workers=2, batch_size=1)
+
+        assert capsys.readouterr().out == (
+            "2 url mappings exported\n"
+            "2 url mappings restored, 0 expired, 0 collisions\n"
+        )
+        with SqliteURLRepository(ShortenerSettings()) as repository:
+            assert repository.get_original_url("https://s.io/b", "sha256") == (
+                "https://b.com/"
+            )
+
+    def test_build_index_command(self, monkeypatch, tmp_path, capsys):
+        monkeypatch.setenv("urlshortener_storage_backend", "sqlite")
+        monkeypatch.setenv("urlshortener_sqlite_path", str(tmp_path / "urls.db"))
+        with SqliteURLRepository(ShortenerSettings()) as repository:
+            repository.save_url_mappings({"https://a.com/": "https://s.io/a"}, "sha256")
+        path = str(tmp_path / "urls.index")
+
+        build_index(path=path, batch_size=10)
+
+        assert capsys.readouterr().out == "1 url mappings indexed\n"
+        assert MmapIndex(path).get_original_url("https://s.io/a", "sha256", 0) == (
+            "https://a.com/"
+        )
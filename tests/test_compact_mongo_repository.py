@@ -0,0 +1,304 @@
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import bson
+import pytest
+from freezegun import freeze_time
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from urlshortener.repository.compact_mongo_repository import (
+    CompactMongoURLRepository,
+    migrate_to_compact_schema,
+    original_url_hash,
+)
+from urlshortener.repository.mongo_repository import to_bson_date
+from urlshortener.repository.repository import ShortURLCollisionError, URLMapping
+from urlshortener.settings import ShortenerSettings
+
+
+@pytest.fixture()
+def repository():
+    with patch("pymongo.MongoClient"):
+        repository = CompactMongoURLRepository(ShortenerSettings())
+        with repository:
+            repository._url_collection = MagicMock()
+            repository._namespace_collection = MagicMock()
+            repository._namespace_collection.find.return_value = [
+                {"_id": 1, "algorithm": "sha256", "domain": "https://s.io/"}
+            ]
+            repository._counter_collection = MagicMock()
+            repository._counter_collection.find_one_and_update.return_value = {
+                "value": 2
+            }
+            yield repository
+
+
+def test_original_url_hash_fits_in_an_int64():
+    url_hash = original_url_hash("https://www.example.com", "sha256")
+
+    assert -(2**63) <= url_hash < 2**63
+    assert url_hash == original_url_hash("https://www.example.com", "sha256")
+    assert url_hash != original_url_hash("https://www.example.com", "base-64")
+
+
+@freeze_time("2024-01-01")
+def test_mapping_is_stored_under_its_code(repository):
+    repository.save_url_mapping("https://s.io/page", "https://s.io/abc", "sha256")
+
+    (replaces,), _ = repository._url_collection.bulk_write.call_args
+    url_hash = original_url_hash("https://s.io/page", "sha256")
+    assert replaces[0]._filter == {"_id": "1:abc", "h": url_hash}
+    assert replaces[0]._doc == {
+        "_id": "1:abc",
+        "h": url_hash,
+        "u": "https://s.io/page",
+        "e": datetime(2024, 1, 1) + timedelta(seconds=repository._expiration_offset),
+        "c": datetime(2024, 1, 1),
+    }
+    repository._namespace_collection.insert_one.assert_not_called()
+
+
+def test_new_domains_get_a_namespace(repository):
+    repository.save_url_mapping("https://a.com/page", "https://a.com/abc", "sha256")
+
+    repository._namespace_collection.insert_one.assert_called_once_with(
+        {"_id": 2, "algorithm": "sha256", "domain": "https://a.com/"}
+    )
+    (replaces,), _ = repository._url_collection.bulk_write.call_args
+    assert replaces[0]._doc["_id"] == "2:abc"
+
+
+def _hash_conflict() -> BulkWriteError:
+    # the url is already stored under another code
+    return BulkWriteError(
+        {"writeErrors": [{"index": 0, "code": 11000, "keyPattern": {"h": 1}}]}
+    )
+
+
+def _stored_doc(url: str, code: str) -> dict:
+    return {
+        "_id": f"1:{code}",
+        "h": original_url_hash(url, "sha256"),
+        "u": url,
+        "e": to_bson_date(2000000000),
+        "c": to_bson_date(1700000000),
+    }
+
+
+def test_url_is_moved_to_its_new_code(repository):
+    collection = repository._url_collection
+    collection.bulk_write.side_effect = _hash_conflict()
+    collection.find_one.return_value = _stored_doc("https://s.io/page", "old")
+
+    repository.save_url_mapping("https://s.io/page", "https://s.io/new", "sha256")
+
+    collection.delete_one.assert_called_once_with(
+        {"_id": "1:old", "u": "https://s.io/page", "e": to_bson_date(2000000000)}
+    )
+    assert collection.insert_one.call_args.args[0]["_id"] == "1:new"
+
+
+def test_moved_url_keeps_its_mapping_when_the_new_code_is_taken(repository):
+    collection = repository._url_collection
+    collection.bulk_write.side_effect = _hash_conflict()
+    previous = _stored_doc("https://s.io/page", "old")
+    collection.find_one.return_value = previous
+    collection.insert_one.side_effect = [DuplicateKeyError("taken"), None]
+
+    with pytest.raises(ShortURLCollisionError) as exc_info:
+        repository.save_url_mapping("https://s.io/page", "https://s.io/new", "sha256")
+
+    assert exc_info.value.original_urls == ["https://s.io/page"]
+    assert collection.insert_one.call_args.args[0] == previous
+
+
+def test_url_with_the_hash_of_another_is_not_stored(repository):
+    collection = repository._url_collection
+    collection.bulk_write.side_effect = _hash_conflict()
+    collection.find_one.return_value = _stored_doc("https://s.io/other", "abc")
+
+    with pytest.raises(ShortURLCollisionError):
+        repository.save_url_mapping("https://s.io/page", "https://s.io/new", "sha256")
+
+    collection.delete_one.assert_not_called()
+    collection.insert_one.assert_not_called()
+
+
+def test_short_url_is_reassembled_from_its_namespace(repository):
+    repository._url_collection.find_one.return_value = {
+        "_id": "1:abc",
+        "h": original_url_hash("https://s.io/page", "sha256"),
+        "u": "https://s.io/page",
+        "e": to_bson_date(2000000000),
+        "c": to_bson_date(1700000000),
+    }
+
+    mapping = repository.get_mapping_by_short_url("https://s.io/abc", "sha256")
+
+    repository._url_collection.find_one.assert_called_once_with(
+        {"_id": {"$in": ["1:abc"]}}
+    )
+    assert mapping == URLMapping(
+        "https://s.io/page", "https://s.io/abc", "sha256", 2000000000, 1700000000
+    )
+    assert repository.get_mapping_by_short_url("https://t.io/abc", "sha256") is None
+
+
+def test_original_url_with_the_same_hash_is_not_a_match(repository):
+    repository._url_collection.find_one.return_value = {
+        "_id": "1:abc",
+        "h": original_url_hash("https://s.io/page", "sha256"),
+        "u": "https://s.io/other",
+        "e": to_bson_date(2000000000),
+        "c": to_bson_date(1700000000),
+    }
+
+    assert repository.get_short_url("https://s.io/page", "sha256") is None
+
+
+@freeze_time("2024-01-01")
+def test_get_or_create_is_one_round_trip(repository):
+    collection = repository._url_collection
+    collection.find_one_and_update.return_value = None
+
+    created = repository.get_or_create_short_url(
+        "https://s.io/page", "https://s.io/abc", "sha256"
+    )
+
+    assert created == ("https://s.io/abc", True)
+    (query, update), kwargs = collection.find_one_and_update.call_args
+    assert query == {
+        "_id": "1:abc",
+        "h": original_url_hash("https://s.io/page", "sha256"),
+    }
+    assert kwargs["upsert"] is True
+    assert set(update[0]["$set"]) == {"u", "e", "c"}
+    collection.find_one.assert_not_called()
+
+
+@freeze_time("2024-01-01")
+def test_get_or_create_returns_the_live_mapping_under_another_code(repository):
+    collection = repository._url_collection
+    collection.find_one_and_update.side_effect = DuplicateKeyError(
+        "duplicate", 11000, {"keyPattern": {"h": 1}}
+    )
+    collection.find_one.return_value = _stored_doc("https://s.io/page", "old")
+
+    created = repository.get_or_create_short_url(
+        "https://s.io/page", "https://s.io/new", "sha256"
+    )
+
+    assert created == ("https://s.io/old", False)
+    collection.find_one.assert_called_once_with(
+        {"h": original_url_hash("https://s.io/page", "sha256")}
+    )
+
+
+@freeze_time("2024-01-01")
+def test_get_or_create_detects_taken_codes(repository):
+    collection = repository._url_collection
+    collection.find_one_and_update.side_effect = DuplicateKeyError(
+        "duplicate", 11000, {"keyPattern": {"_id": 1}}
+    )
+    collection.find_one.return_value = _stored_doc("https://s.io/other", "abc")
+
+    with pytest.raises(ShortURLCollisionError, match="already taken"):
+        repository.get_or_create_short_url(
+            "https://s.io/page", "https://s.io/abc", "sha256"
+        )
+
+
+@freeze_time("2024-01-01")
+def test_create_url_mappings_is_one_bulk_write(repository):
+    collection = repository._url_collection
+    collection.bulk_write.side_effect = BulkWriteError(
+        {"writeErrors": [{"index": 1, "code": 11000, "keyPattern": {"_id": 1}}]}
+    )
+    collection.find_one_and_update.side_effect = DuplicateKeyError(
+        "duplicate", 11000, {"keyPattern": {"_id": 1}}
+    )
+    collection.find_one.return_value = _stored_doc("https://s.io/other", "taken")
+
+    not_stored = repository.create_url_mappings(
+        [
+            URLMapping("https://s.io/a", "https://s.io/a", "sha256", 1704067260, 0),
+            URLMapping("https://s.io/b", "https://s.io/taken", "sha256", 1704067260, 0),
+        ]
+    )
+
+    assert not_stored == {"https://s.io/b"}
+    (requests,), _ = collection.bulk_write.call_args
+    assert requests[0]._filter == {
+        "_id": "1:a",
+        "h": original_url_hash("https://s.io/a", "sha256"),
+        "$or": [
+            {"$nor": [{"e": {"$gt": datetime(2024, 1, 1)}}]},
+            {"u": "https://s.io/a"},
+        ],
+    }
+    assert set(requests[0]._doc["$set"]) == {"u", "e", "c"}
+    # only the colliding url goes through get_or_create_short_url
+    collection.find_one_and_update.assert_called_once()
+
+
+def test_known_namespaces_are_looked_up_without_a_reload(repository):
+    repository._load_namespaces()
+    repository._namespace_collection.find.reset_mock()
+    namespaces = repository._namespaces
+
+    assert repository._candidate_ids("https://s.io/abc", "sha256") == ["1:abc"]
+    repository._namespace_collection.find.assert_not_called()
+
+    repository._namespace_collection.find.return_value = [
+        {"_id": 3, "algorithm": "sha256", "domain": "https://s.io/x/"}
+    ]
+    assert repository._candidate_ids("https://t.io/abc", "sha256") == []
+    (query,), _ = repository._namespace_collection.find.call_args
+    assert query == {
+        "algorithm": "sha256",
+        "domain": {"$in": ["https://t.io/"]},
+    }
+    # published as a new copy, the one read before is left as it was
+    assert repository._candidate_ids("https://s.io/x/abc", "sha256") == [
+        "1:x/abc",
+        "3:abc",
+    ]
+    assert namespaces.ids == {("sha256", "https://s.io/"): 1}
+
+
+def test_compact_documents_are_smaller():
+    full = {
+        "_id": bson.ObjectId(),
+        "algorithm": "base-64",
+        "original_url": "https://www.example.com/some/page?id=42",
+        "short_url": "https://www.example.com/aHR0cHM6",
+        "expiration_time": datetime(2024, 1, 1),
+        "creation_time": datetime(2024, 1, 1),
+    }
+    compact = {
+        "_id": "1:aHR0cHM6",
+        "h": original_url_hash(full["original_url"], "base-64"),
+        "u": full["original_url"],
+        "e": datetime(2024, 1, 1),
+        "c": datetime(2024, 1, 1),
+    }
+
+    assert len(bson.encode(compact)) < len(bson.encode(full)) * 0.7
+
+
+def test_migration_copies_live_mappings_in_batches():
+    mappings = [
+        URLMapping(f"https://a.com/{i}", f"https://a.com/{i}", "sha256", 2**40, 0)
+        for i in range(5)
+    ] + [URLMapping("https://a.com/old", "https://a.com/old", "sha256", 1, 0)]
+    source, target = MagicMock(), MagicMock()
+    source.iter_url_mappings.return_value = iter(mappings)
+
+    migrated = migrate_to_compact_schema(source, target, batch_size=2)
+
+    assert migrated == 5
+    assert [len(call.args[0]) for call in target.restore_url_mappings.mock_calls] == [
+        2,
+        2,
+        1,
+    ]
@@ -0,0 +1,109 @@
+import os
+import socket
+import sys
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+from urlshortener import client, entrypoint
+from urlshortener.algorithms.sha256 import Sha256ShorteningAlgorithm
+from urlshortener.daemon import ShortenerDaemon
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.repository.repository import ShortURLCollisionError
+from urlshortener.settings import ShortenerSettings
+from urlshortener.url_shortener import URLShortener
+
+
+@pytest.fixture()
+def socket_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "daemon.sock")
+    monkeypatch.setenv("URLSHORTENER_DAEMON_SOCKET", path)
+    return path
+
+
+@pytest.fixture()
+def daemon(socket_path):
+    repository = InMemoryURLRepository(ShortenerSettings(expiration_offset=60))
+    daemon = ShortenerDaemon(
+        socket_path, URLShortener(repository=repository), Sha256ShorteningAlgorithm()
+    )
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    yield daemon
+    daemon.shutdown()
+    daemon.server_close()
+
+
+def test_minify_and_expand_through_the_daemon(daemon, socket_path):
+    with client.connect() as daemon_client:
+        short_url = daemon_client.minify("https://www.example.com/page")
+
+        assert daemon_client.expand(short_url) == "https://www.example.com/page"
+        assert daemon_client.request_many(
+            [
+                (client.MINIFY, "https://www.example.com/page"),
+                (client.EXPAND, "https://www.example.com/unknown"),
+            ]
+        ) == [short_url, "not found or expired"]
+
+
+def test_daemon_reports_errors(daemon):
+    with client.connect() as daemon_client:
+        with pytest.raises(client.DaemonError, match="Invalid url format"):
+            daemon_client.minify("not a url")
+
+        # the connection is still usable
+        assert daemon_client.minify("https://www.example.com/")
+
+
+def test_daemon_reports_urls_without_a_free_code(daemon):
+    daemon.shortener.minify = Mock(
+        side_effect=ShortURLCollisionError("no free code\nafter 4 attempts")
+    )
+
+    with client.connect() as daemon_client:
+        with pytest.raises(client.DaemonError, match="no free code after 4 attempts"):
+            daemon_client.minify("https://www.example.com/")
+
+
+def test_connect_without_daemon(socket_path):
+    assert client.connect() is None
+
+
+def test_stale_socket_is_replaced(socket_path):
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()
+    repository = InMemoryURLRepository(ShortenerSettings())
+
+    daemon = ShortenerDaemon(
+        socket_path, URLShortener(repository=repository), Sha256ShorteningAlgorithm()
+    )
+    daemon.server_close()
+
+    assert not os.path.exists(socket_path)
+
+
+def test_entrypoint_uses_the_running_daemon(daemon, monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["urlshortener", "-m", "https://www.example.com/"])
+
+    entrypoint.run()
+
+    short_url = daemon.shortener.minify(
+        "https://www.example.com/", Sha256ShorteningAlgorithm()
+    )
+    assert capsys.readouterr().out == f"https://www.example.com/ -> {short_url}\n"
+
+
+def test_only_simple_invocations_go_to_the_daemon():
+    assert entrypoint._daemon_requests(
+        ["-e", "https://s.io/abc", "--minify", "https://www.example.com/"]
+    ) == [
+        (client.MINIFY, "https://www.example.com/"),
+        (client.EXPAND, "https://s.io/abc"),
+    ]
+    assert entrypoint._daemon_requests([]) is None
+    assert entrypoint._daemon_requests(["-m", "not a url"]) is None
+    assert entrypoint._daemon_requests(["--minify-file", "urls.txt"]) is None
+    assert entrypoint._daemon_requests(["serve"]) is None
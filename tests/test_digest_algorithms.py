@@ -0,0 +1,111 @@
+import pytest
+
+from urlshortener.algorithms import xxh3
+from urlshortener.algorithms.base62 import BASE58_ALPHABET, BASE62_ALPHABET
+from urlshortener.algorithms.blake2b import Blake2bShorteningAlgorithm
+from urlshortener.algorithms.factory import ShorteningAlgorithmFactory
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithmType
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.settings import ShortenerSettings
+from urlshortener.url_shortener import URLShortener
+
+URLS = [f"https://example.com/{i}" for i in range(1000)]
+
+
+class TestBlake2bShorteningAlgorithm:
+
+    def test_codes_are_deterministic(self):
+        assert Blake2bShorteningAlgorithm().shorten(URLS[0]) == (
+            Blake2bShorteningAlgorithm().shorten(URLS[0])
+        )
+
+    @pytest.mark.parametrize(
+        "alphabet, characters",
+        [("base62", BASE62_ALPHABET), ("base58", BASE58_ALPHABET)],
+    )
+    @pytest.mark.parametrize("code_length", [4, 7, 10])
+    def test_codes_have_the_given_length_and_alphabet(
+        self, alphabet, characters, code_length
+    ):
+        algorithm = Blake2bShorteningAlgorithm(code_length, alphabet)
+
+        codes = [algorithm.shorten(url) for url in URLS]
+
+        assert all(
+            len(code) == code_length and set(code) <= set(characters) for code in codes
+        )
+
+    def test_rehashes_differ_per_attempt(self):
+        algorithm = Blake2bShorteningAlgorithm()
+
+        codes = [algorithm.shorten(URLS[0])] + [
+            algorithm.rehash(URLS[0], attempt) for attempt in range(1, 4)
+        ]
+
+        assert len(set(codes)) == 4
+        assert algorithm.rehash(URLS[0], 2) == codes[2]
+
+    def test_codes_grow_when_too_many_are_taken(self):
+        algorithm = Blake2bShorteningAlgorithm(
+            code_length=5, max_code_length=6, collision_threshold=0.01
+        )
+        for i, url in enumerate(URLS * 3):
+            algorithm.shorten(url)
+            if i % 50 == 0:
+                algorithm.rehash(url, 1)
+
+        assert algorithm.code_length == 6
+        assert len(algorithm.shorten(URLS[0])) == 6
+
+    def test_existing_mappings_are_not_counted(self):
+        algorithm = Blake2bShorteningAlgorithm(code_length=5, collision_threshold=0.01)
+        for url in URLS * 3:
+            algorithm.shorten(url)
+            algorithm.release(url)
+        algorithm.rehash(URLS[0], 1)
+        algorithm.rehash(URLS[1], 1)
+
+        for url in URLS[:100]:
+            algorithm.shorten(url)
+
+        assert algorithm.code_length == 5
+
+    def test_collisions_are_rehashed_on_minify(self):
+        repository = InMemoryURLRepository(ShortenerSettings(expiration_offset=60))
+        shortener = URLShortener(repository)
+        algorithm = Blake2bShorteningAlgorithm(code_length=4)
+        taken = algorithm.shorten(URLS[0])
+        repository.save_url_mapping(URLS[1], f"https://example.com/{taken}", "blake2b")
+
+        short_url = shortener.minify(URLS[0], algorithm)
+
+        assert short_url == f"https://example.com/{algorithm.rehash(URLS[0], 1)}"
+
+
+class TestXxh3ShorteningAlgorithm:
+
+    def test_codes_are_deterministic(self):
+        pytest.importorskip("xxhash")
+        algorithm = xxh3.Xxh3ShorteningAlgorithm(code_length=8, alphabet="base58")
+
+        code = algorithm.shorten(URLS[0])
+
+        assert code == xxh3.Xxh3ShorteningAlgorithm(8, "base58").shorten(URLS[0])
+        assert len(code) == 8 and set(code) <= set(BASE58_ALPHABET)
+        assert algorithm.rehash(URLS[0], 1) != code
+
+    def test_the_package_is_required(self, monkeypatch):
+        monkeypatch.setattr(xxh3, "XXHASH_INSTALLED", False)
+
+        with pytest.raises(ValueError, match="xxhash package"):
+            xxh3.Xxh3ShorteningAlgorithm()
+
+
+def test_factory_shares_one_instance_with_the_given_options():
+    factory = ShorteningAlgorithmFactory(code_length=9, code_alphabet="base58")
+
+    algorithm = factory.get(ShorteningAlgorithmType.BLAKE2B)
+
+    assert factory.get(ShorteningAlgorithmType.BLAKE2B) is algorithm
+    assert algorithm.code_length == 9
+    assert set(algorithm.shorten(URLS[0])) <= set(BASE58_ALPHABET)
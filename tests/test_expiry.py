@@ -0,0 +1,121 @@
+from unittest.mock import MagicMock
+
+from freezegun import freeze_time
+
+from urlshortener.algorithms.sha256 import Sha256ShorteningAlgorithm
+from urlshortener.expiry import EXPIRY_REFRESHES_TOTAL, ExpiryRefresher
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.settings import ShortenerSettings
+from urlshortener.url_shortener import URLShortener
+
+START = 1704067200  # 2024-01-01 00:00:00
+
+
+class FailingURLRepository(InMemoryURLRepository):
+
+    def extend_expirations(self, url_mappings, expiration_time, max_lifetime) -> int:
+        raise ConnectionError("database unavailable")
+
+
+def _shortener(repository, **kwargs) -> tuple[URLShortener, ExpiryRefresher]:
+    options = dict(
+        expiration_offset=60,
+        refresh_interval=3600,
+        max_lifetime=600,
+        max_pending=100,
+        batch_size=10,
+    )
+    options.update(kwargs)
+    expiry = ExpiryRefresher(repository, **options)
+    return URLShortener(repository, expiry=expiry), expiry
+
+
+def _expiration_time(repository, short_url: str) -> int:
+    return repository.get_mapping_by_short_url(short_url, "sha256").expiration_time
+
+
+def test_hits_slide_the_expiration():
+    repository = InMemoryURLRepository(ShortenerSettings(expiration_offset=60))
+    shortener, expiry = _shortener(repository, refresh_interval=10)
+    algorithm = Sha256ShorteningAlgorithm()
+    with freeze_time("2024-01-01 00:00:00"):
+        short_url = shortener.minify("https://a.com/", algorithm)
+
+    with freeze_time("2024-01-01 00:00:40"):
+        assert shortener.expand(short_url, algorithm) == "https://a.com/"
+        expiry.flush()
+
+    assert _expiration_time(repository, short_url) == START + 100
+
+    with freeze_time("2024-01-01 00:01:30"):
+        # a minify hit slides it as well
+        assert shortener.minify("https://a.com/", algorithm) == short_url
+        expiry.flush()
+
+    assert _expiration_time(repository, short_url) == START + 150
+
+
+def test_hits_are_coalesced_into_one_refresh_per_interval():
+    repository = MagicMock(
+        wraps=InMemoryURLRepository(ShortenerSettings(expiration_offset=60))
+    )
+    shortener, expiry = _shortener(repository)
+    algorithm = Sha256ShorteningAlgorithm()
+    short_url = shortener.minify("https://a.com/", algorithm)
+    issued = EXPIRY_REFRESHES_TOTAL.value("issued")
+    skipped = EXPIRY_REFRESHES_TOTAL.value("skipped")
+
+    for _ in range(5):
+        shortener.minify("https://a.com/", algorithm)
+    shortener.expand_batch([short_url, "https://s.io/unknown"], algorithm)
+    expiry.flush()
+    expiry.flush()
+
+    repository.extend_expirations.assert_called_once()
+    assert EXPIRY_REFRESHES_TOTAL.value("issued") - issued == 1
+    assert EXPIRY_REFRESHES_TOTAL.value("skipped") - skipped == 5
+
+
+def test_recently_refreshed_mappings_are_skipped():
+    repository = MagicMock(
+        wraps=InMemoryURLRepository(ShortenerSettings(expiration_offset=60))
+    )
+    shortener, expiry = _shortener(repository, refresh_interval=10)
+    algorithm = Sha256ShorteningAlgorithm()
+    with freeze_time("2024-01-01 00:00:00"):
+        short_url = shortener.minify("https://a.com/", algorithm)
+
+    with freeze_time("2024-01-01 00:00:05"):
+        shortener.expand(short_url, algorithm)
+        expiry.flush()
+
+    repository.extend_expirations.assert_not_called()
+
+
+def test_expiration_is_capped_by_the_max_lifetime():
+    repository = InMemoryURLRepository(ShortenerSettings(expiration_offset=60))
+    shortener, expiry = _shortener(repository, refresh_interval=10, max_lifetime=120)
+    algorithm = Sha256ShorteningAlgorithm()
+    with freeze_time("2024-01-01 00:00:00"):
+        short_url = shortener.minify("https://a.com/", algorithm)
+    with freeze_time("2024-01-01 00:00:55"):
+        shortener.expand(short_url, algorithm)
+        expiry.flush()
+    with freeze_time("2024-01-01 00:01:50"):
+        shortener.expand(short_url, algorithm)
+        expiry.flush()
+
+    assert _expiration_time(repository, short_url) == START + 115
+
+
+def test_failed_refreshes_are_dropped():
+    repository = FailingURLRepository(ShortenerSettings(expiration_offset=60))
+    shortener, expiry = _shortener(repository)
+    algorithm = Sha256ShorteningAlgorithm()
+    shortener.minify("https://a.com/", algorithm)
+    dropped = EXPIRY_REFRESHES_TOTAL.value("dropped")
+
+    shortener.minify("https://a.com/", algorithm)
+    expiry.flush()
+
+    assert EXPIRY_REFRESHES_TOTAL.value("dropped") - dropped == 1
@@ -0,0 +1,43 @@
+import pytest
+
+from urlshortener.factory import open_shortener
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.settings import ShortenerSettings
+
+
+class Repository(InMemoryURLRepository):
+    finalized = False
+
+    def finalize(self):
+        self.finalized = True
+
+
+@pytest.fixture()
+def settings(tmp_path):
+    return ShortenerSettings(
+        expiration_offset=60,
+        shortening_algorithm="sha256",
+        analytics_enabled=True,
+        storage_backend="sqlite",
+        sqlite_path=str(tmp_path / "urls.db"),
+    )
+
+
+def test_shortener_is_closed_with_its_repository(settings):
+    repository = Repository(settings)
+
+    with open_shortener(settings, repository) as (shortener, algorithm):
+        short_url = shortener.minify("https://www.example.com", algorithm)
+
+        assert shortener.expand(short_url, algorithm) == "https://www.example.com"
+        assert shortener._clicks is not None
+    assert repository.finalized
+
+
+def test_bulk_shorteners_record_nothing(settings):
+    with open_shortener(settings, Repository(settings), recording=False) as (
+        shortener,
+        _,
+    ):
+        assert shortener._clicks is None
+        assert shortener._expiry is None
@@ -0,0 +1,137 @@
+import json
+import os
+
+import pytest
+
+from urlshortener.algorithms.base_64 import Base64ShorteningAlgorithm
+from urlshortener.algorithms.factory import ShorteningAlgorithmFactory
+from urlshortener.algorithms.sha256 import Sha256ShorteningAlgorithm
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithmType
+from urlshortener.importer import URLImporter
+from urlshortener.key_pool import KEY_POOL_FREE_CODES, KeyPool
+from urlshortener.repository.key_pool_repository import InMemoryKeyPoolRepository
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.settings import ShortenerSettings
+from urlshortener.url_shortener import URLShortener
+
+
+class CrashingRepository(InMemoryURLRepository):
+    def __init__(self, settings, crash_after):
+        super().__init__(settings)
+        self.crash_after = crash_after
+
+    def save_url_mappings(self, url_mappings, algorithm):
+        if self.crash_after == 0:
+            raise ConnectionError("connection reset")
+        self.crash_after -= 1
+        super().save_url_mappings(url_mappings, algorithm)
+
+
+@pytest.fixture()
+def settings():
+    return ShortenerSettings(expiration_offset=60)
+
+
+def _importer(repository, algorithm, work_dir, **kwargs):
+    kwargs.setdefault("partitions", 4)
+    return URLImporter(
+        shortener=URLShortener(repository=repository),
+        repository=repository,
+        algorithm=algorithm,
+        work_dir=str(work_dir),
+        batch_size=10,
+        workers=1,
+        **kwargs,
+    )
+
+
+def _write_urls(path, urls):
+    path.write_text("".join(f"{url}\n" for url in urls))
+    return str(path)
+
+
+def test_import_deduplicates_and_stores_new_mappings(settings, tmp_path):
+    repository = InMemoryURLRepository(settings)
+    algorithm = Sha256ShorteningAlgorithm()
+    urls = [f"https://www.example.com/{i}" for i in range(100)]
+    repository.save_url_mapping(urls[0], "https://www.example.com/old", "sha256")
+    path = _write_urls(tmp_path / "urls.txt", urls + urls[:30] + ["not a url"])
+    reports = []
+
+    progress = _importer(
+        repository, algorithm, tmp_path / "work", on_progress=reports.append
+    ).run(path)
+
+    assert progress.read == 131
+    assert progress.unique == 101
+    assert (progress.invalid, progress.existing, progress.created) == (1, 1, 99)
+    assert reports[-1] == progress
+    assert progress.throughput > 0
+    assert repository.get_short_url(urls[1], "sha256") == (
+        f"https://www.example.com/{algorithm.shorten(urls[1])}"
+    )
+    assert not os.path.exists(tmp_path / "work")
+
+
+def test_colliding_urls_are_rehashed(settings, tmp_path):
+    repository = InMemoryURLRepository(settings)
+    # base-64 codes only depend on the first 6 characters of the url
+    urls = [f"https://www.example.com/{i}" for i in range(5)]
+    path = _write_urls(tmp_path / "urls.txt", urls)
+
+    progress = _importer(
+        repository, Base64ShorteningAlgorithm(), tmp_path / "work", partitions=1
+    ).run(path)
+
+    # the first url takes the shared code, the others get rehashed ones
+    assert (progress.created, progress.rehashed, progress.failed) == (1, 4, 0)
+
+
+def test_key_pool_codes_are_handed_out_by_the_importing_process(settings, tmp_path):
+    repository = InMemoryURLRepository(settings)
+    urls = [f"https://www.example.com/{i}" for i in range(20)]
+    repository.save_url_mapping(urls[0], "https://www.example.com/old", "key-pool")
+    pool_repository = InMemoryKeyPoolRepository()
+    pool_repository.add_codes([f"code{i}" for i in range(100)])
+    path = _write_urls(tmp_path / "urls.txt", urls)
+
+    with KeyPool(
+        pool_repository,
+        lease_size=30,
+        local_low_watermark=0,
+        depth=100,
+        low_watermark=0,
+        code_length=7,
+    ) as pool:
+        algorithm = ShorteningAlgorithmFactory(repository, key_pool=pool).get(
+            ShorteningAlgorithmType.KEY_POOL
+        )
+        progress = _importer(repository, algorithm, tmp_path / "work").run(path)
+
+        # one lease of 30 codes, 19 stored and the one of the url already mapped
+        # handed back
+        assert KEY_POOL_FREE_CODES.value("local") == 11
+
+    assert (progress.existing, progress.created, progress.failed) == (1, 19, 0)
+    short_urls = repository.get_short_urls(urls, "key-pool")
+    assert len(set(short_urls.values())) == 20
+
+
+def test_interrupted_import_resumes_from_its_checkpoint(settings, tmp_path):
+    repository = CrashingRepository(settings, crash_after=12)
+    urls = [f"https://www.example.com/{i}" for i in range(200)]
+    path = _write_urls(tmp_path / "urls.txt", urls)
+    work_dir = tmp_path / "work"
+
+    with pytest.raises(ConnectionError):
+        _importer(repository, Sha256ShorteningAlgorithm(), work_dir).run(path)
+    checkpoint = json.loads((work_dir / "checkpoint.json").read_text())
+    assert checkpoint["completed"]
+
+    repository.crash_after = -1
+    progress = _importer(repository, Sha256ShorteningAlgorithm(), work_dir).run(path)
+
+    assert progress.read == 200
+    assert progress.unique == 200
+    assert progress.created + progress.existing == 200
+    assert repository.get_short_urls(urls, "sha256").keys() == set(urls)
@@ -0,0 +1,223 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from freezegun import freeze_time
+
+from urlshortener.algorithms.base62 import BASE62_ALPHABET
+from urlshortener.algorithms.factory import ShorteningAlgorithmFactory
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithmType
+from urlshortener.key_pool import (
+    KEY_POOL_FREE_CODES,
+    KeyPool,
+    fill_key_pool,
+    generate_codes,
+    recycle_codes,
+)
+from urlshortener.repository.key_pool_repository import InMemoryKeyPoolRepository
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.repository.mongo_key_pool_repository import MongoKeyPoolRepository
+from urlshortener.repository.sqlite_key_pool_repository import (
+    SqliteKeyPoolRepository,
+)
+from urlshortener.repository.sqlite_repository import SqliteURLRepository
+from urlshortener.settings import ShortenerSettings
+from urlshortener.url_shortener import URLShortener
+
+
+def key_pool(repository, **kwargs) -> KeyPool:
+    options = dict(
+        lease_size=10, local_low_watermark=3, depth=50, low_watermark=20, code_length=7
+    )
+    options.update(kwargs)
+    return KeyPool(repository, **options)
+
+
+def test_codes_are_random_base62_codes_of_the_given_length():
+    codes = generate_codes(1000, length=7)
+
+    assert len(set(codes)) == 1000
+    assert all(len(code) == 7 and set(code) <= set(BASE62_ALPHABET) for code in codes)
+
+
+def test_fill_tops_the_pool_up():
+    repository = InMemoryKeyPoolRepository()
+    repository.lease_codes(1)
+
+    assert fill_key_pool(repository, depth=30, code_length=7) == 30
+    assert fill_key_pool(repository, depth=30, code_length=7) == 0
+    assert repository.count_free_codes() == 30
+
+
+def test_exhausted_key_spaces_are_reported():
+    repository = InMemoryKeyPoolRepository()
+    repository.add_codes(list(BASE62_ALPHABET))
+    repository.lease_codes(len(BASE62_ALPHABET))
+
+    with pytest.raises(ValueError, match="No unused code"):
+        fill_key_pool(repository, depth=1, code_length=1)
+
+
+def test_leased_codes_are_never_added_again():
+    repository = InMemoryKeyPoolRepository()
+    repository.add_codes(["a", "b", "c"])
+
+    leased = repository.lease_codes(2)
+
+    assert repository.add_codes(["a", "b", "d"]) == 1
+    assert repository.count_free_codes() == 2
+    repository.release_codes(leased)
+    assert repository.count_free_codes() == 4
+
+
+def test_codes_are_handed_out_once_across_leases():
+    repository = InMemoryKeyPoolRepository()
+
+    with key_pool(repository) as pool:
+        codes = [pool.take() for _ in range(100)]
+
+    assert len(set(codes)) == 100
+    assert KEY_POOL_FREE_CODES.value("local") == 0
+
+
+def test_buffered_codes_are_released_when_the_pool_stops():
+    repository = InMemoryKeyPoolRepository()
+    repository.add_codes(generate_codes(100, length=7))
+
+    with key_pool(repository, depth=100) as pool:
+        pool.take()
+
+    # one lease, and the one fetched in the background, minus the code taken
+    assert repository.count_free_codes() == 99
+
+
+def test_the_shared_pool_is_topped_up_below_its_low_watermark():
+    repository = InMemoryKeyPoolRepository()
+    repository.add_codes(generate_codes(25, length=7))
+
+    with key_pool(repository) as pool:
+        pool.take()
+
+        assert repository.count_free_codes() == 50
+
+
+def test_minified_urls_get_pool_codes():
+    settings = ShortenerSettings(fixed_domain="https://s.io/")
+    repository = InMemoryURLRepository(settings)
+    shortener = URLShortener(repository, fixed_domain=settings.fixed_domain)
+    pool_repository = InMemoryKeyPoolRepository()
+    pool_repository.add_codes(["code1", "code2", "code3"])
+
+    with key_pool(pool_repository, lease_size=3, local_low_watermark=0) as pool:
+        algorithm = ShorteningAlgorithmFactory(repository, key_pool=pool).get(
+            ShorteningAlgorithmType.KEY_POOL
+        )
+        first = shortener.minify("https://a.com/", algorithm)
+        # the code drawn for an url already mapped is handed out again
+        assert shortener.minify("https://a.com/", algorithm) == first
+        second = shortener.minify("https://b.com/", algorithm)
+
+    assert (first, second) == ("https://s.io/code1", "https://s.io/code2")
+    assert repository.get_original_url(second, "key-pool") == "https://b.com/"
+
+
+def test_sqlite_leases_of_concurrent_processes_are_disjoint(tmp_path):
+    settings = ShortenerSettings(sqlite_path=str(tmp_path / "urls.db"))
+    repositories = [SqliteKeyPoolRepository(settings).initialize() for _ in range(4)]
+    repositories[0].add_codes(generate_codes(1000, length=7))
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leases = list(
+            executor.map(
+                lambda repository: [
+                    code for _ in range(30) for code in repository.lease_codes(10)
+                ],
+                repositories,
+            )
+        )
+
+    codes = [code for lease in leases for code in lease]
+    assert len(codes) == len(set(codes)) == 1000
+    assert repositories[0].count_free_codes() == 0
+    for repository in repositories:
+        repository.finalize()
+
+
+def test_purged_sqlite_mappings_give_their_codes_back(tmp_path):
+    settings = ShortenerSettings(
+        sqlite_path=str(tmp_path / "urls.db"), expiration_offset=60
+    )
+    with (
+        SqliteURLRepository(settings) as repository,
+        SqliteKeyPoolRepository(settings) as pool,
+    ):
+        pool.add_codes(["code1", "code2"])
+        codes = pool.lease_codes(2)
+        with freeze_time("2024-01-01 00:00:00"):
+            repository.save_url_mapping(
+                "https://a.com/", "https://s.io/code1", "key-pool"
+            )
+            repository.save_url_mapping("https://b.com/", "https://s.io/x", "sha256")
+
+        with freeze_time("2024-01-01 00:01:00"):
+            repository.purge_expired(
+                batch_size=10, on_purged=lambda purged: recycle_codes(pool, purged)
+            )
+
+        assert codes == ["code1", "code2"]
+        assert pool.lease_codes(2) == ["code1"]
+
+
+def test_buffered_codes_are_dropped_once_their_leases_expired():
+    repository = InMemoryKeyPoolRepository()
+    repository.add_codes(generate_codes(100, length=7))
+
+    with freeze_time("2024-01-01") as frozen:
+        with key_pool(repository, lease_ttl=60) as pool:
+            used = pool.take()
+            first_lease = set(repository._leased_at)
+            frozen.tick(61)
+
+            # leases anew, which renews the leases and marks the code as used
+            assert pool.take() not in first_lease
+            frozen.tick(30)
+
+            # by another process: the dropped codes, the used one is kept
+            assert repository.reclaim_leases(60) == 9
+            assert used not in repository._free
+
+
+def test_sqlite_leases_of_crashed_processes_are_reclaimed(tmp_path):
+    settings = ShortenerSettings(sqlite_path=str(tmp_path / "urls.db"))
+    with freeze_time("2024-01-01 00:00:00"):
+        with SqliteKeyPoolRepository(settings) as crashed:
+            crashed.add_codes(["code1", "code2", "code3", "code4"])
+            leased = crashed.lease_codes(3)
+            crashed.renew_leases(leased[:1], leased[1:])
+
+    with SqliteKeyPoolRepository(settings) as pool:
+        with freeze_time("2024-01-01 00:59:00"):
+            assert pool.reclaim_leases(3600) == 0
+        with freeze_time("2024-01-01 01:00:01"):
+            assert pool.reclaim_leases(3600) == 2
+        assert pool.count_free_codes() == 3
+        assert leased[0] not in pool.lease_codes(3)
+
+
+@freeze_time("2024-01-01")
+@patch("pymongo.MongoClient")
+def test_mongo_leases_are_timestamped(_):
+    with MongoKeyPoolRepository(ShortenerSettings()) as repository:
+        collection = repository._pool_collection
+        collection.find.side_effect = [[{"_id": "code1"}], [{"_id": "code1"}]]
+
+        assert repository.lease_codes(1) == ["code1"]
+        (_, update), _ = collection.update_many.call_args
+        assert update["$set"]["leased_at"] == datetime(2024, 1, 1)
+        assert update["$set"]["holder"] == repository._holder
+
+        repository.reclaim_leases(3600)
+        (query, update), _ = collection.update_many.call_args
+        assert query == {"leased_at": {"$lt": datetime(2023, 12, 31, 23)}}
+        assert update["$unset"] == {"lease": "", "holder": "", "leased_at": ""}
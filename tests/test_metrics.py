@@ -0,0 +1,144 @@
+from unittest.mock import Mock
+
+import pytest
+
+from urlshortener.algorithms.sha256 import Sha256ShorteningAlgorithm
+from urlshortener.metrics import REGISTRY, MetricsRegistry
+from urlshortener.repository.instrumented_repository import (
+    OPERATION_ERRORS_TOTAL,
+    OPERATION_SECONDS,
+    InstrumentedURLRepository,
+)
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.repository.repository import ShortURLCollisionError
+from urlshortener.settings import ShortenerSettings
+from urlshortener.url_shortener import EXPAND_TOTAL, MINIFY_TOTAL, URLShortener
+
+
+@pytest.fixture(autouse=True)
+def clear_registry():
+    REGISTRY.clear()
+    yield
+    REGISTRY.clear()
+
+
+class TestMetricsRegistry:
+
+    def test_renders_counters(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("requests_total", "Requests", ("method",))
+        counter.inc("GET")
+        counter.inc("GET", amount=2)
+
+        assert registry.render() == (
+            "# HELP requests_total Requests\n"
+            "# TYPE requests_total counter\n"
+            'requests_total{method="GET"} 3\n'
+        )
+
+    def test_renders_gauges(self):
+        registry = MetricsRegistry()
+        gauge = registry.gauge("queue_depth", "Queued items", ("queue",))
+        gauge.set("jobs", value=5)
+        gauge.inc("jobs", amount=-2)
+
+        assert registry.render() == (
+            "# HELP queue_depth Queued items\n"
+            "# TYPE queue_depth gauge\n"
+            'queue_depth{queue="jobs"} 3\n'
+        )
+
+    def test_renders_cumulative_histogram_buckets(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+        histogram.observe(value=0.05)
+        histogram.observe(value=0.5)
+        histogram.observe(value=5)
+
+        rendered = registry.render()
+
+        assert 'latency_seconds_bucket{le="0.1"} 1\n' in rendered
+        assert 'latency_seconds_bucket{le="1"} 2\n' in rendered
+        assert 'latency_seconds_bucket{le="+Inf"} 3\n' in rendered
+        assert "latency_seconds_sum 5.55\n" in rendered
+        assert "latency_seconds_count 3\n" in rendered
+
+    def test_escapes_label_values(self):
+        registry = MetricsRegistry()
+        registry.counter("errors_total", "Errors", ("reason",)).inc('a "b"\n')
+
+        assert 'errors_total{reason="a \\"b\\"\\n"} 1' in registry.render()
+
+    def test_registering_twice_returns_the_same_metric(self):
+        registry = MetricsRegistry()
+
+        assert registry.counter("a_total", "A") is registry.counter("a_total", "A")
+
+
+class TestInstrumentedURLRepository:
+
+    def test_records_operation_latency_by_algorithm(self):
+        repository = InstrumentedURLRepository(
+            InMemoryURLRepository(ShortenerSettings())
+        )
+
+        repository.save_url_mapping("https://www.example.com", "abc", "sha256")
+        repository.get_short_url("https://www.example.com", "sha256")
+        repository.get_short_url("https://www.example.com", "sha256")
+
+        assert OPERATION_SECONDS.count("save_url_mapping", "sha256") == 1
+        assert OPERATION_SECONDS.count("get_short_url", "sha256") == 2
+
+    def test_records_errors(self):
+        backend = Mock()
+        backend.get_or_create_short_url.side_effect = ShortURLCollisionError("taken")
+        repository = InstrumentedURLRepository(backend)
+
+        with pytest.raises(ShortURLCollisionError):
+            repository.get_or_create_short_url("https://a.com", "abc", "sha256")
+
+        assert OPERATION_ERRORS_TOTAL.value("get_or_create_short_url", "sha256") == 1
+        assert OPERATION_SECONDS.count("get_or_create_short_url", "sha256") == 1
+
+
+class TestURLShortenerMetrics:
+
+    @pytest.fixture()
+    def shortener(self):
+        settings = ShortenerSettings(expiration_offset=60)
+        return URLShortener(InMemoryURLRepository(settings))
+
+    def test_minify_counts_created_and_existing_mappings(self, shortener):
+        algorithm = Sha256ShorteningAlgorithm()
+
+        shortener.minify("https://www.example.com/a", algorithm)
+        shortener.minify("https://www.example.com/a", algorithm)
+
+        assert MINIFY_TOTAL.value("sha256", "created") == 1
+        assert MINIFY_TOTAL.value("sha256", "existing") == 1
+
+    def test_expand_counts_outcomes(self, shortener):
+        algorithm = Sha256ShorteningAlgorithm()
+        short_url = shortener.minify("https://www.example.com/a", algorithm)
+
+        shortener.expand(short_url, algorithm)
+        shortener.expand("https://www.example.com/unknown", algorithm)
+
+        assert EXPAND_TOTAL.value("sha256", "found") == 1
+        assert EXPAND_TOTAL.value("sha256", "not_found") == 1
+
+    def test_batch_operations_are_counted(self, shortener):
+        algorithm = Sha256ShorteningAlgorithm()
+        shortener.minify("https://www.example.com/a", algorithm)
+
+        short_urls = shortener.minify_batch(
+            ["https://www.example.com/a", "https://www.example.com/b"], algorithm
+        )
+        shortener.expand_batch(
+            list(short_urls.values()) + ["https://www.example.com/unknown"], algorithm
+        )
+
+        assert MINIFY_TOTAL.value("sha256", "created") == 2
+        assert MINIFY_TOTAL.value("sha256", "existing") == 1
+        assert EXPAND_TOTAL.value("sha256", "found") == 2
+        assert EXPAND_TOTAL.value("sha256", "not_found") == 1
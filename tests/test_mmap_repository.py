@@ -0,0 +1,97 @@
+import pytest
+
+from urlshortener import mmap_index
+from urlshortener.mmap_index import MmapIndex, MmapIndexError, build_index
+from urlshortener.repository.mmap_repository import MmapURLRepository
+from urlshortener.repository.repository import URLMapping
+from urlshortener.settings import ShortenerSettings
+
+LIVE = 2**40
+
+MAPPINGS = [
+    URLMapping(f"https://a.com/{i}", f"https://s.io/{i}", "sha256", LIVE, i)
+    for i in range(50)
+] + [
+    URLMapping("https://a.com/old", "https://s.io/old", "sha256", 1, 0),
+    URLMapping("https://a.com/é", "https://s.io/é", "base-64", LIVE, 0),
+]
+
+
+@pytest.fixture()
+def index_path(tmp_path) -> str:
+    path = str(tmp_path / "urls.index")
+    build_index(MAPPINGS, path)
+    return path
+
+
+@pytest.fixture()
+def repository(index_path):
+    settings = ShortenerSettings(mmap_index_path=index_path, mmap_refresh_interval=0)
+    with MmapURLRepository(settings) as repository:
+        yield repository
+
+
+def test_lookups_by_short_url(repository):
+    assert repository.get_original_url("https://s.io/7", "sha256") == "https://a.com/7"
+    assert repository.get_original_url("https://s.io/é", "base-64") == "https://a.com/é"
+    assert repository.get_original_url("https://s.io/7", "base-64") is None
+    assert repository.get_original_url("https://s.io/unknown", "sha256") is None
+    assert repository.get_original_urls(
+        ["https://s.io/1", "https://s.io/2"], "sha256"
+    ) == {"https://s.io/1": "https://a.com/1", "https://s.io/2": "https://a.com/2"}
+
+
+def test_expired_mappings_are_only_returned_as_mappings(repository):
+    assert repository.get_original_url("https://s.io/old", "sha256") is None
+    assert repository.get_mapping_by_short_url("https://s.io/old", "sha256") == (
+        MAPPINGS[50]
+    )
+
+
+def test_hash_collisions_are_told_apart(tmp_path, monkeypatch):
+    monkeypatch.setattr(mmap_index, "_key_hash", lambda key: 42)
+    path = str(tmp_path / "urls.index")
+    build_index(MAPPINGS, path)
+    index = MmapIndex(path)
+
+    assert index.get_original_url("https://s.io/31", "sha256", 0) == "https://a.com/31"
+    assert index.get_mapping("https://s.io/unknown", "sha256") is None
+    index.close()
+
+
+def test_every_mapping_is_iterated(repository):
+    assert sorted(repository.iter_url_mappings(batch_size=10)) == sorted(MAPPINGS)
+
+
+def test_new_index_is_swapped_in(repository, index_path):
+    assert repository.get_original_url("https://s.io/new", "sha256") is None
+    previous = repository._index
+
+    build_index(
+        [URLMapping("https://a.com/new", "https://s.io/new", "sha256", LIVE, 0)],
+        index_path,
+    )
+
+    assert repository.get_original_url("https://s.io/new", "sha256") == (
+        "https://a.com/new"
+    )
+    assert repository.get_original_url("https://s.io/7", "sha256") is None
+    # a lookup that started on the previous index still completes on it
+    assert previous.get_original_url("https://s.io/7", "sha256", 0) == (
+        "https://a.com/7"
+    )
+
+
+def test_writes_are_rejected(repository):
+    with pytest.raises(NotImplementedError):
+        repository.save_url_mapping("https://a.com/", "https://s.io/x", "sha256")
+    with pytest.raises(NotImplementedError):
+        repository.get_short_url("https://a.com/1", "sha256")
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / "urls.txt"
+    path.write_text("https://a.com/\n" * 10)
+
+    with pytest.raises(MmapIndexError):
+        MmapIndex(str(path))
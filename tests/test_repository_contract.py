@@ -0,0 +1,228 @@
+import os
+
+import pytest
+from freezegun import freeze_time
+
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.repository.repository import ShortURLCollisionError, URLMapping
+from urlshortener.repository.sharded_repository import ShardedURLRepository
+from urlshortener.repository.sqlite_repository import SqliteURLRepository
+from urlshortener.repository.write_behind_repository import (
+    WriteBehindURLRepository,
+)
+from urlshortener.settings import ShortenerSettings
+
+# the mongo backend joins the contract when a server is available, e.g.
+# URLSHORTENER_TEST_MONGO_URL=mongodb://localhost:27017/
+MONGO_URL = os.environ.get("URLSHORTENER_TEST_MONGO_URL")
+
+
+@pytest.fixture(
+    params=["memory", "sqlite", "sharded", "write-behind", "mongo", "mongo-compact"]
+)
+def repository(request, tmp_path):
+    settings = ShortenerSettings(
+        expiration_offset=60,
+        sqlite_path=str(tmp_path / "urls.db"),
+        mongo_instance_url=MONGO_URL or "mongodb://localhost:27017/",
+        database_name="urlshortener_contract_tests",
+        write_behind_durability="batched",
+        write_behind_flush_interval=0.001,
+    )
+    if request.param == "memory":
+        repository = InMemoryURLRepository(settings)
+    elif request.param == "sqlite":
+        repository = SqliteURLRepository(settings)
+    elif request.param == "sharded":
+        repository = ShardedURLRepository(
+            {name: InMemoryURLRepository(settings) for name in ("a", "b", "c")}
+        )
+    elif request.param == "write-behind":
+        repository = WriteBehindURLRepository(InMemoryURLRepository(settings), settings)
+    else:
+        if not MONGO_URL:
+            pytest.skip("URLSHORTENER_TEST_MONGO_URL is not set")
+        from urlshortener.repository.compact_mongo_repository import (
+            CompactMongoURLRepository,
+        )
+        from urlshortener.repository.mongo_repository import MongoURLRepository
+
+        if request.param == "mongo-compact":
+            repository = CompactMongoURLRepository(settings)
+        else:
+            repository = MongoURLRepository(settings)
+    with repository:
+        repository.reset()
+        yield repository
+
+
+class TestURLRepositoryContract:
+
+    def test_saved_mapping_is_found_both_ways(self, repository):
+        repository.save_url_mapping("https://www.example.com", "s/abc", "sha256")
+
+        assert repository.get_short_url("https://www.example.com", "sha256") == "s/abc"
+        assert repository.get_original_url("s/abc", "sha256") == (
+            "https://www.example.com"
+        )
+        assert repository.get_short_url("https://www.example.com", "base-64") is None
+
+    def test_expired_mapping_is_only_returned_as_a_mapping(self, repository):
+        with freeze_time("2024-01-01 00:00:00"):
+            repository.save_url_mapping("https://www.example.com", "s/abc", "sha256")
+
+        with freeze_time("2024-01-01 00:01:00"):
+            assert repository.get_original_url("s/abc", "sha256") is None
+            assert repository.get_short_url("https://www.example.com", "sha256") is None
+            mapping = repository.get_mapping_by_short_url("s/abc", "sha256")
+            assert mapping.original_url == "https://www.example.com"
+            assert mapping.is_expired()
+            assert (
+                repository.get_mapping_by_original_url(
+                    "https://www.example.com", "sha256"
+                )
+                == mapping
+            )
+
+    def test_get_or_create_returns_the_existing_mapping(self, repository):
+        created = repository.get_or_create_short_url(
+            "https://www.example.com", "s/abc", "sha256"
+        )
+        existing = repository.get_or_create_short_url(
+            "https://www.example.com", "s/def", "sha256"
+        )
+
+        assert created == ("s/abc", True)
+        assert existing == ("s/abc", False)
+
+    def test_get_or_create_renews_an_expired_mapping(self, repository):
+        with freeze_time("2024-01-01 00:00:00"):
+            repository.get_or_create_short_url(
+                "https://www.example.com", "s/abc", "sha256"
+            )
+
+        with freeze_time("2024-01-01 00:01:00"):
+            renewed = repository.get_or_create_short_url(
+                "https://www.example.com", "s/def", "sha256"
+            )
+            assert renewed == ("s/def", True)
+            assert repository.get_original_url("s/def", "sha256") == (
+                "https://www.example.com"
+            )
+            assert repository.get_mapping_by_short_url("s/abc", "sha256") is None
+
+    def test_get_or_create_detects_collisions(self, repository):
+        repository.get_or_create_short_url("https://a.com", "s/abc", "sha256")
+
+        with pytest.raises(ShortURLCollisionError) as exc_info:
+            repository.get_or_create_short_url("https://b.com", "s/abc", "sha256")
+
+        assert exc_info.value.original_urls == ["https://b.com"]
+        assert repository.get_original_url("s/abc", "sha256") == "https://a.com"
+
+    def test_batch_operations(self, repository):
+        repository.save_url_mappings(
+            {"https://a.com": "s/a", "https://b.com": "s/b"}, "sha256"
+        )
+
+        assert repository.get_short_urls(
+            ["https://a.com", "https://b.com", "https://c.com"], "sha256"
+        ) == {"https://a.com": "s/a", "https://b.com": "s/b"}
+        assert repository.get_original_urls(["s/a", "s/unknown"], "sha256") == {
+            "s/a": "https://a.com"
+        }
+
+    def test_extend_expirations(self, repository):
+        with freeze_time("2024-01-01 00:00:00"):
+            repository.save_url_mappings(
+                {"https://a.com": "s/a", "https://b.com": "s/b"}, "sha256"
+            )
+        with freeze_time("2024-01-01 00:00:30"):
+            extended = repository.extend_expirations(
+                [
+                    URLMapping("https://a.com", "s/a", "sha256", 0, 0),
+                    # no longer the code of the url
+                    URLMapping("https://b.com", "s/other", "sha256", 0, 0),
+                ],
+                expiration_time=1704067290,
+                max_lifetime=3600,
+            )
+            # never moved backward, nor beyond the maximum lifetime
+            repository.extend_expirations(
+                [URLMapping("https://a.com", "s/a", "sha256", 0, 0)], 1704067230, 3600
+            )
+            repository.extend_expirations(
+                [URLMapping("https://b.com", "s/b", "sha256", 0, 0)], 1704067290, 60
+            )
+
+        assert extended == 1
+        assert repository.get_mapping_by_short_url("s/a", "sha256").expiration_time == (
+            1704067290
+        )
+        assert repository.get_mapping_by_short_url("s/b", "sha256").expiration_time == (
+            1704067260
+        )
+
+    def test_reserve_id_block_hands_out_disjoint_blocks(self, repository):
+        first = repository.reserve_id_block(100)
+        second = repository.reserve_id_block(100)
+
+        assert second - first == 100
+
+    def test_iter_url_mappings_created_after(self, repository):
+        with freeze_time("2024-01-01"):
+            repository.save_url_mapping("https://a.com", "s/a", "sha256")
+        with freeze_time("2024-01-02"):
+            repository.save_url_mapping("https://b.com", "s/b", "sha256")
+
+        every = {m.short_url for m in repository.iter_url_mappings(1)}
+        recent = {m.short_url for m in repository.iter_url_mappings(1, 1704153600)}
+
+        assert every == {"s/a", "s/b"}
+        assert recent == {"s/b"}
+
+    def test_iter_url_mappings_created_after_includes_restored_ones(self, repository):
+        with freeze_time("2024-01-02"):
+            repository.restore_url_mappings(
+                [URLMapping("https://a.com", "s/a", "sha256", 1735689600, 1672531200)]
+            )
+
+        recent = list(repository.iter_url_mappings(1, 1704153600))
+
+        assert [(m.short_url, m.creation_time) for m in recent] == [("s/a", 1672531200)]
+
+    @freeze_time("2024-01-01")
+    def test_create_url_mappings_never_replaces_live_ones(self, repository):
+        repository.save_url_mapping("https://a.com", "s/a", "sha256")
+        repository.save_url_mapping("https://taken.com", "s/taken", "sha256")
+
+        not_stored = repository.create_url_mappings(
+            [
+                URLMapping(
+                    "https://a.com", "s/other", "sha256", 1704067260, 1704067200
+                ),
+                URLMapping(
+                    "https://b.com", "s/taken", "sha256", 1704067260, 1704067200
+                ),
+                URLMapping("https://c.com", "s/c", "sha256", 1704067260, 1704067200),
+            ]
+        )
+
+        assert not_stored == {"https://a.com", "https://b.com"}
+        assert repository.get_short_url("https://a.com", "sha256") == "s/a"
+        assert repository.get_original_url("s/taken", "sha256") == "https://taken.com"
+        assert repository.get_original_url("s/c", "sha256") == "https://c.com"
+        # stored again by a retry
+        assert (
+            repository.create_url_mappings(
+                [URLMapping("https://c.com", "s/c", "sha256", 1704067260, 1704067200)]
+            )
+            == set()
+        )
+
+    def test_reset(self, repository):
+        repository.save_url_mapping("https://www.example.com", "s/abc", "sha256")
+
+        repository.reset()
+
+        assert repository.get_mapping_by_short_url("s/abc", "sha256") is None
@@ -0,0 +1,55 @@
+from unittest.mock import Mock
+
+import pytest
+
+from urlshortener.algorithms import base62
+from urlshortener.algorithms.factory import ShorteningAlgorithmFactory
+from urlshortener.algorithms.sequence import SequenceShorteningAlgorithm
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithmType
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.settings import ShortenerSettings
+
+
+class TestSequenceShorteningAlgorithm:
+
+    def test_base62_round_trip(self):
+        for number in [0, 1, 61, 62, 3843, 3844, 2**64]:
+            assert base62.decode(base62.encode(number)) == number
+        assert base62.encode(61) == "Z"
+        assert base62.encode(62) == "10"
+
+    def test_codes_are_unique_for_identical_prefixes(self):
+        algorithm = SequenceShorteningAlgorithm(
+            reserve_id_block=InMemoryURLRepository(
+                ShortenerSettings()
+            ).reserve_id_block,
+            block_size=10,
+        )
+
+        codes = {algorithm.shorten(f"https://example.com/{i}") for i in range(1000)}
+
+        assert len(codes) == 1000
+
+    def test_one_reservation_per_block(self):
+        reserve_id_block = Mock(side_effect=[0, 100])
+        algorithm = SequenceShorteningAlgorithm(reserve_id_block, block_size=3)
+
+        codes = [algorithm.shorten("https://example.com") for _ in range(4)]
+
+        assert codes == ["0", "1", "2", "1C"]
+        assert reserve_id_block.call_count == 2
+        reserve_id_block.assert_called_with(3)
+
+    def test_factory_shares_one_sequence(self):
+        factory = ShorteningAlgorithmFactory(
+            repository=InMemoryURLRepository(ShortenerSettings()), id_block_size=5
+        )
+
+        algorithm = factory.get(ShorteningAlgorithmType.SEQUENCE)
+
+        assert algorithm is factory.get(ShorteningAlgorithmType.SEQUENCE)
+        assert algorithm.type() == ShorteningAlgorithmType.SEQUENCE
+
+    def test_factory_requires_a_repository(self):
+        with pytest.raises(ValueError):
+            ShorteningAlgorithmFactory().get(ShorteningAlgorithmType.SEQUENCE)
@@ -0,0 +1,191 @@
+import http.client
+import json
+import os
+import signal
+import threading
+from unittest.mock import Mock
+
+import pytest
+from freezegun import freeze_time
+
+from urlshortener.algorithms.sha256 import Sha256ShorteningAlgorithm
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.repository.repository import ShortURLCollisionError
+from urlshortener import server
+from urlshortener.server import RedirectServer, create_listening_socket
+from urlshortener.settings import ShortenerSettings
+from urlshortener.url_shortener import URLShortener
+
+
+@pytest.fixture()
+def settings():
+    return ShortenerSettings(fixed_domain="http://s.io/", expiration_offset=60)
+
+
+@pytest.fixture()
+def shortener(settings):
+    return URLShortener(
+        repository=InMemoryURLRepository(settings), fixed_domain=settings.fixed_domain
+    )
+
+
+@pytest.fixture()
+def connection(settings, shortener):
+    server = RedirectServer(
+        create_listening_socket("127.0.0.1", 0),
+        shortener,
+        Sha256ShorteningAlgorithm(),
+        settings,
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+    yield connection
+    connection.close()
+    server.shutdown()
+    server.server_close()
+
+
+def _request(connection, method, path, body=None, headers=None):
+    connection.request(method, path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    return response, response.read()
+
+
+class TestRedirectServer:
+
+    def test_redirects_known_code(self, connection, shortener):
+        short_url = shortener.minify(
+            "https://www.example.com/a", Sha256ShorteningAlgorithm()
+        )
+
+        response, _ = _request(connection, "GET", f"/{short_url.rsplit('/', 1)[1]}")
+
+        assert response.status == 302
+        assert response.getheader("Location") == "https://www.example.com/a"
+
+    def test_unknown_code_is_not_found(self, connection):
+        response, _ = _request(connection, "GET", "/unknown")
+
+        assert response.status == 404
+
+    def test_expired_code_is_gone(self, connection, shortener):
+        with freeze_time("2024-01-01 00:00:00"):
+            short_url = shortener.minify(
+                "https://www.example.com/a", Sha256ShorteningAlgorithm()
+            )
+
+        response, _ = _request(connection, "GET", f"/{short_url.rsplit('/', 1)[1]}")
+
+        assert response.status == 410
+
+    def test_post_minifies_url(self, connection):
+        response, body = _request(
+            connection,
+            "POST",
+            "/",
+            body=json.dumps({"url": "https://www.example.com/a"}),
+            headers={"Content-Type": "application/json"},
+        )
+
+        assert response.status == 201
+        assert json.loads(body)["short_url"].startswith("http://s.io/")
+
+    def test_post_rejects_invalid_url(self, connection):
+        response, body = _request(connection, "POST", "/", body="not-a-url")
+
+        assert response.status == 400
+        assert json.loads(body) == {"error": "'not-a-url' is not a valid URL"}
+
+    def test_post_reports_urls_without_a_free_code(self, connection, shortener):
+        shortener.minify = Mock(side_effect=ShortURLCollisionError("no free code"))
+
+        response, body = _request(
+            connection, "POST", "/", body="https://www.example.com/a"
+        )
+
+        assert response.status == 409
+        assert json.loads(body) == {"error": "no free code"}
+
+    def test_post_rejects_invalid_content_length(self, connection):
+        response, body = _request(
+            connection, "POST", "/", body="x", headers={"Content-Length": "abc"}
+        )
+
+        assert response.status == 400
+        assert json.loads(body) == {"error": "Invalid Content-Length"}
+
+    def test_repository_failures_are_unavailable(self, connection, shortener):
+        shortener.resolve = Mock(side_effect=ConnectionError("connection reset"))
+        shortener.minify = Mock(side_effect=ConnectionError("connection reset"))
+
+        get_response, _ = _request(connection, "GET", "/abc")
+        post_response, body = _request(
+            connection, "POST", "/", body="https://www.example.com/a"
+        )
+
+        assert (get_response.status, post_response.status) == (503, 503)
+        assert json.loads(body) == {"error": "Storage unavailable"}
+
+    def test_connection_is_kept_alive(self, connection):
+        first, body = _request(connection, "GET", "/healthz")
+        sock = connection.sock
+        second, _ = _request(connection, "GET", "/healthz")
+
+        assert (first.status, body, second.status) == (200, b"ok", 200)
+        assert connection.sock is sock
+
+    def test_metrics_are_exposed(self, connection, shortener):
+        shortener.minify("https://www.example.com/a", Sha256ShorteningAlgorithm())
+
+        response, body = _request(connection, "GET", "/metrics")
+
+        assert response.status == 200
+        assert response.getheader("Content-Type").startswith("text/plain")
+        assert b'urlshortener_minify_total{algorithm="sha256"' in body
+
+
+def test_server_needs_a_fixed_domain():
+    settings = ShortenerSettings(fixed_domain=None)
+    sock = create_listening_socket("127.0.0.1", 0)
+
+    try:
+        with pytest.raises(ValueError, match="fixed_domain"):
+            RedirectServer(sock, Mock(), Sha256ShorteningAlgorithm(), settings)
+    finally:
+        sock.close()
+
+
+class StartedServer(RedirectServer):
+    started = threading.Event()
+
+    def service_actions(self):
+        self.started.set()
+
+
+def test_sigterm_stops_the_worker_and_finalizes_its_repository(settings, monkeypatch):
+    finalized = threading.Event()
+
+    class Repository(InMemoryURLRepository):
+        def finalize(self):
+            finalized.set()
+
+    monkeypatch.setattr(server, "build_serving_repository", Repository)
+    monkeypatch.setattr(server, "RedirectServer", StartedServer)
+    previous_handler = signal.getsignal(signal.SIGTERM)
+    sock = create_listening_socket("127.0.0.1", 0)
+
+    def _terminate():
+        StartedServer.started.wait(timeout=5)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    terminate = threading.Thread(target=_terminate)
+    terminate.start()
+    try:
+        server._serve_worker(sock, settings)
+    finally:
+        terminate.join()
+        signal.signal(signal.SIGTERM, previous_handler)
+        sock.close()
+
+    assert finalized.is_set()
@@ -0,0 +1,181 @@
+from unittest.mock import Mock
+
+import pytest
+from freezegun import freeze_time
+
+from urlshortener.hash_ring import HashRing
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.repository.repository import ShortURLCollisionError, URLMapping
+from urlshortener.repository.sharded_repository import ShardedURLRepository
+from urlshortener.settings import ShortenerSettings
+
+URLS = {f"https://www.example.com/{i}": f"https://s.io/{i}" for i in range(2000)}
+
+
+@pytest.fixture()
+def settings():
+    return ShortenerSettings(expiration_offset=60)
+
+
+def _sharded(settings, names, shards=None, previous_shards=None):
+    shards = {} if shards is None else shards
+    for name in names:
+        shards.setdefault(name, InMemoryURLRepository(settings))
+    return ShardedURLRepository(
+        {name: shards[name] for name in names}, previous_shards=previous_shards
+    )
+
+
+def _keys(shard) -> set[str]:
+    return {mapping.original_url for mapping in shard.iter_url_mappings(100)}
+
+
+class TestHashRing:
+
+    def test_spreads_keys_evenly(self):
+        ring = HashRing(["a", "b", "c", "d"])
+        counts = {}
+        for url in URLS:
+            counts[ring.node_for(url)] = counts.get(ring.node_for(url), 0) + 1
+
+        assert min(counts.values()) > len(URLS) / 4 * 0.7
+
+    def test_adding_a_node_only_moves_its_share_of_the_keys(self):
+        before = HashRing(["a", "b", "c"])
+        after = HashRing(["a", "b", "c", "d"])
+
+        moved = [url for url in URLS if before.node_for(url) != after.node_for(url)]
+
+        assert all(after.node_for(url) == "d" for url in moved)
+        assert len(moved) / len(URLS) == pytest.approx(1 / 4, abs=0.08)
+
+
+class TestShardedURLRepository:
+
+    def test_mapping_is_stored_on_both_shards_of_its_urls(self, settings):
+        shards = {}
+        repository = _sharded(settings, ["a", "b", "c"], shards)
+        ring = HashRing(["a", "b", "c"])
+        original_url, short_url = next(
+            (url, code)
+            for url, code in URLS.items()
+            if ring.node_for(url) != ring.node_for(code)
+        )
+
+        repository.get_or_create_short_url(original_url, short_url, "sha256")
+
+        home = shards[ring.node_for(original_url)]
+        code_shard = shards[ring.node_for(short_url)]
+        assert home.get_short_url(original_url, "sha256") == short_url
+        assert code_shard.get_original_url(short_url, "sha256") == original_url
+        assert repository.get_original_url(short_url, "sha256") == original_url
+        assert [m.original_url for m in repository.iter_url_mappings(10)] == [
+            original_url
+        ]
+
+    def test_codes_are_unique_across_shards(self, settings):
+        repository = _sharded(settings, ["a", "b", "c"])
+        ring = HashRing(["a", "b", "c"])
+        repository.get_or_create_short_url("https://a.com", "https://s.io/x", "sha256")
+        other_url = next(url for url in URLS if ring.node_for(url) != "a")
+
+        with pytest.raises(ShortURLCollisionError):
+            repository.get_or_create_short_url(other_url, "https://s.io/x", "sha256")
+
+        assert repository.get_short_url(other_url, "sha256") is None
+
+    def test_ids_are_reserved_on_the_counter_shard(self, settings):
+        shards = {name: InMemoryURLRepository(settings) for name in ["a", "b", "c"]}
+        for name, shard in shards.items():
+            shard.reserve_id_block = lambda size, name=name: name
+
+        reordered = ShardedURLRepository(
+            {name: shards[name] for name in ["c", "a", "b"]}, counter_shard="a"
+        )
+
+        assert _sharded(settings, ["a", "b", "c"], shards).reserve_id_block(10) == "a"
+        assert reordered.reserve_id_block(10) == "a"
+        with pytest.raises(ValueError):
+            ShardedURLRepository(shards, counter_shard="d")
+
+    def test_batch_operations_are_routed(self, settings):
+        repository = _sharded(settings, ["a", "b", "c"])
+
+        repository.save_url_mappings(URLS, "sha256")
+
+        assert repository.get_short_urls(list(URLS), "sha256") == URLS
+        assert len(repository.get_original_urls(list(URLS.values()), "sha256")) == len(
+            URLS
+        )
+
+    def test_rebalance_moves_about_a_share_of_the_mappings(self, settings):
+        shards = {}
+        repository = _sharded(settings, ["a", "b", "c"], shards)
+        repository.save_url_mappings(URLS, "sha256")
+
+        grown = _sharded(settings, ["a", "b", "c", "d"], shards, ["a", "b", "c"])
+        moved = grown.rebalance(batch_size=100)
+
+        # a mapping and its copy each move with a probability of about 1/4
+        assert moved / (2 * len(URLS)) < 0.35
+        assert _keys(shards["d"])
+        assert grown.get_short_urls(list(URLS), "sha256") == URLS
+        assert grown.get_original_urls(list(URLS.values()), "sha256") == {
+            code: url for url, code in URLS.items()
+        }
+        assert grown.rebalance(batch_size=100) == 0
+
+    def test_reads_fall_back_to_the_previous_ring_until_rebalanced(self, settings):
+        shards = {}
+        repository = _sharded(settings, ["a", "b", "c"], shards)
+        repository.save_url_mappings(URLS, "sha256")
+
+        grown = _sharded(settings, ["a", "b", "c", "d"], shards, ["a", "b", "c"])
+
+        assert grown.get_short_url("https://www.example.com/1", "sha256") == (
+            "https://s.io/1"
+        )
+        assert all(grown.get_original_url(code, "sha256") for code in URLS.values())
+
+    @freeze_time("2024-01-01")
+    def test_create_url_mappings_takes_one_batch_per_shard(self, settings):
+        shards = {name: Mock(wraps=InMemoryURLRepository(settings)) for name in "abc"}
+        repository = _sharded(settings, ["a", "b", "c"], shards)
+        mappings = [
+            URLMapping(url, code, "sha256", 1704067260, 1704067200)
+            for url, code in list(URLS.items())[:100]
+        ]
+
+        assert repository.create_url_mappings(mappings) == set()
+
+        for shard in shards.values():
+            # once for the codes it holds, once for the urls it is the home of
+            assert shard.create_url_mappings.call_count == 2
+            shard.get_or_create_short_url.assert_not_called()
+        assert all(
+            repository.get_original_url(code, "sha256") == url
+            for url, code in list(URLS.items())[:100]
+        )
+
+    @freeze_time("2024-01-01")
+    def test_create_url_mappings_releases_the_codes_of_lost_urls(self, settings):
+        shards = {}
+        repository = _sharded(settings, ["a", "b", "c"], shards)
+        ring = HashRing(["a", "b", "c"])
+        original_url, short_url = next(
+            (url, code)
+            for url, code in URLS.items()
+            if ring.node_for(url) != ring.node_for(code)
+        )
+        # a live mapping of the url under another code, on its home shard only
+        shards[ring.node_for(original_url)].save_url_mapping(
+            original_url, "https://s.io/elsewhere", "sha256"
+        )
+
+        not_stored = repository.create_url_mappings(
+            [URLMapping(original_url, short_url, "sha256", 1704067260, 1704067200)]
+        )
+
+        assert not_stored == {original_url}
+        code_shard = shards[ring.node_for(short_url)]
+        assert code_shard.get_mapping_by_short_url(short_url, "sha256") is None
@@ -0,0 +1,107 @@
+import pytest
+
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.repository.repository import URLMapping
+from urlshortener.settings import ShortenerSettings
+from urlshortener.snapshot import (
+    SnapshotError,
+    SnapshotFormat,
+    _decode_block,
+    _encode_block,
+    export_snapshot,
+    import_snapshot,
+    read_snapshot,
+)
+
+LIVE = 2**40
+
+
+def store(mappings: list[URLMapping]) -> InMemoryURLRepository:
+    repository = InMemoryURLRepository(ShortenerSettings())
+    repository.restore_url_mappings(mappings)
+    return repository
+
+
+def stored(repository: InMemoryURLRepository) -> list[URLMapping]:
+    return sorted(repository.iter_url_mappings(batch_size=100))
+
+
+@pytest.fixture()
+def mappings() -> list[URLMapping]:
+    return [
+        URLMapping(f"https://a.com/{i}", f"https://s.io/{i}", "sha256", LIVE, i)
+        for i in range(25)
+    ] + [URLMapping("https://a.com/é", "https://s.io/é", "base-64", LIVE, 0)]
+
+
+@pytest.mark.parametrize("snapshot_format", list(SnapshotFormat))
+def test_live_mappings_round_trip(tmp_path, mappings, snapshot_format):
+    path = str(tmp_path / "urls.snapshot")
+    expired = URLMapping("https://a.com/old", "https://s.io/old", "sha256", 1, 0)
+    source = store(mappings + [expired])
+
+    exported = export_snapshot(source, path, snapshot_format, batch_size=10)
+    target = InMemoryURLRepository(ShortenerSettings())
+    result = import_snapshot(target, path, batch_size=7, write_workers=2)
+
+    assert exported == len(mappings)
+    assert result.restored == len(mappings)
+    assert stored(target) == sorted(mappings)
+
+
+def test_binary_snapshots_are_read_in_blocks(tmp_path, mappings):
+    path = str(tmp_path / "urls.snapshot")
+    export_snapshot(store(mappings), path, batch_size=10)
+
+    assert [len(batch) for batch in read_snapshot(path)] == [10, 10, 6]
+
+
+@pytest.mark.parametrize("snapshot_format", list(SnapshotFormat))
+def test_truncated_snapshots_are_rejected(tmp_path, mappings, snapshot_format):
+    path = tmp_path / "urls.snapshot"
+    export_snapshot(store(mappings), str(path), snapshot_format, batch_size=10)
+    path.write_bytes(path.read_bytes()[:-12])
+
+    with pytest.raises(SnapshotError):
+        for _ in read_snapshot(str(path)):
+            pass
+
+
+@pytest.mark.parametrize("snapshot_format", list(SnapshotFormat))
+@pytest.mark.parametrize("kept", [0.3, 0.6, 0.95])
+def test_nothing_is_imported_from_a_truncated_snapshot(
+    tmp_path, mappings, snapshot_format, kept
+):
+    path = tmp_path / "urls.snapshot"
+    export_snapshot(store(mappings), str(path), snapshot_format, batch_size=10)
+    data = path.read_bytes()
+    path.write_bytes(data[: int(len(data) * kept)])
+    target = InMemoryURLRepository(ShortenerSettings())
+
+    with pytest.raises(SnapshotError):
+        import_snapshot(target, str(path), batch_size=5)
+
+    assert stored(target) == []
+
+
+def test_corrupted_records_are_rejected(mappings):
+    with pytest.raises(SnapshotError, match="Corrupted block"):
+        _decode_block(_encode_block(mappings[:2]), 3)
+
+
+def test_import_counts_expired_mappings_and_collisions(tmp_path, mappings):
+    path = str(tmp_path / "urls.snapshot")
+    export_snapshot(store(mappings), path)
+    target = store([URLMapping("https://b.com/", "https://s.io/1", "sha256", LIVE, 0)])
+
+    result = import_snapshot(target, path)
+
+    assert (result.restored, result.collisions) == (len(mappings) - 1, 1)
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / "urls.txt"
+    path.write_text("https://a.com/\n" * 10)
+
+    with pytest.raises(SnapshotError, match="Not a snapshot"):
+        list(read_snapshot(str(path)))
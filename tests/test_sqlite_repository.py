@@ -0,0 +1,124 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from freezegun import freeze_time
+
+from urlshortener.repository.factory import create_repository
+from urlshortener.repository.repository import ShortURLCollisionError, URLMapping
+from urlshortener.repository.sqlite_repository import (
+    _SELECT_ORIGINAL_URL,
+    _SELECT_SHORT_URL,
+    SqliteURLRepository,
+)
+from urlshortener.settings import ShortenerSettings
+
+
+@pytest.fixture()
+def settings(tmp_path):
+    return ShortenerSettings(
+        storage_backend="sqlite",
+        sqlite_path=str(tmp_path / "urls.db"),
+        expiration_offset=60,
+    )
+
+
+class TestSqliteURLRepository:
+
+    def test_is_selected_by_the_settings(self, settings):
+        assert isinstance(create_repository(settings), SqliteURLRepository)
+
+    def test_uses_wal_mode(self, settings):
+        with SqliteURLRepository(settings) as repository:
+            with repository._connection() as connection:
+                (mode,) = connection.execute("PRAGMA journal_mode").fetchone()
+
+        assert mode == "wal"
+
+    def test_requires_initialization(self, settings):
+        with pytest.raises(Exception, match="not initialized"):
+            SqliteURLRepository(settings).get_short_url("https://a.com", "sha256")
+
+    def test_lookups_use_the_covering_indexes(self, settings):
+        with SqliteURLRepository(settings) as repository:
+            with repository._connection() as connection:
+                plans = [
+                    connection.execute(
+                        f"EXPLAIN QUERY PLAN {query}", ("sha256", "s/abc", 0)
+                    ).fetchall()
+                    for query in (_SELECT_ORIGINAL_URL, _SELECT_SHORT_URL)
+                ]
+
+        # the primary key clusters the table, searching it reads the whole row
+        assert "USING COVERING INDEX" in plans[0][0][-1]
+        assert "USING PRIMARY KEY" in plans[1][0][-1]
+
+    def test_is_safe_to_share_between_threads(self, settings):
+        urls = [f"https://www.example.com/{i}" for i in range(200)]
+        with SqliteURLRepository(settings) as repository:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(
+                    executor.map(
+                        lambda url: repository.get_or_create_short_url(
+                            url, f"s/{url.rsplit('/', 1)[1]}", "sha256"
+                        ),
+                        urls + urls,
+                    )
+                )
+
+            assert sum(created for _, created in results) == len(urls)
+            assert len(repository.get_short_urls(urls, "sha256")) == len(urls)
+
+    def test_short_lived_threads_share_a_bounded_pool(self, settings):
+        settings = settings.model_copy(update={"sqlite_pool_size": 2})
+        with SqliteURLRepository(settings) as repository:
+            for i in range(50):
+                thread = threading.Thread(
+                    target=repository.get_or_create_short_url,
+                    args=(f"https://www.example.com/{i}", f"s/{i}", "sha256"),
+                )
+                thread.start()
+                thread.join()
+
+            assert repository._opened <= 2
+            assert repository.get_short_url("https://www.example.com/49", "sha256")
+
+    def test_adds_the_restore_time_to_older_databases(self, settings):
+        with SqliteURLRepository(settings) as repository:
+            with repository._connection() as connection:
+                connection.execute("ALTER TABLE url_mappings DROP COLUMN restored_time")
+
+        with SqliteURLRepository(settings) as repository:
+            repository.restore_url_mappings(
+                [URLMapping("https://a.com", "s/a", "sha256", 1735689600, 1672531200)]
+            )
+
+            assert list(repository.iter_url_mappings(10, 1704067200))
+
+    def test_save_url_mappings_stores_the_rest_of_a_colliding_batch(self, settings):
+        with SqliteURLRepository(settings) as repository:
+            repository.save_url_mapping("https://a.com", "s/taken", "sha256")
+
+            with pytest.raises(ShortURLCollisionError) as exc_info:
+                repository.save_url_mappings(
+                    {"https://b.com": "s/taken", "https://c.com": "s/c"}, "sha256"
+                )
+
+            assert exc_info.value.original_urls == ["https://b.com"]
+            assert repository.get_original_url("s/c", "sha256") == "https://c.com"
+
+    def test_purge_expired_deletes_in_batches(self, settings):
+        with SqliteURLRepository(settings) as repository:
+            with freeze_time("2024-01-01 00:00:00"):
+                repository.save_url_mappings(
+                    {f"https://a.com/{i}": f"s/{i}" for i in range(25)}, "sha256"
+                )
+            with freeze_time("2024-01-01 00:00:30"):
+                repository.save_url_mapping("https://live.com", "s/live", "sha256")
+
+            with freeze_time("2024-01-01 00:01:00"):
+                purged = repository.purge_expired(batch_size=10)
+
+                assert purged == 25
+                assert repository.get_original_url("s/live", "sha256")
+                assert repository.get_mapping_by_short_url("s/0", "sha256") is None
@@ -0,0 +1,151 @@
+import json
+import time
+
+import pytest
+
+from urlshortener.algorithms.sha256 import Sha256ShorteningAlgorithm
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.settings import ShortenerSettings
+from urlshortener.tracing import TRACER, Tracer, build_trace_recorder
+from urlshortener.url_shortener import URLShortener
+
+
+@pytest.fixture()
+def tracer():
+    TRACER.enable(sampler="head", sample_rate=1)
+    yield TRACER
+    TRACER.disable()
+    TRACER.clear()
+
+
+def test_disabled_tracers_record_nothing():
+    tracer = Tracer()
+
+    with tracer.span("minify", algorithm="sha256") as span:
+        span.set(outcome="created")
+
+    assert not tracer.enabled
+    assert tracer.span("expand") is span
+    assert tracer.traces() == []
+
+
+def test_minify_stages_are_nested_under_one_trace(tracer):
+    shortener = URLShortener(InMemoryURLRepository(ShortenerSettings()))
+
+    shortener.minify("https://a.com/x", Sha256ShorteningAlgorithm())
+
+    (spans,) = tracer.traces()
+    by_name = {span.name: span for span in spans}
+    assert [span.name for span in spans] == [
+        "parse_domain",
+        "hash",
+        "repository.get_or_create_short_url",
+        "minify",
+    ]
+    root = by_name["minify"]
+    assert root.parent_id is None
+    assert root.attributes == {"algorithm": "sha256", "outcome": "created"}
+    assert {span.parent_id for span in spans[:-1]} == {root.span_id}
+
+
+def test_head_sampling_drops_whole_traces():
+    tracer = Tracer()
+    tracer.enable(sampler="head", sample_rate=0)
+
+    with tracer.span("expand"):
+        with tracer.span("repository.get_mapping_by_short_url"):
+            pass
+
+    assert tracer.traces() == []
+
+
+def test_tail_sampling_keeps_slow_traces_only():
+    tracer = Tracer()
+    tracer.enable(sampler="tail", slow_threshold_ms=20)
+
+    with tracer.span("fast"):
+        pass
+    with tracer.span("slow"):
+        with tracer.span("lookup"):
+            time.sleep(0.03)
+
+    assert [[span.name for span in spans] for spans in tracer.traces()] == [
+        ["lookup", "slow"]
+    ]
+
+
+def test_failed_spans_are_marked(tracer):
+    with pytest.raises(KeyError):
+        with tracer.span("expand"):
+            raise KeyError("x")
+
+    ((span,),) = tracer.traces()
+    assert span.attributes == {"error": "KeyError"}
+
+
+def test_only_the_latest_traces_are_kept():
+    tracer = Tracer()
+    tracer.enable(max_traces=2)
+
+    for name in ("a", "b", "c"):
+        with tracer.span(name):
+            pass
+
+    assert [spans[0].name for spans in tracer.traces()] == ["b", "c"]
+
+
+def test_chrome_export(tmp_path):
+    tracer = Tracer()
+    tracer.enable()
+    with tracer.span("expand", algorithm="sha256"):
+        with tracer.span("lookup"):
+            pass
+    path = tmp_path / "trace.json"
+
+    assert tracer.export(str(path), "chrome") == 1
+
+    events = json.loads(path.read_text())["traceEvents"]
+    assert [event["name"] for event in events] == ["lookup", "expand"]
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+    assert events[1]["args"]["algorithm"] == "sha256"
+    assert events[0]["args"]["trace_id"] == events[1]["args"]["trace_id"]
+
+
+def test_otlp_export(tmp_path):
+    tracer = Tracer()
+    tracer.enable()
+    with tracer.span("expand", attempt=1):
+        with tracer.span("lookup"):
+            pass
+    path = tmp_path / "trace.json"
+
+    tracer.export(str(path), "otlp")
+
+    (resource_spans,) = json.loads(path.read_text())["resourceSpans"]
+    lookup, expand = resource_spans["scopeSpans"][0]["spans"]
+    assert lookup["parentSpanId"] == expand["spanId"]
+    assert lookup["traceId"] == expand["traceId"]
+    assert "parentSpanId" not in expand
+    assert {"key": "attempt", "value": {"intValue": "1"}} in expand["attributes"]
+    assert int(expand["endTimeUnixNano"]) >= int(expand["startTimeUnixNano"])
+
+
+def test_recorder_exports_on_shutdown(tmp_path):
+    settings = ShortenerSettings(
+        tracing_enabled=True,
+        tracing_sample_rate=1,
+        tracing_path=str(tmp_path / "trace-{pid}.json"),
+    )
+
+    with build_trace_recorder(settings):
+        with TRACER.span("expand"):
+            pass
+
+    assert not TRACER.enabled
+    (path,) = tmp_path.glob("trace-*.json")
+    assert len(json.loads(path.read_text())["traceEvents"]) == 1
+    TRACER.clear()
+
+
+def test_recorder_is_not_built_when_tracing_is_disabled():
+    assert build_trace_recorder(ShortenerSettings()) is None
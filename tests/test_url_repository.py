@@ -1,10 +1,23 @@
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 from unittest.mock import patch, MagicMock
 
 import pytest
 from freezegun import freeze_time
+from pymongo import ReturnDocument
+from pymongo.errors import (
+    BulkWriteError,
+    CursorNotFound,
+    DuplicateKeyError,
+    OperationFailure,
+)
 
-from urlshortener.repository.mongo_repository import MongoURLRepository
+from urlshortener.repository.mongo_repository import (
+    IndexMigrationError,
+    MongoURLRepository,
+    read_preference,
+)
+from urlshortener.repository.repository import ShortURLCollisionError, URLMapping
 from urlshortener.settings import ShortenerSettings
 
 
@@ -34,10 +47,9 @@ class TestURLRepository:
                         "algorithm": "BASE64",
                         "original_url": "https://www.example.com",
                         "short_url": "abc123",
-                        "expiration_time": int(
-                            datetime.utcnow().timestamp() + settings.expiration_offset
-                        ),
-                        "creation_time": int(datetime.utcnow().timestamp()),
+                        "expiration_time": datetime(2024, 1, 1)
+                        + timedelta(seconds=settings.expiration_offset),
+                        "creation_time": datetime(2024, 1, 1),
                     }
                 },
                 upsert=True,
@@ -58,7 +70,69 @@ class TestURLRepository:
 
         with MongoURLRepository(settings):
             mock_db.create_collection.assert_called_once_with(collection_name)
-            mock_collection.create_index.assert_called_with(["algorithm", "short_url"])
+            mock_collection.create_index.assert_any_call(
+                ["algorithm", "short_url"], unique=True
+            )
+            mock_collection.create_index.assert_any_call(
+                ["algorithm", "short_url", "expiration_time", "original_url"]
+            )
+            mock_collection.create_index.assert_called_with(
+                ["expiration_time"], expireAfterSeconds=0
+            )
+
+    @patch("pymongo.MongoClient")
+    def test_init_fails_on_the_indexes_of_older_versions(self, mock_client):
+        mock_collection = MagicMock()
+        mock_collection.create_index.side_effect = OperationFailure(
+            "Index already exists with a different name", code=85
+        )
+        mock_db = mock_client.return_value.__getitem__.return_value
+        mock_db.list_collection_names.return_value = [
+            ShortenerSettings().mongo_url_collection
+        ]
+        mock_db.__getitem__.return_value = mock_collection
+
+        with pytest.raises(IndexMigrationError, match="urlshortener migrate"):
+            MongoURLRepository(ShortenerSettings()).initialize()
+
+        # the migration opens the collection as it is
+        with MongoURLRepository(ShortenerSettings(), create_indexes=False):
+            pass
+
+    @patch("pymongo.MongoClient")
+    def test_can_migrate_indexes_of_older_versions(self, _):
+        with MongoURLRepository(
+            ShortenerSettings(), create_indexes=False
+        ) as repository:
+            mock_collection = MagicMock()
+            repository._url_collection = mock_collection
+            mock_collection.aggregate.side_effect = [
+                [{"_id": {}, "ids": [1, 2, 3]}],
+                [{"_id": {}, "ids": [4, 5]}],
+            ]
+            mock_collection.delete_many.return_value.deleted_count = 2
+            mock_collection.index_information.return_value = {
+                "_id_": {"key": [("_id", 1)]},
+                "algorithm_1_original_url_1": {
+                    "key": [("algorithm", 1), ("original_url", 1)]
+                },
+                "algorithm_1_short_url_1": {
+                    "key": [("algorithm", 1), ("short_url", 1)],
+                    "unique": True,
+                },
+            }
+
+            deleted = repository.migrate_indexes(batch_size=10)
+
+            assert deleted == 4
+            mock_collection.delete_many.assert_any_call({"_id": {"$in": [2, 3]}})
+            mock_collection.delete_many.assert_any_call({"_id": {"$in": [5]}})
+            mock_collection.drop_index.assert_called_once_with(
+                "algorithm_1_original_url_1"
+            )
+            mock_collection.create_index.assert_any_call(
+                ["algorithm", "original_url"], unique=True
+            )
 
     @freeze_time("2024-01-01")
     @patch("pymongo.MongoClient")
@@ -76,9 +150,10 @@ class TestURLRepository:
             mock_collection.find_one.assert_called_once_with(
                 {
                     "original_url": original_url,
-                    "expiration_time": {"$gt": int(datetime.utcnow().timestamp())},
+                    "expiration_time": {"$gt": datetime(2024, 1, 1)},
                     "algorithm": algorithm,
-                }
+                },
+                projection={"_id": False, "short_url": True},
             )
             assert short_url is None
 
@@ -131,7 +206,469 @@ class TestURLRepository:
     def test_repo_not_initialized_raises_an_error(self, _):
         settings = ShortenerSettings()
 
-        with pytest.raises(Exception):
+        with pytest.raises(Exception, match="MongoURLRepository is not initialized"):
             MongoURLRepository(settings).get_short_url(
                 original_url="http://www.example.com/lorem/ipsum", algorithm="BASE64"
             )
+
+    @freeze_time("2024-01-01")
+    @patch("pymongo.MongoClient")
+    def test_can_save_url_mappings_in_bulk(self, _):
+        settings = ShortenerSettings()
+
+        with MongoURLRepository(settings) as repository:
+            mock_collection = MagicMock()
+            repository._url_collection = mock_collection
+
+            repository.save_url_mappings(
+                {"https://www.example.com/a": "a1", "https://www.example.com/b": "b1"},
+                "BASE64",
+            )
+
+            mock_collection.bulk_write.assert_called_once()
+            requests = mock_collection.bulk_write.call_args.args[0]
+            assert mock_collection.bulk_write.call_args.kwargs == {"ordered": False}
+            assert [request._filter for request in requests] == [
+                {"algorithm": "BASE64", "original_url": "https://www.example.com/a"},
+                {"algorithm": "BASE64", "original_url": "https://www.example.com/b"},
+            ]
+            assert all(request._upsert for request in requests)
+
+    @freeze_time("2024-01-01")
+    @patch("pymongo.MongoClient")
+    def test_expirations_are_extended_with_max_updates(self, _):
+        with MongoURLRepository(ShortenerSettings()) as repository:
+            mock_collection = MagicMock()
+            mock_collection.bulk_write.return_value.modified_count = 1
+            repository._url_collection = mock_collection
+
+            extended = repository.extend_expirations(
+                [URLMapping("https://www.example.com", "abc123", "BASE64", 0, 0)],
+                expiration_time=1704067260,
+                max_lifetime=3600,
+            )
+
+            assert extended == 1
+            (request,) = mock_collection.bulk_write.call_args.args[0]
+            assert request._filter == {
+                "algorithm": "BASE64",
+                "original_url": "https://www.example.com",
+                "short_url": "abc123",
+                "expiration_time": {"$gt": datetime(2024, 1, 1)},
+                "creation_time": {"$gte": datetime(2023, 12, 31, 23, 1)},
+            }
+            assert request._doc == {
+                "$max": {"expiration_time": datetime(2024, 1, 1, 0, 1)}
+            }
+
+    @freeze_time("2024-01-01")
+    @patch("pymongo.MongoClient")
+    def test_created_mappings_never_replace_live_ones(self, _):
+        with MongoURLRepository(ShortenerSettings()) as repository:
+            mock_collection = MagicMock()
+            mock_collection.bulk_write.side_effect = BulkWriteError(
+                {
+                    "writeErrors": [
+                        {
+                            "code": 11000,
+                            "keyPattern": {"algorithm": 1, "original_url": 1},
+                            "op": {"q": {"original_url": "https://www.example.com"}},
+                        }
+                    ]
+                }
+            )
+            repository._url_collection = mock_collection
+
+            not_stored = repository.create_url_mappings(
+                [URLMapping("https://www.example.com", "abc123", "BASE64", 60, 0)]
+            )
+
+            assert not_stored == {"https://www.example.com"}
+            (request,) = mock_collection.bulk_write.call_args.args[0]
+            assert request._filter == {
+                "algorithm": "BASE64",
+                "original_url": "https://www.example.com",
+                "$or": [
+                    {"$nor": [{"expiration_time": {"$gt": datetime(2024, 1, 1)}}]},
+                    {"short_url": "abc123"},
+                ],
+            }
+            assert request._upsert
+
+    @patch("pymongo.MongoClient")
+    def test_save_empty_url_mappings_does_not_write(self, _):
+        with MongoURLRepository(ShortenerSettings()) as repository:
+            mock_collection = MagicMock()
+            repository._url_collection = mock_collection
+
+            repository.save_url_mappings({}, "BASE64")
+
+            mock_collection.bulk_write.assert_not_called()
+
+    @freeze_time("2024-01-01")
+    @patch("pymongo.MongoClient")
+    def test_can_retrieve_original_urls_in_one_query(self, _):
+        with MongoURLRepository(ShortenerSettings()) as repository:
+            mock_collection = MagicMock()
+            repository._url_collection = mock_collection
+            mock_collection.find.return_value = [
+                {"original_url": "https://www.example.com", "short_url": "abc123"}
+            ]
+
+            result = repository.get_original_urls(["abc123", "missing"], "BASE64")
+
+            mock_collection.find.assert_called_once_with(
+                {
+                    "short_url": {"$in": ["abc123", "missing"]},
+                    "expiration_time": {"$gt": datetime(2024, 1, 1)},
+                    "algorithm": "BASE64",
+                },
+                projection={"_id": False, "original_url": True, "short_url": True},
+            )
+            assert result == {"abc123": "https://www.example.com"}
+
+    @patch("pymongo.MongoClient")
+    def test_can_retrieve_mapping_by_short_url(self, _):
+        with MongoURLRepository(ShortenerSettings()) as repository:
+            mock_collection = MagicMock()
+            repository._url_collection = mock_collection
+            mock_collection.find_one.return_value = {
+                "original_url": "https://www.example.com",
+                "short_url": "abc123",
+                "algorithm": "BASE64",
+                "expiration_time": 1704067260,
+                "creation_time": 1704067200,
+            }
+
+            mapping = repository.get_mapping_by_short_url("abc123", "BASE64")
+
+            mock_collection.find_one.assert_called_once_with(
+                {"short_url": "abc123", "algorithm": "BASE64"},
+                projection={"_id": False},
+                sort=[("expiration_time", -1)],
+            )
+            assert mapping.original_url == "https://www.example.com"
+            assert mapping.expiration_time == 1704067260
+
+    @patch("pymongo.MongoClient")
+    def test_can_reserve_id_block(self, _):
+        settings = ShortenerSettings()
+
+        with MongoURLRepository(settings) as repository:
+            mock_counters = MagicMock()
+            repository._counter_collection = mock_counters
+            mock_counters.find_one_and_update.return_value = {"value": 300}
+
+            first_id = repository.reserve_id_block(100)
+
+            mock_counters.find_one_and_update.assert_called_once_with(
+                {"_id": settings.mongo_url_collection},
+                {"$inc": {"value": 100}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            assert first_id == 200
+
+    @freeze_time("2024-01-01")
+    @patch("pymongo.MongoClient")
+    def test_get_or_create_short_url_is_one_round_trip(self, _):
+        with MongoURLRepository(ShortenerSettings()) as repository:
+            mock_collection = MagicMock()
+            repository._url_collection = mock_collection
+            mock_collection.find_one_and_update.return_value = {
+                "short_url": "abc123",
+                "expiration_time": datetime(2024, 1, 2),
+            }
+
+            result = repository.get_or_create_short_url(
+                "https://www.example.com", "def456", "BASE64"
+            )
+
+            mock_collection.find_one_and_update.assert_called_once()
+            kwargs = mock_collection.find_one_and_update.call_args.kwargs
+            assert kwargs["filter"] == {
+                "algorithm": "BASE64",
+                "original_url": "https://www.example.com",
+            }
+            assert kwargs["upsert"] is True
+            assert kwargs["return_document"] == ReturnDocument.BEFORE
+            assert result == ("abc123", False)
+
+    @freeze_time("2024-01-01")
+    @patch("pymongo.MongoClient")
+    def test_get_or_create_short_url_creates_from_the_write_itself(self, _):
+        with MongoURLRepository(ShortenerSettings()) as repository:
+            mock_collection = MagicMock()
+            repository._url_collection = mock_collection
+            # nothing before the upsert, then a mapping that expired
+            mock_collection.find_one_and_update.side_effect = [
+                None,
+                {"short_url": "abc123", "expiration_time": datetime(2024, 1, 1)},
+            ]
+
+            assert repository.get_or_create_short_url(
+                "https://www.example.com", "def456", "BASE64"
+            ) == ("def456", True)
+            assert repository.get_or_create_short_url(
+                "https://www.example.com", "ghi789", "BASE64"
+            ) == ("ghi789", True)
+
+    @freeze_time("2024-01-01")
+    @patch("pymongo.MongoClient")
+    def test_get_or_create_short_url_keeps_live_integer_expirations(self, _):
+        with MongoURLRepository(ShortenerSettings()) as repository:
+            mock_collection = MagicMock()
+            repository._url_collection = mock_collection
+            mock_collection.find_one_and_update.return_value = {
+                "short_url": "abc123",
+                "expiration_time": 1704067260,
+            }
+
+            result = repository.get_or_create_short_url(
+                "https://www.example.com", "def456", "BASE64"
+            )
+
+            assert result == ("abc123", False)
+            (stage,) = mock_collection.find_one_and_update.call_args.kwargs["update"]
+            assert stage["$set"]["short_url"]["$cond"][0] == {
+                "$cond": [
+                    {"$eq": [{"$type": "$expiration_time"}, "date"]},
+                    {"$gt": ["$expiration_time", datetime(2024, 1, 1)]},
+                    {"$gt": ["$expiration_time", 1704067200]},
+                ]
+            }
+
+    @patch("pymongo.MongoClient")
+    def test_get_or_create_short_url_detects_collisions(self, _):
+        with MongoURLRepository(ShortenerSettings()) as repository:
+            mock_collection = MagicMock()
+            repository._url_collection = mock_collection
+            mock_collection.find_one_and_update.side_effect = DuplicateKeyError(
+                "duplicate", 11000, {"keyPattern": {"algorithm": 1, "short_url": 1}}
+            )
+
+            with pytest.raises(ShortURLCollisionError):
+                repository.get_or_create_short_url(
+                    "https://www.example.com", "def456", "BASE64"
+                )
+
+    @freeze_time("2024-01-01")
+    @patch("pymongo.MongoClient")
+    def test_get_or_create_short_url_retries_concurrent_insert(self, _):
+        with MongoURLRepository(ShortenerSettings()) as repository:
+            mock_collection = MagicMock()
+            repository._url_collection = mock_collection
+            mock_collection.find_one_and_update.side_effect = [
+                DuplicateKeyError(
+                    "duplicate",
+                    11000,
+                    {"keyPattern": {"algorithm": 1, "original_url": 1}},
+                ),
+                {"short_url": "abc123", "expiration_time": datetime(2024, 1, 2)},
+            ]
+
+            result = repository.get_or_create_short_url(
+                "https://www.example.com", "def456", "BASE64"
+            )
+
+            assert result == ("abc123", False)
+
+    @freeze_time("2024-01-01")
+    @patch("pymongo.MongoClient")
+    def test_legacy_expiration_matches_both_types(self, _):
+        settings = ShortenerSettings(mongo_legacy_expiration=True)
+
+        with MongoURLRepository(settings) as repository:
+            mock_collection = MagicMock()
+            repository._url_collection = mock_collection
+            mock_collection.find_one.return_value = None
+
+            repository.get_original_url("abc123", "BASE64")
+
+            mock_collection.find_one.assert_called_once_with(
+                {
+                    "short_url": "abc123",
+                    "$or": [
+                        {"expiration_time": {"$gt": datetime(2024, 1, 1)}},
+                        {"expiration_time": {"$gt": 1704067200}},
+                    ],
+                    "algorithm": "BASE64",
+                },
+                projection={"_id": False, "original_url": True},
+            )
+
+    @patch("pymongo.MongoClient")
+    def test_can_migrate_integer_expiration_times(self, _):
+        with MongoURLRepository(ShortenerSettings()) as repository:
+            mock_collection = MagicMock()
+            repository._url_collection = mock_collection
+            mock_collection.find.return_value = [
+                {
+                    "_id": 1,
+                    "expiration_time": 1704067260,
+                    "creation_time": 1704067200,
+                }
+            ]
+            mock_collection.bulk_write.return_value.modified_count = 1
+
+            migrated = repository.migrate_expiration_dates(batch_size=10)
+
+            assert migrated == 1
+            mock_collection.find.assert_called_once()
+            assert mock_collection.find.call_args.kwargs["sort"] == [("_id", 1)]
+            requests = mock_collection.bulk_write.call_args.args[0]
+            assert requests[0]._filter == {"_id": 1, "expiration_time": 1704067260}
+            assert requests[0]._doc == {
+                "$set": {
+                    "expiration_time": datetime(2024, 1, 1, 0, 1),
+                    "creation_time": datetime(2024, 1, 1),
+                }
+            }
+
+    @patch("pymongo.MongoClient")
+    def test_migration_resumes_after_the_last_migrated_id(self, _):
+        def lost_cursor():
+            yield {"_id": 1, "expiration_time": 60, "creation_time": 0}
+            yield {"_id": 2, "expiration_time": 60, "creation_time": 0}
+            raise CursorNotFound("cursor id not found")
+
+        with MongoURLRepository(ShortenerSettings()) as repository:
+            mock_collection = MagicMock()
+            repository._url_collection = mock_collection
+            mock_collection.find.side_effect = [
+                lost_cursor(),
+                [{"_id": 3, "expiration_time": 60, "creation_time": 0}],
+            ]
+            mock_collection.bulk_write.return_value.modified_count = 1
+
+            migrated = repository.migrate_expiration_dates(batch_size=1)
+
+            assert migrated == 3
+            resumed_query = mock_collection.find.call_args_list[1].args[0]
+            assert resumed_query["_id"] == {"$gt": 2}
+
+    @patch("pymongo.MongoClient")
+    def test_iter_url_mappings_created_after(self, _):
+        with MongoURLRepository(ShortenerSettings()) as repository:
+            mock_collection = MagicMock()
+            repository._url_collection = mock_collection
+            mock_collection.find.return_value = [
+                {
+                    "original_url": "https://www.example.com",
+                    "short_url": "abc123",
+                    "algorithm": "BASE64",
+                    "expiration_time": datetime(2024, 1, 1, 1),
+                    "creation_time": datetime(2024, 1, 1),
+                }
+            ]
+
+            mappings = list(repository.iter_url_mappings(500, created_after=1704067200))
+
+            mock_collection.find.assert_called_once_with(
+                {
+                    "$or": [
+                        {"creation_time": {"$gte": datetime(2024, 1, 1)}},
+                        {"restored_time": {"$gte": datetime(2024, 1, 1)}},
+                    ]
+                },
+                projection={"_id": False},
+                batch_size=500,
+            )
+            assert [mapping.short_url for mapping in mappings] == ["abc123"]
+
+    @patch("pymongo.MongoClient")
+    def test_client_options(self, mock_client):
+        settings = ShortenerSettings(
+            mongo_max_pool_size=50,
+            mongo_socket_timeout_ms=2000,
+            mongo_compressors=["zstd", "zlib"],
+        )
+
+        with MongoURLRepository(settings):
+            mock_client.assert_called_once_with(
+                settings.mongo_instance_url,
+                maxPoolSize=50,
+                minPoolSize=0,
+                connectTimeoutMS=20000,
+                socketTimeoutMS=2000,
+                serverSelectionTimeoutMS=30000,
+                compressors="zstd,zlib",
+            )
+
+    def test_read_preference(self):
+        preference = read_preference(
+            ShortenerSettings(
+                mongo_read_preference="secondaryPreferred", mongo_max_staleness=90
+            )
+        )
+
+        assert preference.document == {
+            "mode": "secondaryPreferred",
+            "maxStalenessSeconds": 90,
+        }
+        assert read_preference(ShortenerSettings()).document == {"mode": "primary"}
+
+    @patch("pymongo.MongoClient")
+    def test_reads_go_to_secondaries_except_after_writes(self, _):
+        settings = ShortenerSettings(mongo_read_preference="secondary")
+
+        with MongoURLRepository(settings) as repository:
+            primary, secondary = MagicMock(), MagicMock()
+            repository._url_collection = primary
+            repository._read_collection = secondary
+            secondary.find_one.return_value = {"original_url": "https://a.com"}
+
+            assert repository.get_original_url("abc", "BASE64") == "https://a.com"
+            primary.find_one.assert_not_called()
+
+            repository.save_url_mapping("https://b.com", "def", "BASE64")
+            repository.get_original_url("def", "BASE64")
+
+            primary.find_one.assert_called_once()
+            assert secondary.find_one.call_count == 1
+
+    @patch("pymongo.MongoClient")
+    def test_read_your_writes_window_expires(self, _):
+        settings = ShortenerSettings(
+            mongo_read_preference="secondary", mongo_read_your_writes_window=10
+        )
+
+        with freeze_time("2024-01-01") as frozen_time:
+            with MongoURLRepository(settings) as repository:
+                primary, secondary = MagicMock(), MagicMock()
+                repository._url_collection = primary
+                repository._read_collection = secondary
+
+                repository.save_url_mapping("https://b.com", "def", "BASE64")
+                frozen_time.tick(11)
+                repository.get_short_url("https://b.com", "BASE64")
+
+                primary.find_one.assert_not_called()
+                secondary.find_one.assert_called_once()
+                assert not repository._recent_writes
+
+    @patch("pymongo.MongoClient")
+    def test_slow_secondary_reads_are_hedged(self, _):
+        settings = ShortenerSettings(
+            mongo_read_preference="secondary",
+            mongo_hedged_reads=True,
+            mongo_hedge_delay_ms=10,
+        )
+        secondary_released = threading.Event()
+
+        def slow_find_one(*args, **kwargs):
+            secondary_released.wait(5)
+            return {"original_url": "https://slow.com"}
+
+        with MongoURLRepository(settings) as repository:
+            primary, secondary = MagicMock(), MagicMock()
+            repository._url_collection = primary
+            repository._read_collection = secondary
+            secondary.find_one.side_effect = slow_find_one
+            primary.find_one.return_value = {"original_url": "https://a.com"}
+
+            assert repository.get_original_url("abc", "BASE64") == "https://a.com"
+            secondary_released.set()
+
+            secondary.find_one.assert_called_once()
+            primary.find_one.assert_called_once()
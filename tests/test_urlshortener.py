@@ -2,7 +2,15 @@ from unittest.mock import Mock
 
 import pytest
 
+from urlshortener.algorithms.base_64 import Base64ShorteningAlgorithm
 from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithmType
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.repository.repository import (
+    ShortURLCollisionError,
+    URLMapping,
+    current_date_in_seconds,
+)
+from urlshortener.settings import ShortenerSettings
 from urlshortener.url_shortener import URLShortener
 
 
@@ -14,18 +22,14 @@ class TestURLShortener:
         algorithm.type.return_value = ShorteningAlgorithmType.BASE64
         algorithm.shorten.return_value = "shorten_part"
         repository = Mock()
-        repository.get_short_url.return_value = None
         short_url = "https://www.example.com/shorten_part"
-        repository.save_url_mapping.return_value = None
+        repository.get_or_create_short_url.return_value = (short_url, True)
         url_shortener = URLShortener(repository)
 
         result = url_shortener.minify(url_to_minify, algorithm)
 
-        repository.get_short_url.assert_called_once_with(
-            original_url=url_to_minify, algorithm=ShorteningAlgorithmType.BASE64.value
-        )
         algorithm.shorten.assert_called_once_with(url=url_to_minify)
-        repository.save_url_mapping.assert_called_once_with(
+        repository.get_or_create_short_url.assert_called_once_with(
             original_url=url_to_minify,
             short_url=short_url,
             algorithm="base-64",
@@ -36,30 +40,91 @@ class TestURLShortener:
         url = "https://www.example.com/test?q=123"
         algorithm = Mock()
         algorithm.type.return_value = ShorteningAlgorithmType.BASE64
+        algorithm.shorten.return_value = "shorten_part"
         repository = Mock()
-        repository.get_short_url.return_value = "https://example.com/Hs2s1aD"
+        repository.get_or_create_short_url.return_value = (
+            "https://example.com/Hs2s1aD",
+            False,
+        )
         url_shortener = URLShortener(repository)
 
         result = url_shortener.minify(url, algorithm)
 
-        repository.get_short_url.assert_called_once_with(
-            original_url=url, algorithm="base-64"
+        repository.get_or_create_short_url.assert_called_once_with(
+            original_url=url,
+            short_url="https://www.example.com/shorten_part",
+            algorithm="base-64",
         )
-        algorithm.shorten.assert_not_called()
         repository.save_url_mapping.assert_not_called()
         assert result == "https://example.com/Hs2s1aD"
 
+    def test_minify_url_retries_on_collision(self):
+        url = "https://www.example.com/test?q=123"
+        algorithm = Mock()
+        algorithm.type.return_value = ShorteningAlgorithmType.BASE64
+        algorithm.shorten.return_value = "taken"
+        algorithm.rehash.return_value = "free"
+        repository = Mock()
+        repository.get_or_create_short_url.side_effect = [
+            ShortURLCollisionError("taken"),
+            ("https://www.example.com/free", True),
+        ]
+        url_shortener = URLShortener(repository)
+
+        result = url_shortener.minify(url, algorithm)
+
+        algorithm.rehash.assert_called_once_with(url=url, attempt=1)
+        assert repository.get_or_create_short_url.call_count == 2
+        assert result == "https://www.example.com/free"
+
+    def test_minify_url_gives_up_after_max_collision_retries(self):
+        algorithm = Mock()
+        algorithm.type.return_value = ShorteningAlgorithmType.BASE64
+        algorithm.shorten.return_value = "taken"
+        algorithm.rehash.return_value = "taken"
+        repository = Mock()
+        repository.get_or_create_short_url.side_effect = ShortURLCollisionError("")
+        url_shortener = URLShortener(repository, max_collision_retries=2)
+
+        with pytest.raises(ShortURLCollisionError):
+            url_shortener.minify("https://www.example.com/test?q=123", algorithm)
+
+        assert repository.get_or_create_short_url.call_count == 3
+
+    def test_minify_many_urls_of_one_domain_with_the_default_settings(self):
+        settings = ShortenerSettings()
+        url_shortener = URLShortener(
+            InMemoryURLRepository(settings),
+            fixed_domain=settings.fixed_domain,
+            max_collision_retries=settings.max_collision_retries,
+        )
+        algorithm = Base64ShorteningAlgorithm()
+        urls = [f"https://www.example.com/page/{i}" for i in range(200)]
+
+        short_urls = [url_shortener.minify(url, algorithm) for url in urls]
+
+        assert len(set(short_urls)) == len(urls)
+        assert [
+            url_shortener.expand(short_url, algorithm) for short_url in short_urls
+        ] == urls
+
     def test_expand_existing_short_url(self):
         short_url = "https://example.com/Hs2s1aD"
         algorithm = Mock()
         algorithm.type.return_value = ShorteningAlgorithmType.BASE64
         repository = Mock()
-        repository.get_original_url.return_value = "https://www.example.com/test?q=123"
+        repository.get_mapping_by_short_url.return_value = URLMapping(
+            original_url="https://www.example.com/test?q=123",
+            short_url=short_url,
+            algorithm="base-64",
+            expiration_time=current_date_in_seconds() + 60,
+            creation_time=current_date_in_seconds(),
+        )
         url_shortener = URLShortener(repository)
 
         result = url_shortener.expand(short_url, algorithm)
 
-        repository.get_original_url.assert_called_once_with(
+        repository.get_mapping_by_short_url.assert_called_once_with(
             short_url=short_url, algorithm="base-64"
         )
         assert result == "https://www.example.com/test?q=123"
@@ -103,8 +168,106 @@ class TestURLShortener:
         with pytest.raises(ValueError):
             url_shortener.minify(url, algorithm)
 
-        repository.get_short_url.assert_called_once_with(
-            original_url=url, algorithm="base-64"
-        )
+        repository.get_or_create_short_url.assert_not_called()
         algorithm.shorten.assert_not_called()
         repository.save_url_mapping.assert_not_called()
+
+    def test_minify_batch_saves_only_missing_urls(self):
+        urls = [
+            "https://www.example.com/a",
+            "https://www.example.com/b",
+            "https://www.example.com/a",
+        ]
+        algorithm = Mock()
+        algorithm.type.return_value = ShorteningAlgorithmType.BASE64
+        algorithm.shorten.return_value = "shorten_part"
+        repository = Mock()
+        repository.get_short_urls.return_value = {
+            "https://www.example.com/a": "https://www.example.com/existing"
+        }
+        url_shortener = URLShortener(repository)
+
+        result = url_shortener.minify_batch(urls, algorithm)
+
+        repository.get_short_urls.assert_called_once_with(
+            original_urls=["https://www.example.com/a", "https://www.example.com/b"],
+            algorithm="base-64",
+        )
+        algorithm.shorten.assert_called_once_with(url="https://www.example.com/b")
+        repository.save_url_mappings.assert_called_once_with(
+            url_mappings={
+                "https://www.example.com/b": "https://www.example.com/shorten_part"
+            },
+            algorithm="base-64",
+        )
+        assert result == {
+            "https://www.example.com/a": "https://www.example.com/existing",
+            "https://www.example.com/b": "https://www.example.com/shorten_part",
+        }
+
+    def test_minify_batch_retries_colliding_urls(self):
+        algorithm = Mock()
+        algorithm.type.return_value = ShorteningAlgorithmType.BASE64
+        algorithm.shorten.return_value = "taken"
+        algorithm.rehash.return_value = "free"
+        repository = Mock()
+        repository.get_short_urls.return_value = {}
+        repository.save_url_mappings.side_effect = ShortURLCollisionError(
+            "taken", original_urls=["https://www.example.com/a"]
+        )
+        repository.get_or_create_short_url.side_effect = [
+            ShortURLCollisionError("taken"),
+            ("https://www.example.com/free", True),
+        ]
+        url_shortener = URLShortener(repository)
+
+        result = url_shortener.minify_batch(["https://www.example.com/a"], algorithm)
+
+        assert result == {"https://www.example.com/a": "https://www.example.com/free"}
+
+    def test_minify_batch_already_minified(self):
+        algorithm = Mock()
+        algorithm.type.return_value = ShorteningAlgorithmType.BASE64
+        repository = Mock()
+        repository.get_short_urls.return_value = {
+            "https://www.example.com/a": "https://www.example.com/existing"
+        }
+        url_shortener = URLShortener(repository)
+
+        url_shortener.minify_batch(["https://www.example.com/a"], algorithm)
+
+        algorithm.shorten.assert_not_called()
+        repository.save_url_mappings.assert_not_called()
+
+    def test_expand_batch(self):
+        algorithm = Mock()
+        algorithm.type.return_value = ShorteningAlgorithmType.BASE64
+        repository = Mock()
+        repository.get_original_urls.return_value = {
+            "https://example.com/Hs2s1aD": "https://www.example.com/test?q=123"
+        }
+        url_shortener = URLShortener(repository)
+
+        result = url_shortener.expand_batch(
+            ["https://example.com/Hs2s1aD", "https://example.com/missing"], algorithm
+        )
+
+        repository.get_original_urls.assert_called_once_with(
+            short_urls=["https://example.com/Hs2s1aD", "https://example.com/missing"],
+            algorithm="base-64",
+        )
+        assert result == {
+            "https://example.com/Hs2s1aD": "https://www.example.com/test?q=123"
+        }
+
+    def test_colliding_urls_do_not_overwrite_each_other(self):
+        repository = InMemoryURLRepository(ShortenerSettings())
+        url_shortener = URLShortener(repository)
+        algorithm = Base64ShorteningAlgorithm()
+
+        first = url_shortener.minify("https://example.com/a", algorithm)
+        second = url_shortener.minify("https://example.com/b", algorithm)
+
+        assert first != second
+        assert url_shortener.expand(first, algorithm) == "https://example.com/a"
+        assert url_shortener.expand(second, algorithm) == "https://example.com/b"
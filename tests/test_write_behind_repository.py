@@ -0,0 +1,193 @@
+import threading
+
+import pytest
+
+from urlshortener.repository import write_behind_repository
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.repository.repository import ShortURLCollisionError
+from urlshortener.repository.write_behind_repository import (
+    WRITE_BEHIND_MAPPINGS_TOTAL,
+    WriteBehindURLRepository,
+)
+from urlshortener.settings import ShortenerSettings
+
+
+class FlakyRepository(InMemoryURLRepository):
+    def __init__(self, settings, failures):
+        super().__init__(settings)
+        self.failures = failures
+        self.creates = 0
+
+    def create_url_mappings(self, url_mappings):
+        self.creates += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("connection reset")
+        return super().create_url_mappings(url_mappings)
+
+
+class RacingRepository(InMemoryURLRepository):
+    """Another process minifies every url right before it is flushed."""
+
+    def create_url_mappings(self, url_mappings):
+        for mapping in url_mappings:
+            self.save_url_mapping(mapping.original_url, "s/other", mapping.algorithm)
+        return super().create_url_mappings(url_mappings)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(write_behind_repository, "_RETRY_BACKOFF", 0)
+
+
+def _settings(durability, **kwargs):
+    # the flusher only runs on explicit flushes unless a test says otherwise
+    kwargs.setdefault("write_behind_flush_interval", 60)
+    return ShortenerSettings(
+        expiration_offset=60, write_behind_durability=durability, **kwargs
+    )
+
+
+def test_fire_and_forget_writes_are_served_before_being_stored():
+    settings = _settings("fire-and-forget")
+    backend = InMemoryURLRepository(settings)
+
+    with WriteBehindURLRepository(backend, settings) as repository:
+        created = repository.get_or_create_short_url(
+            "https://www.example.com", "s/abc", "sha256"
+        )
+
+        assert created == ("s/abc", True)
+        assert backend.get_original_url("s/abc", "sha256") is None
+        assert repository.get_original_url("s/abc", "sha256") == (
+            "https://www.example.com"
+        )
+        assert repository.get_or_create_short_url(
+            "https://www.example.com", "s/def", "sha256"
+        ) == ("s/abc", False)
+
+        repository.flush()
+        assert backend.get_original_url("s/abc", "sha256") == "https://www.example.com"
+
+
+def test_pending_writes_are_flushed_on_exit():
+    settings = _settings("fire-and-forget")
+    backend = InMemoryURLRepository(settings)
+
+    with WriteBehindURLRepository(backend, settings) as repository:
+        repository.save_url_mappings(
+            {"https://a.com": "s/a", "https://b.com": "s/b"}, "sha256"
+        )
+
+    assert backend.get_original_urls(["s/a", "s/b"], "sha256") == {
+        "s/a": "https://a.com",
+        "s/b": "https://b.com",
+    }
+
+
+def test_batch_size_triggers_a_flush():
+    settings = _settings("batched", write_behind_batch_size=2)
+    backend = InMemoryURLRepository(settings)
+
+    with WriteBehindURLRepository(backend, settings) as repository:
+        repository.save_url_mappings(
+            {"https://a.com": "s/a", "https://b.com": "s/b"}, "sha256"
+        )
+
+        assert backend.get_original_url("s/a", "sha256") == "https://a.com"
+
+
+def test_batched_writes_see_collisions():
+    settings = _settings("batched", write_behind_flush_interval=0.001)
+    backend = InMemoryURLRepository(settings)
+    backend.save_url_mapping("https://a.com", "s/abc", "sha256")
+    collisions = WRITE_BEHIND_MAPPINGS_TOTAL.value("collision")
+
+    with WriteBehindURLRepository(backend, settings) as repository:
+        with pytest.raises(ShortURLCollisionError) as exc_info:
+            repository.get_or_create_short_url("https://b.com", "s/abc", "sha256")
+
+    assert exc_info.value.original_urls == ["https://b.com"]
+    assert backend.get_original_url("s/abc", "sha256") == "https://a.com"
+    assert WRITE_BEHIND_MAPPINGS_TOTAL.value("collision") == collisions + 1
+
+
+def test_flushes_do_not_overwrite_live_mappings():
+    settings = _settings("fire-and-forget")
+    backend = InMemoryURLRepository(settings)
+    collisions = WRITE_BEHIND_MAPPINGS_TOTAL.value("collision")
+
+    with WriteBehindURLRepository(backend, settings) as repository:
+        repository.save_url_mapping("https://a.com", "s/new", "sha256")
+        backend.save_url_mapping("https://a.com", "s/old", "sha256")
+        repository.flush()
+
+        assert repository.get_short_url("https://a.com", "sha256") == "s/old"
+        assert backend.get_original_url("s/new", "sha256") is None
+
+    assert WRITE_BEHIND_MAPPINGS_TOTAL.value("collision") == collisions + 1
+
+
+def test_batched_minifies_return_the_mapping_that_won_the_race():
+    settings = _settings("batched", write_behind_flush_interval=0.001)
+    backend = RacingRepository(settings)
+
+    with WriteBehindURLRepository(backend, settings) as repository:
+        created = repository.get_or_create_short_url("https://a.com", "s/a", "sha256")
+
+    assert created == ("s/other", False)
+    assert backend.get_original_url("s/a", "sha256") is None
+
+
+def test_failed_batches_are_retried():
+    settings = _settings("batched", write_behind_flush_interval=0.001)
+    backend = FlakyRepository(settings, failures=2)
+
+    with WriteBehindURLRepository(backend, settings) as repository:
+        repository.save_url_mapping("https://a.com", "s/a", "sha256")
+
+    assert backend.creates == 3
+    assert backend.get_original_url("s/a", "sha256") == "https://a.com"
+
+
+def test_batches_failing_every_retry_are_dropped():
+    settings = _settings("fire-and-forget", write_behind_max_retries=1)
+    backend = FlakyRepository(settings, failures=2)
+    dropped = WRITE_BEHIND_MAPPINGS_TOTAL.value("dropped")
+
+    with WriteBehindURLRepository(backend, settings) as repository:
+        repository.save_url_mapping("https://a.com", "s/a", "sha256")
+        repository.flush()
+
+        assert repository.get_original_url("s/a", "sha256") is None
+
+    assert backend.creates == 2
+    assert WRITE_BEHIND_MAPPINGS_TOTAL.value("dropped") == dropped + 1
+
+
+def test_writers_wait_while_the_buffer_is_full():
+    settings = _settings("fire-and-forget", write_behind_max_pending=2)
+    backend = InMemoryURLRepository(settings)
+
+    with WriteBehindURLRepository(backend, settings) as repository:
+        repository.save_url_mappings(
+            {"https://a.com": "s/a", "https://b.com": "s/b"}, "sha256"
+        )
+        writer = threading.Thread(
+            target=repository.save_url_mapping, args=("https://c.com", "s/c", "sha256")
+        )
+        writer.start()
+        writer.join(timeout=0.1)
+        assert writer.is_alive()
+
+        repository.flush()
+        writer.join(timeout=5)
+        assert not writer.is_alive()
+        assert repository.get_original_url("s/c", "sha256") == "https://c.com"
+
+
+def test_sync_durability_needs_no_write_behind():
+    settings = _settings("sync")
+
+    with pytest.raises(ValueError):
+        WriteBehindURLRepository(InMemoryURLRepository(settings), settings)
@@ -1,4 +1,4 @@
-from urlshortener.cli import run
+from urlshortener.entrypoint import run
 
 if __name__ == "__main__":
     run()
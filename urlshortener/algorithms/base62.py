@@ -0,0 +1,25 @@
+import string
+
+BASE62_ALPHABET = string.digits + string.ascii_letters
+# without the characters easily mistaken for one another: 0, O, I and l
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+
+def encode(number: int, alphabet: str = BASE62_ALPHABET) -> str:
+    if number < 0:
+        raise ValueError("Only non negative numbers can be encoded")
+    base = len(alphabet)
+    digits = []
+    while True:
+        number, remainder = divmod(number, base)
+        digits.append(alphabet[remainder])
+        if not number:
+            return "".join(reversed(digits))
+
+
+def decode(code: str, alphabet: str = BASE62_ALPHABET) -> int:
+    base = len(alphabet)
+    number = 0
+    for char in code:
+        number = number * base + alphabet.index(char)
+    return number
@@ -1,4 +1,5 @@
 import base64
+import hashlib
 import logging
 
 from urlshortener.algorithms.shortening_algorithm import (
@@ -16,5 +17,12 @@ class Base64ShorteningAlgorithm(ShorteningAlgorithm):
         return ShorteningAlgorithmType.BASE64
 
     def shorten(self, url) -> str:
-        self._log.debug(f"Shortening URL: {url}")
+        self._log.debug("Shortening URL: %s", url)
         return base64.b64encode(url.encode()).decode()[:8]
+
+    def rehash(self, url, attempt: int) -> str:
+        # the code of a url is its scheme, shared by every other url: rehashed
+        # codes come from a salted digest of the whole url instead, url-safe so
+        # that they can be served as a path
+        digest = hashlib.sha256(f"{attempt}:{url}".encode()).digest()
+        return base64.urlsafe_b64encode(digest).decode()[:8]
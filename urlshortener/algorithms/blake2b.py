@@ -0,0 +1,21 @@
+import hashlib
+
+from urlshortener.algorithms.digest import DigestShorteningAlgorithm
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithmType
+
+
+class Blake2bShorteningAlgorithm(DigestShorteningAlgorithm):
+    """Codes from a BLAKE2b digest sized to the code length, salted on rehash."""
+
+    def type(self) -> ShorteningAlgorithmType:
+        return ShorteningAlgorithmType.BLAKE2B
+
+    def _digest(self, data: bytes, salt: int) -> int:
+        if salt:
+            digest = hashlib.blake2b(
+                data, digest_size=self._digest_size, salt=salt.to_bytes(8, "little")
+            )
+        else:
+            # the same digest as a salt of zeros, without building it
+            digest = hashlib.blake2b(data, digest_size=self._digest_size)
+        return int.from_bytes(digest.digest(), "little")
@@ -0,0 +1,100 @@
+import logging
+from abc import abstractmethod
+from typing import Literal
+
+from urlshortener.algorithms.base62 import BASE58_ALPHABET, BASE62_ALPHABET
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithm
+
+ALPHABETS = {"base62": BASE62_ALPHABET, "base58": BASE58_ALPHABET}
+
+
+class DigestShorteningAlgorithm(ShorteningAlgorithm):
+    """Encodes a short digest of the url in base62 or base58, as codes of
+    `code_length` characters.
+
+    A code already taken is rehashed with the attempt as the salt of the digest.
+    The share of first codes found taken estimates how full the codes of the
+    current length are: when it goes past `collision_threshold` over a window of
+    minifies, the codes of the following ones are one character longer, up to
+    `max_code_length`. Mappings keep the code they were created with.
+    """
+
+    # first codes handed out per estimate of the collision rate
+    collision_window = 1000
+
+    def __init__(
+        self,
+        code_length: int = 7,
+        alphabet: Literal["base62", "base58"] = "base62",
+        max_code_length: int = 12,
+        collision_threshold: float = 0.01,
+    ):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._alphabet = ALPHABETS[alphabet]
+        # two characters per division: the codes are encoded a lot
+        self._pairs = [low + high for high in self._alphabet for low in self._alphabet]
+        self._max_code_length = max(code_length, max_code_length)
+        self._collision_threshold = collision_threshold
+        # updated without a lock: a few hits lost between threads do not matter
+        # to the estimate
+        self._attempts = 0
+        self._collisions = 0
+        self._set_code_length(code_length)
+
+    @property
+    def code_length(self) -> int:
+        return self._code_length
+
+    def _set_code_length(self, code_length: int):
+        self._code_length = code_length
+        self._code_space = len(self._alphabet) ** code_length
+        # two bytes more than the code space, so that the modulo bias is
+        # negligible
+        self._digest_size = (self._code_space.bit_length() + 7) // 8 + 2
+
+    @abstractmethod
+    def _digest(self, data: bytes, salt: int) -> int:
+        raise NotImplementedError
+
+    def shorten(self, url) -> str:
+        self._log.debug("Shortening URL: %s", url)
+        self._attempts += 1
+        if self._attempts >= self.collision_window:
+            self._check_occupancy()
+        return self._encode(self._digest(url.encode(), 0))
+
+    def rehash(self, url, attempt: int) -> str:
+        if attempt == 1:
+            self._collisions += 1
+        return self._encode(self._digest(url.encode(), attempt))
+
+    def release(self, code: str):
+        # the url was already minified: its code says nothing of the occupancy
+        self._attempts -= 1
+
+    def _check_occupancy(self):
+        attempts, collisions = self._attempts, self._collisions
+        self._attempts = self._collisions = 0
+        if (
+            collisions > attempts * self._collision_threshold
+            and self._code_length < self._max_code_length
+        ):
+            self._set_code_length(self._code_length + 1)
+            self._log.info(
+                "%s of %s codes taken, codes are now %s characters long",
+                collisions,
+                attempts,
+                self._code_length,
+            )
+
+    def _encode(self, number: int) -> str:
+        # least significant digit first, the code length is fixed anyway
+        pairs, pair_base = self._pairs, len(self._pairs)
+        number %= self._code_space
+        digits = []
+        for _ in range(self._code_length // 2):
+            number, remainder = divmod(number, pair_base)
+            digits.append(pairs[remainder])
+        if self._code_length % 2:
+            digits.append(self._alphabet[number])
+        return "".join(digits)
@@ -1,21 +1,103 @@
+from functools import cache
+from typing import TYPE_CHECKING, Literal
+
 from urlshortener.algorithms.base_64 import Base64ShorteningAlgorithm
+from urlshortener.algorithms.blake2b import Blake2bShorteningAlgorithm
+from urlshortener.algorithms.digest import DigestShorteningAlgorithm
+from urlshortener.algorithms.key_pool import KeyPoolShorteningAlgorithm
+from urlshortener.algorithms.sequence import SequenceShorteningAlgorithm
 from urlshortener.algorithms.sha256 import Sha256ShorteningAlgorithm
+from urlshortener.algorithms.xxh3 import Xxh3ShorteningAlgorithm
 
 from urlshortener.algorithms.shortening_algorithm import (
     ShorteningAlgorithmType,
     ShorteningAlgorithm,
 )
+from urlshortener.repository.repository import URLRepository
+
+if TYPE_CHECKING:
+    from urlshortener.key_pool import KeyPool
 
+# stateless algorithms, built on first use then shared
 factory_config = {
-    ShorteningAlgorithmType.BASE64: Base64ShorteningAlgorithm(),
-    ShorteningAlgorithmType.SHA256: Sha256ShorteningAlgorithm(),
+    ShorteningAlgorithmType.BASE64: Base64ShorteningAlgorithm,
+    ShorteningAlgorithmType.SHA256: Sha256ShorteningAlgorithm,
 }
 
+digest_algorithms = {
+    ShorteningAlgorithmType.BLAKE2B: Blake2bShorteningAlgorithm,
+    ShorteningAlgorithmType.XXHASH: Xxh3ShorteningAlgorithm,
+}
+
+
+@cache
+def _stateless_algorithm(
+    algorithm_type: ShorteningAlgorithmType,
+) -> ShorteningAlgorithm:
+    return factory_config[algorithm_type]()
+
 
 class ShorteningAlgorithmFactory:
 
+    def __init__(
+        self,
+        repository: URLRepository = None,
+        id_block_size: int = 100,
+        key_pool: "KeyPool" = None,
+        code_length: int = 7,
+        code_alphabet: Literal["base62", "base58"] = "base62",
+        max_code_length: int = 12,
+        collision_threshold: float = 0.01,
+    ):
+        self._repository = repository
+        self._id_block_size = id_block_size
+        self._key_pool = key_pool
+        self._digest_options = dict(
+            code_length=code_length,
+            alphabet=code_alphabet,
+            max_code_length=max_code_length,
+            collision_threshold=collision_threshold,
+        )
+        self._sequence = None
+        self._digests: dict[ShorteningAlgorithmType, DigestShorteningAlgorithm] = {}
+
     def get(self, algorithm_type: ShorteningAlgorithmType) -> ShorteningAlgorithm:
+        if algorithm_type == ShorteningAlgorithmType.SEQUENCE:
+            return self._get_sequence()
+        if algorithm_type == ShorteningAlgorithmType.KEY_POOL:
+            return self._get_key_pool()
+        if algorithm_type in digest_algorithms:
+            return self._get_digest(algorithm_type)
         if algorithm_type in factory_config:
-            return factory_config[algorithm_type]
+            return _stateless_algorithm(algorithm_type)
         else:
             raise NotImplementedError("Unknown shortening algorithm type")
+
+    def _get_sequence(self) -> ShorteningAlgorithm:
+        # the counter lives in the repository, so unlike the stateless algorithms
+        # there is one instance per factory
+        if not self._repository:
+            raise ValueError("The sequence algorithm requires a repository")
+        if not self._sequence:
+            self._sequence = SequenceShorteningAlgorithm(
+                reserve_id_block=self._repository.reserve_id_block,
+                block_size=self._id_block_size,
+            )
+        return self._sequence
+
+    def _get_digest(
+        self, algorithm_type: ShorteningAlgorithmType
+    ) -> ShorteningAlgorithm:
+        # the code length grows with the codes taken, one instance per factory
+        if algorithm_type not in self._digests:
+            self._digests[algorithm_type] = digest_algorithms[algorithm_type](
+                **self._digest_options
+            )
+        return self._digests[algorithm_type]
+
+    def _get_key_pool(self) -> ShorteningAlgorithm:
+        if not self._key_pool:
+            raise ValueError("The key-pool algorithm requires a key pool")
+        return KeyPoolShorteningAlgorithm(
+            take_code=self._key_pool.take, put_back=self._key_pool.put_back
+        )
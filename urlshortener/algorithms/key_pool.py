@@ -0,0 +1,35 @@
+import logging
+from typing import Callable
+
+from urlshortener.algorithms.shortening_algorithm import (
+    ShorteningAlgorithmType,
+    ShorteningAlgorithm,
+)
+
+
+class KeyPoolShorteningAlgorithm(ShorteningAlgorithm):
+    """Hands out random base62 codes generated ahead of time in a shared pool.
+
+    Every code of the pool is handed out once, so codes never collide and no
+    check against the store is needed. Codes are taken from a buffer of codes
+    leased by the process, see `urlshortener.key_pool.KeyPool`.
+    """
+
+    def __init__(self, take_code: Callable[[], str], put_back: Callable[[str], None]):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._take_code = take_code
+        self._put_back = put_back
+
+    def type(self) -> ShorteningAlgorithmType:
+        return ShorteningAlgorithmType.KEY_POOL
+
+    def shorten(self, url) -> str:
+        self._log.debug("Shortening URL: %s", url)
+        return self._take_code()
+
+    def rehash(self, url, attempt: int) -> str:
+        # codes are not derived from the url, any other one will do
+        return self._take_code()
+
+    def release(self, code: str):
+        self._put_back(code)
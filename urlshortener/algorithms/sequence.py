@@ -0,0 +1,41 @@
+import logging
+import threading
+from typing import Callable
+
+from urlshortener.algorithms import base62
+from urlshortener.algorithms.shortening_algorithm import (
+    ShorteningAlgorithmType,
+    ShorteningAlgorithm,
+)
+
+
+class SequenceShorteningAlgorithm(ShorteningAlgorithm):
+    """Encodes the next value of a global counter in base62.
+
+    Codes never collide, so no check against the store is needed. The counter is
+    leased in blocks of `block_size` ids, so only one round trip to the counter is
+    paid every `block_size` codes; ids left in a block when the process ends are
+    simply skipped.
+    """
+
+    def __init__(self, reserve_id_block: Callable[[int], int], block_size: int):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._reserve_id_block = reserve_id_block
+        self._block_size = block_size
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._block_end = 0
+
+    def type(self) -> ShorteningAlgorithmType:
+        return ShorteningAlgorithmType.SEQUENCE
+
+    def shorten(self, url) -> str:
+        with self._lock:
+            if self._next_id >= self._block_end:
+                self._next_id = self._reserve_id_block(self._block_size)
+                self._block_end = self._next_id + self._block_size
+                self._log.debug("Leased ids [%s, %s)", self._next_id, self._block_end)
+            next_id = self._next_id
+            self._next_id += 1
+        self._log.debug("Shortening URL: %s", url)
+        return base62.encode(next_id)
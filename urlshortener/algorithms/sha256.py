@@ -16,5 +16,5 @@ class Sha256ShorteningAlgorithm(ShorteningAlgorithm):
         return ShorteningAlgorithmType.SHA256
 
     def shorten(self, url) -> str:
-        self._log.debug(f"Shortening URL: {url}")
+        self._log.debug("Shortening URL: %s", url)
         return hashlib.sha256(url.encode()).hexdigest()[:8]
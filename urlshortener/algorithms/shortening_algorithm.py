@@ -5,6 +5,10 @@ from enum import Enum
 class ShorteningAlgorithmType(Enum):
     BASE64 = "base-64"
     SHA256 = "sha256"
+    SEQUENCE = "sequence"
+    KEY_POOL = "key-pool"
+    BLAKE2B = "blake2b"
+    XXHASH = "xxhash"
 
     def __str__(self) -> str:
         return str(self.value)
@@ -23,6 +27,16 @@ class ShorteningAlgorithm(metaclass=ABCMeta):
     def type(self) -> ShorteningAlgorithmType:
         raise NotImplementedError
 
+    def rehash(self, url, attempt: int) -> str:
+        # a different, but still deterministic, code used when the first one is
+        # already taken by another url
+        return self.shorten(url=f"{attempt}:{url}")
+
+    def release(self, code: str):
+        # a code returned by shorten that was not stored, the url being already
+        # mapped; only algorithms handing out a finite set of codes reuse it
+        pass
+
     def __str__(self) -> str:
         return str(self.type())
 
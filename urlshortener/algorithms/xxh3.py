@@ -0,0 +1,28 @@
+from urlshortener.algorithms.digest import DigestShorteningAlgorithm
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithmType
+
+try:
+    import xxhash
+except ImportError:  # an optional dependency: pip install urlshortener[xxhash]
+    xxhash = None
+
+XXHASH_INSTALLED = xxhash is not None
+
+
+class Xxh3ShorteningAlgorithm(DigestShorteningAlgorithm):
+    """Codes from the non-cryptographic 128-bit XXH3 hash, seeded on rehash.
+
+    Requires the `xxhash` package.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if not XXHASH_INSTALLED:
+            raise ValueError("The xxhash algorithm requires the xxhash package")
+        super().__init__(*args, **kwargs)
+
+    def type(self) -> ShorteningAlgorithmType:
+        return ShorteningAlgorithmType.XXHASH
+
+    def _digest(self, data: bytes, salt: int) -> int:
+        # 128 bits cover every code length with a negligible modulo bias
+        return xxhash.xxh3_128_intdigest(data, seed=salt)
@@ -0,0 +1,187 @@
+import logging
+import threading
+from array import array
+
+from urlshortener.metrics import REGISTRY
+from urlshortener.repository.click_stats_repository import ClickStatsRepository
+from urlshortener.settings import ShortenerSettings
+
+ANALYTICS_CLICKS_TOTAL = REGISTRY.counter(
+    "urlshortener_analytics_clicks_total",
+    "Expands counted by the analytics, by how they were counted or if their flush "
+    "failed",
+    ("outcome",),
+)
+
+
+class CountMinSketch:
+    """Approximate counts of any number of keys, in a fixed memory.
+
+    Estimates are never below the true counts. With probability 1 - e**-depth,
+    they exceed them by at most e / width of the total count.
+    """
+
+    __slots__ = ("width", "depth", "_counters")
+
+    def __init__(self, width: int, depth: int):
+        if width <= 0 or depth <= 0:
+            raise ValueError("width and depth must be positive")
+        self.width = width
+        self.depth = depth
+        self._counters = array("q", bytes(8 * width * depth))
+
+    def add(self, key: str, count: int = 1) -> int:
+        """Adds `count` to the count of `key` and returns its new estimate."""
+        # double hashing of the cached hash of the string, as only this process
+        # reads the sketch
+        key_hash = hash(key)
+        h1, h2 = key_hash & 0xFFFFFFFF, (key_hash >> 32) | 1
+        counters, width = self._counters, self.width
+        estimate = None
+        for row in range(self.depth):
+            index = row * width + (h1 + row * h2) % width
+            counters[index] += count
+            if estimate is None or counters[index] < estimate:
+                estimate = counters[index]
+        return estimate
+
+
+class ClickAggregator:
+    """Counts the expands of short urls in memory and adds them to a
+    ClickStatsRepository in periodic bulk increments.
+
+    Between two flushes, the first `max_keys` short urls are counted exactly.
+    The hits of the others go to a count-min sketch, and the `top_keys` of them
+    with the highest estimates are flushed with their estimates, so that links
+    getting hot late in a flush interval are not missed. The rest of the long
+    tail is only counted in `urlshortener_analytics_clicks_total`. Memory is
+    bounded by these sizes whatever the number of short urls.
+    """
+
+    def __init__(
+        self,
+        repository: ClickStatsRepository,
+        flush_interval: float,
+        max_keys: int,
+        top_keys: int,
+        sketch_width: int,
+        sketch_depth: int,
+    ):
+        self._repository = repository
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._flush_interval = flush_interval
+        self._max_keys = max_keys
+        self._top_keys = top_keys
+        self._sketch_width = sketch_width
+        self._sketch_depth = sketch_depth
+        self._lock = threading.Lock()
+        # serializes the flushes of the background thread and the explicit ones
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+        self._reset(self._new_sketch())
+
+    def _new_sketch(self) -> CountMinSketch:
+        return CountMinSketch(self._sketch_width, self._sketch_depth)
+
+    def _reset(self, sketch: CountMinSketch):
+        self._counts: dict[str, int] = {}
+        self._sketch = sketch
+        self._heavy_hitters: dict[str, int] = {}
+        # a lower bound of the smallest heavy hitter estimate, which spares
+        # looking for it on most hits of the tail
+        self._heavy_hitters_floor = 0
+        self._tail_hits = 0
+
+    def initialize(self):
+        self._repository.initialize()
+        self._closed.clear()
+        self._flusher = threading.Thread(
+            target=self._run_flusher, name="click-stats-flusher", daemon=True
+        )
+        self._flusher.start()
+        return self
+
+    def finalize(self):
+        try:
+            self._closed.set()
+            if self._flusher:
+                self._flusher.join()
+            self.flush()
+        finally:
+            self._repository.finalize()
+
+    def __enter__(self):
+        return self.initialize()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def record(self, short_url: str):
+        with self._lock:
+            count = self._counts.get(short_url)
+            if count is not None:
+                self._counts[short_url] = count + 1
+            elif len(self._counts) < self._max_keys:
+                self._counts[short_url] = 1
+            else:
+                self._record_tail(short_url)
+
+    def _record_tail(self, short_url: str):
+        self._tail_hits += 1
+        estimate = self._sketch.add(short_url)
+        heavy_hitters = self._heavy_hitters
+        if short_url in heavy_hitters or len(heavy_hitters) < self._top_keys:
+            heavy_hitters[short_url] = estimate
+        elif estimate > self._heavy_hitters_floor:
+            coldest = min(heavy_hitters, key=heavy_hitters.__getitem__)
+            if heavy_hitters[coldest] < estimate:
+                del heavy_hitters[coldest]
+                heavy_hitters[short_url] = estimate
+            self._heavy_hitters_floor = min(heavy_hitters.values())
+
+    def flush(self):
+        """Adds the counts since the last flush to the repository."""
+        with self._flush_lock:
+            # allocated before taking the lock, which blocks the expands
+            sketch = self._new_sketch()
+            with self._lock:
+                counts, heavy_hitters = self._counts, self._heavy_hitters
+                tail_hits = self._tail_hits
+                self._reset(sketch)
+            if not counts and not tail_hits:
+                return
+            # the heavy hitters are not in the exact counts, which were full
+            clicks = {**counts, **heavy_hitters}
+            exact_hits = sum(counts.values())
+            try:
+                self._repository.add_clicks(clicks)
+            except Exception as e:
+                self._log.error(
+                    "dropping the clicks of %s short urls: %s", len(clicks), e
+                )
+                ANALYTICS_CLICKS_TOTAL.inc("dropped", amount=exact_hits + tail_hits)
+                return
+            ANALYTICS_CLICKS_TOTAL.inc("exact", amount=exact_hits)
+            ANALYTICS_CLICKS_TOTAL.inc("sketched", amount=tail_hits)
+
+    def _run_flusher(self):
+        while not self._closed.wait(self._flush_interval):
+            self.flush()
+
+
+def build_click_aggregator(settings: ShortenerSettings) -> ClickAggregator | None:
+    """The aggregator of the configured storage backend, None when analytics are
+    disabled."""
+    if not settings.analytics_enabled:
+        return None
+    from urlshortener.repository.factory import create_click_stats_repository
+
+    return ClickAggregator(
+        create_click_stats_repository(settings),
+        flush_interval=settings.analytics_flush_interval,
+        max_keys=settings.analytics_max_keys,
+        top_keys=settings.analytics_top_keys,
+        sketch_width=settings.analytics_sketch_width,
+        sketch_depth=settings.analytics_sketch_depth,
+    )
@@ -0,0 +1,72 @@
+import logging
+
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithm
+from urlshortener.repository.async_repository import AsyncURLRepository
+from urlshortener.repository.repository import ShortURLCollisionError
+from urlshortener.url_shortener import get_url_domain
+
+
+class AsyncURLShortener:
+    def __init__(
+        self,
+        repository: AsyncURLRepository,
+        fixed_domain: str = None,
+        max_collision_retries: int = 3,
+    ):
+        self._repository = repository
+        self._fixed_domain = fixed_domain
+        self._max_collision_retries = max_collision_retries
+        self._log = logging.getLogger(self.__class__.__name__)
+
+    async def minify(self, url: str, algorithm: ShorteningAlgorithm) -> str | None:
+        if not algorithm:
+            raise ValueError("No algorithm specified")
+        if not url:
+            raise ValueError("No URL specified")
+
+        self._log.debug("Minifying URL %s using algorithm '%s'", url, algorithm)
+
+        url_domain = get_url_domain(url, self._fixed_domain)
+        for attempt in range(self._max_collision_retries + 1):
+            if attempt:
+                url_hash = algorithm.rehash(url=url, attempt=attempt)
+            else:
+                url_hash = algorithm.shorten(url=url)
+            try:
+                # one atomic round trip, see URLShortener.minify
+                short_url, created = await self._repository.get_or_create_short_url(
+                    original_url=url,
+                    short_url=f"{url_domain}{url_hash}",
+                    algorithm=algorithm.type().value,
+                )
+            except ShortURLCollisionError:
+                self._log.debug(
+                    "%s%s is taken, rehashing %s", url_domain, url_hash, url
+                )
+            else:
+                if not created:
+                    algorithm.release(url_hash)
+                return short_url
+
+        raise ShortURLCollisionError(
+            f"No free short url found for {url} after {attempt + 1} attempts",
+            original_urls=[url],
+        )
+
+    async def expand(
+        self, short_url: str, algorithm: ShorteningAlgorithm
+    ) -> str | None:
+        if not algorithm:
+            raise ValueError("No algorithm specified")
+
+        if not short_url:
+            raise ValueError("No URL specified")
+
+        # Check if the shortened URL is in the database and not expired
+        existing_url = await self._repository.get_original_url(
+            short_url=short_url, algorithm=algorithm.type().value
+        )
+        if existing_url:
+            return existing_url
+        else:
+            return f"not found or expired"
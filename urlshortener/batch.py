@@ -0,0 +1,95 @@
+import json
+from enum import Enum
+from itertools import islice
+from typing import Iterable, Iterator, TextIO
+from urllib.parse import urlparse
+
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithm
+from urlshortener.repository.repository import ShortURLCollisionError
+from urlshortener.url_shortener import URLShortener
+
+NOT_FOUND_OR_EXPIRED = "not found or expired"
+
+
+class OutputFormat(str, Enum):
+    TSV = "tsv"
+    NDJSON = "ndjson"
+
+    def __str__(self) -> str:
+        return str(self.value)
+
+
+def _is_valid_url(url: str) -> bool:
+    parsed = urlparse(url)
+    return bool(parsed.scheme and parsed.netloc)
+
+
+def read_urls(stream: TextIO) -> Iterator[str]:
+    for line in stream:
+        url = line.strip()
+        if url:
+            yield url
+
+
+def chunked(iterable: Iterable[str], size: int) -> Iterator[list[str]]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def minify_stream(
+    shortener: URLShortener,
+    urls: Iterable[str],
+    algorithm: ShorteningAlgorithm,
+    batch_size: int,
+) -> Iterator[dict]:
+    # only one chunk is held in memory at a time, whatever the input size
+    for chunk in chunked(urls, batch_size):
+        valid_urls = [url for url in chunk if _is_valid_url(url)]
+        try:
+            short_urls = shortener.minify_batch(urls=valid_urls, algorithm=algorithm)
+        except ShortURLCollisionError:
+            # a url of the chunk has no free code left: the others are minified
+            # one by one, the ones stored already being found as existing
+            short_urls = _minify_each(shortener, valid_urls, algorithm)
+        for url in chunk:
+            if url in short_urls:
+                yield {"url": url, "short_url": short_urls[url]}
+            elif _is_valid_url(url):
+                yield {"url": url, "error": "No free short url found"}
+            else:
+                yield {"url": url, "error": f"'{url}' is not a valid URL"}
+
+
+def _minify_each(
+    shortener: URLShortener, urls: list[str], algorithm: ShorteningAlgorithm
+) -> dict[str, str]:
+    short_urls = {}
+    for url in urls:
+        try:
+            short_urls[url] = shortener.minify(url=url, algorithm=algorithm)
+        except ShortURLCollisionError:
+            pass
+    return short_urls
+
+
+def expand_stream(
+    shortener: URLShortener,
+    short_urls: Iterable[str],
+    algorithm: ShorteningAlgorithm,
+    batch_size: int,
+) -> Iterator[dict]:
+    for chunk in chunked(short_urls, batch_size):
+        original_urls = shortener.expand_batch(short_urls=chunk, algorithm=algorithm)
+        for short_url in chunk:
+            yield {"short_url": short_url, "original_url": original_urls.get(short_url)}
+
+
+def format_record(record: dict, output_format: OutputFormat) -> str:
+    if output_format == OutputFormat.NDJSON:
+        return json.dumps(record)
+    if "error" in record:
+        return f"{record['url']}\terror: {record['error']}"
+    if "url" in record:
+        return f"{record['url']}\t{record['short_url']}"
+    return f"{record['short_url']}\t{record['original_url'] or NOT_FOUND_OR_EXPIRED}"
@@ -0,0 +1,60 @@
+"""Offline benchmarks of the algorithms and URLShortener on an in-memory repository.
+
+    python -m urlshortener.bench --output results.json
+    python -m urlshortener.bench --baseline results.json --threshold 0.1
+"""
+
+import json
+from pathlib import Path
+from typing import Annotated
+
+import typer
+
+from urlshortener.bench.runner import compare, measure
+from urlshortener.bench.workloads import WORKLOADS
+
+
+def main(
+    iterations: Annotated[
+        int, typer.Option(min=1, help="Operations per benchmark")
+    ] = 20000,
+    only: Annotated[
+        str, typer.Option(help="Only run the benchmarks whose name contains it")
+    ] = None,
+    output: Annotated[Path, typer.Option(help="Write the results as JSON")] = None,
+    baseline: Annotated[
+        Path, typer.Option(help="JSON results to compare the run against")
+    ] = None,
+    threshold: Annotated[
+        float, typer.Option(min=0, help="Tolerated throughput drop (0.1 = 10%)")
+    ] = 0.1,
+):
+    results = []
+    typer.echo(
+        f"{'benchmark':<28}{'ops/s':>12}{'p50 us':>10}{'p95 us':>10}"
+        f"{'p99 us':>10}{'peak KiB':>10}"
+    )
+    for name, workload in WORKLOADS.items():
+        if only and only not in name:
+            continue
+        result = measure(name, workload, iterations)
+        results.append(result)
+        typer.echo(
+            f"{name:<28}{result['ops_per_sec']:>12.0f}{result['p50_us']:>10.2f}"
+            f"{result['p95_us']:>10.2f}{result['p99_us']:>10.2f}"
+            f"{result['peak_alloc_bytes'] / 1024:>10.1f}"
+        )
+
+    if output:
+        output.write_text(json.dumps(results, indent=2))
+
+    if baseline:
+        regressions = compare(results, json.loads(baseline.read_text()), threshold)
+        for regression in regressions:
+            typer.echo(f"REGRESSION {regression}", err=True)
+        if regressions:
+            raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,82 @@
+import gc
+import time
+import tracemalloc
+from typing import Callable
+
+
+def percentile(sorted_samples: list[float], fraction: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))
+    return sorted_samples[index]
+
+
+def measure(
+    name: str,
+    workload: Callable[[int], list[Callable[[], object]]],
+    iterations: int,
+    warmup: int = 100,
+) -> dict:
+    """Times each operation of the workload, then runs a fresh copy of it under
+    tracemalloc.
+
+    The timing and the allocation passes are kept apart, as tracing allocations
+    slows every operation down by an order of magnitude.
+    """
+    for operation in workload(warmup):
+        operation()
+
+    operations = workload(iterations)
+
+    gc.collect()
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    samples = []
+    try:
+        started = time.perf_counter()
+        for operation in operations:
+            start = time.perf_counter_ns()
+            operation()
+            samples.append(time.perf_counter_ns() - start)
+        elapsed = time.perf_counter() - started
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    operations = workload(iterations)
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        for operation in operations:
+            operation()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    samples.sort()
+    return {
+        "name": name,
+        "operations": len(operations),
+        "ops_per_sec": len(operations) / elapsed if elapsed else 0.0,
+        "p50_us": percentile(samples, 0.50) / 1000,
+        "p95_us": percentile(samples, 0.95) / 1000,
+        "p99_us": percentile(samples, 0.99) / 1000,
+        "peak_alloc_bytes": peak - baseline,
+        "retained_bytes_per_op": (retained - baseline) / len(operations),
+    }
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[str]:
+    """Returns the benchmarks whose throughput dropped by more than `threshold`."""
+    baseline_by_name = {result["name"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        reference = baseline_by_name.get(result["name"])
+        if not reference:
+            continue
+        if result["ops_per_sec"] < reference["ops_per_sec"] * (1 - threshold):
+            regressions.append(
+                f"{result['name']}: {result['ops_per_sec']:.0f} ops/s "
+                f"< {reference['ops_per_sec']:.0f} ops/s baseline"
+            )
+    return regressions
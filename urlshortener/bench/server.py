@@ -0,0 +1,90 @@
+"""Load test of the redirect server.
+
+Runs the server in-process on top of an in-memory repository and hammers
+`GET /<code>` from several keep-alive client connections, reporting the redirect
+latency percentiles:
+
+    python -m urlshortener.bench.server --requests 20000 --concurrency 16
+"""
+
+import http.client
+import random
+import threading
+import time
+from typing import Annotated
+
+import typer
+
+from urlshortener.algorithms.factory import ShorteningAlgorithmFactory
+from urlshortener.bench.runner import percentile
+from urlshortener.repository.caching_repository import CachingURLRepository
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.server import RedirectServer, create_listening_socket
+from urlshortener.settings import ShortenerSettings
+from urlshortener.url_shortener import URLShortener
+
+
+def _client(port: int, codes: list[str], requests: int, samples: list[float]):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    rng = random.Random()
+    for _ in range(requests):
+        start = time.perf_counter()
+        connection.request("GET", f"/{rng.choice(codes)}")
+        response = connection.getresponse()
+        response.read()
+        samples.append(time.perf_counter() - start)
+    connection.close()
+
+
+def main(
+    requests: Annotated[int, typer.Option(min=1)] = 10000,
+    concurrency: Annotated[int, typer.Option(min=1)] = 8,
+    urls: Annotated[int, typer.Option(min=1, help="Distinct short URLs")] = 1000,
+):
+    settings = ShortenerSettings(fixed_domain="http://bench.local/")
+    repository = CachingURLRepository(InMemoryURLRepository(settings), settings)
+    shortener = URLShortener(repository=repository, fixed_domain=settings.fixed_domain)
+    algorithm = ShorteningAlgorithmFactory(
+        repository=repository,
+        id_block_size=settings.id_block_size,
+        code_length=settings.hash_code_length,
+        code_alphabet=settings.hash_code_alphabet,
+        max_code_length=settings.hash_code_max_length,
+        collision_threshold=settings.hash_collision_threshold,
+    ).get(settings.shortening_algorithm)
+    codes = [
+        shortener.minify(f"https://www.example.com/{i}", algorithm).rsplit("/", 1)[1]
+        for i in range(urls)
+    ]
+
+    server = RedirectServer(
+        create_listening_socket("127.0.0.1", 0), shortener, algorithm, settings
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    samples: list[list[float]] = [[] for _ in range(concurrency)]
+    clients = [
+        threading.Thread(
+            target=_client, args=(port, codes, requests // concurrency, samples[i])
+        )
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    server.server_close()
+
+    latencies = sorted(sample for client in samples for sample in client)
+    typer.echo(f"requests:   {len(latencies)}")
+    typer.echo(f"throughput: {len(latencies) / elapsed:.0f} req/s")
+    typer.echo(f"p50:        {percentile(latencies, 0.50) * 1000:.3f} ms")
+    typer.echo(f"p99:        {percentile(latencies, 0.99) * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,123 @@
+import itertools
+import random
+from typing import Callable, Iterator
+
+from urlshortener.algorithms.factory import ShorteningAlgorithmFactory
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithmType
+from urlshortener.algorithms.xxh3 import XXHASH_INSTALLED
+from urlshortener.key_pool import KeyPool
+from urlshortener.repository.key_pool_repository import InMemoryKeyPoolRepository
+from urlshortener.repository.memory_repository import InMemoryURLRepository
+from urlshortener.settings import ShortenerSettings
+from urlshortener.url_shortener import URLShortener
+
+Workload = Callable[[int], list[Callable[[], object]]]
+
+
+def _settings() -> ShortenerSettings:
+    return ShortenerSettings(fixed_domain="http://bench.local/")
+
+
+def _urls() -> Iterator[str]:
+    for i in itertools.count():
+        yield f"https://www.example.com/articles/{i}?utm_source=bench&page={i % 97}"
+
+
+def _setup(algorithm_type: ShorteningAlgorithmType = None):
+    # sha256 by default: base-64 codes of urls sharing a domain always collide
+    settings = _settings()
+    repository = InMemoryURLRepository(settings)
+    shortener = URLShortener(repository=repository, fixed_domain=settings.fixed_domain)
+    # a pool a few leases deep, so that topping it up stays short
+    key_pool = KeyPool(
+        InMemoryKeyPoolRepository(),
+        lease_size=settings.key_pool_lease_size,
+        local_low_watermark=settings.key_pool_local_low_watermark,
+        depth=4 * settings.key_pool_lease_size,
+        low_watermark=settings.key_pool_lease_size,
+        code_length=settings.key_pool_code_length,
+    )
+    algorithm = ShorteningAlgorithmFactory(
+        repository=repository,
+        id_block_size=settings.id_block_size,
+        key_pool=key_pool,
+        code_length=settings.hash_code_length,
+        code_alphabet=settings.hash_code_alphabet,
+        max_code_length=settings.hash_code_max_length,
+        collision_threshold=settings.hash_collision_threshold,
+    ).get(algorithm_type or ShorteningAlgorithmType.SHA256)
+    return shortener, algorithm
+
+
+def zipf_keys(keys: list, count: int, exponent: float, seed: int = 42) -> list:
+    weights = [1 / (rank**exponent) for rank in range(1, len(keys) + 1)]
+    return random.Random(seed).choices(keys, weights=weights, k=count)
+
+
+def shorten(algorithm_type: ShorteningAlgorithmType) -> Workload:
+    def workload(iterations: int):
+        _, algorithm = _setup(algorithm_type)
+        urls = list(itertools.islice(_urls(), iterations))
+        return [lambda url=url: algorithm.shorten(url) for url in urls]
+
+    return workload
+
+
+def minify_new(iterations: int):
+    shortener, algorithm = _setup()
+    urls = list(itertools.islice(_urls(), iterations))
+    return [lambda url=url: shortener.minify(url, algorithm) for url in urls]
+
+
+def minify_existing(iterations: int):
+    shortener, algorithm = _setup()
+    urls = list(itertools.islice(_urls(), 1000))
+    for url in urls:
+        shortener.minify(url, algorithm)
+    return [
+        lambda url=url: shortener.minify(url, algorithm)
+        for url in zipf_keys(urls, iterations, exponent=1.0)
+    ]
+
+
+def expand(iterations: int):
+    shortener, algorithm = _setup()
+    short_urls = [
+        shortener.minify(url, algorithm) for url in itertools.islice(_urls(), 1000)
+    ]
+    return [
+        lambda short_url=short_url: shortener.expand(short_url, algorithm)
+        for short_url in zipf_keys(short_urls, iterations, exponent=1.0)
+    ]
+
+
+def mixed(iterations: int, read_ratio: float = 0.9, keys: int = 10000):
+    """Zipf distributed expands of existing urls, interleaved with minifies."""
+    shortener, algorithm = _setup()
+    urls = list(itertools.islice(_urls(), keys))
+    short_urls = [shortener.minify(url, algorithm) for url in urls[: keys // 2]]
+    rng = random.Random(7)
+    operations = []
+    for url, short_url in zip(
+        zipf_keys(urls, iterations, exponent=1.1),
+        zipf_keys(short_urls, iterations, exponent=1.1, seed=43),
+    ):
+        if rng.random() < read_ratio:
+            operations.append(lambda s=short_url: shortener.expand(s, algorithm))
+        else:
+            operations.append(lambda u=url: shortener.minify(u, algorithm))
+    return operations
+
+
+WORKLOADS: dict[str, Workload] = {
+    **{
+        f"shorten[{algorithm_type}]": shorten(algorithm_type)
+        for algorithm_type in ShorteningAlgorithmType
+        # an optional dependency
+        if algorithm_type != ShorteningAlgorithmType.XXHASH or XXHASH_INSTALLED
+    },
+    "minify[new]": minify_new,
+    "minify[existing]": minify_existing,
+    "expand": expand,
+    "mixed[90% expand, zipf]": mixed,
+}
@@ -0,0 +1,153 @@
+import hashlib
+import math
+import struct
+
+_MAGIC = b"USBF"
+_VERSION = 1
+_HEADER = struct.Struct("<4sBQdI")  # magic, version, capacity, error rate, slices
+_SLICE_HEADER = struct.Struct("<QdQQI")  # capacity, error rate, count, bits, hashes
+
+# each new slice holds twice as many keys with a tighter error rate, so that the
+# compound error rate stays below the configured one however many slices are added
+_GROWTH = 2
+_TIGHTENING = 0.5
+
+
+def _hash_pair(key: str) -> tuple[int, int]:
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    # the second hash is odd so that it never cycles on a subset of the bits
+    return (
+        int.from_bytes(digest[:8], "little"),
+        int.from_bytes(digest[8:], "little") | 1,
+    )
+
+
+class _BloomSlice:
+    __slots__ = ("capacity", "error_rate", "count", "num_bits", "num_hashes", "bits")
+
+    def __init__(
+        self,
+        capacity: int,
+        error_rate: float,
+        count: int = 0,
+        num_bits: int = None,
+        num_hashes: int = None,
+        bits: bytearray = None,
+    ):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = count
+        self.num_bits = num_bits or math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        )
+        self.num_hashes = num_hashes or max(
+            1, round(self.num_bits / capacity * math.log(2))
+        )
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+
+    def __contains__(self, hashes: tuple[int, int]) -> bool:
+        h1, h2 = hashes
+        for i in range(self.num_hashes):
+            bit = (h1 + i * h2) % self.num_bits
+            if not self.bits[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def add(self, hashes: tuple[int, int]):
+        h1, h2 = hashes
+        for i in range(self.num_hashes):
+            bit = (h1 + i * h2) % self.num_bits
+            self.bits[bit >> 3] |= 1 << (bit & 7)
+        self.count += 1
+
+
+class ScalableBloomFilter:
+    """A Bloom filter that grows with the number of keys added.
+
+    Membership tests have no false negatives and a false positive rate bounded
+    by `error_rate`. Keys cannot be removed.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._slices = [_BloomSlice(capacity, error_rate * _TIGHTENING)]
+
+    def __contains__(self, key: str) -> bool:
+        hashes = _hash_pair(key)
+        return any(hashes in bloom_slice for bloom_slice in reversed(self._slices))
+
+    def __len__(self) -> int:
+        # an estimate: keys colliding with already added ones are not counted
+        return sum(bloom_slice.count for bloom_slice in self._slices)
+
+    def add(self, key: str) -> bool:
+        """Adds the key, returns False if it was (probably) already there."""
+        hashes = _hash_pair(key)
+        if any(hashes in bloom_slice for bloom_slice in self._slices):
+            return False
+        current = self._slices[-1]
+        if current.count >= current.capacity:
+            current = _BloomSlice(
+                current.capacity * _GROWTH, current.error_rate * _TIGHTENING
+            )
+            self._slices.append(current)
+        current.add(hashes)
+        return True
+
+    def to_bytes(self) -> bytes:
+        chunks = [
+            _HEADER.pack(
+                _MAGIC, _VERSION, self.capacity, self.error_rate, len(self._slices)
+            )
+        ]
+        for bloom_slice in self._slices:
+            chunks.append(
+                _SLICE_HEADER.pack(
+                    bloom_slice.capacity,
+                    bloom_slice.error_rate,
+                    bloom_slice.count,
+                    bloom_slice.num_bits,
+                    bloom_slice.num_hashes,
+                )
+            )
+            chunks.append(bytes(bloom_slice.bits))
+        return b"".join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ScalableBloomFilter":
+        magic, version, capacity, error_rate, slice_count = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("Not a bloom filter file, or an unsupported version")
+        bloom_filter = cls(capacity, error_rate)
+        bloom_filter._slices = []
+        offset = _HEADER.size
+        for _ in range(slice_count):
+            (
+                slice_capacity,
+                slice_error_rate,
+                count,
+                num_bits,
+                num_hashes,
+            ) = _SLICE_HEADER.unpack_from(data, offset)
+            offset += _SLICE_HEADER.size
+            size = (num_bits + 7) // 8
+            bits = bytearray(data[offset : offset + size])
+            if len(bits) != size:
+                raise ValueError("Truncated bloom filter file")
+            offset += size
+            bloom_filter._slices.append(
+                _BloomSlice(
+                    slice_capacity,
+                    slice_error_rate,
+                    count,
+                    num_bits,
+                    num_hashes,
+                    bits,
+                )
+            )
+        return bloom_filter
@@ -1,17 +1,55 @@
 import logging
-from typing import Annotated
+from contextlib import nullcontext
+from functools import partial
+from typing import TYPE_CHECKING, Annotated
 from urllib.parse import urlparse
 
 import typer
 
-from urlshortener.algorithms.factory import ShorteningAlgorithmFactory
-from urlshortener.repository.mongo_repository import MongoURLRepository
+from urlshortener import client
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithmType
+from urlshortener.batch import (
+    OutputFormat,
+    expand_stream,
+    format_record,
+    minify_stream,
+    read_urls,
+)
+from urlshortener.key_pool import recycle_codes
+from urlshortener.factory import open_shortener
+from urlshortener.metrics import REGISTRY
+from urlshortener.repository.bloom_repository import BloomFilteredURLRepository
+from urlshortener.repository.factory import (
+    create_click_stats_repository,
+    create_key_pool_repository,
+    create_repository,
+)
+from urlshortener.repository.instrumented_repository import (
+    InstrumentedURLRepository,
+)
+from urlshortener.repository.repository import (
+    ShortURLCollisionError,
+    current_date_in_seconds,
+)
+from urlshortener.repository.write_behind_repository import (
+    WriteBehindURLRepository,
+)
 from urlshortener.settings import ShortenerSettings
-from urlshortener.url_shortener import URLShortener
+from urlshortener.snapshot import SnapshotFormat
 
+if TYPE_CHECKING:
+    from urlshortener.importer import ImportProgress
 
-def _validate_options(url_to_minify: str, url_to_expand: str):
-    if not url_to_minify and not url_to_expand:
+app = typer.Typer(add_completion=False)
+
+
+def _validate_options(
+    url_to_minify: str,
+    url_to_expand: str,
+    minify_file: str = None,
+    expand_file: str = None,
+):
+    if not any([url_to_minify, url_to_expand, minify_file, expand_file]):
         raise typer.BadParameter("Please specify either --minify or --expand option")
 
     url_to_minify_parsed = urlparse(url_to_minify)
@@ -27,6 +65,7 @@ def _validate_options(url_to_minify: str, url_to_expand: str):
         raise typer.BadParameter(f"'{url_to_expand}' is not a valid URL")
 
 
+@app.callback(invoke_without_command=True)
 def main(
     url_to_minify: Annotated[
         str,
@@ -38,33 +77,410 @@ def main(
     verbose_flag: Annotated[
         bool, typer.Option("-v", "--verbose", help="Print debugging information")
     ] = False,
+    minify_file: Annotated[
+        str,
+        typer.Option(help="File with one URL to shorten per line ('-' for stdin)"),
+    ] = None,
+    expand_file: Annotated[
+        str,
+        typer.Option(help="File with one URL to expand per line ('-' for stdin)"),
+    ] = None,
+    output_format: Annotated[
+        OutputFormat, typer.Option("--format", help="Output format of batch mode")
+    ] = OutputFormat.TSV,
+    batch_size: Annotated[
+        int, typer.Option(min=1, help="Number of URLs processed per round trip")
+    ] = None,
+    metrics_file: Annotated[
+        str,
+        typer.Option(help="File the metrics are written to, in Prometheus format"),
+    ] = None,
+    ctx: typer.Context = None,
 ):
     if verbose_flag:
         logging.basicConfig(level=logging.DEBUG)
 
+    if ctx is not None and ctx.invoked_subcommand:
+        return
+
     settings = ShortenerSettings()
 
-    _validate_options(url_to_minify, url_to_expand)
+    _validate_options(url_to_minify, url_to_expand, minify_file, expand_file)
+    batch_size = batch_size or settings.batch_size
 
-    with MongoURLRepository(settings=settings) as repository:
-        shortener = URLShortener(
-            repository=repository, fixed_domain=settings.fixed_domain
-        )
-        algorithm = ShorteningAlgorithmFactory().get(
-            algorithm_type=settings.shortening_algorithm
-        )
+    repository = InstrumentedURLRepository(create_repository(settings))
+    if settings.write_behind_durability != "sync":
+        repository = WriteBehindURLRepository(repository, settings)
+    if settings.bloom_filter_enabled:
+        repository = BloomFilteredURLRepository(repository, settings)
 
+    with open_shortener(settings, repository) as (shortener, algorithm):
         if url_to_minify:
-            short_url = shortener.minify(url=url_to_minify, algorithm=algorithm)
+            try:
+                short_url = shortener.minify(url=url_to_minify, algorithm=algorithm)
+            except ShortURLCollisionError as e:
+                typer.echo(f"Error: {e}", err=True)
+                raise typer.Exit(code=1)
             typer.echo(f"{url_to_minify} -> {short_url}")
 
         if url_to_expand:
-            original_url = shortener.expand(short_url=url_to_expand, algorithm=algorithm)
+            original_url = shortener.expand(
+                short_url=url_to_expand, algorithm=algorithm
+            )
             typer.echo(f"{url_to_expand} -> {original_url}")
 
+        if minify_file:
+            with typer.open_file(minify_file) as stream:
+                for record in minify_stream(
+                    shortener, read_urls(stream), algorithm, batch_size
+                ):
+                    typer.echo(format_record(record, output_format))
+
+        if expand_file:
+            with typer.open_file(expand_file) as stream:
+                for record in expand_stream(
+                    shortener, read_urls(stream), algorithm, batch_size
+                ):
+                    typer.echo(format_record(record, output_format))
+
+    if metrics_file:
+        with open(metrics_file, "w") as stream:
+            stream.write(REGISTRY.render())
+
+
+@app.command()
+def serve(
+    host: Annotated[str, typer.Option(help="Address to listen on")] = None,
+    port: Annotated[int, typer.Option(help="Port to listen on")] = None,
+    workers: Annotated[
+        int, typer.Option(min=1, help="Number of worker processes")
+    ] = None,
+):
+    """Run the HTTP redirect server."""
+    from urlshortener.server import serve as serve_forever
+
+    settings = ShortenerSettings()
+    if not settings.fixed_domain:
+        raise typer.BadParameter(
+            "The redirect server needs urlshortener_fixed_domain, the domain of "
+            "the short urls it redirects"
+        )
+    serve_forever(
+        settings=settings,
+        host=host or settings.server_host,
+        port=port if port is not None else settings.server_port,
+        workers=workers or settings.server_workers,
+    )
+
+
+def _echo_progress(progress: "ImportProgress"):
+    typer.echo(
+        f"{progress.processed}/{progress.unique} urls imported "
+        f"({progress.throughput:.0f} urls/s)",
+        err=True,
+    )
+
+
+@app.command("import")
+def import_urls(
+    path: Annotated[str, typer.Argument(help="File with one URL to shorten per line")],
+    work_dir: Annotated[
+        str,
+        typer.Option(
+            help="Directory of the spilled partitions and of the checkpoint, "
+            "'<path>.import' by default"
+        ),
+    ] = None,
+    workers: Annotated[
+        int, typer.Option(min=1, help="Processes computing the short urls")
+    ] = None,
+    write_workers: Annotated[
+        int, typer.Option(min=1, help="Threads writing the mappings")
+    ] = 4,
+    partitions: Annotated[
+        int, typer.Option(min=1, help="Partitions the input is deduplicated in")
+    ] = 64,
+    batch_size: Annotated[
+        int, typer.Option(min=1, help="Number of URLs processed per round trip")
+    ] = None,
+):
+    """Shorten a large file of urls, resuming an interrupted import of it."""
+    from urlshortener.importer import URLImporter
+
+    settings = ShortenerSettings()
+    repository = InstrumentedURLRepository(create_repository(settings))
+    # clicks, expiry extensions and traces are not recorded for bulk imports
+    with open_shortener(settings, repository, recording=False) as (
+        shortener,
+        algorithm,
+    ):
+        progress = URLImporter(
+            shortener=shortener,
+            repository=repository,
+            algorithm=algorithm,
+            work_dir=work_dir or f"{path}.import",
+            fixed_domain=settings.fixed_domain,
+            batch_size=batch_size or settings.batch_size,
+            partitions=partitions,
+            workers=workers,
+            write_workers=write_workers,
+            on_progress=_echo_progress,
+        ).run(path)
+    typer.echo(
+        f"{progress.created} url mappings created, {progress.existing} existing, "
+        f"{progress.rehashed} rehashed, {progress.invalid} invalid, "
+        f"{progress.failed} failed"
+    )
+
+
+@app.command("export")
+def export_snapshot(
+    path: Annotated[str, typer.Argument(help="File the snapshot is written to")],
+    snapshot_format: Annotated[
+        SnapshotFormat, typer.Option("--format", help="Format of the snapshot")
+    ] = SnapshotFormat.BINARY,
+    batch_size: Annotated[
+        int, typer.Option(min=1, help="Number of mappings read per round trip")
+    ] = None,
+):
+    """Write every live url mapping to a snapshot file."""
+    from urlshortener import snapshot
+
+    settings = ShortenerSettings()
+    with create_repository(settings) as repository:
+        exported = snapshot.export_snapshot(
+            repository,
+            path,
+            snapshot_format=snapshot_format,
+            batch_size=batch_size or settings.batch_size,
+        )
+    typer.echo(f"{exported} url mappings exported")
+
+
+@app.command("import-snapshot")
+def import_snapshot(
+    path: Annotated[str, typer.Argument(help="Snapshot file, of either format")],
+    write_workers: Annotated[
+        int, typer.Option(min=1, help="Threads writing the mappings")
+    ] = 4,
+    batch_size: Annotated[
+        int, typer.Option(min=1, help="Number of mappings written per round trip")
+    ] = None,
+):
+    """Restore the url mappings of a snapshot file."""
+    from urlshortener import snapshot
+
+    settings = ShortenerSettings()
+    with create_repository(settings) as repository:
+        try:
+            result = snapshot.import_snapshot(
+                repository,
+                path,
+                batch_size=batch_size or settings.batch_size,
+                write_workers=write_workers,
+            )
+        except snapshot.SnapshotError as e:
+            raise typer.BadParameter(f"{path}: {e}")
+    typer.echo(
+        f"{result.restored} url mappings restored, {result.expired} expired, "
+        f"{result.collisions} collisions"
+    )
+
+
+@app.command("build-index")
+def build_index(
+    path: Annotated[
+        str,
+        typer.Argument(help="Index file, urlshortener_mmap_index_path by default"),
+    ] = None,
+    batch_size: Annotated[
+        int, typer.Option(min=1, help="Number of mappings read per round trip")
+    ] = None,
+):
+    """Compile the live url mappings into an index file for expand-only nodes."""
+    from urlshortener.mmap_index import build_index as build_mmap_index
+
+    settings = ShortenerSettings()
+    if settings.storage_backend == "mmap":
+        raise typer.BadParameter("The index is built from a database backend")
+    now = current_date_in_seconds()
+    with create_repository(settings) as repository:
+        indexed = build_mmap_index(
+            (
+                mapping
+                for mapping in repository.iter_url_mappings(
+                    batch_size=batch_size or settings.batch_size
+                )
+                if not mapping.is_expired(now)
+            ),
+            path or settings.mmap_index_path,
+        )
+    typer.echo(f"{indexed} url mappings indexed")
+
+
+@app.command()
+def daemon(
+    socket_path: Annotated[
+        str, typer.Option("--socket", help="Unix socket to listen on")
+    ] = None,
+):
+    """Answer the --minify and --expand invocations of the cli from a warm process."""
+    from urlshortener.daemon import serve_daemon
+
+    settings = ShortenerSettings()
+    socket_path = socket_path or settings.daemon_socket
+    running = client.connect(socket_path)
+    if running:
+        running.close()
+        raise typer.BadParameter(f"A daemon is already listening on {socket_path}")
+    serve_daemon(settings=settings, path=socket_path)
+
+
+@app.command()
+def migrate(
+    batch_size: Annotated[
+        int, typer.Option(min=1, help="Number of documents updated per round trip")
+    ] = None,
+):
+    """Give the url collection of older versions its unique indexes, and convert
+    integer expiration times to dates, so that the TTL index applies."""
+    from urlshortener.repository.mongo_repository import MongoURLRepository
+
+    settings = ShortenerSettings()
+    batch_size = batch_size or settings.batch_size
+    with MongoURLRepository(settings=settings, create_indexes=False) as repository:
+        deleted = repository.migrate_indexes(batch_size=batch_size)
+        migrated = repository.migrate_expiration_dates(batch_size=batch_size)
+    typer.echo(f"{deleted} duplicate url mappings deleted")
+    typer.echo(f"{migrated} url mappings migrated")
+
+
+def _bytes_per_mapping(stats: dict[str, int]) -> str:
+    if not stats["count"]:
+        return "n/a"
+    return f"{(stats['data_bytes'] + stats['index_bytes']) / stats['count']:.0f}"
+
+
+@app.command("migrate-schema")
+def migrate_schema(
+    batch_size: Annotated[
+        int, typer.Option(min=1, help="Number of mappings copied per round trip")
+    ] = None,
+):
+    """Copy the url mappings to the compact schema, and report the space saved."""
+    from urlshortener.repository.compact_mongo_repository import (
+        CompactMongoURLRepository,
+        migrate_to_compact_schema,
+    )
+    from urlshortener.repository.mongo_repository import MongoURLRepository
+
+    settings = ShortenerSettings()
+    with (
+        MongoURLRepository(settings=settings) as source,
+        CompactMongoURLRepository(settings=settings) as target,
+    ):
+        migrated = migrate_to_compact_schema(
+            source, target, batch_size=batch_size or settings.batch_size
+        )
+        before, after = source.storage_stats(), target.storage_stats()
+    typer.echo(f"{migrated} url mappings migrated")
+    typer.echo(
+        f"bytes per mapping, indexes included: {_bytes_per_mapping(before)} before, "
+        f"{_bytes_per_mapping(after)} after"
+    )
+
+
+@app.command()
+def purge(
+    batch_size: Annotated[
+        int, typer.Option(min=1, help="Number of mappings deleted per transaction")
+    ] = None,
+):
+    """Delete the expired url mappings of the sqlite backend."""
+    from urlshortener.repository.sqlite_repository import SqliteURLRepository
+
+    settings = ShortenerSettings()
+    if settings.storage_backend != "sqlite":
+        # mongo deletes them on its own, through the TTL index
+        raise typer.BadParameter("Only the sqlite backend needs purging")
+    key_pool = None
+    if settings.shortening_algorithm == ShorteningAlgorithmType.KEY_POOL:
+        key_pool = create_key_pool_repository(settings)
+    with (
+        SqliteURLRepository(settings=settings) as repository,
+        key_pool or nullcontext(),
+    ):
+        # the codes of the purged mappings go back to the key pool
+        purged = repository.purge_expired(
+            batch_size=batch_size or settings.batch_size,
+            on_purged=partial(recycle_codes, key_pool) if key_pool else None,
+        )
+    typer.echo(f"{purged} expired url mappings purged")
+
+
+@app.command("fill-key-pool")
+def fill_key_pool(
+    depth: Annotated[
+        int, typer.Option(min=1, help="Free codes to top the pool up to")
+    ] = None,
+):
+    """Generate codes ahead of time for the key-pool algorithm."""
+    from urlshortener.key_pool import fill_key_pool as fill
+
+    settings = ShortenerSettings()
+    with create_key_pool_repository(settings) as key_pool:
+        added = fill(
+            key_pool,
+            depth=depth or settings.key_pool_depth,
+            code_length=settings.key_pool_code_length,
+            lease_ttl=settings.key_pool_lease_ttl,
+        )
+        free = key_pool.count_free_codes()
+    typer.echo(f"{added} codes added, {free} free")
+
+
+@app.command()
+def rebalance(
+    batch_size: Annotated[
+        int, typer.Option(min=1, help="Number of mappings moved per round trip")
+    ] = None,
+):
+    """Move the url mappings to the shards of the current ring."""
+    from urlshortener.repository.sharded_repository import ShardedURLRepository
+
+    settings = ShortenerSettings()
+    repository = create_repository(settings)
+    if not isinstance(repository, ShardedURLRepository):
+        raise typer.BadParameter("No shards are configured")
+    with repository:
+        moved = repository.rebalance(batch_size=batch_size or settings.batch_size)
+    typer.echo(f"{moved} url mappings moved")
+
+
+@app.command()
+def stats(
+    short_urls: Annotated[
+        list[str],
+        typer.Argument(help="Short urls to report, the most expanded ones if none"),
+    ] = None,
+    top: Annotated[
+        int, typer.Option(min=1, help="Number of most expanded short urls")
+    ] = 10,
+):
+    """Print the number of expands of short urls."""
+    settings = ShortenerSettings()
+    with create_click_stats_repository(settings) as repository:
+        if short_urls:
+            clicks = repository.get_clicks(short_urls)
+            rows = [(short_url, clicks.get(short_url, 0)) for short_url in short_urls]
+        else:
+            rows = repository.get_top_short_urls(top)
+    for short_url, hits in rows:
+        typer.echo(f"{hits}\t{short_url}")
+
 
 def run():
-    typer.run(main)
+    app()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+import os
+import socket
+
+# only the standard library is imported here: this module is loaded by every
+# cli invocation before it knows whether a daemon can answer it
+
+# a request is one line, an operation and its argument; its response is one
+# line too, the result after OK or an error message after ERROR
+MINIFY = "m"
+EXPAND = "e"
+OK = "+"
+ERROR = "-"
+
+_SOCKET_SETTING = "urlshortener_daemon_socket"
+
+
+class DaemonError(Exception):
+    """The daemon could not answer a request."""
+
+
+def default_socket_path() -> str:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(runtime_dir, f"urlshortener-{os.getuid()}.sock")
+
+
+def socket_path() -> str:
+    # looked up like ShortenerSettings does, without loading pydantic
+    for name, value in os.environ.items():
+        if name.lower() == _SOCKET_SETTING:
+            return value
+    if os.path.exists(".env"):
+        with open(".env", encoding="utf-8") as stream:
+            for line in stream:
+                name, _, value = line.strip().partition("=")
+                if name.lower() == _SOCKET_SETTING:
+                    return value.strip("'\"")
+    return default_socket_path()
+
+
+class DaemonClient:
+
+    def __init__(self, path: str, timeout: float = 10.0):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.settimeout(timeout)
+            self._sock.connect(path)
+        except OSError:
+            self._sock.close()
+            raise
+        self._reader = self._sock.makefile("r", encoding="utf-8", newline="\n")
+
+    def close(self):
+        self._reader.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def minify(self, url: str) -> str:
+        return self.request_many([(MINIFY, url)])[0]
+
+    def expand(self, short_url: str) -> str:
+        return self.request_many([(EXPAND, short_url)])[0]
+
+    def request_many(self, requests: list[tuple[str, str]]) -> list[str]:
+        # pipelined: every request is sent before the first response is read
+        self._sock.sendall(
+            "".join(
+                f"{operation} {argument}\n" for operation, argument in requests
+            ).encode()
+        )
+        results = []
+        for _ in requests:
+            line = self._reader.readline()
+            if not line:
+                raise DaemonError("The daemon closed the connection")
+            status, result = line[:1], line[1:].rstrip("\n")
+            if status != OK:
+                raise DaemonError(result)
+            results.append(result)
+        return results
+
+
+def connect(path: str = None, timeout: float = 10.0) -> DaemonClient | None:
+    """Returns a client of the running daemon, or None when there is none."""
+    try:
+        return DaemonClient(path or socket_path(), timeout)
+    except OSError:
+        return None
@@ -0,0 +1,107 @@
+import logging
+import os
+import signal
+import socket
+import socketserver
+
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithm
+from urlshortener.client import ERROR, EXPAND, MINIFY, OK
+from urlshortener.factory import open_shortener
+from urlshortener.repository.factory import build_serving_repository
+from urlshortener.repository.repository import ShortURLCollisionError
+from urlshortener.settings import ShortenerSettings
+from urlshortener.url_shortener import URLShortener
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    server: "ShortenerDaemon"
+
+    def handle(self):
+        # a connection carries any number of requests, answered in order
+        for line in self.rfile:
+            response = self.server.dispatch(line.decode().rstrip("\n"))
+            self.wfile.write(response.encode())
+
+
+class ShortenerDaemon(socketserver.ThreadingUnixStreamServer):
+    """Answers the minify and expand requests of the cli on a Unix socket, with a
+    URLShortener and a repository connection pool kept warm between them.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, path: str, shortener: URLShortener, algorithm: ShorteningAlgorithm
+    ):
+        _remove_stale_socket(path)
+        super().__init__(path, DaemonRequestHandler)
+        # only the user running the daemon may use it
+        os.chmod(path, 0o600)
+        self.path = path
+        self.shortener = shortener
+        self.algorithm = algorithm
+        self.log = logging.getLogger(self.__class__.__name__)
+
+    def dispatch(self, request: str) -> str:
+        operation, _, argument = request.partition(" ")
+        try:
+            if operation == MINIFY:
+                result = self.shortener.minify(url=argument, algorithm=self.algorithm)
+            elif operation == EXPAND:
+                result = self.shortener.expand(
+                    short_url=argument, algorithm=self.algorithm
+                )
+            else:
+                return f"{ERROR}Unknown operation '{operation}'\n"
+        except ShortURLCollisionError as e:
+            self.log.warning("%s", e)
+            return _error_line(e)
+        except Exception as e:
+            self.log.debug("%s failed: %s", request, e)
+            return _error_line(e)
+        return f"{OK}{result}\n"
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def _error_line(error: Exception) -> str:
+    # a response is a single line, whatever the message
+    return f"{ERROR}{' '.join(str(error).splitlines())}\n"
+
+
+def _remove_stale_socket(path: str):
+    # left behind by a daemon that was killed
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f"A daemon is already listening on {path}")
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve_daemon(settings: ShortenerSettings, path: str):
+    log = logging.getLogger("ShortenerDaemon")
+    repository = build_serving_repository(settings)
+    with open_shortener(settings, repository) as (shortener, algorithm):
+        daemon = ShortenerDaemon(path, shortener, algorithm)
+        # stopped like on ctrl-c, so that pending writes are flushed
+        signal.signal(signal.SIGTERM, _interrupt)
+        log.info("listening on %s", path)
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            daemon.server_close()
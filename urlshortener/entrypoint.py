@@ -0,0 +1,54 @@
+import sys
+from urllib.parse import urlparse
+
+from urlshortener import client
+
+# the options a running daemon can answer, anything else goes to the full cli
+_DAEMON_OPTIONS = {
+    "-m": client.MINIFY,
+    "--minify": client.MINIFY,
+    "-e": client.EXPAND,
+    "--expand": client.EXPAND,
+}
+
+
+def _is_valid_url(url: str) -> bool:
+    parsed = urlparse(url)
+    return bool(parsed.scheme and parsed.netloc)
+
+
+def _daemon_requests(args: list[str]) -> list[tuple[str, str]] | None:
+    urls = {}
+    arguments = iter(args)
+    for option in arguments:
+        url = next(arguments, None)
+        if option not in _DAEMON_OPTIONS or not url or not _is_valid_url(url):
+            # the cli reports the errors
+            return None
+        urls[_DAEMON_OPTIONS[option]] = url
+    # minified before expanded, like the cli does
+    return [
+        (operation, urls[operation])
+        for operation in (client.MINIFY, client.EXPAND)
+        if operation in urls
+    ] or None
+
+
+def run():
+    requests = _daemon_requests(sys.argv[1:])
+    daemon = requests and client.connect()
+    if not daemon:
+        # typer, pydantic and the database drivers are only loaded here
+        from urlshortener.cli import run as run_cli
+
+        run_cli()
+        return
+
+    with daemon:
+        try:
+            results = daemon.request_many(requests)
+        except (client.DaemonError, OSError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+    for (_, url), result in zip(requests, results):
+        print(f"{url} -> {result}")
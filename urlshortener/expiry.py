@@ -0,0 +1,150 @@
+import logging
+import threading
+
+from urlshortener.batch import chunked
+from urlshortener.metrics import REGISTRY
+from urlshortener.repository.repository import (
+    URLMapping,
+    URLRepository,
+    current_date_in_seconds,
+)
+from urlshortener.settings import ShortenerSettings
+
+EXPIRY_REFRESHES_TOTAL = REGISTRY.counter(
+    "urlshortener_expiry_refreshes_total",
+    "Hits of live mappings, by whether they refreshed the expiration, were "
+    "skipped, or their flush failed",
+    ("outcome",),
+)
+
+
+class ExpiryRefresher:
+    """Slides the expiration of the mappings in use: a minify or expand hit
+    pushes the expiration of its mapping `expiration_offset` seconds ahead, as
+    long as the mapping would not live more than `max_lifetime` seconds.
+
+    Hits are coalesced in memory and flushed every `refresh_interval` seconds,
+    in bulk writes of `batch_size` refreshes, so that a mapping is refreshed at
+    most once per interval whatever its traffic. Hits of a mapping refreshed
+    less than an interval ago, of a mapping already pending, or beyond
+    `max_pending` mappings, are skipped.
+    """
+
+    def __init__(
+        self,
+        repository: URLRepository,
+        expiration_offset: int,
+        refresh_interval: float,
+        max_lifetime: int,
+        max_pending: int,
+        batch_size: int,
+    ):
+        self._repository = repository
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._expiration_offset = expiration_offset
+        self._refresh_interval = refresh_interval
+        self._max_lifetime = max_lifetime
+        self._max_pending = max_pending
+        self._batch_size = batch_size
+        # a mapping expiring after this far ahead was refreshed (or created)
+        # less than an interval ago
+        self._fresh_for = expiration_offset - refresh_interval
+        self._lock = threading.Lock()
+        # serializes the flushes of the background thread and the explicit ones
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+        self._pending: set[tuple[str, str, str]] = set()
+        self._skipped = 0
+
+    def initialize(self):
+        self._closed.clear()
+        self._flusher = threading.Thread(
+            target=self._run_flusher, name="expiry-refresher", daemon=True
+        )
+        self._flusher.start()
+        return self
+
+    def finalize(self):
+        self._closed.set()
+        if self._flusher:
+            self._flusher.join()
+        self.flush()
+
+    def __enter__(self):
+        return self.initialize()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def record(
+        self,
+        original_url: str,
+        short_url: str,
+        algorithm: str,
+        expiration_time: int = None,
+    ):
+        """Records a hit of a live mapping, whose expiration time may be unknown
+        (e.g. on a minify hit)."""
+        fresh = (
+            expiration_time is not None
+            and expiration_time > current_date_in_seconds() + self._fresh_for
+        )
+        key = (algorithm, original_url, short_url)
+        with self._lock:
+            if fresh or key in self._pending or len(self._pending) >= self._max_pending:
+                self._skipped += 1
+            else:
+                self._pending.add(key)
+
+    def flush(self):
+        """Refreshes the expiration of the mappings hit since the last flush."""
+        with self._flush_lock:
+            with self._lock:
+                pending, skipped = self._pending, self._skipped
+                self._pending, self._skipped = set(), 0
+            EXPIRY_REFRESHES_TOTAL.inc("skipped", amount=skipped)
+            if not pending:
+                return
+            expiration_time = current_date_in_seconds() + self._expiration_offset
+            mappings = (
+                URLMapping(original_url, short_url, algorithm, 0, 0)
+                for algorithm, original_url, short_url in pending
+            )
+            extended = 0
+            for batch in chunked(mappings, self._batch_size):
+                try:
+                    extended += self._repository.extend_expirations(
+                        batch, expiration_time, self._max_lifetime
+                    )
+                except Exception as e:
+                    self._log.error(
+                        "dropping the refreshes of %s mappings: %s", len(batch), e
+                    )
+                    EXPIRY_REFRESHES_TOTAL.inc("dropped", amount=len(batch))
+                    continue
+                EXPIRY_REFRESHES_TOTAL.inc("issued", amount=len(batch))
+            self._log.debug(
+                "%d of %d mapping expirations extended", extended, len(pending)
+            )
+
+    def _run_flusher(self):
+        while not self._closed.wait(self._refresh_interval):
+            self.flush()
+
+
+def build_expiry_refresher(
+    settings: ShortenerSettings, repository: URLRepository
+) -> ExpiryRefresher | None:
+    """The refresher of the expirations of the mappings of `repository`, None
+    when expirations do not slide."""
+    if not settings.sliding_expiration_enabled:
+        return None
+    return ExpiryRefresher(
+        repository,
+        expiration_offset=settings.expiration_offset,
+        refresh_interval=settings.sliding_expiration_refresh_interval,
+        max_lifetime=settings.sliding_expiration_max_lifetime,
+        max_pending=settings.sliding_expiration_max_pending,
+        batch_size=settings.batch_size,
+    )
@@ -0,0 +1,54 @@
+from contextlib import contextmanager, nullcontext
+from typing import Iterator
+
+from urlshortener.algorithms.factory import ShorteningAlgorithmFactory
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithm
+from urlshortener.analytics import build_click_aggregator
+from urlshortener.expiry import build_expiry_refresher
+from urlshortener.key_pool import build_key_pool
+from urlshortener.repository.repository import URLRepository
+from urlshortener.settings import ShortenerSettings
+from urlshortener.tracing import build_trace_recorder
+from urlshortener.url_shortener import URLShortener
+
+
+@contextmanager
+def open_shortener(
+    settings: ShortenerSettings, repository: URLRepository, recording: bool = True
+) -> Iterator[tuple[URLShortener, ShorteningAlgorithm]]:
+    """The shortener of the configured algorithm over `repository`, which is
+    opened with the key pool and, when `recording`, the click aggregator, the
+    expiry refresher and the trace recorder the settings enable. They are all
+    closed, and their pending writes flushed, on exit."""
+    key_pool = build_key_pool(settings)
+    tracing = clicks = expiry = None
+    if recording:
+        tracing = build_trace_recorder(settings)
+        clicks = build_click_aggregator(settings)
+        expiry = build_expiry_refresher(settings, repository)
+    # exited in reverse order: the expiry refresher is flushed before the
+    # repository is closed
+    with (
+        tracing or nullcontext(),
+        repository,
+        expiry or nullcontext(),
+        clicks or nullcontext(),
+        key_pool or nullcontext(),
+    ):
+        shortener = URLShortener(
+            repository=repository,
+            fixed_domain=settings.fixed_domain,
+            max_collision_retries=settings.max_collision_retries,
+            clicks=clicks,
+            expiry=expiry,
+        )
+        algorithm = ShorteningAlgorithmFactory(
+            repository=repository,
+            id_block_size=settings.id_block_size,
+            key_pool=key_pool,
+            code_length=settings.hash_code_length,
+            code_alphabet=settings.hash_code_alphabet,
+            max_code_length=settings.hash_code_max_length,
+            collision_threshold=settings.hash_collision_threshold,
+        ).get(algorithm_type=settings.shortening_algorithm)
+        yield shortener, algorithm
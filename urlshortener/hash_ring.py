@@ -0,0 +1,30 @@
+import bisect
+import hashlib
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """A consistent-hash ring: every node owns the keys that hash right before
+    its points. With `virtual_nodes` points per node, adding a node to a ring of
+    N takes about 1/(N+1) of the keys, evenly from the other nodes.
+    """
+
+    def __init__(self, nodes: list[str], virtual_nodes: int = 100):
+        if not nodes:
+            raise ValueError("A hash ring needs at least one node")
+        self.nodes = list(dict.fromkeys(nodes))
+        self._virtual_nodes = virtual_nodes
+        points = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key: str) -> str:
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
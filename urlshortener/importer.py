@@ -0,0 +1,294 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, NamedTuple
+
+from urlshortener.algorithms.shortening_algorithm import (
+    ShorteningAlgorithm,
+    ShorteningAlgorithmType,
+)
+from urlshortener.batch import chunked, read_urls
+from urlshortener.repository.repository import ShortURLCollisionError, URLRepository
+from urlshortener.url_shortener import URLShortener, get_url_domain
+
+CHECKPOINT_FILE = "checkpoint.json"
+
+# algorithms handing out codes leased by this process: they are neither
+# picklable nor shareable with the worker processes
+IN_PROCESS_ALGORITHMS = {
+    ShorteningAlgorithmType.SEQUENCE,
+    ShorteningAlgorithmType.KEY_POOL,
+}
+
+
+class ImportProgress(NamedTuple):
+    read: int = 0
+    unique: int = 0
+    invalid: int = 0
+    existing: int = 0
+    created: int = 0
+    rehashed: int = 0
+    failed: int = 0
+    # seconds spent importing, over every run of a resumed import
+    elapsed: float = 0.0
+
+    @property
+    def processed(self) -> int:
+        return self.invalid + self.existing + self.created + self.rehashed + self.failed
+
+    @property
+    def throughput(self) -> float:
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def merged(self, other: "ImportProgress") -> "ImportProgress":
+        return ImportProgress(*(mine + theirs for mine, theirs in zip(self, other)))
+
+
+def shorten_chunk(
+    algorithm: ShorteningAlgorithm, fixed_domain: str, urls: list[str]
+) -> dict[str, str | None]:
+    # runs in the worker processes: invalid urls are mapped to None
+    short_urls = {}
+    for url in urls:
+        try:
+            url_domain = get_url_domain(url)
+        except ValueError:
+            short_urls[url] = None
+        else:
+            short_urls[url] = (
+                f"{fixed_domain or url_domain}{algorithm.shorten(url=url)}"
+            )
+    return short_urls
+
+
+def _partition_of(url: str, partitions: int) -> int:
+    digest = hashlib.blake2b(url.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % partitions
+
+
+class URLImporter:
+    """Shortens a large file of urls and stores the new mappings in bulk.
+
+    The input is first spilled to `partitions` files of `work_dir`, by hash of
+    the url, so that every duplicate lands in the same partition and each one is
+    deduplicated in memory. Partitions are then imported one at a time: codes are
+    computed by `workers` processes, checked for collisions within the chunk and
+    against the store, and written by `write_workers` threads. Colliding urls go
+    through `URLShortener.minify`, which rehashes them.
+
+    A checkpoint in `work_dir` records the imported partitions: an import that was
+    interrupted resumes with the first partition that was not completed, and
+    mappings of that one that were stored already are found as existing.
+    """
+
+    def __init__(
+        self,
+        shortener: URLShortener,
+        repository: URLRepository,
+        algorithm: ShorteningAlgorithm,
+        work_dir: str,
+        fixed_domain: str = None,
+        batch_size: int = 1000,
+        partitions: int = 64,
+        workers: int = None,
+        write_workers: int = 4,
+        on_progress: Callable[[ImportProgress], None] = None,
+        progress_interval: float = 1.0,
+    ):
+        self._shortener = shortener
+        self._repository = repository
+        self._algorithm = algorithm
+        self._work_dir = work_dir
+        self._fixed_domain = fixed_domain
+        self._batch_size = batch_size
+        self._partitions = partitions
+        self._workers = workers or os.cpu_count()
+        self._write_workers = write_workers
+        self._on_progress = on_progress
+        self._progress_interval = progress_interval
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._progress = ImportProgress()
+        self._started_at = 0.0
+        self._reported_at = 0.0
+
+    def run(self, path: str) -> ImportProgress:
+        self._started_at = time.monotonic()
+        identity = self._identity(path)
+        checkpoint = self._load_checkpoint(identity)
+        if checkpoint:
+            self._progress = ImportProgress(**checkpoint["progress"])
+            self._log.info(
+                "resuming import of %s, %s partitions done",
+                path,
+                len(checkpoint["completed"]),
+            )
+        else:
+            shutil.rmtree(self._work_dir, ignore_errors=True)
+            os.makedirs(self._work_dir)
+            self._progress = ImportProgress()
+            self._spill(path)
+            checkpoint = {"input": identity, "completed": []}
+            self._save_checkpoint(checkpoint)
+
+        with ProcessPoolExecutor(
+            max_workers=self._workers,
+            # workers are spawned, forking a process with live database clients
+            # and flusher threads is not safe
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as shorteners, ThreadPoolExecutor(max_workers=self._write_workers) as writers:
+            for partition in range(self._partitions):
+                if partition in checkpoint["completed"]:
+                    continue
+                self._import_partition(partition, shorteners, writers)
+                checkpoint["completed"].append(partition)
+                self._save_checkpoint(checkpoint)
+
+        shutil.rmtree(self._work_dir)
+        progress = self._elapsed_progress()
+        if self._on_progress:
+            self._on_progress(progress)
+        return progress
+
+    def _identity(self, path: str) -> dict:
+        # a checkpoint only applies to the same file, imported the same way
+        stat = os.stat(path)
+        return {
+            "path": os.path.abspath(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "algorithm": self._algorithm.type().value,
+            "fixed_domain": self._fixed_domain,
+            "partitions": self._partitions,
+        }
+
+    def _load_checkpoint(self, identity: dict) -> dict | None:
+        path = os.path.join(self._work_dir, CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as stream:
+            checkpoint = json.load(stream)
+        if checkpoint["input"] != identity:
+            self._log.warning("checkpoint of another import found, starting over")
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint: dict):
+        checkpoint["progress"] = self._elapsed_progress()._asdict()
+        path = os.path.join(self._work_dir, CHECKPOINT_FILE)
+        # written aside then renamed, a crash never leaves a partial checkpoint
+        with open(f"{path}.tmp", "w") as stream:
+            json.dump(checkpoint, stream)
+        os.replace(f"{path}.tmp", path)
+
+    def _partition_path(self, partition: int) -> str:
+        return os.path.join(self._work_dir, f"partition-{partition:04d}.txt")
+
+    def _spill(self, path: str):
+        streams = [
+            open(self._partition_path(partition), "w")
+            for partition in range(self._partitions)
+        ]
+        read = 0
+        try:
+            with open(path) as stream:
+                for url in read_urls(stream):
+                    streams[_partition_of(url, self._partitions)].write(f"{url}\n")
+                    read += 1
+        finally:
+            for stream in streams:
+                stream.close()
+        self._progress = self._progress._replace(read=read)
+        self._log.debug("%s urls spilled to %s partitions", read, self._partitions)
+
+    def _import_partition(
+        self,
+        partition: int,
+        shorteners: ProcessPoolExecutor,
+        writers: ThreadPoolExecutor,
+    ):
+        with open(self._partition_path(partition)) as stream:
+            urls = list(dict.fromkeys(read_urls(stream)))
+        self._progress = self._progress._replace(
+            unique=self._progress.unique + len(urls)
+        )
+        shorten = partial(shorten_chunk, self._algorithm, self._fixed_domain)
+        chunks = chunked(urls, self._batch_size)
+        if self._algorithm.type() in IN_PROCESS_ALGORITHMS:
+            short_url_chunks = map(shorten, chunks)
+        else:
+            short_url_chunks = shorteners.map(shorten, chunks)
+        stores = [
+            writers.submit(self._store_chunk, short_urls)
+            for short_urls in short_url_chunks
+        ]
+        for store in stores:
+            self._progress = self._progress.merged(store.result())
+            self._report()
+
+    def _store_chunk(self, short_urls: dict[str, str | None]) -> ImportProgress:
+        algorithm = self._algorithm.type().value
+        invalid = sum(short_url is None for short_url in short_urls.values())
+        short_urls = {url: code for url, code in short_urls.items() if code}
+        existing = self._repository.get_short_urls(list(short_urls), algorithm)
+        if self._algorithm.type() in IN_PROCESS_ALGORITHMS:
+            # the codes drawn for the urls already mapped are handed out again
+            for url in existing:
+                self._algorithm.release(short_urls[url].rsplit("/", 1)[1])
+        candidates = {
+            url: code for url, code in short_urls.items() if url not in existing
+        }
+        taken = self._repository.get_original_urls(
+            list(set(candidates.values())), algorithm
+        )
+
+        new_mappings, claimed, colliding_urls = {}, set(), []
+        for url, code in candidates.items():
+            if code in taken or code in claimed:
+                colliding_urls.append(url)
+            else:
+                claimed.add(code)
+                new_mappings[url] = code
+        if new_mappings:
+            try:
+                self._repository.save_url_mappings(new_mappings, algorithm)
+            except ShortURLCollisionError as e:
+                # taken by a chunk stored concurrently, or by an expired mapping
+                colliding_urls.extend(e.original_urls)
+                for url in e.original_urls:
+                    del new_mappings[url]
+
+        failed = 0
+        for url in colliding_urls:
+            try:
+                self._shortener.minify(url=url, algorithm=self._algorithm)
+            except ShortURLCollisionError as e:
+                self._log.warning(str(e))
+                failed += 1
+        return ImportProgress(
+            invalid=invalid,
+            existing=len(existing),
+            created=len(new_mappings),
+            rehashed=len(colliding_urls) - failed,
+            failed=failed,
+        )
+
+    def _elapsed_progress(self) -> ImportProgress:
+        now = time.monotonic()
+        self._progress = self._progress._replace(
+            elapsed=self._progress.elapsed + now - self._started_at
+        )
+        self._started_at = now
+        return self._progress
+
+    def _report(self):
+        now = time.monotonic()
+        if not self._on_progress or now - self._reported_at < self._progress_interval:
+            return
+        self._reported_at = now
+        self._on_progress(self._elapsed_progress())
@@ -0,0 +1,247 @@
+import logging
+import secrets
+import threading
+import time
+from collections import deque
+
+from urlshortener.algorithms import base62
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithmType
+from urlshortener.metrics import REGISTRY
+from urlshortener.repository.key_pool_repository import KeyPoolRepository
+from urlshortener.settings import ShortenerSettings
+
+KEY_POOL_FREE_CODES = REGISTRY.gauge(
+    "urlshortener_key_pool_free_codes",
+    "Free codes of the key pool, in the shared pool when this process last "
+    "leased from it and in its local buffer",
+    ("pool",),
+)
+KEY_POOL_CODES_TOTAL = REGISTRY.counter(
+    "urlshortener_key_pool_codes_total",
+    "Codes added to the shared pool, leased from it, released back to it or "
+    "reclaimed from expired leases by this process",
+    ("operation",),
+)
+# codes generated per round trip when filling the pool
+_FILL_BATCH_SIZE = 10000
+
+
+def generate_codes(count: int, length: int) -> list[str]:
+    """`count` random base62 codes of `length` characters, drawn uniformly."""
+    space = len(base62.BASE62_ALPHABET) ** length
+    return [
+        base62.encode(secrets.randbelow(space)).rjust(length, "0") for _ in range(count)
+    ]
+
+
+def fill_key_pool(
+    repository: KeyPoolRepository, depth: int, code_length: int, lease_ttl: int = None
+) -> int:
+    """Adds random codes to the pool until `depth` of them are free and returns
+    how many were added.
+
+    The codes leased more than `lease_ttl` seconds ago and neither used nor
+    renewed since are freed first. The free codes are counted again before each
+    batch, so that processes filling the pool at the same time do not all add
+    the whole difference.
+    """
+    if lease_ttl is not None:
+        reclaimed = repository.reclaim_leases(lease_ttl)
+        KEY_POOL_CODES_TOTAL.inc("reclaimed", amount=reclaimed)
+    added = 0
+    while (free := repository.count_free_codes()) < depth:
+        count = min(depth - free, _FILL_BATCH_SIZE)
+        batch_added = repository.add_codes(generate_codes(count, code_length))
+        if not batch_added:
+            raise ValueError(
+                f"No unused code of {code_length} characters left, " "use longer codes"
+            )
+        added += batch_added
+        KEY_POOL_CODES_TOTAL.inc("added", amount=batch_added)
+    KEY_POOL_FREE_CODES.set("shared", value=free)
+    return added
+
+
+def recycle_codes(repository: KeyPoolRepository, purged: list[tuple[str, str]]):
+    """Releases back to the pool the codes of the purged key-pool mappings, given
+    as (algorithm, short url) pairs."""
+    codes = [
+        short_url.rsplit("/", 1)[-1]
+        for algorithm, short_url in purged
+        if algorithm == ShorteningAlgorithmType.KEY_POOL.value
+    ]
+    if codes:
+        repository.release_codes(codes)
+        KEY_POOL_CODES_TOTAL.inc("released", amount=len(codes))
+
+
+class KeyPool:
+    """Hands out the codes of the key-pool algorithm from a local buffer of codes
+    leased from the shared pool, `lease_size` at a time.
+
+    Taking a code is a pop from the buffer, without any round trip. When the
+    buffer falls to `local_low_watermark` codes, the next lease is fetched in the
+    background, and when fewer than `low_watermark` codes are left free in the
+    shared pool, the process tops it up to `depth` codes. The codes still
+    buffered when the process stops are released back to the pool.
+    """
+
+    def __init__(
+        self,
+        repository: KeyPoolRepository,
+        lease_size: int,
+        local_low_watermark: int,
+        depth: int,
+        low_watermark: int,
+        code_length: int,
+        lease_ttl: int = 3600,
+    ):
+        self._repository = repository
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._lease_size = lease_size
+        self._local_low_watermark = local_low_watermark
+        self._depth = depth
+        self._low_watermark = low_watermark
+        self._code_length = code_length
+        self._lease_ttl = lease_ttl
+        self._lock = threading.Lock()
+        # one lease at a time, in the background or by a taker finding the
+        # buffer empty
+        self._lease_lock = threading.Lock()
+        self._codes: deque[str] = deque()
+        # handed out since the leases were last renewed
+        self._taken: set[str] = set()
+        self._renewed_at = time.monotonic()
+        self._refiller = None
+        self._local_free = KEY_POOL_FREE_CODES.labels("local")
+
+    def initialize(self):
+        self._repository.initialize()
+        return self
+
+    def finalize(self):
+        try:
+            if self._refiller:
+                self._refiller.join()
+            with self._lock:
+                codes, self._codes = list(self._codes), deque()
+                self._local_free.set(0)
+            self._renew()
+            if codes:
+                self._repository.release_codes(codes)
+                KEY_POOL_CODES_TOTAL.inc("released", amount=len(codes))
+                self._log.debug("released %s unused codes", len(codes))
+        finally:
+            self._repository.finalize()
+
+    def __enter__(self):
+        return self.initialize()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def take(self) -> str:
+        while True:
+            with self._lock:
+                codes = self._codes
+                since_renewal = time.monotonic() - self._renewed_at
+                if codes and since_renewal >= self._lease_ttl:
+                    self._log.warning(
+                        "dropping %s codes whose leases expired", len(codes)
+                    )
+                    codes.clear()
+                if codes:
+                    code = codes.popleft()
+                    self._taken.add(code)
+                    self._local_free.set(len(codes))
+                    if (
+                        len(codes) <= self._local_low_watermark
+                        or since_renewal >= self._lease_ttl / 2
+                    ) and not (self._refiller and self._refiller.is_alive()):
+                        self._refiller = threading.Thread(
+                            target=self._refill, name="key-pool-refill", daemon=True
+                        )
+                        self._refiller.start()
+                    return code
+            # the buffer ran dry before the lease in the background came back
+            self._lease()
+
+    def put_back(self, code: str):
+        # a code taken but not stored, handed out again first
+        with self._lock:
+            self._taken.discard(code)
+            self._codes.appendleft(code)
+            self._local_free.set(len(self._codes))
+
+    def _refill(self):
+        try:
+            self._lease()
+        except Exception as e:
+            # the next taker finding the buffer empty leases again
+            self._log.error("leasing codes failed: %s", e)
+
+    def _renew(self):
+        started = time.monotonic()
+        with self._lock:
+            used, self._taken = list(self._taken), set()
+            held = list(self._codes)
+        try:
+            self._repository.renew_leases(used, held)
+        except Exception:
+            with self._lock:
+                self._taken.update(used)
+            raise
+        self._renewed_at = started
+
+    def _lease(self):
+        with self._lease_lock:
+            self._renew()
+            with self._lock:
+                if len(self._codes) > self._local_low_watermark:
+                    # leased meanwhile by another thread
+                    return
+            codes = self._repository.lease_codes(self._lease_size)
+            if len(codes) < self._lease_size:
+                # the shared pool ran dry, enough codes are added to finish the
+                # lease, the next one tops the pool up
+                fill_key_pool(
+                    self._repository,
+                    self._lease_size - len(codes),
+                    self._code_length,
+                    self._lease_ttl,
+                )
+                codes += self._repository.lease_codes(self._lease_size - len(codes))
+            else:
+                free = self._repository.count_free_codes()
+                KEY_POOL_FREE_CODES.set("shared", value=free)
+                if free < self._low_watermark:
+                    added = fill_key_pool(
+                        self._repository,
+                        self._depth,
+                        self._code_length,
+                        self._lease_ttl,
+                    )
+                    self._log.info("added %s codes to the key pool", added)
+            KEY_POOL_CODES_TOTAL.inc("leased", amount=len(codes))
+            with self._lock:
+                self._codes.extend(codes)
+                self._local_free.set(len(self._codes))
+            self._log.debug("leased %s codes", len(codes))
+
+
+def build_key_pool(settings: ShortenerSettings) -> KeyPool | None:
+    """The key pool of the configured storage backend, None unless the key-pool
+    algorithm is used."""
+    from urlshortener.repository.factory import create_key_pool_repository
+
+    if settings.shortening_algorithm != ShorteningAlgorithmType.KEY_POOL:
+        return None
+    return KeyPool(
+        create_key_pool_repository(settings),
+        lease_size=settings.key_pool_lease_size,
+        local_low_watermark=settings.key_pool_local_low_watermark,
+        depth=settings.key_pool_depth,
+        low_watermark=settings.key_pool_low_watermark,
+        code_length=settings.key_pool_code_length,
+        lease_ttl=settings.key_pool_lease_ttl,
+    )
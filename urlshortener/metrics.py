@@ -0,0 +1,252 @@
+import bisect
+import threading
+
+# latency buckets, in seconds, from 50us (in-process cache hit) to 2.5s
+DEFAULT_BUCKETS = (
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple) -> str:
+    if not label_names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(str(value))}"'
+        for name, value in zip(label_names, label_values)
+    )
+    return f"{{{pairs}}}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("_lock", "_upper_bounds", "bucket_counts", "count", "sum")
+
+    def __init__(self, upper_bounds: tuple[float, ...]):
+        self._lock = threading.Lock()
+        self._upper_bounds = upper_bounds
+        # the last bucket is +Inf
+        self.bucket_counts = [0] * (len(upper_bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, *label_values):
+        # children are cached, so callers on a hot path should keep them around
+        child = self._children.get(label_values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(label_values, self._new_child())
+        return child
+
+    def clear(self):
+        with self._lock:
+            self._children.clear()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for label_values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(label_values, child))
+        return lines
+
+    def _render_child(self, label_values: tuple, child) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        self.labels(*label_values).inc(amount)
+
+    def value(self, *label_values) -> float:
+        child = self._children.get(label_values)
+        return child.value if child else 0
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def _render_child(self, label_values: tuple, child: _CounterChild) -> list[str]:
+        labels = _format_labels(self.label_names, label_values)
+        return [f"{self.name}{labels} {_format_value(child.value)}"]
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, *label_values, value: float):
+        self.labels(*label_values).set(value)
+
+    def inc(self, *label_values, amount: float = 1):
+        self.labels(*label_values).inc(amount)
+
+    def value(self, *label_values) -> float:
+        child = self._children.get(label_values)
+        return child.value if child else 0
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def _render_child(self, label_values: tuple, child: _GaugeChild) -> list[str]:
+        labels = _format_labels(self.label_names, label_values)
+        return [f"{self.name}{labels} {_format_value(child.value)}"]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple[str, ...],
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *label_values, value: float):
+        self.labels(*label_values).observe(value)
+
+    def count(self, *label_values) -> int:
+        child = self._children.get(label_values)
+        return child.count if child else 0
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, label_values: tuple, child: _HistogramChild) -> list[str]:
+        names = self.label_names + ("le",)
+        lines = []
+        cumulative = 0
+        for upper_bound, bucket_count in zip(
+            self.buckets + (float("inf"),), child.bucket_counts
+        ):
+            cumulative += bucket_count
+            labels = _format_labels(names, label_values + (_format_value(upper_bound),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, label_values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds the metrics of the process and renders them in the Prometheus text
+    exposition format.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def counter(
+        self, name: str, documentation: str, label_names: tuple[str, ...] = ()
+    ) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(
+        self, name: str, documentation: str, label_names: tuple[str, ...] = ()
+    ) -> Gauge:
+        return self._register(Gauge(name, documentation, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for metric in self._metrics.values():
+            metric.clear()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            # registering twice returns the existing metric, as module reloads do
+            return self._metrics.setdefault(metric.name, metric)
+
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,176 @@
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator
+
+from urlshortener.repository.repository import URLMapping, current_date_in_seconds
+
+# an index file is a header, the sorted 64-bit hashes of the keys, the records
+# in the same order, then an arena holding the key (algorithm and short url)
+# and the original url of each record. Lookups bisect the hashes in place and
+# compare the key in the arena, so that hash collisions are told apart
+_MAGIC = b"USMI"
+_VERSION = 1
+_HEADER = struct.Struct("<4sB3xQq")  # magic, version, records, creation time
+_HASH_SIZE = 8
+# expiration time, creation time, arena offset, key size, original url size
+_RECORD = struct.Struct("<qqQII")
+
+
+class MmapIndexError(Exception):
+    """The file is not a valid index."""
+
+
+def _key(algorithm: str, short_url: str) -> bytes:
+    return f"{algorithm}\n{short_url}".encode()
+
+
+def _key_hash(key: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def build_index(mappings: Iterable[URLMapping], path: str) -> int:
+    """Writes an index of the mappings to `path` and returns how many it holds.
+
+    The index is written aside and renamed over `path`, so readers of the
+    previous one never see a partial file.
+    """
+    entries = []
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))) as arena:
+        offset = 0
+        for mapping in mappings:
+            key = _key(mapping.algorithm, mapping.short_url)
+            original_url = mapping.original_url.encode()
+            arena.write(key)
+            arena.write(original_url)
+            entries.append(
+                (
+                    _key_hash(key),
+                    mapping.expiration_time,
+                    mapping.creation_time,
+                    offset,
+                    len(key),
+                    len(original_url),
+                )
+            )
+            offset += len(key) + len(original_url)
+        entries.sort()
+
+        with open(f"{path}.tmp", "wb") as stream:
+            stream.write(
+                _HEADER.pack(_MAGIC, _VERSION, len(entries), current_date_in_seconds())
+            )
+            hashes = array("Q", (entry[0] for entry in entries))
+            if sys.byteorder != "little":
+                hashes.byteswap()
+            stream.write(hashes.tobytes())
+            del hashes
+            stream.writelines(_RECORD.pack(*entry[1:]) for entry in entries)
+            arena.seek(0)
+            shutil.copyfileobj(arena, stream)
+            stream.flush()
+            os.fsync(stream.fileno())
+    os.replace(f"{path}.tmp", path)
+    return len(entries)
+
+
+class MmapIndex:
+    """A read-only index of url mappings by short url, memory-mapped from a file
+    written by `build_index`.
+
+    The file is mapped, not read: every process opening the same file shares one
+    copy of it in the page cache, and lookups do not copy it.
+    """
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise MmapIndexError("Indexes are only read on little-endian machines")
+        with open(path, "rb") as stream:
+            self._mmap = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self.count, self.creation_time = _HEADER.unpack_from(
+                self._mmap
+            )
+        except struct.error:
+            self._mmap.close()
+            raise MmapIndexError(f"{path} is not an index")
+        if magic != _MAGIC or version != _VERSION:
+            self._mmap.close()
+            raise MmapIndexError(f"{path} is not an index of version {_VERSION}")
+        self._records_offset = _HEADER.size + self.count * _HASH_SIZE
+        self._arena_offset = self._records_offset + self.count * _RECORD.size
+        if self._arena_offset > len(self._mmap):
+            self._mmap.close()
+            raise MmapIndexError(f"{path} is truncated")
+        self._view = memoryview(self._mmap)
+        self._hashes = self._view[_HEADER.size : self._records_offset].cast("Q")
+
+    def close(self):
+        self._hashes.release()
+        self._view.release()
+        self._mmap.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _find(self, algorithm: str, short_url: str) -> tuple | None:
+        key = _key(algorithm, short_url)
+        key_hash = _key_hash(key)
+        hashes = self._hashes
+        position = bisect_left(hashes, key_hash)
+        while position < self.count and hashes[position] == key_hash:
+            record = self._record(position)
+            _, _, offset, key_size, _ = record
+            start = self._arena_offset + offset
+            # compared in place, without copying the key out of the file
+            if (
+                key_size == len(key)
+                and self._mmap.find(key, start, start + key_size) == start
+            ):
+                return record
+            position += 1
+        return None
+
+    def _record(self, position: int) -> tuple[int, int, int, int, int]:
+        return _RECORD.unpack_from(
+            self._mmap, self._records_offset + position * _RECORD.size
+        )
+
+    def get_original_url(self, short_url: str, algorithm: str, now: int) -> str | None:
+        record = self._find(algorithm, short_url)
+        if record is None:
+            return None
+        expiration_time, _, offset, key_size, original_size = record
+        if expiration_time <= now:
+            return None
+        start = self._arena_offset + offset + key_size
+        return str(self._view[start : start + original_size], "utf-8")
+
+    def get_mapping(self, short_url: str, algorithm: str) -> URLMapping | None:
+        record = self._find(algorithm, short_url)
+        return None if record is None else self._mapping(record)
+
+    def __iter__(self) -> Iterator[URLMapping]:
+        for position in range(self.count):
+            yield self._mapping(self._record(position))
+
+    def _mapping(self, record: tuple[int, int, int, int, int]) -> URLMapping:
+        expiration_time, creation_time, offset, key_size, original_size = record
+        start = self._arena_offset + offset
+        algorithm, _, short_url = str(
+            self._view[start : start + key_size], "utf-8"
+        ).partition("\n")
+        start += key_size
+        return URLMapping(
+            original_url=str(self._view[start : start + original_size], "utf-8"),
+            short_url=short_url,
+            algorithm=algorithm,
+            expiration_time=expiration_time,
+            creation_time=creation_time,
+        )
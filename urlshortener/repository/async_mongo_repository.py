@@ -0,0 +1,204 @@
+import logging
+
+import pymongo
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from urlshortener.repository.async_repository import AsyncURLRepository
+from urlshortener.repository.mongo_repository import (
+    URL_COLLECTION_INDEXES,
+    IndexMigrationError,
+    UninitializedCollection,
+    client_options,
+    get_or_create_request,
+    get_or_create_result,
+    is_short_url_collision,
+    live_filter,
+    to_bson_date,
+    to_url_mapping,
+)
+from urlshortener.repository.repository import (
+    ShortURLCollisionError,
+    URLMapping,
+    current_date_in_seconds,
+)
+from urlshortener.settings import ShortenerSettings
+
+
+class AsyncMongoURLRepository(AsyncURLRepository):
+    """The asyncio counterpart of MongoURLRepository.
+
+    All the coroutines share the connection pool of a single motor client, so one
+    event loop can serve many concurrent lookups.
+    """
+
+    def __init__(self, settings: ShortenerSettings):
+        self._settings = settings
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._initialized = False
+        self._expiration_offset = self._settings.expiration_offset
+        self._url_collection = UninitializedCollection(self.__class__.__name__)
+
+    async def _init_collection(self, client: AsyncIOMotorClient):
+        self._log.debug("initializing url mongo collection")
+        db = client[self._settings.database_name]
+        if self._settings.mongo_url_collection not in await db.list_collection_names():
+            self._log.debug(
+                "creating collection '%s'", self._settings.mongo_url_collection
+            )
+            self._url_collection = await db.create_collection(
+                self._settings.mongo_url_collection
+            )
+        else:
+            self._log.debug(
+                "collection '%s' already exists", self._settings.mongo_url_collection
+            )
+            self._url_collection = db[self._settings.mongo_url_collection]
+        await self._ensure_indexes()
+
+    async def _ensure_indexes(self):
+        # see MongoURLRepository._ensure_indexes
+        for keys, options in URL_COLLECTION_INDEXES:
+            try:
+                await self._url_collection.create_index(keys, **options)
+            except OperationFailure as e:
+                raise IndexMigrationError(
+                    f"could not create index {keys} on {self._url_collection.name} "
+                    f"({e}), run 'urlshortener migrate' first"
+                ) from e
+
+    async def initialize(self):
+        self._log.debug("initializing AsyncMongoURLRepository")
+        if self._initialized:
+            self._log.debug("AsyncMongoURLRepository is already initialized")
+            return self
+        self._log.debug("opening mongo connection")
+        self._client = AsyncIOMotorClient(
+            self._settings.mongo_instance_url, **client_options(self._settings)
+        )
+        await self._init_collection(self._client)
+        self._initialized = True
+        return self
+
+    async def finalize(self):
+        self._log.debug("closing mongo client")
+        self._client.close()
+        self._url_collection = UninitializedCollection(self.__class__.__name__)
+        self._initialized = False
+
+    async def __aenter__(self):
+        return await self.initialize()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.finalize()
+
+    def _live_filter(self) -> dict:
+        return live_filter(
+            current_date_in_seconds(), self._settings.mongo_legacy_expiration
+        )
+
+    async def save_url_mapping(self, original_url: str, short_url: str, algorithm: str):
+        current_time = current_date_in_seconds()
+        expiration_time = current_time + self._expiration_offset
+        doc = {
+            "algorithm": algorithm,
+            "original_url": original_url,
+            "short_url": short_url,
+            "expiration_time": to_bson_date(expiration_time),
+            "creation_time": to_bson_date(current_time),
+        }
+        self._log.debug("Storing %s", doc)
+        try:
+            await self._url_collection.update_one(
+                filter={"algorithm": algorithm, "original_url": original_url},
+                update={"$set": doc},
+                upsert=True,
+            )
+        except DuplicateKeyError as e:
+            if is_short_url_collision(e):
+                raise ShortURLCollisionError(
+                    f"{short_url} is already taken", original_urls=[original_url]
+                ) from e
+            raise
+
+    async def get_or_create_short_url(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> tuple[str, bool]:
+        current_time = current_date_in_seconds()
+        request = get_or_create_request(
+            original_url, short_url, algorithm, current_time, self._expiration_offset
+        )
+        for _ in range(2):
+            try:
+                previous = await self._url_collection.find_one_and_update(**request)
+                return get_or_create_result(previous, short_url, current_time)
+            except DuplicateKeyError as e:
+                if is_short_url_collision(e):
+                    raise ShortURLCollisionError(
+                        f"{short_url} is already taken", original_urls=[original_url]
+                    )
+                # a concurrent upsert of the same url won the race: the retry
+                # returns its mapping
+                self._log.debug("concurrent minify of %s, retrying", original_url)
+        raise ShortURLCollisionError(
+            f"could not store {original_url}", original_urls=[original_url]
+        )
+
+    async def get_short_url(self, original_url: str, algorithm: str) -> str | None:
+        self._log.debug("retrieving original url %s (%s)", original_url, algorithm)
+        existing_url = await self._url_collection.find_one(
+            {
+                "original_url": original_url,
+                **self._live_filter(),
+                "algorithm": algorithm,
+            },
+            projection={"_id": False, "short_url": True},
+        )
+        if existing_url:
+            return existing_url["short_url"]
+
+        self._log.debug("url %s (%s) not found or expired", original_url, algorithm)
+        return None
+
+    async def get_original_url(self, short_url: str, algorithm: str) -> str | None:
+        self._log.debug("retrieving short url %s (%s)", short_url, algorithm)
+        existing_url = await self._url_collection.find_one(
+            {
+                "short_url": short_url,
+                **self._live_filter(),
+                "algorithm": algorithm,
+            },
+            projection={"_id": False, "original_url": True},
+        )
+        if existing_url:
+            return existing_url["original_url"]
+
+        self._log.debug("url %s (%s) not found or expired", short_url, algorithm)
+        return None
+
+    async def get_mapping_by_short_url(
+        self, short_url: str, algorithm: str
+    ) -> URLMapping | None:
+        self._log.debug("retrieving mapping of short url %s (%s)", short_url, algorithm)
+        doc = await self._url_collection.find_one(
+            {"short_url": short_url, "algorithm": algorithm},
+            projection={"_id": False},
+            sort=[("expiration_time", pymongo.DESCENDING)],
+        )
+        return to_url_mapping(doc) if doc else None
+
+    async def get_mapping_by_original_url(
+        self, original_url: str, algorithm: str
+    ) -> URLMapping | None:
+        self._log.debug(
+            "retrieving mapping of original url %s (%s)", original_url, algorithm
+        )
+        doc = await self._url_collection.find_one(
+            {"original_url": original_url, "algorithm": algorithm},
+            projection={"_id": False},
+        )
+        return to_url_mapping(doc) if doc else None
+
+    async def reset(self):
+        self._log.debug("resetting repository")
+        await self._url_collection.delete_many({})
@@ -0,0 +1,52 @@
+from abc import ABCMeta, abstractmethod
+
+from urlshortener.repository.repository import ShortURLCollisionError, URLMapping
+
+
+class AsyncURLRepository(metaclass=ABCMeta):
+
+    @abstractmethod
+    async def save_url_mapping(self, original_url: str, short_url: str, algorithm: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_short_url(self, original_url: str, algorithm: str) -> str | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_original_url(self, short_url: str, algorithm: str) -> str | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_mapping_by_short_url(
+        self, short_url: str, algorithm: str
+    ) -> URLMapping | None:
+        # unlike get_original_url, expired mappings are returned as well
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_mapping_by_original_url(
+        self, original_url: str, algorithm: str
+    ) -> URLMapping | None:
+        # unlike get_short_url, expired mappings are returned as well
+        raise NotImplementedError
+
+    @abstractmethod
+    async def reset(self):
+        raise NotImplementedError
+
+    async def get_or_create_short_url(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> tuple[str, bool]:
+        # see URLRepository.get_or_create_short_url: backends should override
+        # this default, subject to races between concurrent minifies
+        existing_url = await self.get_short_url(original_url, algorithm)
+        if existing_url:
+            return existing_url, False
+        mapping = await self.get_mapping_by_short_url(short_url, algorithm)
+        if mapping and mapping.original_url != original_url:
+            raise ShortURLCollisionError(
+                f"{short_url} is already taken", original_urls=[original_url]
+            )
+        await self.save_url_mapping(original_url, short_url, algorithm)
+        return short_url, True
@@ -0,0 +1,242 @@
+import logging
+import os
+import struct
+import threading
+import time
+from typing import Iterator
+
+from urlshortener.bloom import ScalableBloomFilter
+from urlshortener.metrics import REGISTRY
+from urlshortener.repository.repository import (
+    URLMapping,
+    URLRepository,
+    current_date_in_seconds,
+)
+from urlshortener.settings import ShortenerSettings
+
+BLOOM_LOOKUPS_TOTAL = REGISTRY.counter(
+    "urlshortener_bloom_filter_lookups_total",
+    "Short url lookups, by whether the bloom filter let them through",
+    ("outcome",),
+)
+
+# the persisted file is the scan watermark followed by the filter itself
+_WATERMARK = struct.Struct("<q")
+# creation times come from the clocks of every writer: catching up rescans
+# a margin before the watermark so that slightly late mappings are not missed
+_CLOCK_SKEW_MARGIN = 60
+
+
+class BloomFilteredURLRepository(URLRepository):
+    """Keeps a Bloom filter of the issued short urls in front of any URLRepository,
+    so that lookups of codes that were never issued (scanners, typos) are answered
+    without a round trip.
+
+    The filter is loaded from `bloom_path` when it exists, and caught up with the
+    mappings created since it was saved; otherwise it is built from a full scan.
+    Mappings stored by other processes are picked up by a rescan of the recent
+    ones, at most every `bloom_refresh_interval` seconds, so such a mapping may be
+    reported missing for that long.
+    """
+
+    def __init__(self, repository: URLRepository, settings: ShortenerSettings):
+        self._repository = repository
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._capacity = settings.bloom_capacity
+        self._error_rate = settings.bloom_error_rate
+        self._path = settings.bloom_path
+        self._refresh_interval = settings.bloom_refresh_interval
+        self._batch_size = settings.batch_size
+        # adds are serialized, bits only ever go from 0 to 1 so lookups are not
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._filter = ScalableBloomFilter(self._capacity, self._error_rate)
+        # creation time up to which the backend has been scanned
+        self._watermark = None
+        self._refreshed_at = 0.0
+
+    def initialize(self):
+        self._repository.initialize()
+        self._load()
+        self._refresh()
+        return self
+
+    def finalize(self):
+        try:
+            self.save()
+        finally:
+            self._repository.finalize()
+
+    def __enter__(self):
+        return self.initialize()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def save(self):
+        if not self._path:
+            return
+        with self._lock:
+            data = _WATERMARK.pack(self._watermark or 0) + self._filter.to_bytes()
+        # written aside then renamed, a reader never sees a partial file
+        temporary_path = f"{self._path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as stream:
+            stream.write(data)
+        os.replace(temporary_path, self._path)
+        self._log.debug("saved bloom filter of %s keys", len(self._filter))
+
+    def save_url_mapping(self, original_url: str, short_url: str, algorithm: str):
+        # added before the write: a failed write only costs a false positive,
+        # while adding after it would let a concurrent lookup miss the mapping
+        self._add(short_url, algorithm)
+        self._repository.save_url_mapping(original_url, short_url, algorithm)
+
+    def save_url_mappings(self, url_mappings: dict[str, str], algorithm: str):
+        for short_url in url_mappings.values():
+            self._add(short_url, algorithm)
+        self._repository.save_url_mappings(url_mappings, algorithm)
+
+    def get_or_create_short_url(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> tuple[str, bool]:
+        self._add(short_url, algorithm)
+        stored_url, created = self._repository.get_or_create_short_url(
+            original_url, short_url, algorithm
+        )
+        if stored_url != short_url:
+            self._add(stored_url, algorithm)
+        return stored_url, created
+
+    def get_short_url(self, original_url: str, algorithm: str) -> str | None:
+        return self._repository.get_short_url(original_url, algorithm)
+
+    def get_original_url(self, short_url: str, algorithm: str) -> str | None:
+        if not self._may_exist(short_url, algorithm):
+            return None
+        return self._repository.get_original_url(short_url, algorithm)
+
+    def get_short_urls(
+        self, original_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        return self._repository.get_short_urls(original_urls, algorithm)
+
+    def get_original_urls(
+        self, short_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        short_urls = [url for url in short_urls if self._may_exist(url, algorithm)]
+        if not short_urls:
+            return {}
+        return self._repository.get_original_urls(short_urls, algorithm)
+
+    def get_mapping_by_short_url(
+        self, short_url: str, algorithm: str
+    ) -> URLMapping | None:
+        if not self._may_exist(short_url, algorithm):
+            return None
+        return self._repository.get_mapping_by_short_url(short_url, algorithm)
+
+    def get_mapping_by_original_url(
+        self, original_url: str, algorithm: str
+    ) -> URLMapping | None:
+        return self._repository.get_mapping_by_original_url(original_url, algorithm)
+
+    def iter_url_mappings(
+        self, batch_size: int, created_after: int = None
+    ) -> Iterator[URLMapping]:
+        return self._repository.iter_url_mappings(batch_size, created_after)
+
+    def restore_url_mappings(self, url_mappings: list[URLMapping]):
+        for mapping in url_mappings:
+            self._add(mapping.short_url, mapping.algorithm)
+        self._repository.restore_url_mappings(url_mappings)
+
+    def create_url_mappings(self, url_mappings: list[URLMapping]) -> set[str]:
+        for mapping in url_mappings:
+            self._add(mapping.short_url, mapping.algorithm)
+        return self._repository.create_url_mappings(url_mappings)
+
+    def delete_url_mappings(self, url_mappings: list[URLMapping]) -> int:
+        # the codes stay in the filter, which only costs false positives
+        return self._repository.delete_url_mappings(url_mappings)
+
+    def extend_expirations(
+        self, url_mappings: list[URLMapping], expiration_time: int, max_lifetime: int
+    ) -> int:
+        return self._repository.extend_expirations(
+            url_mappings, expiration_time, max_lifetime
+        )
+
+    def reserve_id_block(self, size: int) -> int:
+        return self._repository.reserve_id_block(size)
+
+    def reset(self):
+        self._repository.reset()
+        with self._lock:
+            self._filter = ScalableBloomFilter(self._capacity, self._error_rate)
+            self._watermark = None
+
+    def _add(self, short_url: str, algorithm: str):
+        with self._lock:
+            self._filter.add(f"{algorithm} {short_url}")
+
+    def _may_exist(self, short_url: str, algorithm: str) -> bool:
+        key = f"{algorithm} {short_url}"
+        if key in self._filter:
+            BLOOM_LOOKUPS_TOTAL.inc("passed")
+            return True
+        # the code may have been issued by another process since the last scan
+        if time.monotonic() - self._refreshed_at >= self._refresh_interval:
+            self._refresh()
+            if key in self._filter:
+                BLOOM_LOOKUPS_TOTAL.inc("passed")
+                return True
+        BLOOM_LOOKUPS_TOTAL.inc("rejected")
+        return False
+
+    def _refresh(self):
+        # a single thread scans, the others keep answering from the current filter
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            scan_started = current_date_in_seconds()
+            # mappings restored since, e.g. by import-snapshot or rebalance, are
+            # returned by their restore time whatever their creation time
+            created_after = (
+                None
+                if self._watermark is None
+                else self._watermark - _CLOCK_SKEW_MARGIN
+            )
+            added = 0
+            for mapping in self._repository.iter_url_mappings(
+                self._batch_size, created_after
+            ):
+                with self._lock:
+                    added += self._filter.add(
+                        f"{mapping.algorithm} {mapping.short_url}"
+                    )
+            self._watermark = scan_started
+            self._refreshed_at = time.monotonic()
+            self._log.debug("bloom filter refreshed, %s short urls added", added)
+        finally:
+            self._refresh_lock.release()
+
+    def _load(self):
+        if not self._path or not os.path.exists(self._path):
+            return
+        with open(self._path, "rb") as stream:
+            data = stream.read()
+        try:
+            (watermark,) = _WATERMARK.unpack_from(data)
+            bloom_filter = ScalableBloomFilter.from_bytes(data[_WATERMARK.size :])
+        except (ValueError, struct.error) as e:
+            self._log.warning("ignoring unreadable bloom filter %s: %s", self._path, e)
+            return
+        if (bloom_filter.capacity, bloom_filter.error_rate) != (
+            self._capacity,
+            self._error_rate,
+        ):
+            self._log.info("bloom filter settings changed, rebuilding it")
+            return
+        self._filter = bloom_filter
+        self._watermark = watermark
+        self._log.debug("loaded bloom filter of %s keys", len(bloom_filter))
@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from urlshortener.batch import chunked
+from urlshortener.metrics import REGISTRY
+from urlshortener.repository.repository import (
+    MAPPINGS_RESET,
+    URLMapping,
+    URLRepository,
+    current_date_in_seconds,
+)
+from urlshortener.settings import ShortenerSettings
+
+if TYPE_CHECKING:
+    from urlshortener.repository.caching_repository import CachingURLRepository
+
+CACHE_INVALIDATIONS_TOTAL = REGISTRY.counter(
+    "urlshortener_cache_invalidations_total",
+    "Mappings evicted from the cache after a write seen on the backend, by how",
+    ("source",),
+)
+
+# creation times come from the clocks of every writer: each poll rescans a
+# margin before the previous one, and skips the mappings it has already seen
+_CLOCK_SKEW_MARGIN = 5
+
+
+class CacheInvalidator:
+    """Evicts from a cache the mappings written to its backend by any process, so
+    that the caches of several nodes converge after a write on one of them.
+
+    Writes are followed on the change stream of the backend when it has one. When
+    the stream breaks, it is resumed after the last change applied; when it cannot
+    be, the whole cache is cleared. Without a change stream, the mappings created
+    since the previous poll are scanned every `poll_interval` seconds: polls do
+    not see resets or restored mappings, which only leave the cache with
+    `cache_max_staleness`.
+
+    Evictions are applied in batches of up to `batch_size` mappings, at most
+    `batch_interval` seconds after the first one was seen.
+    """
+
+    def __init__(
+        self,
+        source: URLRepository,
+        cache: "CachingURLRepository",
+        settings: ShortenerSettings,
+    ):
+        self._source = source
+        self._cache = cache
+        self._poll_interval = settings.cache_invalidation_poll_interval
+        self._batch_interval = settings.cache_invalidation_batch_interval
+        self._batch_size = settings.cache_invalidation_batch_size
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._closed = threading.Event()
+        self._watcher = None
+        self._stream = None
+        self._high_water = None
+        self.resume_token = None
+
+    def start(self):
+        self._closed.clear()
+        # opened before returning: the writes made once the cache is in use are
+        # all seen
+        try:
+            self._stream = self._open_stream()
+            target = self._watch
+        except NotImplementedError as e:
+            self._log.info("polling for new mappings: %s", e)
+            self._high_water = current_date_in_seconds()
+            target = self._poll
+        self._watcher = threading.Thread(
+            target=target, name="cache-invalidator", daemon=True
+        )
+        self._watcher.start()
+
+    def stop(self):
+        self._closed.set()
+        if self._watcher:
+            self._watcher.join()
+            self._watcher = None
+
+    def _open_stream(self):
+        max_await_ms = max(1, int(self._batch_interval * 1000))
+        if self.resume_token is None:
+            return self._source.watch_url_mappings(max_await_ms=max_await_ms)
+        try:
+            return self._source.watch_url_mappings(self.resume_token, max_await_ms)
+        except Exception as e:
+            # e.g. the changes since the token are no longer kept: any of them
+            # may be cached
+            self._log.warning("could not resume watching, clearing the cache: %s", e)
+            self.resume_token = None
+            self._cache.clear()
+            return self._source.watch_url_mappings(max_await_ms=max_await_ms)
+
+    def _watch(self):
+        while not self._closed.is_set():
+            try:
+                if self._stream is None:
+                    self._stream = self._open_stream()
+                with self._stream:
+                    self._follow(self._stream)
+            except Exception as e:
+                self._log.warning("change stream interrupted: %s", e)
+                self._closed.wait(self._poll_interval)
+            finally:
+                self._stream = None
+
+    def _follow(self, stream):
+        # the point the stream was opened at, not to lose the changes read but
+        # not yet applied if it breaks
+        self.resume_token = stream.resume_token
+        pending: list[URLMapping | str] = []
+        first_seen = 0.0
+        while not self._closed.is_set():
+            change = stream.try_next()
+            if change is not None:
+                if not pending:
+                    first_seen = time.monotonic()
+                pending.append(change)
+            # flushed as soon as the stream is idle
+            if pending and (
+                change is None
+                or len(pending) >= self._batch_size
+                or time.monotonic() - first_seen >= self._batch_interval
+            ):
+                self._apply(pending, "stream")
+                pending = []
+            if not pending:
+                self.resume_token = stream.resume_token
+
+    def _poll(self):
+        seen: set[URLMapping] = set()
+        while not self._closed.wait(self._poll_interval):
+            scan_started = current_date_in_seconds()
+            try:
+                mappings = list(
+                    self._source.iter_url_mappings(
+                        self._batch_size, self._high_water - _CLOCK_SKEW_MARGIN
+                    )
+                )
+            except Exception as e:
+                self._log.warning("could not poll for new mappings: %s", e)
+                continue
+            new_mappings = [mapping for mapping in mappings if mapping not in seen]
+            for batch in chunked(new_mappings, self._batch_size):
+                self._apply(batch, "poll")
+            # the next scan starts within this one
+            seen = set(mappings)
+            self._high_water = scan_started
+
+    def _apply(self, changes: list[URLMapping | str], source: str):
+        if MAPPINGS_RESET in changes:
+            self._log.info("mappings reset on the backend, clearing the cache")
+            self._cache.clear()
+            return
+        self._cache.invalidate_mappings(changes)
+        CACHE_INVALIDATIONS_TOTAL.inc(source, amount=len(changes))
+        self._log.debug("%d cached mappings invalidated", len(changes))
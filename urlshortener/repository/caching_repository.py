@@ -0,0 +1,276 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterator
+
+from urlshortener.repository.cache_invalidation import CacheInvalidator
+from urlshortener.repository.repository import URLMapping, URLRepository
+from urlshortener.settings import ShortenerSettings
+
+_SHORT_URL = "short_url"
+_ORIGINAL_URL = "original_url"
+
+
+class CachingURLRepository(URLRepository):
+    """A read-through cache in front of any URLRepository.
+
+    Entries are kept in a bounded LRU and expire together with the mapping they
+    hold, so an expired link is never served from the cache. Lookups of unknown
+    (or already expired) urls are cached as well, for `cache_negative_ttl` seconds.
+    No entry is kept longer than `cache_max_staleness` seconds when it is set.
+
+    Writes through the cache invalidate it; the writes of other processes do when
+    a `change_source`, the backend shared with them, is given.
+    """
+
+    def __init__(
+        self,
+        repository: URLRepository,
+        settings: ShortenerSettings,
+        change_source: URLRepository = None,
+    ):
+        self._repository = repository
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._max_entries = settings.cache_max_entries
+        self._negative_ttl = settings.cache_negative_ttl
+        self._max_staleness = settings.cache_max_staleness
+        self._invalidator = (
+            CacheInvalidator(change_source, self, settings) if change_source else None
+        )
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, tuple[URLMapping | None, float]] = (
+            OrderedDict()
+        )
+        # bumped on every invalidation, so that a lookup racing with a write
+        # does not put a stale mapping back into the cache
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def initialize(self):
+        self._repository.initialize()
+        if self._invalidator:
+            self._invalidator.start()
+        return self
+
+    def finalize(self):
+        if self._invalidator:
+            self._invalidator.stop()
+        self._repository.finalize()
+
+    def __enter__(self):
+        return self.initialize()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+        }
+
+    def save_url_mapping(self, original_url: str, short_url: str, algorithm: str):
+        self._repository.save_url_mapping(original_url, short_url, algorithm)
+        self._invalidate(original_url, short_url, algorithm)
+
+    def save_url_mappings(self, url_mappings: dict[str, str], algorithm: str):
+        try:
+            self._repository.save_url_mappings(url_mappings, algorithm)
+        finally:
+            for original_url, short_url in url_mappings.items():
+                self._invalidate(original_url, short_url, algorithm)
+
+    def get_or_create_short_url(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> tuple[str, bool]:
+        stored_url, created = self._repository.get_or_create_short_url(
+            original_url, short_url, algorithm
+        )
+        self._invalidate(original_url, stored_url, algorithm)
+        return stored_url, created
+
+    def get_short_url(self, original_url: str, algorithm: str) -> str | None:
+        mapping = self.get_mapping_by_original_url(original_url, algorithm)
+        if mapping and not mapping.is_expired():
+            return mapping.short_url
+        return None
+
+    def get_original_url(self, short_url: str, algorithm: str) -> str | None:
+        mapping = self.get_mapping_by_short_url(short_url, algorithm)
+        if mapping and not mapping.is_expired():
+            return mapping.original_url
+        return None
+
+    def get_short_urls(
+        self, original_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        return self._batch_read_through(
+            _ORIGINAL_URL, original_urls, algorithm, self._repository.get_short_urls
+        )
+
+    def get_original_urls(
+        self, short_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        return self._batch_read_through(
+            _SHORT_URL, short_urls, algorithm, self._repository.get_original_urls
+        )
+
+    def get_mapping_by_short_url(
+        self, short_url: str, algorithm: str
+    ) -> URLMapping | None:
+        return self._read_through(
+            (_SHORT_URL, algorithm, short_url),
+            self._repository.get_mapping_by_short_url,
+            short_url,
+            algorithm,
+        )
+
+    def get_mapping_by_original_url(
+        self, original_url: str, algorithm: str
+    ) -> URLMapping | None:
+        return self._read_through(
+            (_ORIGINAL_URL, algorithm, original_url),
+            self._repository.get_mapping_by_original_url,
+            original_url,
+            algorithm,
+        )
+
+    def iter_url_mappings(
+        self, batch_size: int, created_after: int = None
+    ) -> Iterator[URLMapping]:
+        return self._repository.iter_url_mappings(batch_size, created_after)
+
+    def restore_url_mappings(self, url_mappings: list[URLMapping]):
+        try:
+            self._repository.restore_url_mappings(url_mappings)
+        finally:
+            for mapping in url_mappings:
+                self._invalidate(
+                    mapping.original_url, mapping.short_url, mapping.algorithm
+                )
+
+    def create_url_mappings(self, url_mappings: list[URLMapping]) -> set[str]:
+        try:
+            return self._repository.create_url_mappings(url_mappings)
+        finally:
+            for mapping in url_mappings:
+                self._invalidate(
+                    mapping.original_url, mapping.short_url, mapping.algorithm
+                )
+
+    def delete_url_mappings(self, url_mappings: list[URLMapping]) -> int:
+        try:
+            return self._repository.delete_url_mappings(url_mappings)
+        finally:
+            for mapping in url_mappings:
+                self._invalidate(
+                    mapping.original_url, mapping.short_url, mapping.algorithm
+                )
+
+    def extend_expirations(
+        self, url_mappings: list[URLMapping], expiration_time: int, max_lifetime: int
+    ) -> int:
+        # the cached entries are left: they expire at the previous expiration
+        # time, and are then read again with the new one
+        return self._repository.extend_expirations(
+            url_mappings, expiration_time, max_lifetime
+        )
+
+    def reserve_id_block(self, size: int) -> int:
+        return self._repository.reserve_id_block(size)
+
+    def reset(self):
+        self._repository.reset()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def _read_through(self, key: tuple, load, url: str, algorithm: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+
+        mapping = load(url, algorithm)
+        if mapping and not mapping.is_expired(int(now)):
+            valid_until = mapping.expiration_time
+        else:
+            valid_until = now + self._negative_ttl
+        if self._max_staleness is not None:
+            valid_until = min(valid_until, now + self._max_staleness)
+        self._store(key, mapping, valid_until, generation)
+        return mapping
+
+    def _batch_read_through(
+        self, kind: str, urls: list[str], algorithm: str, load_many
+    ) -> dict[str, str]:
+        # batch lookups are served from the cache when possible, the misses go to
+        # the backend in one call but are not cached: it does not return expiry
+        now = time.time()
+        found, missing = {}, []
+        with self._lock:
+            for url in urls:
+                entry = self._entries.get((kind, algorithm, url))
+                if entry and entry[1] > now:
+                    self.hits += 1
+                    mapping = entry[0]
+                    if mapping and not mapping.is_expired(int(now)):
+                        found[url] = (
+                            mapping.short_url
+                            if kind == _ORIGINAL_URL
+                            else mapping.original_url
+                        )
+                else:
+                    self.misses += 1
+                    missing.append(url)
+        if missing:
+            found.update(load_many(missing, algorithm))
+        return found
+
+    def _store(
+        self,
+        key: tuple,
+        mapping: URLMapping | None,
+        valid_until: float,
+        generation: int,
+    ):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (mapping, valid_until)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_mappings(self, url_mappings: list[URLMapping]):
+        """Evicts the entries of mappings written elsewhere, in one go."""
+        with self._lock:
+            self._generation += 1
+            for mapping in url_mappings:
+                self._evict(mapping.original_url, mapping.short_url, mapping.algorithm)
+
+    def _invalidate(self, original_url: str, short_url: str, algorithm: str):
+        with self._lock:
+            self._generation += 1
+            self._evict(original_url, short_url, algorithm)
+
+    def _evict(self, original_url: str, short_url: str, algorithm: str):
+        # the url may have been minified before under a different short url
+        entry = self._entries.pop((_ORIGINAL_URL, algorithm, original_url), None)
+        if entry and entry[0]:
+            self._entries.pop((_SHORT_URL, algorithm, entry[0].short_url), None)
+        self._entries.pop((_SHORT_URL, algorithm, short_url), None)
@@ -0,0 +1,61 @@
+import threading
+from abc import ABCMeta, abstractmethod
+
+
+class ClickStatsRepository(metaclass=ABCMeta):
+    """Stores the number of expands of each short url.
+
+    Counts only ever grow by the increments of `add_clicks`, so that several
+    processes can flush their own counts concurrently.
+    """
+
+    def initialize(self):
+        return self
+
+    def finalize(self):
+        pass
+
+    def __enter__(self):
+        return self.initialize()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    @abstractmethod
+    def add_clicks(self, clicks: dict[str, int]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_clicks(self, short_urls: list[str]) -> dict[str, int]:
+        # short urls never expanded are left out
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_top_short_urls(self, limit: int) -> list[tuple[str, int]]:
+        # the most expanded short urls first, with their counts
+        raise NotImplementedError
+
+
+class InMemoryClickStatsRepository(ClickStatsRepository):
+    """A process local stats repository, used by tests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clicks: dict[str, int] = {}
+
+    def add_clicks(self, clicks: dict[str, int]):
+        with self._lock:
+            for short_url, count in clicks.items():
+                self._clicks[short_url] = self._clicks.get(short_url, 0) + count
+
+    def get_clicks(self, short_urls: list[str]) -> dict[str, int]:
+        with self._lock:
+            return {
+                short_url: self._clicks[short_url]
+                for short_url in short_urls
+                if short_url in self._clicks
+            }
+
+    def get_top_short_urls(self, limit: int) -> list[tuple[str, int]]:
+        with self._lock:
+            return sorted(self._clicks.items(), key=lambda item: -item[1])[:limit]
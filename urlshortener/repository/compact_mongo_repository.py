@@ -0,0 +1,539 @@
+import hashlib
+import threading
+from typing import Iterator, NamedTuple
+
+import pymongo
+from pymongo import DeleteOne, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from urlshortener.repository.mongo_repository import (
+    MongoURLRepository,
+    from_bson_date,
+    recorded_urls,
+    to_bson_date,
+)
+from urlshortener.repository.repository import (
+    ShortURLCollisionError,
+    URLMapping,
+    URLRepository,
+    current_date_in_seconds,
+)
+from urlshortener.settings import ShortenerSettings
+from urlshortener.url_shortener import get_url_domain
+
+# a mapping is stored as
+#   _id: "<namespace>:<code>", the namespace standing for an algorithm and a domain
+#   h: 64-bit hash of the algorithm and original url, the original url itself is
+#      only stored, never indexed
+#   u: original url, e: expiration date, c: creation date, r: restore date of
+#      the mappings restored with their own times
+COMPACT_URL_COLLECTION_INDEXES = [
+    (["h"], {"unique": True}),
+    (["c"], {}),
+    (["r"], {"sparse": True}),
+    (["e"], {"expireAfterSeconds": 0}),
+]
+
+
+def original_url_hash(original_url: str, algorithm: str) -> int:
+    digest = hashlib.blake2b(
+        f"{algorithm}\n{original_url}".encode(), digest_size=8
+    ).digest()
+    # signed, to fit in a BSON int64
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class Namespaces(NamedTuple):
+    """The namespaces known to a repository. Never changed once published: new
+    namespaces are added to a copy, which replaces it."""
+
+    ids: dict[tuple[str, str], int]
+    by_id: dict[int, tuple[str, str]]
+    # the lengths of the known domains, the only prefixes of a short url that
+    # can be one
+    domain_lengths: tuple[int, ...]
+
+    def with_docs(self, docs: list[dict]) -> "Namespaces":
+        ids, by_id = dict(self.ids), dict(self.by_id)
+        for doc in docs:
+            ids[(doc["algorithm"], doc["domain"])] = doc["_id"]
+            by_id[doc["_id"]] = (doc["algorithm"], doc["domain"])
+        return Namespaces(ids, by_id, tuple(sorted({len(d) for _, d in ids})))
+
+
+class CompactMongoURLRepository(MongoURLRepository):
+    """Stores the mappings in a compact schema, a few times smaller than the one of
+    MongoURLRepository together with its indexes.
+
+    The domain of the short urls and their algorithm are stored once in a
+    namespace document, and short urls are reassembled from it. Original urls are
+    looked up by hash; the url stored with it is checked on every read, so that
+    the only effect of two urls with the same 64-bit hash is that the second one
+    cannot be minified.
+    """
+
+    url_collection_indexes = COMPACT_URL_COLLECTION_INDEXES
+
+    def __init__(self, settings: ShortenerSettings, create_indexes: bool = True):
+        super().__init__(settings, create_indexes)
+        # serializes the creation and publication of namespaces, reads take the
+        # published ones without it
+        self._namespace_lock = threading.RLock()
+        self._namespaces = Namespaces({}, {}, ())
+
+    def _uninitialize_collections(self):
+        super()._uninitialize_collections()
+        self._namespace_collection = self._url_collection
+
+    def _init_collection(self, client: pymongo.MongoClient):
+        self._log.debug("initializing compact url mongo collection")
+        db = self._client[self._settings.database_name]
+        self._url_collection = db[self._settings.mongo_compact_url_collection]
+        if self._create_indexes:
+            self._ensure_indexes()
+        self._namespace_collection = db[self._settings.mongo_namespace_collection]
+        self._namespace_collection.create_index(["algorithm", "domain"], unique=True)
+        self._counter_collection = db[self._settings.mongo_counter_collection]
+        self._load_namespaces()
+
+    def save_url_mapping(self, original_url: str, short_url: str, algorithm: str):
+        self._record_writes(original_url, short_url)
+        self._write_docs(
+            [self._to_doc(self._new_mapping(original_url, short_url, algorithm))]
+        )
+
+    def get_short_url(self, original_url: str, algorithm: str) -> str | None:
+        mapping = self.get_mapping_by_original_url(original_url, algorithm)
+        if mapping and not mapping.is_expired():
+            return mapping.short_url
+        return None
+
+    def get_original_url(self, short_url: str, algorithm: str) -> str | None:
+        mapping = self.get_mapping_by_short_url(short_url, algorithm)
+        if mapping and not mapping.is_expired():
+            return mapping.original_url
+        return None
+
+    def get_or_create_short_url(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> tuple[str, bool]:
+        mapping = self._new_mapping(original_url, short_url, algorithm)
+        current_time = mapping.creation_time
+        doc = self._to_doc(mapping)
+        # one round trip when the url is new, or minified again to the same code:
+        # the upsert renews an expired mapping and leaves a live one untouched.
+        # The code of a document cannot be changed, so a mapping of the url under
+        # another code fails on the unique hash, and an expired one is deleted
+        # before the retry
+        is_live = {"$gt": ["$e", to_bson_date(current_time)]}
+        for _ in range(3):
+            try:
+                previous = self._url_collection.find_one_and_update(
+                    {"_id": doc["_id"], "h": doc["h"]},
+                    [
+                        {
+                            "$set": {
+                                field: {"$cond": [is_live, f"${field}", doc[field]]}
+                                for field in ("u", "e", "c")
+                            }
+                        }
+                    ],
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE,
+                )
+            except DuplicateKeyError as e:
+                # the code or the hash is held by another document, which is
+                # only replaced once expired
+                key = "_id" if "_id" in (e.details or {}).get("keyPattern", {}) else "h"
+                previous = self._url_collection.find_one({key: doc[key]})
+                if previous is None or self._is_expired(previous, current_time):
+                    if previous:
+                        self._delete_if_unchanged(previous)
+                    continue
+            else:
+                if previous is None or self._is_expired(previous, current_time):
+                    self._record_writes(original_url, short_url)
+                    return short_url, True
+            if previous["u"] != original_url:
+                if previous["h"] == doc["h"]:
+                    message = f"{original_url} has the hash of {previous['u']}"
+                else:
+                    message = f"{short_url} is already taken"
+                raise ShortURLCollisionError(message, original_urls=[original_url])
+            return self._to_mapping(previous).short_url, False
+        raise ShortURLCollisionError(
+            f"could not store {original_url}", original_urls=[original_url]
+        )
+
+    def get_mapping_by_short_url(
+        self, short_url: str, algorithm: str
+    ) -> URLMapping | None:
+        ids = self._candidate_ids(short_url, algorithm)
+        if not ids:
+            return None
+        doc = self._read(
+            lambda collection: collection.find_one({"_id": {"$in": ids}}), short_url
+        )
+        return self._to_mapping(doc) if doc else None
+
+    def get_mapping_by_original_url(
+        self, original_url: str, algorithm: str
+    ) -> URLMapping | None:
+        url_hash = original_url_hash(original_url, algorithm)
+        doc = self._read(
+            lambda collection: collection.find_one({"h": url_hash}), original_url
+        )
+        # another url with the same hash is not a match
+        if doc and doc["u"] == original_url:
+            return self._to_mapping(doc)
+        return None
+
+    def save_url_mappings(self, url_mappings: dict[str, str], algorithm: str):
+        self._record_writes(*url_mappings, *url_mappings.values())
+        self._write_docs(
+            [
+                self._to_doc(self._new_mapping(original_url, short_url, algorithm))
+                for original_url, short_url in url_mappings.items()
+            ]
+        )
+
+    def restore_url_mappings(self, url_mappings: list[URLMapping]):
+        self._record_writes(*recorded_urls(url_mappings))
+        restored_time = to_bson_date(current_date_in_seconds())
+        self._write_docs(
+            [{**self._to_doc(mapping), "r": restored_time} for mapping in url_mappings]
+        )
+
+    def create_url_mappings(self, url_mappings: list[URLMapping]) -> set[str]:
+        if not url_mappings:
+            return set()
+        self._record_writes(*recorded_urls(url_mappings))
+        # one upsert each: only an expired document of the code, or the same
+        # mapping stored by a previous attempt, matches. When the code or the
+        # hash is held by another live document the upsert fails on the unique
+        # indexes, and an expired one in the way is only deleted by
+        # get_or_create_short_url, which these urls go through one by one
+        expired_filter = {"$nor": [self._compact_live_filter()]}
+        requests = []
+        for mapping in url_mappings:
+            doc = self._to_doc(mapping)
+            requests.append(
+                UpdateOne(
+                    {
+                        "_id": doc["_id"],
+                        "h": doc["h"],
+                        "$or": [expired_filter, {"u": doc["u"]}],
+                    },
+                    {"$set": {field: doc[field] for field in ("u", "e", "c")}},
+                    upsert=True,
+                )
+            )
+        try:
+            self._url_collection.bulk_write(requests, ordered=False)
+            return set()
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if any(error["code"] != 11000 for error in errors):
+                raise
+        # stored with the current times by the default, which goes through
+        # get_or_create_short_url
+        return URLRepository.create_url_mappings(
+            self, [url_mappings[error["index"]] for error in errors]
+        )
+
+    def delete_url_mappings(self, url_mappings: list[URLMapping]) -> int:
+        requests = []
+        for mapping in url_mappings:
+            ids = self._candidate_ids(mapping.short_url, mapping.algorithm)
+            if ids:
+                requests.append(
+                    DeleteOne(
+                        {
+                            "_id": {"$in": ids},
+                            "h": original_url_hash(
+                                mapping.original_url, mapping.algorithm
+                            ),
+                            "u": mapping.original_url,
+                        }
+                    )
+                )
+        if not requests:
+            return 0
+        self._record_writes(*recorded_urls(url_mappings))
+        return self._url_collection.bulk_write(requests, ordered=False).deleted_count
+
+    def extend_expirations(
+        self, url_mappings: list[URLMapping], expiration_time: int, max_lifetime: int
+    ) -> int:
+        requests = []
+        for mapping in url_mappings:
+            ids = self._candidate_ids(mapping.short_url, mapping.algorithm)
+            if ids:
+                requests.append(
+                    UpdateOne(
+                        {
+                            "_id": {"$in": ids},
+                            "h": original_url_hash(
+                                mapping.original_url, mapping.algorithm
+                            ),
+                            "u": mapping.original_url,
+                            **self._compact_live_filter(),
+                            "c": {"$gte": to_bson_date(expiration_time - max_lifetime)},
+                        },
+                        {"$max": {"e": to_bson_date(expiration_time)}},
+                    )
+                )
+        if not requests:
+            return 0
+        return self._url_collection.bulk_write(requests, ordered=False).modified_count
+
+    def get_short_urls(
+        self, original_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        hashes = {original_url_hash(url, algorithm): url for url in original_urls}
+        query = {"h": {"$in": list(hashes)}, **self._compact_live_filter()}
+        docs = self._read(
+            lambda collection: list(collection.find(query)), *original_urls
+        )
+        return {
+            doc["u"]: self._to_mapping(doc).short_url
+            for doc in docs
+            if hashes.get(doc["h"]) == doc["u"]
+        }
+
+    def get_original_urls(
+        self, short_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        short_urls_by_id = {
+            doc_id: short_url
+            for short_url in short_urls
+            for doc_id in self._candidate_ids(short_url, algorithm)
+        }
+        if not short_urls_by_id:
+            return {}
+        query = {"_id": {"$in": list(short_urls_by_id)}, **self._compact_live_filter()}
+        docs = self._read(
+            lambda collection: list(collection.find(query, projection={"u": True})),
+            *short_urls,
+        )
+        return {short_urls_by_id[doc["_id"]]: doc["u"] for doc in docs}
+
+    def iter_url_mappings(
+        self, batch_size: int, created_after: int = None
+    ) -> Iterator[URLMapping]:
+        query = {}
+        if created_after is not None:
+            since = {"$gte": to_bson_date(created_after)}
+            query = {"$or": [{"c": since}, {"r": since}]}
+        for doc in self._url_collection.find(query, batch_size=batch_size):
+            yield self._to_mapping(doc)
+
+    def migrate_expiration_dates(self, batch_size: int) -> int:
+        # the compact schema never stored integer timestamps
+        return 0
+
+    def reset(self):
+        self._url_collection.delete_many({})
+        self._record_reset()
+
+    def _write_docs(self, docs: list[dict]):
+        if not docs:
+            return
+        # new urls and the ones keeping their code take one upsert each, the
+        # upserts of the urls stored under another code fail on the unique hash
+        # and are moved one by one
+        try:
+            self._url_collection.bulk_write(
+                [
+                    ReplaceOne({"_id": doc["_id"], "h": doc["h"]}, doc, upsert=True)
+                    for doc in docs
+                ],
+                ordered=False,
+            )
+            return
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if any(error["code"] != 11000 for error in errors):
+                raise
+        # a code held by another url makes the upsert insert a duplicate _id
+        colliding_urls = [
+            docs[error["index"]]["u"]
+            for error in errors
+            if "h" not in error.get("keyPattern", {})
+            or not self._move_doc(docs[error["index"]])
+        ]
+        if colliding_urls:
+            raise ShortURLCollisionError(
+                f"{len(colliding_urls)} short urls already taken",
+                original_urls=colliding_urls,
+            )
+
+    def _move_doc(self, doc: dict) -> bool:
+        # the code of a document cannot be changed: the document of the url is
+        # deleted, unless it changed meanwhile, and put back if the new code
+        # turns out to be taken
+        previous = self._url_collection.find_one({"h": doc["h"]})
+        if previous and previous["u"] != doc["u"]:
+            # another url with the same hash
+            return False
+        if previous:
+            deleted = self._url_collection.delete_one(
+                {"_id": previous["_id"], "u": doc["u"], "e": previous["e"]}
+            )
+            if not deleted.deleted_count:
+                return False
+        try:
+            self._url_collection.insert_one(doc)
+            return True
+        except DuplicateKeyError:
+            if previous:
+                try:
+                    self._url_collection.insert_one(previous)
+                except DuplicateKeyError:
+                    # the url was minified again in the meantime
+                    pass
+            return False
+
+    def _new_mapping(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> URLMapping:
+        current_time = current_date_in_seconds()
+        return URLMapping(
+            original_url=original_url,
+            short_url=short_url,
+            algorithm=algorithm,
+            expiration_time=current_time + self._expiration_offset,
+            creation_time=current_time,
+        )
+
+    def _to_doc(self, mapping: URLMapping) -> dict:
+        domain = self._short_url_domain(mapping.original_url, mapping.short_url)
+        namespace = self._namespace_id(mapping.algorithm, domain)
+        return {
+            "_id": f"{namespace}:{mapping.short_url[len(domain):]}",
+            "h": original_url_hash(mapping.original_url, mapping.algorithm),
+            "u": mapping.original_url,
+            "e": to_bson_date(mapping.expiration_time),
+            "c": to_bson_date(mapping.creation_time),
+        }
+
+    def _to_mapping(self, doc: dict) -> URLMapping:
+        namespace, _, code = doc["_id"].partition(":")
+        algorithm, domain = self._namespace(int(namespace))
+        return URLMapping(
+            original_url=doc["u"],
+            short_url=f"{domain}{code}",
+            algorithm=algorithm,
+            expiration_time=from_bson_date(doc["e"]),
+            creation_time=from_bson_date(doc["c"]),
+        )
+
+    def _short_url_domain(self, original_url: str, short_url: str) -> str:
+        # the domain URLShortener gives to the short urls of this url, or for
+        # short urls built otherwise, everything up to their last slash
+        try:
+            domain = get_url_domain(original_url, self._settings.fixed_domain)
+        except ValueError:
+            domain = None
+        if domain and short_url.startswith(domain):
+            return domain
+        return short_url[: short_url.rfind("/") + 1]
+
+    def _candidate_ids(self, short_url: str, algorithm: str) -> list[str]:
+        # the namespaces whose domain prefixes the short url, e.g. both
+        # "https://s.io/" and "https://s.io/x/" for "https://s.io/x/abc"
+        ids = self._ids_in_namespaces(short_url, algorithm)
+        if not ids:
+            # a namespace created by another process since the last load, only
+            # the ones of the domains that can prefix the short url are loaded
+            host_start = short_url.find("://") + 3
+            domains = [
+                short_url[: i + 1]
+                for i, char in enumerate(short_url)
+                if char == "/" and i >= host_start
+            ]
+            fixed_domain = self._settings.fixed_domain
+            if fixed_domain and short_url.startswith(fixed_domain):
+                domains.append(fixed_domain)
+            self._load_namespaces({"algorithm": algorithm, "domain": {"$in": domains}})
+            ids = self._ids_in_namespaces(short_url, algorithm)
+        return ids
+
+    def _ids_in_namespaces(self, short_url: str, algorithm: str) -> list[str]:
+        namespaces = self._namespaces
+        ids = []
+        for length in namespaces.domain_lengths:
+            namespace = namespaces.ids.get((algorithm, short_url[:length]))
+            if namespace is not None:
+                ids.append(f"{namespace}:{short_url[length:]}")
+        return ids
+
+    def _namespace(self, namespace: int) -> tuple[str, str]:
+        if namespace not in self._namespaces.by_id:
+            self._load_namespaces({"_id": namespace})
+        return self._namespaces.by_id[namespace]
+
+    def _namespace_id(self, algorithm: str, domain: str) -> int:
+        key = (algorithm, domain)
+        if key in self._namespaces.ids:
+            return self._namespaces.ids[key]
+        query = {"algorithm": algorithm, "domain": domain}
+        with self._namespace_lock:
+            self._load_namespaces(query)
+            if key in self._namespaces.ids:
+                return self._namespaces.ids[key]
+            counter = self._counter_collection.find_one_and_update(
+                {"_id": self._settings.mongo_namespace_collection},
+                {"$inc": {"value": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            doc = {"_id": counter["value"], **query}
+            try:
+                self._namespace_collection.insert_one(doc)
+            except DuplicateKeyError:
+                # created concurrently by another process
+                self._load_namespaces(query)
+                return self._namespaces.ids[key]
+            self._log.debug("created namespace %s for %s", counter["value"], key)
+            self._publish_namespaces([doc])
+            return counter["value"]
+
+    def _load_namespaces(self, query: dict = None):
+        docs = list(self._namespace_collection.find(query or {}))
+        if docs:
+            self._publish_namespaces(docs)
+
+    def _publish_namespaces(self, docs: list[dict]):
+        with self._namespace_lock:
+            self._namespaces = self._namespaces.with_docs(docs)
+
+    def _compact_live_filter(self) -> dict:
+        return {"e": {"$gt": to_bson_date(current_date_in_seconds())}}
+
+    def _is_expired(self, doc: dict, current_time: int) -> bool:
+        return from_bson_date(doc["e"]) <= current_time
+
+    def _delete_if_unchanged(self, doc: dict):
+        # left alone if a concurrent minify renewed it in the meantime
+        self._url_collection.delete_one({"_id": doc["_id"], "e": doc["e"]})
+
+
+def migrate_to_compact_schema(
+    source: MongoURLRepository, target: CompactMongoURLRepository, batch_size: int
+) -> int:
+    """Copies the live mappings of `source` to `target`, `batch_size` at a time.
+    Mappings already copied are overwritten, so an interrupted migration can be
+    run again."""
+    migrated = 0
+    batch = []
+    for mapping in source.iter_url_mappings(batch_size):
+        if mapping.is_expired():
+            continue
+        batch.append(mapping)
+        if len(batch) == batch_size:
+            target.restore_url_mappings(batch)
+            migrated += len(batch)
+            batch = []
+    target.restore_url_mappings(batch)
+    return migrated + len(batch)
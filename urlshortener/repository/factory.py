@@ -0,0 +1,117 @@
+from urlshortener.repository.click_stats_repository import ClickStatsRepository
+from urlshortener.repository.key_pool_repository import KeyPoolRepository
+from urlshortener.repository.repository import URLRepository
+from urlshortener.settings import ShortenerSettings
+
+
+def create_repository(settings: ShortenerSettings) -> URLRepository:
+    # backends are imported on demand: an sqlite edge node never loads pymongo
+    if settings.storage_backend == "sqlite":
+        from urlshortener.repository.sqlite_repository import SqliteURLRepository
+
+        return SqliteURLRepository(settings=settings)
+    if settings.storage_backend == "mmap":
+        from urlshortener.repository.mmap_repository import MmapURLRepository
+
+        return MmapURLRepository(settings=settings)
+    if settings.storage_backend == "mongo":
+        if settings.mongo_shard_urls:
+            return _create_sharded_repository(settings)
+        return _mongo_repository_class(settings)(settings=settings)
+    raise NotImplementedError(f"Unknown storage backend {settings.storage_backend}")
+
+
+def create_click_stats_repository(settings: ShortenerSettings) -> ClickStatsRepository:
+    if settings.storage_backend == "sqlite":
+        from urlshortener.repository.sqlite_click_stats_repository import (
+            SqliteClickStatsRepository,
+        )
+
+        return SqliteClickStatsRepository(settings=settings)
+    if settings.storage_backend == "mongo":
+        from urlshortener.repository.mongo_click_stats_repository import (
+            MongoClickStatsRepository,
+        )
+
+        # on sharded setups too, the counts are kept on the main instance
+        return MongoClickStatsRepository(settings=settings)
+    raise NotImplementedError(f"Unknown storage backend {settings.storage_backend}")
+
+
+def create_key_pool_repository(settings: ShortenerSettings) -> KeyPoolRepository:
+    if settings.storage_backend == "sqlite":
+        from urlshortener.repository.sqlite_key_pool_repository import (
+            SqliteKeyPoolRepository,
+        )
+
+        return SqliteKeyPoolRepository(settings=settings)
+    if settings.storage_backend == "mongo":
+        from urlshortener.repository.mongo_key_pool_repository import (
+            MongoKeyPoolRepository,
+        )
+
+        # on sharded setups too, the pool is kept on the main instance
+        return MongoKeyPoolRepository(settings=settings)
+    raise NotImplementedError(f"{settings.storage_backend} backends have no key pool")
+
+
+def build_serving_repository(settings: ShortenerSettings) -> URLRepository:
+    """The repository stack of the long-running processes: the server and the
+    daemon."""
+    from urlshortener.repository.bloom_repository import BloomFilteredURLRepository
+    from urlshortener.repository.caching_repository import CachingURLRepository
+    from urlshortener.repository.instrumented_repository import (
+        InstrumentedURLRepository,
+    )
+    from urlshortener.repository.write_behind_repository import (
+        WriteBehindURLRepository,
+    )
+
+    # the cache sits in front of the instrumentation, so the latency histograms
+    # only see the operations that reach the database
+    backend = create_repository(settings)
+    repository = InstrumentedURLRepository(backend)
+    if settings.write_behind_durability != "sync":
+        # below the cache, which sees the pending mappings as stored
+        repository = WriteBehindURLRepository(repository, settings)
+    repository = CachingURLRepository(
+        repository,
+        settings,
+        # the writes of the other nodes are watched on the backend itself
+        change_source=backend if settings.cache_invalidation_enabled else None,
+    )
+    if settings.bloom_filter_enabled:
+        # outermost, so that lookups of unknown codes do not evict cached mappings
+        repository = BloomFilteredURLRepository(repository, settings)
+    return repository
+
+
+def _mongo_repository_class(settings: ShortenerSettings) -> type[URLRepository]:
+    if settings.mongo_schema == "compact":
+        from urlshortener.repository.compact_mongo_repository import (
+            CompactMongoURLRepository,
+        )
+
+        return CompactMongoURLRepository
+    from urlshortener.repository.mongo_repository import MongoURLRepository
+
+    return MongoURLRepository
+
+
+def _create_sharded_repository(settings: ShortenerSettings) -> URLRepository:
+    from urlshortener.repository.sharded_repository import ShardedURLRepository
+
+    repository_class = _mongo_repository_class(settings)
+
+    # every shard holds the same database and collections as a single instance
+    return ShardedURLRepository(
+        shards={
+            url: repository_class(
+                settings=settings.model_copy(update={"mongo_instance_url": url})
+            )
+            for url in settings.mongo_shard_urls
+        },
+        virtual_nodes=settings.shard_virtual_nodes,
+        previous_shards=settings.mongo_previous_shard_urls or None,
+        counter_shard=settings.mongo_counter_shard_url,
+    )
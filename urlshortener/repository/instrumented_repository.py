@@ -0,0 +1,195 @@
+import time
+from typing import Iterator
+
+from urlshortener.metrics import REGISTRY
+from urlshortener.repository.repository import URLMapping, URLRepository
+
+OPERATION_SECONDS = REGISTRY.histogram(
+    "urlshortener_repository_operation_seconds",
+    "Latency of the repository operations",
+    ("operation", "algorithm"),
+)
+OPERATION_ERRORS_TOTAL = REGISTRY.counter(
+    "urlshortener_repository_operation_errors_total",
+    "Repository operations that raised an exception",
+    ("operation", "algorithm"),
+)
+
+
+class InstrumentedURLRepository(URLRepository):
+    """Records the latency of every operation of the wrapped repository, labelled
+    by operation and algorithm. Operations not tied to an algorithm use "".
+    """
+
+    def __init__(self, repository: URLRepository):
+        self._repository = repository
+
+    def initialize(self):
+        self._repository.initialize()
+        return self
+
+    def finalize(self):
+        self._repository.finalize()
+
+    def __enter__(self):
+        return self.initialize()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def save_url_mapping(self, original_url: str, short_url: str, algorithm: str):
+        return self._observe(
+            "save_url_mapping",
+            algorithm,
+            self._repository.save_url_mapping,
+            original_url,
+            short_url,
+            algorithm,
+        )
+
+    def save_url_mappings(self, url_mappings: dict[str, str], algorithm: str):
+        return self._observe(
+            "save_url_mappings",
+            algorithm,
+            self._repository.save_url_mappings,
+            url_mappings,
+            algorithm,
+        )
+
+    def get_or_create_short_url(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> tuple[str, bool]:
+        return self._observe(
+            "get_or_create_short_url",
+            algorithm,
+            self._repository.get_or_create_short_url,
+            original_url,
+            short_url,
+            algorithm,
+        )
+
+    def get_short_url(self, original_url: str, algorithm: str) -> str | None:
+        return self._observe(
+            "get_short_url",
+            algorithm,
+            self._repository.get_short_url,
+            original_url,
+            algorithm,
+        )
+
+    def get_original_url(self, short_url: str, algorithm: str) -> str | None:
+        return self._observe(
+            "get_original_url",
+            algorithm,
+            self._repository.get_original_url,
+            short_url,
+            algorithm,
+        )
+
+    def get_short_urls(
+        self, original_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        return self._observe(
+            "get_short_urls",
+            algorithm,
+            self._repository.get_short_urls,
+            original_urls,
+            algorithm,
+        )
+
+    def get_original_urls(
+        self, short_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        return self._observe(
+            "get_original_urls",
+            algorithm,
+            self._repository.get_original_urls,
+            short_urls,
+            algorithm,
+        )
+
+    def get_mapping_by_short_url(
+        self, short_url: str, algorithm: str
+    ) -> URLMapping | None:
+        return self._observe(
+            "get_mapping_by_short_url",
+            algorithm,
+            self._repository.get_mapping_by_short_url,
+            short_url,
+            algorithm,
+        )
+
+    def get_mapping_by_original_url(
+        self, original_url: str, algorithm: str
+    ) -> URLMapping | None:
+        return self._observe(
+            "get_mapping_by_original_url",
+            algorithm,
+            self._repository.get_mapping_by_original_url,
+            original_url,
+            algorithm,
+        )
+
+    def iter_url_mappings(
+        self, batch_size: int, created_after: int = None
+    ) -> Iterator[URLMapping]:
+        # not timed: the time spent consuming the iterator is the caller's
+        return self._repository.iter_url_mappings(batch_size, created_after)
+
+    def restore_url_mappings(self, url_mappings: list[URLMapping]):
+        # mappings of several algorithms may be restored at once
+        return self._observe(
+            "restore_url_mappings",
+            "",
+            self._repository.restore_url_mappings,
+            url_mappings,
+        )
+
+    def create_url_mappings(self, url_mappings: list[URLMapping]) -> set[str]:
+        return self._observe(
+            "create_url_mappings",
+            "",
+            self._repository.create_url_mappings,
+            url_mappings,
+        )
+
+    def delete_url_mappings(self, url_mappings: list[URLMapping]) -> int:
+        return self._observe(
+            "delete_url_mappings",
+            "",
+            self._repository.delete_url_mappings,
+            url_mappings,
+        )
+
+    def extend_expirations(
+        self, url_mappings: list[URLMapping], expiration_time: int, max_lifetime: int
+    ) -> int:
+        return self._observe(
+            "extend_expirations",
+            "",
+            self._repository.extend_expirations,
+            url_mappings,
+            expiration_time,
+            max_lifetime,
+        )
+
+    def reserve_id_block(self, size: int) -> int:
+        return self._observe(
+            "reserve_id_block", "", self._repository.reserve_id_block, size
+        )
+
+    def reset(self):
+        return self._observe("reset", "", self._repository.reset)
+
+    @staticmethod
+    def _observe(operation: str, algorithm: str, call, *args):
+        start = time.perf_counter()
+        try:
+            return call(*args)
+        except Exception:
+            OPERATION_ERRORS_TOTAL.inc(operation, algorithm)
+            raise
+        finally:
+            OPERATION_SECONDS.observe(
+                operation, algorithm, value=time.perf_counter() - start
+            )
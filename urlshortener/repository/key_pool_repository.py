@@ -0,0 +1,123 @@
+import threading
+import time
+from itertools import islice
+from abc import ABCMeta, abstractmethod
+
+
+class KeyPoolRepository(metaclass=ABCMeta):
+    """Stores the codes generated ahead of time for the key-pool algorithm.
+
+    A code is added once and never again, so the pool never hands out a code it
+    already handed out. Leasing a code marks it as leased, atomically, so that
+    concurrent processes always lease different codes; releasing it makes it
+    free again, e.g. once the mapping holding it expired.
+
+    A lease is timestamped: the codes a process leased and neither used nor
+    renewed for a while, e.g. because it crashed, are reclaimed by
+    `reclaim_leases`. The codes used by mappings are never reclaimed.
+    """
+
+    def initialize(self):
+        return self
+
+    def finalize(self):
+        pass
+
+    def __enter__(self):
+        return self.initialize()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    @abstractmethod
+    def add_codes(self, codes: list[str]) -> int:
+        # codes already in the pool, free or leased, are skipped; returns how
+        # many were added
+        raise NotImplementedError
+
+    @abstractmethod
+    def lease_codes(self, count: int) -> list[str]:
+        # at most `count` free codes, fewer when the pool runs low
+        raise NotImplementedError
+
+    @abstractmethod
+    def renew_leases(self, used_codes: list[str], held_codes: list[str]):
+        # the used codes, handed out since the last renewal, are held for good;
+        # the leases of the held ones, not used yet, are renewed. Only the codes
+        # still leased through this repository are changed
+        raise NotImplementedError
+
+    @abstractmethod
+    def reclaim_leases(self, ttl: int) -> int:
+        # frees the codes leased, and neither used nor renewed, more than `ttl`
+        # seconds ago; returns how many
+        raise NotImplementedError
+
+    @abstractmethod
+    def release_codes(self, codes: list[str]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_free_codes(self) -> int:
+        raise NotImplementedError
+
+
+class InMemoryKeyPoolRepository(KeyPoolRepository):
+    """A process local key pool, used by tests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._free: dict[str, None] = {}
+        self._leased: set[str] = set()
+        # when the leased codes not used yet were leased or last renewed
+        self._leased_at: dict[str, float] = {}
+
+    def add_codes(self, codes: list[str]) -> int:
+        added = 0
+        with self._lock:
+            for code in codes:
+                if code not in self._free and code not in self._leased:
+                    self._free[code] = None
+                    added += 1
+        return added
+
+    def lease_codes(self, count: int) -> list[str]:
+        with self._lock:
+            codes = list(islice(self._free, count))
+            now = time.time()
+            for code in codes:
+                del self._free[code]
+                self._leased_at[code] = now
+            self._leased.update(codes)
+        return codes
+
+    def renew_leases(self, used_codes: list[str], held_codes: list[str]):
+        with self._lock:
+            for code in used_codes:
+                self._leased_at.pop(code, None)
+            now = time.time()
+            for code in held_codes:
+                if code in self._leased_at:
+                    self._leased_at[code] = now
+
+    def reclaim_leases(self, ttl: int) -> int:
+        with self._lock:
+            cutoff = time.time() - ttl
+            expired = [code for code, at in self._leased_at.items() if at < cutoff]
+            for code in expired:
+                del self._leased_at[code]
+                self._leased.remove(code)
+                self._free[code] = None
+        return len(expired)
+
+    def release_codes(self, codes: list[str]):
+        with self._lock:
+            for code in codes:
+                self._leased_at.pop(code, None)
+                if code in self._leased:
+                    self._leased.remove(code)
+                    self._free[code] = None
+
+    def count_free_codes(self) -> int:
+        with self._lock:
+            return len(self._free)
@@ -0,0 +1,254 @@
+import logging
+import threading
+from typing import Iterator
+
+from urlshortener.repository.async_repository import AsyncURLRepository
+from urlshortener.repository.repository import (
+    ShortURLCollisionError,
+    URLMapping,
+    URLRepository,
+    current_date_in_seconds,
+)
+from urlshortener.settings import ShortenerSettings
+
+
+class InMemoryURLRepository(URLRepository):
+    """A process local repository, used by tests, benchmarks and as a stand-in
+    for a real backend. It honours the same expiration rules as MongoURLRepository.
+    """
+
+    def __init__(self, settings: ShortenerSettings):
+        self._settings = settings
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._expiration_offset = self._settings.expiration_offset
+        self._lock = threading.Lock()
+        self._by_original_url: dict[tuple[str, str], URLMapping] = {}
+        self._by_short_url: dict[tuple[str, str], URLMapping] = {}
+        # when the mappings restored with their own times were restored
+        self._restored_at: dict[tuple[str, str], int] = {}
+        self._next_id = 0
+
+    def initialize(self):
+        return self
+
+    def finalize(self):
+        pass
+
+    def __enter__(self):
+        return self.initialize()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def save_url_mapping(self, original_url: str, short_url: str, algorithm: str):
+        with self._lock:
+            self._store(original_url, short_url, algorithm)
+
+    def get_or_create_short_url(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> tuple[str, bool]:
+        with self._lock:
+            mapping = self._by_original_url.get((algorithm, original_url))
+            if mapping and not mapping.is_expired():
+                return mapping.short_url, False
+            taken = self._by_short_url.get((algorithm, short_url))
+            if (
+                taken
+                and taken.original_url != original_url
+                and taken.short_url == self._current_short_url(taken)
+            ):
+                raise ShortURLCollisionError(
+                    f"{short_url} is already taken", original_urls=[original_url]
+                )
+            self._store(original_url, short_url, algorithm)
+            return short_url, True
+
+    def get_short_url(self, original_url: str, algorithm: str) -> str | None:
+        mapping = self.get_mapping_by_original_url(original_url, algorithm)
+        if mapping and not mapping.is_expired():
+            return mapping.short_url
+        return None
+
+    def get_original_url(self, short_url: str, algorithm: str) -> str | None:
+        mapping = self.get_mapping_by_short_url(short_url, algorithm)
+        if mapping and not mapping.is_expired():
+            return mapping.original_url
+        return None
+
+    def get_mapping_by_short_url(
+        self, short_url: str, algorithm: str
+    ) -> URLMapping | None:
+        mapping = self._by_short_url.get((algorithm, short_url))
+        # the mapping could have been re-minified under another short url since
+        if mapping and mapping.short_url == self._current_short_url(mapping):
+            return mapping
+        return None
+
+    def get_mapping_by_original_url(
+        self, original_url: str, algorithm: str
+    ) -> URLMapping | None:
+        return self._by_original_url.get((algorithm, original_url))
+
+    def iter_url_mappings(
+        self, batch_size: int, created_after: int = None
+    ) -> Iterator[URLMapping]:
+        with self._lock:
+            mappings = list(self._by_original_url.values())
+            restored_at = dict(self._restored_at)
+        for mapping in mappings:
+            if (
+                created_after is None
+                or mapping.creation_time >= created_after
+                or restored_at.get((mapping.algorithm, mapping.original_url), -1)
+                >= created_after
+            ):
+                yield mapping
+
+    def restore_url_mappings(self, url_mappings: list[URLMapping]):
+        colliding_urls = []
+        restored_time = current_date_in_seconds()
+        with self._lock:
+            for mapping in url_mappings:
+                taken = self._by_short_url.get((mapping.algorithm, mapping.short_url))
+                if (
+                    taken
+                    and taken.original_url != mapping.original_url
+                    and taken.short_url == self._current_short_url(taken)
+                ):
+                    colliding_urls.append(mapping.original_url)
+                else:
+                    self._put(mapping)
+                    key = (mapping.algorithm, mapping.original_url)
+                    self._restored_at[key] = restored_time
+        if colliding_urls:
+            raise ShortURLCollisionError(
+                f"{len(colliding_urls)} short urls already taken",
+                original_urls=colliding_urls,
+            )
+
+    def delete_url_mappings(self, url_mappings: list[URLMapping]) -> int:
+        deleted = 0
+        with self._lock:
+            for mapping in url_mappings:
+                key = (mapping.algorithm, mapping.original_url)
+                current = self._by_original_url.get(key)
+                if current and current.short_url == mapping.short_url:
+                    del self._by_original_url[key]
+                    self._by_short_url.pop((mapping.algorithm, mapping.short_url))
+                    deleted += 1
+        return deleted
+
+    def extend_expirations(
+        self, url_mappings: list[URLMapping], expiration_time: int, max_lifetime: int
+    ) -> int:
+        now = current_date_in_seconds()
+        extended = 0
+        with self._lock:
+            for mapping in url_mappings:
+                current = self._by_original_url.get(
+                    (mapping.algorithm, mapping.original_url)
+                )
+                if (
+                    current
+                    and current.short_url == mapping.short_url
+                    and now < current.expiration_time < expiration_time
+                    and expiration_time - current.creation_time <= max_lifetime
+                ):
+                    self._put(current._replace(expiration_time=expiration_time))
+                    extended += 1
+        return extended
+
+    def reset(self):
+        self._log.debug("resetting repository")
+        with self._lock:
+            self._by_original_url.clear()
+            self._by_short_url.clear()
+            self._restored_at.clear()
+
+    def reserve_id_block(self, size: int) -> int:
+        with self._lock:
+            first_id = self._next_id
+            self._next_id += size
+            return first_id
+
+    def _store(self, original_url: str, short_url: str, algorithm: str):
+        current_time = current_date_in_seconds()
+        self._put(
+            URLMapping(
+                original_url=original_url,
+                short_url=short_url,
+                algorithm=algorithm,
+                expiration_time=current_time + self._expiration_offset,
+                creation_time=current_time,
+            )
+        )
+
+    def _put(self, mapping: URLMapping):
+        self._log.debug("Storing %s", mapping)
+        self._by_original_url[(mapping.algorithm, mapping.original_url)] = mapping
+        self._by_short_url[(mapping.algorithm, mapping.short_url)] = mapping
+
+    def _current_short_url(self, mapping: URLMapping) -> str | None:
+        current = self._by_original_url.get((mapping.algorithm, mapping.original_url))
+        return current.short_url if current else None
+
+
+class AsyncInMemoryURLRepository(AsyncURLRepository):
+    """The asyncio counterpart of InMemoryURLRepository."""
+
+    def __init__(self, settings: ShortenerSettings):
+        self._repository = InMemoryURLRepository(settings)
+        self._expiration_offset = settings.expiration_offset
+
+    async def initialize(self):
+        return self
+
+    async def finalize(self):
+        pass
+
+    async def __aenter__(self):
+        return await self.initialize()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.finalize()
+
+    async def save_url_mapping(self, original_url: str, short_url: str, algorithm: str):
+        current_time = current_date_in_seconds()
+        # like the unique index of mongo, refuses a code held by another url
+        self._repository.restore_url_mappings(
+            [
+                URLMapping(
+                    original_url=original_url,
+                    short_url=short_url,
+                    algorithm=algorithm,
+                    expiration_time=current_time + self._expiration_offset,
+                    creation_time=current_time,
+                )
+            ]
+        )
+
+    async def get_or_create_short_url(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> tuple[str, bool]:
+        return self._repository.get_or_create_short_url(
+            original_url, short_url, algorithm
+        )
+
+    async def get_short_url(self, original_url: str, algorithm: str) -> str | None:
+        return self._repository.get_short_url(original_url, algorithm)
+
+    async def get_original_url(self, short_url: str, algorithm: str) -> str | None:
+        return self._repository.get_original_url(short_url, algorithm)
+
+    async def get_mapping_by_short_url(
+        self, short_url: str, algorithm: str
+    ) -> URLMapping | None:
+        return self._repository.get_mapping_by_short_url(short_url, algorithm)
+
+    async def get_mapping_by_original_url(
+        self, original_url: str, algorithm: str
+    ) -> URLMapping | None:
+        return self._repository.get_mapping_by_original_url(original_url, algorithm)
+
+    async def reset(self):
+        self._repository.reset()
@@ -0,0 +1,115 @@
+import logging
+import os
+import threading
+import time
+from typing import Iterator
+
+from urlshortener.mmap_index import MmapIndex
+from urlshortener.repository.repository import (
+    URLMapping,
+    URLRepository,
+    current_date_in_seconds,
+)
+from urlshortener.settings import ShortenerSettings
+
+
+class MmapURLRepository(URLRepository):
+    """A read-only repository of expand-only edge nodes, served from an index
+    file built by `urlshortener build-index`, without any database.
+
+    Every `mmap_refresh_interval` seconds, the repository checks whether the
+    file was replaced and maps the new one. Lookups in progress finish on the
+    index they started with, which is unmapped once no lookup uses it.
+    Mappings created after the index was built are not found, and the ones
+    that expired since are reported as expired.
+    """
+
+    def __init__(self, settings: ShortenerSettings):
+        self._path = settings.mmap_index_path
+        self._refresh_interval = settings.mmap_refresh_interval
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._reload_lock = threading.Lock()
+        self._index = None
+        self._file_id = None
+        self._checked_at = 0.0
+
+    def initialize(self):
+        self._log.debug("mapping index %s", self._path)
+        self._reload()
+        return self
+
+    def finalize(self):
+        self._index = None
+
+    def __enter__(self):
+        return self.initialize()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def _current_index(self) -> MmapIndex:
+        if time.monotonic() - self._checked_at >= self._refresh_interval:
+            self._refresh()
+        index = self._index
+        if index is None:
+            raise Exception("MmapURLRepository is not initialized")
+        return index
+
+    def _refresh(self):
+        # one thread checks the file, the others keep using the current index
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            stat = os.stat(self._path)
+            if (stat.st_dev, stat.st_ino, stat.st_mtime_ns) != self._file_id:
+                self._load()
+        except OSError as e:
+            self._log.warning("keeping the current index: %s", e)
+        finally:
+            self._reload_lock.release()
+
+    def _reload(self):
+        with self._reload_lock:
+            self._checked_at = time.monotonic()
+            self._load()
+
+    def _load(self):
+        stat = os.stat(self._path)
+        index = MmapIndex(self._path)
+        # the previous index is not closed: lookups may still be using it, and
+        # it is unmapped when the last of them drops it
+        self._index = index
+        self._file_id = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+        self._log.info("serving %s url mappings from %s", len(index), self._path)
+
+    def get_original_url(self, short_url: str, algorithm: str) -> str | None:
+        return self._current_index().get_original_url(
+            short_url, algorithm, current_date_in_seconds()
+        )
+
+    def get_mapping_by_short_url(
+        self, short_url: str, algorithm: str
+    ) -> URLMapping | None:
+        return self._current_index().get_mapping(short_url, algorithm)
+
+    def iter_url_mappings(
+        self, batch_size: int, created_after: int = None
+    ) -> Iterator[URLMapping]:
+        for mapping in self._current_index():
+            if created_after is None or mapping.creation_time >= created_after:
+                yield mapping
+
+    def get_short_url(self, original_url: str, algorithm: str) -> str | None:
+        raise NotImplementedError("The index only serves lookups by short url")
+
+    def get_mapping_by_original_url(
+        self, original_url: str, algorithm: str
+    ) -> URLMapping | None:
+        raise NotImplementedError("The index only serves lookups by short url")
+
+    def save_url_mapping(self, original_url: str, short_url: str, algorithm: str):
+        raise NotImplementedError("MmapURLRepository is read-only")
+
+    def reset(self):
+        raise NotImplementedError("MmapURLRepository is read-only")
@@ -0,0 +1,53 @@
+import logging
+
+import pymongo
+from pymongo import UpdateOne
+
+from urlshortener.repository.click_stats_repository import ClickStatsRepository
+from urlshortener.repository.mongo_repository import client_options
+from urlshortener.settings import ShortenerSettings
+
+
+class MongoClickStatsRepository(ClickStatsRepository):
+    """Click counts in `mongo_stats_collection`, one `{_id: short_url, hits}`
+    document per short url, next to the url mappings."""
+
+    def __init__(self, settings: ShortenerSettings):
+        self._settings = settings
+        self._log = logging.getLogger(self.__class__.__name__)
+
+    def initialize(self):
+        self._log.debug("opening mongo connection")
+        self._client = pymongo.MongoClient(
+            self._settings.mongo_instance_url, **client_options(self._settings)
+        )
+        db = self._client[self._settings.database_name]
+        self._stats_collection = db[self._settings.mongo_stats_collection]
+        # serves the top short urls without sorting the collection
+        self._stats_collection.create_index([("hits", pymongo.DESCENDING)])
+        return self
+
+    def finalize(self):
+        self._log.debug("closing mongo client")
+        self._client.close()
+
+    def add_clicks(self, clicks: dict[str, int]):
+        if not clicks:
+            return
+        self._stats_collection.bulk_write(
+            [
+                UpdateOne({"_id": short_url}, {"$inc": {"hits": count}}, upsert=True)
+                for short_url, count in clicks.items()
+            ],
+            ordered=False,
+        )
+
+    def get_clicks(self, short_urls: list[str]) -> dict[str, int]:
+        cursor = self._stats_collection.find({"_id": {"$in": short_urls}})
+        return {doc["_id"]: doc["hits"] for doc in cursor}
+
+    def get_top_short_urls(self, limit: int) -> list[tuple[str, int]]:
+        cursor = self._stats_collection.find(
+            sort=[("hits", pymongo.DESCENDING)], limit=limit
+        )
+        return [(doc["_id"], doc["hits"]) for doc in cursor]
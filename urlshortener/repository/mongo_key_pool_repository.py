@@ -0,0 +1,122 @@
+import logging
+
+import pymongo
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from urlshortener.repository.key_pool_repository import KeyPoolRepository
+from urlshortener.repository.mongo_repository import client_options, to_bson_date
+from urlshortener.repository.repository import current_date_in_seconds
+from urlshortener.settings import ShortenerSettings
+
+_RELEASE = {
+    "$set": {"leased": False},
+    "$unset": {"lease": "", "holder": "", "leased_at": ""},
+}
+
+
+class MongoKeyPoolRepository(KeyPoolRepository):
+    """The key pool in `mongo_key_pool_collection`, one `{_id: code, leased}`
+    document per code, next to the url mappings.
+
+    A lease picks free codes then claims them with an update conditioned on
+    them being still free, tagged with a token of its own: of the codes picked
+    by concurrent leases, each one is claimed by a single lease. Until they are
+    used, leased codes also carry the `holder` token of the repository and the
+    `leased_at` date its renewals bump.
+    """
+
+    def __init__(self, settings: ShortenerSettings):
+        self._settings = settings
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._holder = ObjectId()
+
+    def initialize(self):
+        self._log.debug("opening mongo connection")
+        # leases and counts go to the primary, whatever the read preference
+        self._client = pymongo.MongoClient(
+            self._settings.mongo_instance_url, **client_options(self._settings)
+        )
+        db = self._client[self._settings.database_name]
+        self._pool_collection = db[self._settings.mongo_key_pool_collection]
+        self._pool_collection.create_index([("leased", pymongo.ASCENDING)])
+        # only the codes leased and not used yet carry them
+        self._pool_collection.create_index([("holder", pymongo.ASCENDING)], sparse=True)
+        self._pool_collection.create_index(
+            [("leased_at", pymongo.ASCENDING)], sparse=True
+        )
+        return self
+
+    def finalize(self):
+        self._log.debug("closing mongo client")
+        self._client.close()
+
+    def add_codes(self, codes: list[str]) -> int:
+        if not codes:
+            return 0
+        try:
+            result = self._pool_collection.insert_many(
+                [{"_id": code, "leased": False} for code in codes], ordered=False
+            )
+        except BulkWriteError as e:
+            # the duplicate codes are rejected, the others are inserted
+            return e.details["nInserted"]
+        return len(result.inserted_ids)
+
+    def lease_codes(self, count: int) -> list[str]:
+        codes = []
+        while len(codes) < count:
+            candidates = [
+                doc["_id"]
+                for doc in self._pool_collection.find(
+                    {"leased": False}, {"_id": 1}, limit=count - len(codes)
+                )
+            ]
+            if not candidates:
+                break
+            token = ObjectId()
+            self._pool_collection.update_many(
+                {"_id": {"$in": candidates}, "leased": False},
+                {
+                    "$set": {
+                        "leased": True,
+                        "lease": token,
+                        "holder": self._holder,
+                        "leased_at": to_bson_date(current_date_in_seconds()),
+                    }
+                },
+            )
+            # the candidates claimed by concurrent leases are picked again
+            codes += [
+                doc["_id"]
+                for doc in self._pool_collection.find(
+                    {"_id": {"$in": candidates}, "lease": token}, {"_id": 1}
+                )
+            ]
+        return codes
+
+    def renew_leases(self, used_codes: list[str], held_codes: list[str]):
+        if used_codes:
+            self._pool_collection.update_many(
+                {"_id": {"$in": used_codes}, "holder": self._holder},
+                {"$unset": {"holder": "", "leased_at": ""}},
+            )
+        if held_codes:
+            self._pool_collection.update_many(
+                {"_id": {"$in": held_codes}, "holder": self._holder},
+                {"$set": {"leased_at": to_bson_date(current_date_in_seconds())}},
+            )
+
+    def reclaim_leases(self, ttl: int) -> int:
+        result = self._pool_collection.update_many(
+            {"leased_at": {"$lt": to_bson_date(current_date_in_seconds() - ttl)}},
+            _RELEASE,
+        )
+        return result.modified_count
+
+    def release_codes(self, codes: list[str]):
+        if codes:
+            self._pool_collection.update_many({"_id": {"$in": codes}}, _RELEASE)
+
+    def count_free_codes(self) -> int:
+        return self._pool_collection.count_documents({"leased": False})
@@ -1,40 +1,362 @@
+import calendar
 import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
+from typing import Callable, Iterator, TypeVar
 
 import pymongo
+from pymongo import DeleteOne, ReturnDocument, UpdateOne, read_preferences
+from pymongo.change_stream import ChangeStream
+from pymongo.collection import Collection
+from pymongo.errors import (
+    BulkWriteError,
+    CursorNotFound,
+    DuplicateKeyError,
+    OperationFailure,
+)
 
-from urlshortener.repository.repository import URLRepository
+from urlshortener.batch import chunked
+from urlshortener.metrics import REGISTRY
+from urlshortener.repository.repository import (
+    MAPPINGS_RESET,
+    ShortURLCollisionError,
+    URLMapping,
+    URLRepository,
+    current_date_in_seconds,
+)
 from urlshortener.settings import ShortenerSettings
 
+T = TypeVar("T")
 
-def _current_date_in_seconds() -> int:
-    return int(datetime.utcnow().timestamp())
+HEDGED_READS_TOTAL = REGISTRY.counter(
+    "urlshortener_mongo_hedged_reads_total",
+    "Reads sent to a second member after the latency budget, by which one answered",
+    ("answered_by",),
+)
+
+READ_PREFERENCES = {
+    "primaryPreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondaryPreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+
+# the unique indexes guard the mappings, the lookup ones cover the lookup queries
+# (filter and projection), the creation and restore time ones serve incremental
+# scans and the TTL one lets mongo reclaim expired mappings
+URL_COLLECTION_INDEXES = [
+    (["algorithm", "original_url"], {"unique": True}),
+    (["algorithm", "short_url"], {"unique": True}),
+    (["algorithm", "original_url", "expiration_time", "short_url"], {}),
+    (["algorithm", "short_url", "expiration_time", "original_url"], {}),
+    (["creation_time"], {}),
+    (["restored_time"], {"sparse": True}),
+    (["expiration_time"], {"expireAfterSeconds": 0}),
+]
+
+
+def to_bson_date(seconds: int) -> datetime:
+    return datetime.utcfromtimestamp(seconds)
+
+
+def from_bson_date(date: datetime | int) -> int:
+    if isinstance(date, datetime):
+        return calendar.timegm(date.utctimetuple())
+    # documents written before expiry was stored as a date
+    return int(date)
+
+
+def to_url_mapping(doc: dict) -> URLMapping:
+    return URLMapping(
+        original_url=doc["original_url"],
+        short_url=doc["short_url"],
+        algorithm=doc["algorithm"],
+        expiration_time=from_bson_date(doc["expiration_time"]),
+        creation_time=from_bson_date(doc["creation_time"]),
+    )
+
+
+def client_options(settings: ShortenerSettings) -> dict:
+    # the defaults are the driver's own, keyword options override the url ones
+    options = {
+        "maxPoolSize": settings.mongo_max_pool_size,
+        "minPoolSize": settings.mongo_min_pool_size,
+        "connectTimeoutMS": settings.mongo_connect_timeout_ms,
+        "socketTimeoutMS": settings.mongo_socket_timeout_ms,
+        "serverSelectionTimeoutMS": settings.mongo_server_selection_timeout_ms,
+    }
+    if settings.mongo_compressors:
+        options["compressors"] = ",".join(settings.mongo_compressors)
+    return options
+
+
+def read_preference(settings: ShortenerSettings) -> read_preferences._ServerMode:
+    if settings.mongo_read_preference == "primary":
+        return read_preferences.Primary()
+    return READ_PREFERENCES[settings.mongo_read_preference](
+        max_staleness=settings.mongo_max_staleness or -1
+    )
+
+
+def live_filter(current_time: int, legacy_expiration: bool = False) -> dict:
+    # while integer expiration times are being migrated, both types are matched
+    if legacy_expiration:
+        return {
+            "$or": [
+                {"expiration_time": {"$gt": to_bson_date(current_time)}},
+                {"expiration_time": {"$gt": current_time}},
+            ]
+        }
+    return {"expiration_time": {"$gt": to_bson_date(current_time)}}
+
+
+def get_or_create_request(
+    original_url: str,
+    short_url: str,
+    algorithm: str,
+    current_time: int,
+    expiration_offset: int,
+) -> dict:
+    """The arguments of the find_one_and_update of get_or_create_short_url,
+    shared by the sync and asyncio repositories."""
+    # a pipeline update instead of $setOnInsert: an expired mapping is replaced
+    # in the same round trip, a live one is left untouched. Integer expiration
+    # times not migrated yet are compared as such, not ordered before any date
+    is_live = {
+        "$cond": [
+            {"$eq": [{"$type": "$expiration_time"}, "date"]},
+            {"$gt": ["$expiration_time", to_bson_date(current_time)]},
+            {"$gt": ["$expiration_time", current_time]},
+        ]
+    }
+    return dict(
+        filter={"algorithm": algorithm, "original_url": original_url},
+        update=[
+            {
+                "$set": {
+                    "algorithm": algorithm,
+                    "original_url": original_url,
+                    "short_url": {"$cond": [is_live, "$short_url", short_url]},
+                    "expiration_time": {
+                        "$cond": [
+                            is_live,
+                            "$expiration_time",
+                            to_bson_date(current_time + expiration_offset),
+                        ]
+                    },
+                    "creation_time": {
+                        "$cond": [
+                            is_live,
+                            "$creation_time",
+                            to_bson_date(current_time),
+                        ]
+                    },
+                }
+            }
+        ],
+        # the mapping before the update tells whether this call created one,
+        # unlike the times of the updated one, which a concurrent minify within
+        # the same second could have written as well
+        projection={"_id": False, "short_url": True, "expiration_time": True},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+    )
+
+
+def get_or_create_result(
+    previous: dict | None, short_url: str, current_time: int
+) -> tuple[str, bool]:
+    # the same test as the is_live of the update: only a live mapping was kept
+    if previous:
+        expiration_time = previous["expiration_time"]
+        if isinstance(expiration_time, datetime):
+            current = to_bson_date(current_time)
+        else:
+            current = current_time
+        if expiration_time > current:
+            return previous["short_url"], False
+    return short_url, True
+
+
+def is_short_url_collision(error: DuplicateKeyError) -> bool:
+    # rather than a concurrent insert of the same original url
+    return "short_url" in (error.details or {}).get("keyPattern", {})
+
+
+def recorded_urls(url_mappings: list[URLMapping]) -> list[str]:
+    return [
+        url
+        for mapping in url_mappings
+        for url in (mapping.original_url, mapping.short_url)
+    ]
+
+
+class IndexMigrationError(Exception):
+    """The url collection cannot have its unique indexes, e.g. it still has the
+    non-unique ones of older versions and the duplicate mappings they let in."""
+
+
+class UninitializedCollection:
+    """Stands for the collections of a repository until it is initialized: any
+    use of them raises, so that the methods need no check of their own."""
+
+    __slots__ = ("_repository_name",)
+
+    def __init__(self, repository_name: str):
+        self._repository_name = repository_name
+
+    def __getattr__(self, name: str):
+        raise Exception(f"{self._repository_name} is not initialized")
+
+
+class MappingChangeStream:
+    """The url mappings written to a mongo database, as told by a change stream.
+
+    `try_next` returns the next mapping inserted or rewritten, MAPPINGS_RESET
+    when the repository was reset, or None when nothing changed within the wait
+    given to the stream. `resume_token` reopens the stream after the last change
+    returned.
+    """
+
+    def __init__(
+        self,
+        stream: ChangeStream,
+        url_collection: str,
+        to_mapping: Callable[[dict], URLMapping],
+    ):
+        self._stream = stream
+        self._url_collection = url_collection
+        self._to_mapping = to_mapping
+
+    @property
+    def resume_token(self) -> dict | None:
+        return self._stream.resume_token
+
+    def try_next(self) -> URLMapping | str | None:
+        change = self._stream.try_next()
+        if change is None:
+            return None
+        if change["ns"]["coll"] != self._url_collection:
+            return MAPPINGS_RESET
+        doc = change.get("fullDocument")
+        # None when the document was deleted before the change was looked up
+        return self._to_mapping(doc) if doc else None
+
+    def close(self):
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
 
 class MongoURLRepository(URLRepository):
-    def __init__(self, settings: ShortenerSettings):
+    url_collection_indexes = URL_COLLECTION_INDEXES
+
+    def __init__(self, settings: ShortenerSettings, create_indexes: bool = True):
+        # without its indexes, a repository is only good for `migrate_indexes`
+        self._create_indexes = create_indexes
         self._settings = settings
         self._log = logging.getLogger(self.__class__.__name__)
         self._initialized = False
         self._expiration_offset = self._settings.expiration_offset
+        self._routes_reads = self._settings.mongo_read_preference != "primary"
+        # urls written by this process recently, read from the primary until
+        # the secondaries have caught up with them
+        self._recent_writes: OrderedDict[str, float] = OrderedDict()
+        self._recent_writes_lock = threading.Lock()
+        self._hedge_executor = None
+        self._uninitialize_collections()
+
+    def _uninitialize_collections(self):
+        uninitialized = UninitializedCollection(self.__class__.__name__)
+        self._url_collection = self._read_collection = uninitialized
+        self._counter_collection = uninitialized
 
     def _init_collection(self, client: pymongo.MongoClient):
         self._log.debug("initializing url mongo collection")
         db = self._client[self._settings.database_name]
         if self._settings.mongo_url_collection not in db.list_collection_names():
             self._log.debug(
-                f"creating collection '{self._settings.mongo_url_collection}'"
+                "creating collection '%s'", self._settings.mongo_url_collection
             )
             self._url_collection = db.create_collection(
                 self._settings.mongo_url_collection
             )
-            self._url_collection.create_index(["algorithm", "original_url"])
-            self._url_collection.create_index(["algorithm", "short_url"])
         else:
             self._log.debug(
-                f"collection '{self._settings.mongo_url_collection}' already exists"
+                "collection '%s' already exists", self._settings.mongo_url_collection
             )
             self._url_collection = db[self._settings.mongo_url_collection]
+        if self._create_indexes:
+            self._ensure_indexes()
+        self._counter_collection = db[self._settings.mongo_counter_collection]
+
+    def _ensure_indexes(self):
+        # unique indexes make concurrent minifies of the same url converge on one
+        # mapping, and reject a code already used by another url: without them,
+        # minifies would silently overwrite each other
+        for keys, options in self.url_collection_indexes:
+            try:
+                self._url_collection.create_index(keys, **options)
+            except OperationFailure as e:
+                raise IndexMigrationError(
+                    f"could not create index {keys} on {self._url_collection.name} "
+                    f"({e}), run 'urlshortener migrate' first"
+                ) from e
+
+    def migrate_indexes(self, batch_size: int) -> int:
+        """Gives a collection written by older versions its unique indexes: the
+        duplicate mappings they let in are deleted, keeping the one expiring last,
+        and the non-unique indexes with the same keys are replaced. Returns the
+        number of mappings deleted."""
+        deleted = 0
+        for keys, options in self.url_collection_indexes:
+            if not options.get("unique"):
+                continue
+            deleted += self._delete_duplicates(keys, batch_size)
+            key = [(name, 1) for name in keys]
+            for name, index in self._url_collection.index_information().items():
+                if index["key"] == key and not index.get("unique"):
+                    self._log.info("dropping index %s, rebuilt as unique", name)
+                    self._url_collection.drop_index(name)
+        self._ensure_indexes()
+        return deleted
+
+    def _delete_duplicates(self, keys: list[str], batch_size: int) -> int:
+        duplicates = self._url_collection.aggregate(
+            [
+                # dates sort after the integer expiration times of older versions
+                {"$sort": {"expiration_time": pymongo.DESCENDING}},
+                {
+                    "$group": {
+                        "_id": {name: f"${name}" for name in keys},
+                        "ids": {"$push": "$_id"},
+                    }
+                },
+                {"$match": {"ids.1": {"$exists": True}}},
+            ],
+            allowDiskUse=True,
+        )
+        deleted = 0
+        ids = (doc_id for group in duplicates for doc_id in group["ids"][1:])
+        for batch in chunked(ids, batch_size):
+            deleted += self._url_collection.delete_many(
+                {"_id": {"$in": batch}}
+            ).deleted_count
+        if deleted:
+            self._log.info("deleted %s mappings duplicating %s", deleted, keys)
+        return deleted
+
+    def _live_filter(self) -> dict:
+        return live_filter(
+            current_date_in_seconds(), self._settings.mongo_legacy_expiration
+        )
 
     def initialize(self):
         self._log.debug("initializing MongoURLRepository")
@@ -42,14 +364,29 @@ class MongoURLRepository(URLRepository):
             self._log.debug("MongoURLRepository is already initialized")
             return
         self._log.debug("opening mongo connection")
-        self._client = pymongo.MongoClient(self._settings.mongo_instance_url)
+        self._client = pymongo.MongoClient(
+            self._settings.mongo_instance_url, **client_options(self._settings)
+        )
         self._init_collection(self._client)
+        self._read_collection = self._url_collection.with_options(
+            read_preference=read_preference(self._settings)
+        )
+        if self._routes_reads and self._settings.mongo_hedged_reads:
+            self._hedge_executor = ThreadPoolExecutor(
+                max_workers=self._settings.mongo_max_pool_size,
+                thread_name_prefix="mongo-hedged-read",
+            )
         self._initialized = True
         return self
 
     def finalize(self):
         self._log.debug("closing mongo client")
+        if self._hedge_executor:
+            # the losing reads are not waited for
+            self._hedge_executor.shutdown(wait=False, cancel_futures=True)
+            self._hedge_executor = None
         self._client.close()
+        self._uninitialize_collections()
         self._initialized = False
 
     def __enter__(self):
@@ -58,66 +395,504 @@ class MongoURLRepository(URLRepository):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.finalize()
 
-    def _check_initialization(func):
-        # a decorator to enforce initialization in a pythonic way
-        def wrap_check_initialization(self, *args, **kwargs):
-            if not self._initialized:
-                raise Exception("MongoURLRepository is not initialized")
-            return func(self, *args, **kwargs)
+    def _record_writes(self, *urls: str):
+        if not self._routes_reads:
+            return
+        deadline = time.monotonic() + self._settings.mongo_read_your_writes_window
+        with self._recent_writes_lock:
+            for url in urls:
+                self._recent_writes[url] = deadline
+                self._recent_writes.move_to_end(url)
+
+    def _recently_written(self, urls: tuple[str, ...]) -> bool:
+        now = time.monotonic()
+        with self._recent_writes_lock:
+            # deadlines are in insertion order, expired ones are at the front
+            while self._recent_writes:
+                url, deadline = next(iter(self._recent_writes.items()))
+                if deadline > now:
+                    break
+                del self._recent_writes[url]
+            return any(url in self._recent_writes for url in urls)
 
-        return wrap_check_initialization
+    def _read(self, query: Callable[[Collection], T], *urls: str) -> T:
+        # reads of the urls just written stay on the primary, the others go to
+        # the members picked by the read preference
+        if not self._routes_reads or self._recently_written(urls):
+            return query(self._url_collection)
+        if self._hedge_executor is None:
+            return query(self._read_collection)
+        return self._hedged_read(query)
+
+    def _hedged_read(self, query: Callable[[Collection], T]) -> T:
+        first = self._hedge_executor.submit(query, self._read_collection)
+        wait([first], timeout=self._settings.mongo_hedge_delay_ms / 1000)
+        if first.done() and first.exception() is None:
+            return first.result()
+        # the primary is the one member sure to differ from the first one
+        hedge = self._hedge_executor.submit(query, self._url_collection)
+        pending = {first: "first", hedge: "hedge"}
+        while True:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                answered_by = pending.pop(future)
+                if future.exception() is None:
+                    HEDGED_READS_TOTAL.inc(answered_by)
+                    return future.result()
+                if not pending:
+                    raise future.exception()
 
-    @_check_initialization
     def save_url_mapping(self, original_url: str, short_url: str, algorithm: str):
-        current_time = _current_date_in_seconds()
+        current_time = current_date_in_seconds()
         expiration_time = current_time + self._expiration_offset
         doc = {
             "algorithm": algorithm,
             "original_url": original_url,
             "short_url": short_url,
-            "expiration_time": expiration_time,
-            "creation_time": current_time,
+            "expiration_time": to_bson_date(expiration_time),
+            "creation_time": to_bson_date(current_time),
         }
-        self._log.debug(f"Storing {doc}")
+        self._log.debug("Storing %s", doc)
         self._url_collection.update_one(
             filter={"algorithm": algorithm, "original_url": original_url},
             update={"$set": doc},
             upsert=True,
         )
+        self._record_writes(original_url, short_url)
 
-    @_check_initialization
     def get_short_url(self, original_url: str, algorithm: str) -> str | None:
-        self._log.debug(f"retrieving original url {original_url} ({algorithm})")
-        existing_url = self._url_collection.find_one(
-            {
-                "original_url": original_url,
-                "expiration_time": {"$gt": _current_date_in_seconds()},
-                "algorithm": algorithm,
-            }
+        self._log.debug("retrieving original url %s (%s)", original_url, algorithm)
+        query = {
+            "original_url": original_url,
+            **self._live_filter(),
+            "algorithm": algorithm,
+        }
+        existing_url = self._read(
+            lambda collection: collection.find_one(
+                query, projection={"_id": False, "short_url": True}
+            ),
+            original_url,
         )
         if existing_url:
             return existing_url["short_url"]
 
-        self._log.debug(f"url {original_url} ({algorithm}) not found or expired")
+        self._log.debug("url %s (%s) not found or expired", original_url, algorithm)
         return None
 
-    @_check_initialization
     def get_original_url(self, short_url: str, algorithm: str) -> str | None:
-        self._log.debug(f"retrieving short url {short_url} ({algorithm})")
-        existing_url = self._url_collection.find_one(
-            {
-                "short_url": short_url,
-                "expiration_time": {"$gt": _current_date_in_seconds()},
-                "algorithm": algorithm,
-            }
+        self._log.debug("retrieving short url %s (%s)", short_url, algorithm)
+        query = {
+            "short_url": short_url,
+            **self._live_filter(),
+            "algorithm": algorithm,
+        }
+        existing_url = self._read(
+            lambda collection: collection.find_one(
+                query, projection={"_id": False, "original_url": True}
+            ),
+            short_url,
         )
         if existing_url:
             return existing_url["original_url"]
 
-        self._log.debug(f"url {short_url} ({algorithm}) not found or expired")
+        self._log.debug("url %s (%s) not found or expired", short_url, algorithm)
         return None
 
-    @_check_initialization
+    def get_or_create_short_url(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> tuple[str, bool]:
+        current_time = current_date_in_seconds()
+        request = get_or_create_request(
+            original_url, short_url, algorithm, current_time, self._expiration_offset
+        )
+        for _ in range(2):
+            try:
+                previous = self._url_collection.find_one_and_update(**request)
+                stored_url, created = get_or_create_result(
+                    previous, short_url, current_time
+                )
+                self._record_writes(original_url, stored_url)
+                return stored_url, created
+            except DuplicateKeyError as e:
+                if is_short_url_collision(e):
+                    raise ShortURLCollisionError(
+                        f"{short_url} is already taken", original_urls=[original_url]
+                    )
+                # a concurrent upsert of the same url won the race: the retry
+                # returns its mapping
+                self._log.debug("concurrent minify of %s, retrying", original_url)
+        raise ShortURLCollisionError(
+            f"could not store {original_url}", original_urls=[original_url]
+        )
+
+    def get_mapping_by_short_url(
+        self, short_url: str, algorithm: str
+    ) -> URLMapping | None:
+        self._log.debug("retrieving mapping of short url %s (%s)", short_url, algorithm)
+        doc = self._read(
+            lambda collection: collection.find_one(
+                {"short_url": short_url, "algorithm": algorithm},
+                projection={"_id": False},
+                sort=[("expiration_time", pymongo.DESCENDING)],
+            ),
+            short_url,
+        )
+        return to_url_mapping(doc) if doc else None
+
+    def get_mapping_by_original_url(
+        self, original_url: str, algorithm: str
+    ) -> URLMapping | None:
+        self._log.debug(
+            "retrieving mapping of original url %s (%s)", original_url, algorithm
+        )
+        doc = self._read(
+            lambda collection: collection.find_one(
+                {"original_url": original_url, "algorithm": algorithm},
+                projection={"_id": False},
+            ),
+            original_url,
+        )
+        return to_url_mapping(doc) if doc else None
+
+    def save_url_mappings(self, url_mappings: dict[str, str], algorithm: str):
+        if not url_mappings:
+            return
+        current_time = current_date_in_seconds()
+        expiration_time = to_bson_date(current_time + self._expiration_offset)
+        current_time = to_bson_date(current_time)
+        self._log.debug("Storing %s url mappings (%s)", len(url_mappings), algorithm)
+        requests = [
+            UpdateOne(
+                filter={"algorithm": algorithm, "original_url": original_url},
+                update={
+                    "$set": {
+                        "algorithm": algorithm,
+                        "original_url": original_url,
+                        "short_url": short_url,
+                        "expiration_time": expiration_time,
+                        "creation_time": current_time,
+                    }
+                },
+                upsert=True,
+            )
+            for original_url, short_url in url_mappings.items()
+        ]
+        self._record_writes(*url_mappings, *url_mappings.values())
+        self._bulk_upsert(requests)
+
+    def restore_url_mappings(self, url_mappings: list[URLMapping]):
+        if not url_mappings:
+            return
+        self._record_writes(*recorded_urls(url_mappings))
+        # restored mappings keep their creation time, the restore time lets the
+        # incremental scans of other processes find them all the same
+        restored_time = to_bson_date(current_date_in_seconds())
+        self._bulk_upsert(
+            [
+                UpdateOne(
+                    filter={
+                        "algorithm": mapping.algorithm,
+                        "original_url": mapping.original_url,
+                    },
+                    update={
+                        "$set": {
+                            "algorithm": mapping.algorithm,
+                            "original_url": mapping.original_url,
+                            "short_url": mapping.short_url,
+                            "expiration_time": to_bson_date(mapping.expiration_time),
+                            "creation_time": to_bson_date(mapping.creation_time),
+                            "restored_time": restored_time,
+                        }
+                    },
+                    upsert=True,
+                )
+                for mapping in url_mappings
+            ]
+        )
+
+    def create_url_mappings(self, url_mappings: list[URLMapping]) -> set[str]:
+        if not url_mappings:
+            return set()
+        self._record_writes(*recorded_urls(url_mappings))
+        # only an expired mapping of the url, or the same one stored by a previous
+        # attempt, matches: when the url has another live one the upsert fails
+        # on the unique original_url index instead of replacing it
+        expired_filter = {"$nor": [self._live_filter()]}
+        requests = [
+            UpdateOne(
+                filter={
+                    "algorithm": mapping.algorithm,
+                    "original_url": mapping.original_url,
+                    "$or": [expired_filter, {"short_url": mapping.short_url}],
+                },
+                update={
+                    "$set": {
+                        "algorithm": mapping.algorithm,
+                        "original_url": mapping.original_url,
+                        "short_url": mapping.short_url,
+                        "expiration_time": to_bson_date(mapping.expiration_time),
+                        "creation_time": to_bson_date(mapping.creation_time),
+                    }
+                },
+                upsert=True,
+            )
+            for mapping in url_mappings
+        ]
+        try:
+            self._url_collection.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if any(error["code"] != 11000 for error in errors):
+                raise
+            return {error["op"]["q"]["original_url"] for error in errors}
+        return set()
+
+    def delete_url_mappings(self, url_mappings: list[URLMapping]) -> int:
+        if not url_mappings:
+            return 0
+        self._record_writes(*recorded_urls(url_mappings))
+        result = self._url_collection.bulk_write(
+            [
+                DeleteOne(
+                    {
+                        "algorithm": mapping.algorithm,
+                        "original_url": mapping.original_url,
+                        "short_url": mapping.short_url,
+                    }
+                )
+                for mapping in url_mappings
+            ],
+            ordered=False,
+        )
+        return result.deleted_count
+
+    def extend_expirations(
+        self, url_mappings: list[URLMapping], expiration_time: int, max_lifetime: int
+    ) -> int:
+        if not url_mappings:
+            return 0
+        # $max never moves an expiration backward, e.g. when the refreshes of
+        # several processes cross
+        result = self._url_collection.bulk_write(
+            [
+                UpdateOne(
+                    filter={
+                        "algorithm": mapping.algorithm,
+                        "original_url": mapping.original_url,
+                        "short_url": mapping.short_url,
+                        **self._live_filter(),
+                        "creation_time": {
+                            "$gte": to_bson_date(expiration_time - max_lifetime)
+                        },
+                    },
+                    update={"$max": {"expiration_time": to_bson_date(expiration_time)}},
+                )
+                for mapping in url_mappings
+            ],
+            ordered=False,
+        )
+        return result.modified_count
+
+    def _bulk_upsert(self, requests: list[UpdateOne]):
+        try:
+            self._url_collection.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            # unordered: every other mapping of the batch has been stored
+            colliding_urls = [
+                error["op"]["q"]["original_url"]
+                for error in e.details["writeErrors"]
+                if error["code"] == 11000 and "short_url" in error.get("keyPattern", {})
+            ]
+            if len(colliding_urls) < len(e.details["writeErrors"]):
+                raise
+            raise ShortURLCollisionError(
+                f"{len(colliding_urls)} short urls already taken",
+                original_urls=colliding_urls,
+            )
+
+    def get_short_urls(
+        self, original_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        self._log.debug(
+            "retrieving %s original urls (%s)", len(original_urls), algorithm
+        )
+        query = {
+            "original_url": {"$in": original_urls},
+            **self._live_filter(),
+            "algorithm": algorithm,
+        }
+        docs = self._read(
+            lambda collection: list(
+                collection.find(
+                    query,
+                    projection={"_id": False, "original_url": True, "short_url": True},
+                )
+            ),
+            *original_urls,
+        )
+        return {doc["original_url"]: doc["short_url"] for doc in docs}
+
+    def get_original_urls(
+        self, short_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        self._log.debug("retrieving %s short urls (%s)", len(short_urls), algorithm)
+        query = {
+            "short_url": {"$in": short_urls},
+            **self._live_filter(),
+            "algorithm": algorithm,
+        }
+        docs = self._read(
+            lambda collection: list(
+                collection.find(
+                    query,
+                    projection={"_id": False, "original_url": True, "short_url": True},
+                )
+            ),
+            *short_urls,
+        )
+        return {doc["short_url"]: doc["original_url"] for doc in docs}
+
+    def reserve_id_block(self, size: int) -> int:
+        counter = self._counter_collection.find_one_and_update(
+            {"_id": self._settings.mongo_url_collection},
+            {"$inc": {"value": size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self._log.debug("reserved ids up to %s", counter["value"])
+        return counter["value"] - size
+
+    def iter_url_mappings(
+        self, batch_size: int, created_after: int = None
+    ) -> Iterator[URLMapping]:
+        query = {}
+        if created_after is not None:
+            since = {"$gte": to_bson_date(created_after)}
+            query = {"$or": [{"creation_time": since}, {"restored_time": since}]}
+        cursor = self._url_collection.find(
+            query, projection={"_id": False}, batch_size=batch_size
+        )
+        for doc in cursor:
+            yield to_url_mapping(doc)
+
+    def watch_url_mappings(
+        self, resume_after: dict = None, max_await_ms: int = 1000
+    ) -> MappingChangeStream:
+        # deletes are not followed: expired mappings leave the caches by
+        # themselves, and resets are told by the marker bumped by `reset`
+        pipeline = [
+            {
+                "$match": {
+                    "$or": [
+                        {
+                            "ns.coll": self._url_collection.name,
+                            "operationType": {"$in": ["insert", "update", "replace"]},
+                        },
+                        {
+                            "ns.coll": self._counter_collection.name,
+                            "documentKey._id": self._reset_marker(),
+                        },
+                    ]
+                }
+            }
+        ]
+        try:
+            stream = self._url_collection.database.watch(
+                pipeline,
+                full_document="updateLookup",
+                resume_after=resume_after,
+                max_await_time_ms=max_await_ms,
+            )
+        except OperationFailure as e:
+            if e.code == 40573:
+                raise NotImplementedError(
+                    "Change streams are only available on replica sets"
+                ) from e
+            raise
+        return MappingChangeStream(stream, self._url_collection.name, self._to_mapping)
+
+    def _to_mapping(self, doc: dict) -> URLMapping:
+        return to_url_mapping(doc)
+
+    def _reset_marker(self) -> str:
+        return f"{self._url_collection.name}.resets"
+
+    def _record_reset(self):
+        # a write the change streams of the other processes can see, unlike the
+        # deletes of every mapping
+        self._counter_collection.update_one(
+            {"_id": self._reset_marker()}, {"$inc": {"value": 1}}, upsert=True
+        )
+
+    def storage_stats(self) -> dict[str, int]:
+        stats = self._url_collection.database.command(
+            "collStats", self._url_collection.name
+        )
+        return {
+            "count": stats.get("count", 0),
+            "data_bytes": stats.get("size", 0),
+            "index_bytes": stats.get("totalIndexSize", 0),
+        }
+
+    def migrate_expiration_dates(self, batch_size: int) -> int:
+        # converts integer timestamps to dates, batch by batch, on the live
+        # collection. Each update is conditioned on the old value, so documents
+        # rewritten by a concurrent minify are left alone. One cursor in _id
+        # order goes over the collection, reopened after the last _id migrated
+        # if it is lost
+        migrated = 0
+        legacy_filter = {
+            "$or": [
+                {"expiration_time": {"$type": "number"}},
+                {"creation_time": {"$type": "number"}},
+            ]
+        }
+        last_id = None
+        while True:
+            query = dict(legacy_filter)
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            cursor = self._url_collection.find(
+                query,
+                projection={"expiration_time": True, "creation_time": True},
+                sort=[("_id", pymongo.ASCENDING)],
+                batch_size=batch_size,
+            )
+            try:
+                for docs in chunked(cursor, batch_size):
+                    migrated += self._migrate_expiration_docs(docs)
+                    last_id = docs[-1]["_id"]
+                    self._log.debug("migrated %s url mappings", migrated)
+                return migrated
+            except CursorNotFound:
+                self._log.warning("migration cursor lost, resuming after %s", last_id)
+
+    def _migrate_expiration_docs(self, docs: list[dict]) -> int:
+        result = self._url_collection.bulk_write(
+            [
+                UpdateOne(
+                    filter={
+                        "_id": doc["_id"],
+                        "expiration_time": doc["expiration_time"],
+                    },
+                    update={
+                        "$set": {
+                            "expiration_time": to_bson_date(
+                                from_bson_date(doc["expiration_time"])
+                            ),
+                            "creation_time": to_bson_date(
+                                from_bson_date(doc["creation_time"])
+                            ),
+                        }
+                    },
+                )
+                for doc in docs
+            ],
+            ordered=False,
+        )
+        return result.modified_count
+
     def reset(self):
-        self._log.debug(f"resetting repository")
+        self._log.debug("resetting repository")
         self._url_collection.delete_many({})
+        self._record_reset()
@@ -1,4 +1,35 @@
 from abc import ABCMeta, abstractmethod
+from datetime import datetime
+from typing import Iterator, NamedTuple
+
+
+def current_date_in_seconds() -> int:
+    return int(datetime.utcnow().timestamp())
+
+
+class ShortURLCollisionError(Exception):
+    """The short url is already mapped to another original url."""
+
+    def __init__(self, message: str, original_urls: list[str] = None):
+        super().__init__(message)
+        self.original_urls = original_urls or []
+
+
+# reported by the change streams of url mappings when they were all deleted
+MAPPINGS_RESET = "reset"
+
+
+class URLMapping(NamedTuple):
+    original_url: str
+    short_url: str
+    algorithm: str
+    expiration_time: int
+    creation_time: int
+
+    def is_expired(self, now: int = None) -> bool:
+        if now is None:
+            now = current_date_in_seconds()
+        return self.expiration_time <= now
 
 
 class URLRepository(metaclass=ABCMeta):
@@ -15,6 +46,131 @@ class URLRepository(metaclass=ABCMeta):
     def get_original_url(self, short_url: str, algorithm: str) -> str | None:
         raise NotImplementedError
 
+    @abstractmethod
+    def get_mapping_by_short_url(
+        self, short_url: str, algorithm: str
+    ) -> URLMapping | None:
+        # unlike get_original_url, expired mappings are returned as well
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_mapping_by_original_url(
+        self, original_url: str, algorithm: str
+    ) -> URLMapping | None:
+        # unlike get_short_url, expired mappings are returned as well
+        raise NotImplementedError
+
     @abstractmethod
     def reset(self):
         raise NotImplementedError
+
+    def get_or_create_short_url(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> tuple[str, bool]:
+        # returns the short url already mapped to original_url if any, else stores
+        # the given one; the flag tells whether a new mapping was created.
+        # Backends should override it with an atomic operation, this default is
+        # subject to races between concurrent minifies
+        existing_url = self.get_short_url(original_url, algorithm)
+        if existing_url:
+            return existing_url, False
+        mapping = self.get_mapping_by_short_url(short_url, algorithm)
+        if mapping and mapping.original_url != original_url:
+            raise ShortURLCollisionError(
+                f"{short_url} is already taken", original_urls=[original_url]
+            )
+        self.save_url_mapping(original_url, short_url, algorithm)
+        return short_url, True
+
+    # batch operations: backends should override them with a single round trip,
+    # the defaults only fall back to the one-by-one methods above
+
+    def save_url_mappings(self, url_mappings: dict[str, str], algorithm: str):
+        for original_url, short_url in url_mappings.items():
+            self.save_url_mapping(original_url, short_url, algorithm)
+
+    def get_short_urls(
+        self, original_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        short_urls = {}
+        for original_url in original_urls:
+            short_url = self.get_short_url(original_url, algorithm)
+            if short_url:
+                short_urls[original_url] = short_url
+        return short_urls
+
+    def get_original_urls(
+        self, short_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        original_urls = {}
+        for short_url in short_urls:
+            original_url = self.get_original_url(short_url, algorithm)
+            if original_url:
+                original_urls[short_url] = original_url
+        return original_urls
+
+    def extend_expirations(
+        self, url_mappings: list[URLMapping], expiration_time: int, max_lifetime: int
+    ) -> int:
+        # pushes the expiration time of the live mappings that still map the same
+        # original and short urls forward to `expiration_time`, never backward.
+        # Mappings that would then live more than `max_lifetime` seconds since
+        # their creation are left as they are. Returns how many were extended
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not support extending expirations"
+        )
+
+    def reserve_id_block(self, size: int) -> int:
+        # atomically reserves `size` consecutive ids and returns the first one
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not support id sequences"
+        )
+
+    def iter_url_mappings(
+        self, batch_size: int, created_after: int = None
+    ) -> Iterator[URLMapping]:
+        # every stored mapping, expired ones included, fetched `batch_size` at a
+        # time; only the ones created or restored at or after `created_after` if
+        # given, restored mappings keeping their original creation time
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not support iterating over mappings"
+        )
+
+    def watch_url_mappings(self, resume_after: dict = None, max_await_ms: int = 1000):
+        # a stream of the mappings stored from now on (or after the given resume
+        # token) by any process, see MappingChangeStream of the mongo backend
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not support watching mappings"
+        )
+
+    def restore_url_mappings(self, url_mappings: list[URLMapping]):
+        # stores the mappings as they are, times included, e.g. when moving them
+        # between backends; raises ShortURLCollisionError like save_url_mappings
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not support restoring mappings"
+        )
+
+    def create_url_mappings(self, url_mappings: list[URLMapping]) -> set[str]:
+        # stores the mappings with get_or_create_short_url semantics: a live
+        # mapping of the same original url, or of the same short url, is never
+        # overwritten. Returns the original urls of the mappings not stored, a
+        # mapping already stored as it is counts as stored (e.g. on retries).
+        # This default gives the stored mappings the current times
+        not_stored = set()
+        for mapping in url_mappings:
+            try:
+                stored_url, _ = self.get_or_create_short_url(
+                    mapping.original_url, mapping.short_url, mapping.algorithm
+                )
+            except ShortURLCollisionError:
+                stored_url = None
+            if stored_url != mapping.short_url:
+                not_stored.add(mapping.original_url)
+        return not_stored
+
+    def delete_url_mappings(self, url_mappings: list[URLMapping]) -> int:
+        # deletes the mappings that still map the same original and short urls,
+        # returns how many were deleted
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not support deleting mappings"
+        )
@@ -0,0 +1,322 @@
+import logging
+from collections import defaultdict
+from itertools import islice
+from typing import Iterator
+
+from urlshortener.hash_ring import HashRing
+from urlshortener.repository.repository import (
+    ShortURLCollisionError,
+    URLMapping,
+    URLRepository,
+)
+
+
+class ShardedURLRepository(URLRepository):
+    """Spreads the mappings over several repositories with a consistent-hash ring.
+
+    A mapping is stored on the shard of its original url, where lookups by
+    original url go, and copied on the shard of its short url, where lookups by
+    short url go; both are the same shard for about 1/N of the mappings.
+
+    While a `rebalance` is moving mappings to a new ring, `previous_shards` lists
+    the shards of the old one: reads that miss on their new shard fall back to the
+    old one. Sequence ids are reserved on `counter_shard`, the first shard given
+    unless named, so that reordering or adding shards never moves the counter.
+    """
+
+    def __init__(
+        self,
+        shards: dict[str, URLRepository],
+        virtual_nodes: int = 100,
+        previous_shards: list[str] = None,
+        counter_shard: str = None,
+    ):
+        counter_shard = counter_shard or next(iter(shards), None)
+        if counter_shard not in shards:
+            raise ValueError(f"Unknown counter shard {counter_shard}")
+        self._shards = shards
+        self._counter_shard = counter_shard
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._ring = HashRing(list(shards), virtual_nodes)
+        self._previous_ring = (
+            HashRing(previous_shards, virtual_nodes) if previous_shards else None
+        )
+
+    def initialize(self):
+        for shard in self._shards.values():
+            shard.initialize()
+        return self
+
+    def finalize(self):
+        for shard in self._shards.values():
+            shard.finalize()
+
+    def __enter__(self):
+        return self.initialize()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def save_url_mapping(self, original_url: str, short_url: str, algorithm: str):
+        home, code_shard = self._shards_of(original_url, short_url)
+        previous = home.get_mapping_by_original_url(original_url, algorithm)
+        if code_shard is not home:
+            code_shard.save_url_mapping(original_url, short_url, algorithm)
+        home.save_url_mapping(original_url, short_url, algorithm)
+        if previous and previous.short_url != short_url:
+            # the copy of the replaced mapping would still resolve its short url
+            self._delete_copy(previous)
+
+    def get_or_create_short_url(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> tuple[str, bool]:
+        # most urls are minified again: one round trip when they are
+        previous = self.get_mapping_by_original_url(original_url, algorithm)
+        if previous and not previous.is_expired():
+            return previous.short_url, False
+
+        home, code_shard = self._shards_of(original_url, short_url)
+        claimed_url = short_url
+        if code_shard is not home:
+            # the code is claimed on its shard first, where its uniqueness is
+            # enforced
+            claimed_url, _ = code_shard.get_or_create_short_url(
+                original_url, short_url, algorithm
+            )
+        stored_url, created = home.get_or_create_short_url(
+            original_url, claimed_url, algorithm
+        )
+        if stored_url != claimed_url and code_shard is not home:
+            # a concurrent minify of the same url won on the home shard
+            code_shard.delete_url_mappings(
+                [URLMapping(original_url, claimed_url, algorithm, 0, 0)]
+            )
+        if created and previous and previous.short_url != stored_url:
+            # the copy of the expired mapping would still hold its short url
+            self._delete_copy(previous)
+        return stored_url, created
+
+    def get_short_url(self, original_url: str, algorithm: str) -> str | None:
+        return self._read_with_fallback(
+            original_url, lambda shard: shard.get_short_url(original_url, algorithm)
+        )
+
+    def get_original_url(self, short_url: str, algorithm: str) -> str | None:
+        return self._read_with_fallback(
+            short_url, lambda shard: shard.get_original_url(short_url, algorithm)
+        )
+
+    def get_mapping_by_short_url(
+        self, short_url: str, algorithm: str
+    ) -> URLMapping | None:
+        return self._read_with_fallback(
+            short_url,
+            lambda shard: shard.get_mapping_by_short_url(short_url, algorithm),
+        )
+
+    def get_mapping_by_original_url(
+        self, original_url: str, algorithm: str
+    ) -> URLMapping | None:
+        return self._read_with_fallback(
+            original_url,
+            lambda shard: shard.get_mapping_by_original_url(original_url, algorithm),
+        )
+
+    def save_url_mappings(self, url_mappings: dict[str, str], algorithm: str):
+        # codes are claimed on their shards first, colliding urls are then left
+        # out of the writes on the home shards
+        colliding_urls = []
+        by_code_shard = defaultdict(dict)
+        for original_url, short_url in url_mappings.items():
+            by_code_shard[self._ring.node_for(short_url)][original_url] = short_url
+        for name, shard_mappings in by_code_shard.items():
+            try:
+                self._shards[name].save_url_mappings(shard_mappings, algorithm)
+            except ShortURLCollisionError as e:
+                colliding_urls.extend(e.original_urls)
+
+        by_home_shard = defaultdict(dict)
+        for original_url, short_url in url_mappings.items():
+            name = self._ring.node_for(original_url)
+            if name != self._ring.node_for(short_url):
+                by_home_shard[name][original_url] = short_url
+        skipped = set(colliding_urls)
+        for name, shard_mappings in by_home_shard.items():
+            self._shards[name].save_url_mappings(
+                {
+                    url: code
+                    for url, code in shard_mappings.items()
+                    if url not in skipped
+                },
+                algorithm,
+            )
+        if colliding_urls:
+            raise ShortURLCollisionError(
+                f"{len(colliding_urls)} short urls already taken",
+                original_urls=colliding_urls,
+            )
+
+    def get_short_urls(
+        self, original_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        found = {}
+        for name, urls in self._group(original_urls).items():
+            found.update(self._shards[name].get_short_urls(urls, algorithm))
+        return found
+
+    def get_original_urls(
+        self, short_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        found = {}
+        for name, urls in self._group(short_urls).items():
+            found.update(self._shards[name].get_original_urls(urls, algorithm))
+        return found
+
+    def iter_url_mappings(
+        self, batch_size: int, created_after: int = None
+    ) -> Iterator[URLMapping]:
+        # the copies kept on the short url shards are skipped
+        for name, shard in self._shards.items():
+            for mapping in shard.iter_url_mappings(batch_size, created_after):
+                if self._ring.node_for(mapping.original_url) == name:
+                    yield mapping
+
+    def restore_url_mappings(self, url_mappings: list[URLMapping]):
+        by_shard = defaultdict(list)
+        for mapping in url_mappings:
+            for name in set(self._placement(mapping)):
+                by_shard[name].append(mapping)
+        for name, shard_mappings in by_shard.items():
+            self._shards[name].restore_url_mappings(shard_mappings)
+
+    def create_url_mappings(self, url_mappings: list[URLMapping]) -> set[str]:
+        # like get_or_create_short_url, codes are claimed on their shards first,
+        # one batch per shard. The copies of the expired mappings replaced on the
+        # home shards are left to expire
+        by_home_shard, by_code_shard = self._group_by_shards(url_mappings)
+        not_stored = set()
+        for name, shard_mappings in by_code_shard.items():
+            not_stored |= self._shards[name].create_url_mappings(shard_mappings)
+        for name, shard_mappings in by_home_shard.items():
+            lost = self._shards[name].create_url_mappings(
+                [m for m in shard_mappings if m.original_url not in not_stored]
+            )
+            # the codes claimed for the urls lost on their home shard are released
+            for code_shard, claimed in self._group_by_shards(
+                [m for m in shard_mappings if m.original_url in lost]
+            )[1].items():
+                self._shards[code_shard].delete_url_mappings(claimed)
+            not_stored |= lost
+        return not_stored
+
+    def delete_url_mappings(self, url_mappings: list[URLMapping]) -> int:
+        by_home_shard, by_code_shard = self._group_by_shards(url_mappings)
+        for name, shard_mappings in by_code_shard.items():
+            self._shards[name].delete_url_mappings(shard_mappings)
+        # the copies are not counted
+        return sum(
+            self._shards[name].delete_url_mappings(shard_mappings)
+            for name, shard_mappings in by_home_shard.items()
+        )
+
+    def extend_expirations(
+        self, url_mappings: list[URLMapping], expiration_time: int, max_lifetime: int
+    ) -> int:
+        by_home_shard, by_code_shard = self._group_by_shards(url_mappings)
+        for name, shard_mappings in by_code_shard.items():
+            self._shards[name].extend_expirations(
+                shard_mappings, expiration_time, max_lifetime
+            )
+        # the copies are not counted
+        return sum(
+            self._shards[name].extend_expirations(
+                shard_mappings, expiration_time, max_lifetime
+            )
+            for name, shard_mappings in by_home_shard.items()
+        )
+
+    def reserve_id_block(self, size: int) -> int:
+        return self._shards[self._counter_shard].reserve_id_block(size)
+
+    def reset(self):
+        for shard in self._shards.values():
+            shard.reset()
+
+    def rebalance(self, batch_size: int) -> int:
+        """Copies every mapping whose shards changed from the previous ring to the
+        current one onto its new shards, then deletes it from the shards it left.
+        Shards are streamed `batch_size` mappings at a time. Returns the number of
+        copies moved, about 1/N of them when a shard is added to N.
+
+        Without a previous ring, every mapping is copied to its shards again.
+        """
+        if not self._previous_ring:
+            self._log.warning("no previous shards, every mapping will be rewritten")
+        moved = 0
+        for name, shard in self._shards.items():
+            mappings = shard.iter_url_mappings(batch_size)
+            while batch := list(islice(mappings, batch_size)):
+                changed = [m for m in batch if self._placement_changed(m)]
+                if not changed:
+                    continue
+                self.restore_url_mappings(changed)
+                left = [m for m in changed if name not in self._placement(m)]
+                shard.delete_url_mappings(left)
+                moved += len(left)
+                self._log.debug("moved %s url mappings", moved)
+        return moved
+
+    def _placement_changed(self, mapping: URLMapping) -> bool:
+        if not self._previous_ring:
+            return True
+        return {
+            self._previous_ring.node_for(mapping.original_url),
+            self._previous_ring.node_for(mapping.short_url),
+        } != set(self._placement(mapping))
+
+    def _group_by_shards(
+        self, url_mappings: list[URLMapping]
+    ) -> tuple[dict[str, list[URLMapping]], dict[str, list[URLMapping]]]:
+        # the mappings by home shard, and by code shard when it is another one
+        by_home_shard, by_code_shard = defaultdict(list), defaultdict(list)
+        for mapping in url_mappings:
+            home, code_shard = self._placement(mapping)
+            by_home_shard[home].append(mapping)
+            if code_shard != home:
+                by_code_shard[code_shard].append(mapping)
+        return by_home_shard, by_code_shard
+
+    def _placement(self, mapping: URLMapping) -> tuple[str, str]:
+        return (
+            self._ring.node_for(mapping.original_url),
+            self._ring.node_for(mapping.short_url),
+        )
+
+    def _shards_of(
+        self, original_url: str, short_url: str
+    ) -> tuple[URLRepository, URLRepository]:
+        return (
+            self._shards[self._ring.node_for(original_url)],
+            self._shards[self._ring.node_for(short_url)],
+        )
+
+    def _group(self, urls: list[str]) -> dict[str, list[str]]:
+        groups = defaultdict(list)
+        for url in urls:
+            groups[self._ring.node_for(url)].append(url)
+        return groups
+
+    def _read_with_fallback(self, url: str, read):
+        name = self._ring.node_for(url)
+        result = read(self._shards[name])
+        if result is None and self._previous_ring:
+            previous_name = self._previous_ring.node_for(url)
+            if previous_name != name and previous_name in self._shards:
+                # not moved to its new shard yet
+                result = read(self._shards[previous_name])
+        return result
+
+    def _delete_copy(self, mapping: URLMapping):
+        home, code_shard = self._placement(mapping)
+        if code_shard != home:
+            self._shards[code_shard].delete_url_mappings([mapping])
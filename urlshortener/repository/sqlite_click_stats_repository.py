@@ -0,0 +1,75 @@
+import logging
+import sqlite3
+import threading
+
+from urlshortener.repository.click_stats_repository import ClickStatsRepository
+from urlshortener.settings import ShortenerSettings
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS url_stats (
+        short_url TEXT PRIMARY KEY,
+        hits INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS url_stats_hits ON url_stats (hits)
+    """,
+]
+_ADD_CLICKS = """
+    INSERT INTO url_stats (short_url, hits) VALUES (?, ?)
+    ON CONFLICT (short_url) DO UPDATE SET hits = hits + excluded.hits
+"""
+_SELECT_TOP = "SELECT short_url, hits FROM url_stats ORDER BY hits DESC LIMIT ?"
+# stays below SQLITE_MAX_VARIABLE_NUMBER of older sqlite versions
+_MAX_VARIABLES = 500
+
+
+class SqliteClickStatsRepository(ClickStatsRepository):
+    """Click counts in the `url_stats` table of the sqlite database.
+
+    Flushes are infrequent, so a single connection is shared by every thread.
+    """
+
+    def __init__(self, settings: ShortenerSettings):
+        self._path = settings.sqlite_path
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.Lock()
+
+    def initialize(self):
+        self._log.debug("opening sqlite database %s", self._path)
+        self._connection = sqlite3.connect(
+            self._path, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA busy_timeout = 5000")
+        for statement in _SCHEMA:
+            self._connection.execute(statement)
+        return self
+
+    def finalize(self):
+        self._log.debug("closing sqlite connection")
+        self._connection.close()
+
+    def add_clicks(self, clicks: dict[str, int]):
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(_ADD_CLICKS, clicks.items())
+
+    def get_clicks(self, short_urls: list[str]) -> dict[str, int]:
+        clicks = {}
+        with self._lock:
+            for start in range(0, len(short_urls), _MAX_VARIABLES):
+                chunk = short_urls[start : start + _MAX_VARIABLES]
+                clicks.update(
+                    self._connection.execute(
+                        "SELECT short_url, hits FROM url_stats WHERE short_url IN "
+                        f"({', '.join('?' * len(chunk))})",
+                        chunk,
+                    )
+                )
+        return clicks
+
+    def get_top_short_urls(self, limit: int) -> list[tuple[str, int]]:
+        with self._lock:
+            return self._connection.execute(_SELECT_TOP, (limit,)).fetchall()
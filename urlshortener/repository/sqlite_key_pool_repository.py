@@ -0,0 +1,137 @@
+import logging
+import sqlite3
+import threading
+import uuid
+
+from urlshortener.repository.key_pool_repository import KeyPoolRepository
+from urlshortener.repository.repository import current_date_in_seconds
+from urlshortener.settings import ShortenerSettings
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS key_pool (
+        code TEXT PRIMARY KEY,
+        leased INTEGER NOT NULL DEFAULT 0,
+        holder TEXT,
+        leased_at INTEGER
+    ) WITHOUT ROWID
+    """,
+    # only the free codes are indexed, leases and counts do not scan the others
+    """
+    CREATE INDEX IF NOT EXISTS key_pool_free ON key_pool (code) WHERE leased = 0
+    """,
+]
+# tables created by older versions lack them
+_LEASE_COLUMNS = {"holder": "TEXT", "leased_at": "INTEGER"}
+# which only the codes leased and not used yet carry
+_LEASE_INDEX = """
+    CREATE INDEX IF NOT EXISTS key_pool_leased_at ON key_pool (leased_at)
+    WHERE leased_at IS NOT NULL
+"""
+_ADD_CODE = "INSERT INTO key_pool (code) VALUES (?) ON CONFLICT (code) DO NOTHING"
+_LEASE_CODES = """
+    UPDATE key_pool SET leased = 1, holder = ?, leased_at = ? WHERE code IN (
+        SELECT code FROM key_pool WHERE leased = 0 LIMIT ?
+    )
+    RETURNING code
+"""
+_USE_CODE = """
+    UPDATE key_pool SET holder = NULL, leased_at = NULL
+    WHERE code = ? AND holder = ?
+"""
+_RENEW_LEASE = "UPDATE key_pool SET leased_at = ? WHERE code = ? AND holder = ?"
+_RELEASE = "UPDATE key_pool SET leased = 0, holder = NULL, leased_at = NULL"
+_RELEASE_CODE = f"{_RELEASE} WHERE code = ?"
+_RECLAIM_LEASES = f"{_RELEASE} WHERE leased_at < ?"
+_COUNT_FREE = "SELECT count(*) FROM key_pool WHERE leased = 0"
+
+
+class SqliteKeyPoolRepository(KeyPoolRepository):
+    """The key pool in the `key_pool` table of the sqlite database.
+
+    Leases are rare, one every `key_pool_lease_size` codes, so a single
+    connection is shared by every thread. Each lease is a single statement,
+    atomic across the processes sharing the database. Until they are used,
+    leased codes carry the `holder` token of the repository and the `leased_at`
+    time its renewals bump.
+    """
+
+    def __init__(self, settings: ShortenerSettings):
+        self._path = settings.sqlite_path
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.Lock()
+        self._holder = uuid.uuid4().hex
+
+    def initialize(self):
+        self._log.debug("opening sqlite database %s", self._path)
+        self._connection = sqlite3.connect(
+            self._path, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA busy_timeout = 5000")
+        for statement in _SCHEMA:
+            self._connection.execute(statement)
+        self._add_lease_columns()
+        self._connection.execute(_LEASE_INDEX)
+        return self
+
+    def finalize(self):
+        self._log.debug("closing sqlite connection")
+        self._connection.close()
+
+    def add_codes(self, codes: list[str]) -> int:
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            return self._connection.executemany(
+                _ADD_CODE, ((code,) for code in codes)
+            ).rowcount
+
+    def lease_codes(self, count: int) -> list[str]:
+        with self._lock:
+            rows = self._connection.execute(
+                _LEASE_CODES, (self._holder, current_date_in_seconds(), count)
+            ).fetchall()
+        return [code for (code,) in rows]
+
+    def renew_leases(self, used_codes: list[str], held_codes: list[str]):
+        now = current_date_in_seconds()
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(
+                _USE_CODE, ((code, self._holder) for code in used_codes)
+            )
+            self._connection.executemany(
+                _RENEW_LEASE, ((now, code, self._holder) for code in held_codes)
+            )
+
+    def reclaim_leases(self, ttl: int) -> int:
+        with self._lock:
+            return self._connection.execute(
+                _RECLAIM_LEASES, (current_date_in_seconds() - ttl,)
+            ).rowcount
+
+    def release_codes(self, codes: list[str]):
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(_RELEASE_CODE, ((code,) for code in codes))
+
+    def _add_lease_columns(self):
+        columns = {
+            row[1] for row in self._connection.execute("PRAGMA table_info(key_pool)")
+        }
+        for name, column_type in _LEASE_COLUMNS.items():
+            if name in columns:
+                continue
+            try:
+                self._connection.execute(
+                    f"ALTER TABLE key_pool ADD COLUMN {name} {column_type}"
+                )
+            except sqlite3.OperationalError as e:
+                # added by another process in between
+                if "duplicate column" not in str(e):
+                    raise
+
+    def count_free_codes(self) -> int:
+        with self._lock:
+            ((count,),) = self._connection.execute(_COUNT_FREE).fetchall()
+        return count
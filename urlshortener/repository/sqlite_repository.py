@@ -0,0 +1,515 @@
+import logging
+import queue
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+
+from urlshortener.repository.repository import (
+    ShortURLCollisionError,
+    URLMapping,
+    URLRepository,
+    current_date_in_seconds,
+)
+from urlshortener.settings import ShortenerSettings
+
+# the (algorithm, original_url) primary key clusters the table, so lookups by
+# original url read the whole mapping from it. Secondary indexes of a WITHOUT
+# ROWID table carry the primary key, hence the short url one covers lookups
+# by short url (filter and result) with the expiration time added
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS url_mappings (
+        algorithm TEXT NOT NULL,
+        original_url TEXT NOT NULL,
+        short_url TEXT NOT NULL,
+        expiration_time INTEGER NOT NULL,
+        creation_time INTEGER NOT NULL,
+        restored_time INTEGER,
+        PRIMARY KEY (algorithm, original_url)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS url_mappings_short_url
+    ON url_mappings (algorithm, short_url)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS url_mappings_short_url_expiration
+    ON url_mappings (algorithm, short_url, expiration_time)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS url_mappings_expiration
+    ON url_mappings (expiration_time)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS url_mappings_creation
+    ON url_mappings (creation_time)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """,
+]
+
+_MAPPING_COLUMNS = "original_url, short_url, algorithm, expiration_time, creation_time"
+
+_UPSERT = """
+    INSERT INTO url_mappings
+        (algorithm, original_url, short_url, expiration_time, creation_time)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (algorithm, original_url) DO UPDATE SET
+        short_url = excluded.short_url,
+        expiration_time = excluded.expiration_time,
+        creation_time = excluded.creation_time
+"""
+# restored mappings keep their creation time, the restore time lets incremental
+# scans find them all the same
+_RESTORE = """
+    INSERT INTO url_mappings
+        (algorithm, original_url, short_url, expiration_time, creation_time,
+         restored_time)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (algorithm, original_url) DO UPDATE SET
+        short_url = excluded.short_url,
+        expiration_time = excluded.expiration_time,
+        creation_time = excluded.creation_time,
+        restored_time = excluded.restored_time
+"""
+# only replaces an expired mapping, a live one is left untouched and not returned
+_INSERT_OR_RENEW = (
+    _UPSERT
+    + """
+    WHERE url_mappings.expiration_time <= excluded.creation_time
+    RETURNING short_url
+"""
+)
+# also leaves a live mapping alone, unless it is the same one stored by a
+# previous attempt
+_CREATE = (
+    _UPSERT
+    + """
+    WHERE url_mappings.expiration_time <= ?
+    OR url_mappings.short_url = excluded.short_url
+"""
+)
+_SELECT_SHORT_URL = """
+    SELECT short_url FROM url_mappings
+    WHERE algorithm = ? AND original_url = ? AND expiration_time > ?
+"""
+# the planner would pick the unique index, which lacks the expiration time
+_SELECT_ORIGINAL_URL = """
+    SELECT original_url FROM url_mappings
+    INDEXED BY url_mappings_short_url_expiration
+    WHERE algorithm = ? AND short_url = ? AND expiration_time > ?
+"""
+_SELECT_BY_SHORT_URL = f"""
+    SELECT {_MAPPING_COLUMNS} FROM url_mappings
+    WHERE algorithm = ? AND short_url = ?
+"""
+_SELECT_BY_ORIGINAL_URL = f"""
+    SELECT {_MAPPING_COLUMNS} FROM url_mappings
+    WHERE algorithm = ? AND original_url = ?
+"""
+_SELECT_PAGE = f"""
+    SELECT {_MAPPING_COLUMNS} FROM url_mappings
+    WHERE (creation_time >= ? OR restored_time >= ?)
+    AND (algorithm, original_url) > (?, ?)
+    ORDER BY algorithm, original_url LIMIT ?
+"""
+_RESERVE_IDS = """
+    INSERT INTO counters (name, value) VALUES ('url_mappings', ?)
+    ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+    RETURNING value
+"""
+_PURGE_EXPIRED = """
+    DELETE FROM url_mappings WHERE (algorithm, original_url) IN (
+        SELECT algorithm, original_url FROM url_mappings
+        WHERE expiration_time <= ? LIMIT ?
+    )
+    RETURNING algorithm, short_url
+"""
+# stays below SQLITE_MAX_VARIABLE_NUMBER of older sqlite versions
+_MAX_VARIABLES = 500
+
+
+class SqliteURLRepository(URLRepository):
+    """An embedded repository, for single node and edge deployments.
+
+    The database runs in WAL mode, so readers never wait for the writer. Every
+    operation checks a connection out of a pool of at most `sqlite_pool_size`,
+    which cache their prepared statements, and waits while they are all in use:
+    short-lived threads, e.g. one per request, never open connections of their
+    own. Expired mappings stay in the table until `purge_expired` deletes them.
+    """
+
+    def __init__(self, settings: ShortenerSettings):
+        self._settings = settings
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._expiration_offset = self._settings.expiration_offset
+        self._path = self._settings.sqlite_path
+        self._pool_size = self._settings.sqlite_pool_size
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._initialized = False
+
+    def initialize(self):
+        self._log.debug("opening sqlite database %s", self._path)
+        self._initialized = True
+        with self._connection() as connection:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+            self._add_restored_time(connection)
+        return self
+
+    def finalize(self):
+        self._log.debug("closing sqlite connections")
+        self._initialized = False
+        with self._lock:
+            while not self._idle.empty():
+                self._idle.get_nowait().close()
+            self._opened = 0
+
+    def __enter__(self):
+        return self.initialize()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        if not self._initialized:
+            raise Exception("SqliteURLRepository is not initialized")
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self._pool_size
+                if can_open:
+                    self._opened += 1
+            connection = self._open() if can_open else self._idle.get()
+        try:
+            yield connection
+        finally:
+            self._idle.put(connection)
+
+    def _open(self) -> sqlite3.Connection:
+        try:
+            # autocommit: every statement is its own transaction unless a
+            # `with connection` block groups them. A connection is used by one
+            # thread at a time, not always the same one
+            connection = sqlite3.connect(
+                self._path, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode = WAL")
+            # durable at checkpoints, which is enough for WAL in most setups
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute("PRAGMA busy_timeout = 5000")
+            return connection
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def save_url_mapping(self, original_url: str, short_url: str, algorithm: str):
+        current_time = current_date_in_seconds()
+        self._log.debug("Storing %s -> %s (%s)", original_url, short_url, algorithm)
+        try:
+            with self._connection() as connection:
+                connection.execute(
+                    _UPSERT,
+                    (
+                        algorithm,
+                        original_url,
+                        short_url,
+                        current_time + self._expiration_offset,
+                        current_time,
+                    ),
+                )
+        except sqlite3.IntegrityError:
+            raise ShortURLCollisionError(
+                f"{short_url} is already taken", original_urls=[original_url]
+            )
+
+    def get_or_create_short_url(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> tuple[str, bool]:
+        current_time = current_date_in_seconds()
+        with self._connection() as connection:
+            try:
+                # fetchall steps the statement to completion, which ends its write
+                rows = connection.execute(
+                    _INSERT_OR_RENEW,
+                    (
+                        algorithm,
+                        original_url,
+                        short_url,
+                        current_time + self._expiration_offset,
+                        current_time,
+                    ),
+                ).fetchall()
+            except sqlite3.IntegrityError:
+                # the primary key conflict is handled by the upsert, so this is
+                # the unique index on short urls
+                raise ShortURLCollisionError(
+                    f"{short_url} is already taken", original_urls=[original_url]
+                )
+            if rows:
+                return rows[0][0], True
+            # the url is mapped to a live short url, which the upsert left alone
+            row = connection.execute(
+                _SELECT_SHORT_URL, (algorithm, original_url, current_time)
+            ).fetchone()
+        return row[0], False
+
+    def get_short_url(self, original_url: str, algorithm: str) -> str | None:
+        row = self._fetchone(
+            _SELECT_SHORT_URL, (algorithm, original_url, current_date_in_seconds())
+        )
+        return row[0] if row else None
+
+    def get_original_url(self, short_url: str, algorithm: str) -> str | None:
+        row = self._fetchone(
+            _SELECT_ORIGINAL_URL, (algorithm, short_url, current_date_in_seconds())
+        )
+        return row[0] if row else None
+
+    def get_mapping_by_short_url(
+        self, short_url: str, algorithm: str
+    ) -> URLMapping | None:
+        row = self._fetchone(_SELECT_BY_SHORT_URL, (algorithm, short_url))
+        return URLMapping(*row) if row else None
+
+    def get_mapping_by_original_url(
+        self, original_url: str, algorithm: str
+    ) -> URLMapping | None:
+        row = self._fetchone(_SELECT_BY_ORIGINAL_URL, (algorithm, original_url))
+        return URLMapping(*row) if row else None
+
+    def save_url_mappings(self, url_mappings: dict[str, str], algorithm: str):
+        if not url_mappings:
+            return
+        current_time = current_date_in_seconds()
+        expiration_time = current_time + self._expiration_offset
+        self._log.debug("Storing %s url mappings (%s)", len(url_mappings), algorithm)
+        self._upsert_many(
+            (algorithm, original_url, short_url, expiration_time, current_time)
+            for original_url, short_url in url_mappings.items()
+        )
+
+    def restore_url_mappings(self, url_mappings: list[URLMapping]):
+        restored_time = current_date_in_seconds()
+        self._upsert_many(
+            (
+                (
+                    mapping.algorithm,
+                    mapping.original_url,
+                    mapping.short_url,
+                    mapping.expiration_time,
+                    mapping.creation_time,
+                    restored_time,
+                )
+                for mapping in url_mappings
+            ),
+            _RESTORE,
+        )
+
+    def create_url_mappings(self, url_mappings: list[URLMapping]) -> set[str]:
+        current_time = current_date_in_seconds()
+        rows = [
+            (
+                mapping.algorithm,
+                mapping.original_url,
+                mapping.short_url,
+                mapping.expiration_time,
+                mapping.creation_time,
+                current_time,
+            )
+            for mapping in url_mappings
+        ]
+        with self._connection() as connection, connection:
+            connection.execute("BEGIN")
+            try:
+                connection.executemany(_CREATE, rows)
+            except sqlite3.IntegrityError:
+                # a code is taken by another url, which stopped the batch there:
+                # the rows are written again one by one, which changes nothing
+                # for the ones already written
+                for row in rows:
+                    try:
+                        connection.execute(_CREATE, row)
+                    except sqlite3.IntegrityError:
+                        pass
+        # the urls mapped to another code, or to none, were not stored
+        by_algorithm = defaultdict(list)
+        for mapping in url_mappings:
+            by_algorithm[mapping.algorithm].append(mapping)
+        not_stored = set()
+        for algorithm, mappings in by_algorithm.items():
+            stored = self.get_short_urls([m.original_url for m in mappings], algorithm)
+            not_stored.update(
+                mapping.original_url
+                for mapping in mappings
+                if stored.get(mapping.original_url) != mapping.short_url
+            )
+        return not_stored
+
+    def delete_url_mappings(self, url_mappings: list[URLMapping]) -> int:
+        with self._connection() as connection, connection:
+            connection.execute("BEGIN")
+            return connection.executemany(
+                "DELETE FROM url_mappings "
+                "WHERE algorithm = ? AND original_url = ? AND short_url = ?",
+                [
+                    (mapping.algorithm, mapping.original_url, mapping.short_url)
+                    for mapping in url_mappings
+                ],
+            ).rowcount
+
+    def extend_expirations(
+        self, url_mappings: list[URLMapping], expiration_time: int, max_lifetime: int
+    ) -> int:
+        now = current_date_in_seconds()
+        with self._connection() as connection, connection:
+            connection.execute("BEGIN")
+            return connection.executemany(
+                "UPDATE url_mappings SET expiration_time = ? "
+                "WHERE algorithm = ? AND original_url = ? AND short_url = ? "
+                "AND expiration_time > ? AND expiration_time < ? "
+                "AND creation_time >= ?",
+                [
+                    (
+                        expiration_time,
+                        mapping.algorithm,
+                        mapping.original_url,
+                        mapping.short_url,
+                        now,
+                        expiration_time,
+                        expiration_time - max_lifetime,
+                    )
+                    for mapping in url_mappings
+                ],
+            ).rowcount
+
+    def get_short_urls(
+        self, original_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        return self._select_many("original_url", "short_url", original_urls, algorithm)
+
+    def get_original_urls(
+        self, short_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        return self._select_many("short_url", "original_url", short_urls, algorithm)
+
+    def iter_url_mappings(
+        self, batch_size: int, created_after: int = None
+    ) -> Iterator[URLMapping]:
+        # paginated on the primary key, so that no statement stays open between
+        # batches: callers may write in between, and a long read would hold
+        # back WAL checkpoints. The connection goes back to the pool in between
+        since = created_after if created_after is not None else 0
+        last_key = ("", "")
+        while True:
+            with self._connection() as connection:
+                rows = connection.execute(
+                    _SELECT_PAGE,
+                    (
+                        since,
+                        since,
+                        *last_key,
+                        batch_size,
+                    ),
+                ).fetchall()
+            for row in rows:
+                yield URLMapping(*row)
+            if len(rows) < batch_size:
+                return
+            last_key = (rows[-1][2], rows[-1][0])
+
+    def reserve_id_block(self, size: int) -> int:
+        with self._connection() as connection:
+            ((value,),) = connection.execute(_RESERVE_IDS, (size,)).fetchall()
+        return value - size
+
+    def purge_expired(
+        self,
+        batch_size: int,
+        on_purged: Callable[[list[tuple[str, str]]], None] = None,
+    ) -> int:
+        # deleted batch by batch, each in its own short transaction, so that the
+        # writers are never locked out for long; `on_purged` is given the
+        # algorithm and short url of the mappings of each batch
+        purged = 0
+        current_time = current_date_in_seconds()
+        while True:
+            with self._connection() as connection:
+                rows = connection.execute(
+                    _PURGE_EXPIRED, (current_time, batch_size)
+                ).fetchall()
+            purged += len(rows)
+            if on_purged and rows:
+                on_purged(rows)
+            if len(rows) < batch_size:
+                self._log.debug("purged %s expired url mappings", purged)
+                return purged
+
+    def reset(self):
+        self._log.debug("resetting repository")
+        with self._connection() as connection:
+            connection.execute("DELETE FROM url_mappings")
+
+    def _add_restored_time(self, connection: sqlite3.Connection):
+        # databases created by older versions lack the column
+        columns = {
+            row[1] for row in connection.execute("PRAGMA table_info(url_mappings)")
+        }
+        if "restored_time" in columns:
+            return
+        try:
+            connection.execute(
+                "ALTER TABLE url_mappings ADD COLUMN restored_time INTEGER"
+            )
+        except sqlite3.OperationalError as e:
+            # added by another process in between
+            if "duplicate column" not in str(e):
+                raise
+
+    def _upsert_many(self, rows: Iterable[tuple], statement: str = _UPSERT):
+        colliding_urls = []
+        # one transaction: a failed statement only rolls back its own row
+        with self._connection() as connection, connection:
+            connection.execute("BEGIN")
+            for row in rows:
+                try:
+                    connection.execute(statement, row)
+                except sqlite3.IntegrityError:
+                    colliding_urls.append(row[1])
+        if colliding_urls:
+            raise ShortURLCollisionError(
+                f"{len(colliding_urls)} short urls already taken",
+                original_urls=colliding_urls,
+            )
+
+    def _fetchone(self, query: str, parameters: tuple) -> tuple | None:
+        with self._connection() as connection:
+            return connection.execute(query, parameters).fetchone()
+
+    def _select_many(
+        self, key_column: str, value_column: str, urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        found = {}
+        current_time = current_date_in_seconds()
+        with self._connection() as connection:
+            for start in range(0, len(urls), _MAX_VARIABLES):
+                chunk = urls[start : start + _MAX_VARIABLES]
+                rows = connection.execute(
+                    f"SELECT {key_column}, {value_column} FROM url_mappings "
+                    f"WHERE algorithm = ? AND expiration_time > ? "
+                    f"AND {key_column} IN ({', '.join('?' * len(chunk))})",
+                    (algorithm, current_time, *chunk),
+                )
+                found.update(rows)
+        return found
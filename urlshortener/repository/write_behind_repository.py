@@ -0,0 +1,389 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Iterator
+
+from urlshortener.metrics import REGISTRY
+from urlshortener.repository.repository import (
+    ShortURLCollisionError,
+    URLMapping,
+    URLRepository,
+    current_date_in_seconds,
+)
+from urlshortener.settings import ShortenerSettings
+
+WRITE_BEHIND_MAPPINGS_TOTAL = REGISTRY.counter(
+    "urlshortener_write_behind_mappings_total",
+    "Mappings flushed by the write-behind buffer, by outcome",
+    ("outcome",),
+)
+
+BATCHED = "batched"
+FIRE_AND_FORGET = "fire-and-forget"
+
+# seconds before the first retry of a failed flush, doubled on every retry
+_RETRY_BACKOFF = 0.1
+
+
+class _PendingWrite:
+    __slots__ = ("mapping", "done", "error")
+
+    def __init__(self, mapping: URLMapping):
+        self.mapping = mapping
+        self.done = threading.Event()
+        self.error = None
+
+
+class WriteBehindURLRepository(URLRepository):
+    """Buffers the writes to any URLRepository and stores them in batches.
+
+    New mappings go to a pending buffer, which also serves reads, and a background
+    thread flushes it every `write_behind_flush_interval` seconds or as soon as
+    `write_behind_batch_size` mappings are pending. Failed batches are retried
+    `write_behind_max_retries` times. Writers block while the buffer holds
+    `write_behind_max_pending` mappings.
+
+    Flushes never overwrite a live mapping: a buffered mapping whose original or
+    short url was mapped meanwhile by another process is reported as a collision.
+    With the `batched` durability, writers wait until their batch is stored and
+    see its errors, collisions included. With `fire-and-forget`, they return once
+    the mapping is buffered: a mapping whose batch fails for good is lost, and
+    only logged.
+    """
+
+    def __init__(self, repository: URLRepository, settings: ShortenerSettings):
+        if settings.write_behind_durability not in (BATCHED, FIRE_AND_FORGET):
+            raise ValueError(
+                f"Unsupported durability {settings.write_behind_durability}"
+            )
+        self._repository = repository
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._durability = settings.write_behind_durability
+        self._expiration_offset = settings.expiration_offset
+        self._batch_size = settings.write_behind_batch_size
+        self._flush_interval = settings.write_behind_flush_interval
+        self._max_pending = settings.write_behind_max_pending
+        self._max_retries = settings.write_behind_max_retries
+        self._condition = threading.Condition()
+        # serializes the flushes of the background thread and the explicit ones
+        self._flush_lock = threading.Lock()
+        self._pending: OrderedDict[tuple[str, str], _PendingWrite] = OrderedDict()
+        self._pending_by_short_url: dict[tuple[str, str], _PendingWrite] = {}
+        self._flusher = None
+        self._closed = True
+
+    def initialize(self):
+        self._repository.initialize()
+        self._closed = False
+        self._flusher = threading.Thread(
+            target=self._run_flusher, name="write-behind-flusher", daemon=True
+        )
+        self._flusher.start()
+        return self
+
+    def finalize(self):
+        try:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+            if self._flusher:
+                self._flusher.join()
+            # whatever was enqueued while the flusher was stopping
+            self.flush()
+        finally:
+            self._repository.finalize()
+
+    def __enter__(self):
+        return self.initialize()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def flush(self):
+        """Stores every pending mapping before returning."""
+        while batch := self._next_batch():
+            self._flush(batch)
+
+    def save_url_mapping(self, original_url: str, short_url: str, algorithm: str):
+        self._wait(
+            self._enqueue([self._new_mapping(original_url, short_url, algorithm)])
+        )
+
+    def save_url_mappings(self, url_mappings: dict[str, str], algorithm: str):
+        self._wait(
+            self._enqueue(
+                [
+                    self._new_mapping(original_url, short_url, algorithm)
+                    for original_url, short_url in url_mappings.items()
+                ]
+            )
+        )
+
+    def get_or_create_short_url(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> tuple[str, bool]:
+        pending = self._pending_mapping(self._pending, algorithm, original_url)
+        if pending and not pending.is_expired():
+            return pending.short_url, False
+        existing_url = self._repository.get_short_url(original_url, algorithm)
+        if existing_url:
+            return existing_url, False
+
+        mapping = self._new_mapping(original_url, short_url, algorithm)
+        with self._condition:
+            # checked again under the lock, a concurrent minify may have won
+            pending = self._pending.get((algorithm, original_url))
+            if pending and not pending.mapping.is_expired():
+                return pending.mapping.short_url, False
+            taken = self._pending_by_short_url.get((algorithm, short_url))
+            if taken and taken.mapping.original_url != original_url:
+                raise ShortURLCollisionError(
+                    f"{short_url} is already taken", original_urls=[original_url]
+                )
+            writes = self._put([mapping])
+        try:
+            self._wait(writes)
+        except ShortURLCollisionError:
+            # another process may have minified the url since it was looked up
+            existing_url = self._repository.get_short_url(original_url, algorithm)
+            if existing_url:
+                return existing_url, False
+            raise
+        return short_url, True
+
+    def get_short_url(self, original_url: str, algorithm: str) -> str | None:
+        pending = self._pending_mapping(self._pending, algorithm, original_url)
+        if pending:
+            return None if pending.is_expired() else pending.short_url
+        return self._repository.get_short_url(original_url, algorithm)
+
+    def get_original_url(self, short_url: str, algorithm: str) -> str | None:
+        pending = self._pending_mapping(
+            self._pending_by_short_url, algorithm, short_url
+        )
+        if pending:
+            return None if pending.is_expired() else pending.original_url
+        return self._repository.get_original_url(short_url, algorithm)
+
+    def get_short_urls(
+        self, original_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        found, missing = self._split_pending(self._pending, original_urls, algorithm)
+        found = {url: mapping.short_url for url, mapping in found.items()}
+        if missing:
+            found.update(self._repository.get_short_urls(missing, algorithm))
+        return found
+
+    def get_original_urls(
+        self, short_urls: list[str], algorithm: str
+    ) -> dict[str, str]:
+        found, missing = self._split_pending(
+            self._pending_by_short_url, short_urls, algorithm
+        )
+        found = {url: mapping.original_url for url, mapping in found.items()}
+        if missing:
+            found.update(self._repository.get_original_urls(missing, algorithm))
+        return found
+
+    def get_mapping_by_short_url(
+        self, short_url: str, algorithm: str
+    ) -> URLMapping | None:
+        return self._pending_mapping(
+            self._pending_by_short_url, algorithm, short_url
+        ) or self._repository.get_mapping_by_short_url(short_url, algorithm)
+
+    def get_mapping_by_original_url(
+        self, original_url: str, algorithm: str
+    ) -> URLMapping | None:
+        return self._pending_mapping(
+            self._pending, algorithm, original_url
+        ) or self._repository.get_mapping_by_original_url(original_url, algorithm)
+
+    def iter_url_mappings(
+        self, batch_size: int, created_after: int = None
+    ) -> Iterator[URLMapping]:
+        self.flush()
+        return self._repository.iter_url_mappings(batch_size, created_after)
+
+    def restore_url_mappings(self, url_mappings: list[URLMapping]):
+        self.flush()
+        self._repository.restore_url_mappings(url_mappings)
+
+    def delete_url_mappings(self, url_mappings: list[URLMapping]) -> int:
+        # flushed first, so that a pending write does not bring them back
+        self.flush()
+        return self._repository.delete_url_mappings(url_mappings)
+
+    def extend_expirations(
+        self, url_mappings: list[URLMapping], expiration_time: int, max_lifetime: int
+    ) -> int:
+        # flushed first, so that the pending mappings are extended as well
+        self.flush()
+        return self._repository.extend_expirations(
+            url_mappings, expiration_time, max_lifetime
+        )
+
+    def reserve_id_block(self, size: int) -> int:
+        return self._repository.reserve_id_block(size)
+
+    def reset(self):
+        with self._condition:
+            writes = list(self._pending.values())
+            self._pending.clear()
+            self._pending_by_short_url.clear()
+            self._condition.notify_all()
+        for write in writes:
+            write.done.set()
+        self._repository.reset()
+
+    def _new_mapping(
+        self, original_url: str, short_url: str, algorithm: str
+    ) -> URLMapping:
+        current_time = current_date_in_seconds()
+        return URLMapping(
+            original_url=original_url,
+            short_url=short_url,
+            algorithm=algorithm,
+            expiration_time=current_time + self._expiration_offset,
+            creation_time=current_time,
+        )
+
+    def _enqueue(self, mappings: list[URLMapping]) -> list[_PendingWrite]:
+        with self._condition:
+            return self._put(mappings)
+
+    def _put(self, mappings: list[URLMapping]) -> list[_PendingWrite]:
+        # called with the condition held
+        while len(self._pending) >= self._max_pending and not self._closed:
+            # backpressure: writers wait for the flusher to catch up
+            self._condition.wait()
+        writes = []
+        for mapping in mappings:
+            write = _PendingWrite(mapping)
+            key = (mapping.algorithm, mapping.original_url)
+            replaced = self._pending.pop(key, None)
+            if replaced:
+                self._pop_short_url(replaced)
+            self._pending[key] = write
+            self._pending_by_short_url[(mapping.algorithm, mapping.short_url)] = write
+            writes.append(write)
+        if len(self._pending) >= self._batch_size:
+            self._condition.notify_all()
+        return writes
+
+    def _wait(self, writes: list[_PendingWrite]):
+        if self._closed:
+            self.flush()
+        if self._durability != BATCHED:
+            return
+        for write in writes:
+            write.done.wait()
+        errors = [write for write in writes if write.error]
+        if not errors:
+            return
+        collisions = [
+            write.mapping.original_url
+            for write in errors
+            if isinstance(write.error, ShortURLCollisionError)
+        ]
+        if len(collisions) < len(errors):
+            raise next(write.error for write in errors)
+        raise ShortURLCollisionError(
+            f"{len(collisions)} short urls already taken", original_urls=collisions
+        )
+
+    def _pending_mapping(
+        self, pending: dict, algorithm: str, url: str
+    ) -> URLMapping | None:
+        write = pending.get((algorithm, url))
+        return write.mapping if write else None
+
+    def _split_pending(
+        self, pending: dict, urls: list[str], algorithm: str
+    ) -> tuple[dict[str, URLMapping], list[str]]:
+        found, missing = {}, []
+        for url in urls:
+            mapping = self._pending_mapping(pending, algorithm, url)
+            if mapping is None:
+                missing.append(url)
+            elif not mapping.is_expired():
+                found[url] = mapping
+        return found, missing
+
+    def _pop_short_url(self, write: _PendingWrite):
+        key = (write.mapping.algorithm, write.mapping.short_url)
+        if self._pending_by_short_url.get(key) is write:
+            del self._pending_by_short_url[key]
+
+    def _run_flusher(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._closed or len(self._pending) >= self._batch_size,
+                    timeout=self._flush_interval,
+                )
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def _next_batch(self) -> list[_PendingWrite]:
+        with self._condition:
+            return list(islice(self._pending.values(), self._batch_size))
+
+    def _flush(self, batch: list[_PendingWrite]):
+        with self._flush_lock:
+            # a concurrent flush may have stored part of the batch already
+            with self._condition:
+                batch = [
+                    write
+                    for write in batch
+                    if self._pending.get(
+                        (write.mapping.algorithm, write.mapping.original_url)
+                    )
+                    is write
+                ]
+            if not batch:
+                return
+            error, colliding_urls = self._store([write.mapping for write in batch])
+            with self._condition:
+                for write in batch:
+                    key = (write.mapping.algorithm, write.mapping.original_url)
+                    # the mapping may have been replaced while being stored
+                    if self._pending.get(key) is write:
+                        del self._pending[key]
+                        self._pop_short_url(write)
+                    if error:
+                        write.error = error
+                        outcome = "dropped"
+                    elif write.mapping.original_url in colliding_urls:
+                        write.error = ShortURLCollisionError(
+                            f"{write.mapping.short_url} is already taken",
+                            original_urls=[write.mapping.original_url],
+                        )
+                        outcome = "collision"
+                    else:
+                        outcome = "stored"
+                    WRITE_BEHIND_MAPPINGS_TOTAL.inc(outcome)
+                    write.done.set()
+                self._condition.notify_all()
+
+    def _store(self, mappings: list[URLMapping]) -> tuple[Exception, set[str]]:
+        for attempt in range(self._max_retries + 1):
+            try:
+                # never overwrites the live mappings stored meanwhile by another
+                # process, whose urls or codes are reported as taken
+                not_stored = self._repository.create_url_mappings(mappings)
+                if not_stored:
+                    self._log.warning("%s url mappings lost a race", len(not_stored))
+                return None, not_stored
+            except Exception as e:
+                if attempt == self._max_retries:
+                    self._log.error("dropping %s url mappings: %s", len(mappings), e)
+                    return e, set()
+                self._log.warning(
+                    "storing %s url mappings failed: %s", len(mappings), e
+                )
+                time.sleep(_RETRY_BACKOFF * 2**attempt)
@@ -0,0 +1,237 @@
+import json
+import logging
+import os
+import signal
+import socket
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithm
+from urlshortener.factory import open_shortener
+from urlshortener.metrics import REGISTRY
+from urlshortener.repository.factory import build_serving_repository
+from urlshortener.repository.repository import ShortURLCollisionError
+from urlshortener.settings import ShortenerSettings
+from urlshortener.tracing import TRACER
+from urlshortener.url_shortener import URLShortener
+
+HEALTH_PATH = "/healthz"
+METRICS_PATH = "/metrics"
+
+
+class RedirectRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps the connection alive between requests
+    protocol_version = "HTTP/1.1"
+    server: "RedirectServer"
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == HEALTH_PATH:
+            self._send(HTTPStatus.OK, b"ok", "text/plain")
+            return
+        if path == METRICS_PATH:
+            self._send(HTTPStatus.OK, REGISTRY.render().encode(), REGISTRY.CONTENT_TYPE)
+            return
+
+        code = path.lstrip("/")
+        if not code:
+            self._send(HTTPStatus.NOT_FOUND)
+            return
+
+        # the request spans the lookup and the response, the request line and
+        # headers being read before
+        with TRACER.span("http.redirect"):
+            try:
+                mapping = self.server.shortener.resolve(
+                    short_url=f"{self.server.fixed_domain}{code}",
+                    algorithm=self.server.algorithm,
+                )
+            except Exception as e:
+                self.server.log.error("lookup of %s failed: %s", code, e)
+                self._send(HTTPStatus.SERVICE_UNAVAILABLE)
+                return
+            if not mapping:
+                self._send(HTTPStatus.NOT_FOUND)
+            elif mapping.is_expired():
+                self._send(HTTPStatus.GONE)
+            else:
+                self._send(
+                    self.server.redirect_status,
+                    headers={"Location": mapping.original_url},
+                )
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/":
+            self._send(HTTPStatus.NOT_FOUND)
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length < 0:
+                raise ValueError
+        except ValueError:
+            # the body cannot be told from the next request
+            self.close_connection = True
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": "Invalid Content-Length"})
+            return
+        try:
+            url = self._parse_url(self.rfile.read(length))
+        except ValueError as e:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+
+        with TRACER.span("http.minify"):
+            try:
+                short_url = self.server.shortener.minify(
+                    url=url, algorithm=self.server.algorithm
+                )
+            except ShortURLCollisionError as e:
+                # every code tried for the url is taken by another one
+                self.server.log.warning("%s", e)
+                self._send_json(HTTPStatus.CONFLICT, {"error": str(e)})
+                return
+            except Exception as e:
+                self.server.log.error("minify of %s failed: %s", url, e)
+                self._send_json(
+                    HTTPStatus.SERVICE_UNAVAILABLE, {"error": "Storage unavailable"}
+                )
+                return
+            self._send_json(HTTPStatus.CREATED, {"url": url, "short_url": short_url})
+
+    def log_message(self, format, *args):
+        self.server.log.debug(format, *args)
+
+    def _parse_url(self, body: bytes) -> str:
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            try:
+                url = json.loads(body).get("url")
+            except (json.JSONDecodeError, AttributeError):
+                raise ValueError("Invalid JSON body")
+        else:
+            url = body.decode().strip()
+        parsed = urlparse(url)
+        if not url or not parsed.scheme or not parsed.netloc:
+            raise ValueError(f"'{url}' is not a valid URL")
+        return url
+
+    def _send_json(self, status: HTTPStatus, payload: dict):
+        self._send(status, json.dumps(payload).encode(), "application/json")
+
+    def _send(
+        self,
+        status: int,
+        body: bytes = b"",
+        content_type: str = None,
+        headers: dict[str, str] = None,
+    ):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+
+def check_settings(settings: ShortenerSettings):
+    # without a fixed domain, short urls take the domain of their original url,
+    # which a request for a code does not tell
+    if not settings.fixed_domain:
+        raise ValueError("The redirect server needs urlshortener_fixed_domain")
+
+
+class RedirectServer(ThreadingHTTPServer):
+    """A thread-per-connection HTTP server; every thread of the process shares the
+    same URLShortener, hence the same repository connection pool. The codes it
+    redirects are the ones of short urls on the fixed domain.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        shortener: URLShortener,
+        algorithm: ShorteningAlgorithm,
+        settings: ShortenerSettings,
+    ):
+        check_settings(settings)
+        super().__init__(
+            sock.getsockname()[:2], RedirectRequestHandler, bind_and_activate=False
+        )
+        # the listening socket is created once and inherited by every worker
+        self.socket.close()
+        self.socket = sock
+        self.shortener = shortener
+        self.algorithm = algorithm
+        self.fixed_domain = settings.fixed_domain
+        self.redirect_status = settings.redirect_status_code
+        self.log = logging.getLogger(self.__class__.__name__)
+
+
+def create_listening_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(socket.SOMAXCONN)
+    return sock
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _serve_worker(sock: socket.socket, settings: ShortenerSettings):
+    log = logging.getLogger("RedirectServer")
+    repository = build_serving_repository(settings)
+    with open_shortener(settings, repository) as (shortener, algorithm):
+        server = RedirectServer(sock, shortener, algorithm, settings)
+        # stopped like on ctrl-c, so that pending writes are flushed
+        signal.signal(signal.SIGTERM, _interrupt)
+        log.debug("worker %s serving on %s", os.getpid(), server.server_address)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+def serve(settings: ShortenerSettings, host: str, port: int, workers: int):
+    check_settings(settings)
+    log = logging.getLogger("RedirectServer")
+    sock = create_listening_socket(host, port)
+    log.info("listening on %s:%s with %s worker(s)", host, port, workers)
+    if workers == 1:
+        _serve_worker(sock, settings)
+        return
+
+    # pre-fork: each worker accepts on the shared socket and opens its own
+    # repository after the fork, as mongo clients are not fork-safe
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # until the worker installs its own handler
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                _serve_worker(sock, settings)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def _terminate(signum, frame):
+        for child in children:
+            os.kill(child, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        for child in children:
+            os.waitpid(child, 0)
+    except KeyboardInterrupt:
+        _terminate(signal.SIGINT, None)
+    finally:
+        sock.close()
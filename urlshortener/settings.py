@@ -1,20 +1,105 @@
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithmType
+from urlshortener.client import default_socket_path
 
 
 class ShortenerSettings(BaseSettings):
     model_config = SettingsConfigDict(
         env_file=".env", env_file_encoding="utf-8", env_prefix="urlshortener_"
     )
+    storage_backend: Literal["mongo", "sqlite", "mmap"] = Field(default="mongo")
+    sqlite_path: str = Field(default="urlshortener.db")
+    sqlite_pool_size: int = Field(default=8, gt=0)
+    mmap_index_path: str = Field(default="urlshortener.index")
+    mmap_refresh_interval: float = Field(default=5, ge=0)  # seconds
     mongo_instance_url: str = Field(default="mongodb://localhost:27017/")
     database_name: str = Field(default="urlshortener")
     expiration_offset: int = Field(default=3600, gt=0)  # 1 hour by default
     mongo_url_collection: str = Field(default="urls")
+    mongo_schema: Literal["full", "compact"] = Field(default="full")
+    mongo_compact_url_collection: str = Field(default="urls_compact")
+    mongo_namespace_collection: str = Field(default="namespaces")
     shortening_algorithm: ShorteningAlgorithmType = Field(
         default=ShorteningAlgorithmType.BASE64
     )
     fixed_domain: Optional[str] = Field(default=None)
+    batch_size: int = Field(default=1000, gt=0)
+    cache_max_entries: int = Field(default=10000, gt=0)
+    cache_negative_ttl: int = Field(default=5, ge=0)
+    cache_max_staleness: Optional[float] = Field(default=None, gt=0)  # seconds
+    cache_invalidation_enabled: bool = Field(default=False)
+    cache_invalidation_poll_interval: float = Field(default=1, gt=0)  # seconds
+    cache_invalidation_batch_interval: float = Field(default=0.05, gt=0)  # seconds
+    cache_invalidation_batch_size: int = Field(default=1000, gt=0)
+    server_host: str = Field(default="127.0.0.1")
+    server_port: int = Field(default=5000, ge=0)
+    server_workers: int = Field(default=1, gt=0)
+    redirect_status_code: Literal[301, 302] = Field(default=302)
+    mongo_counter_collection: str = Field(default="counters")
+    id_block_size: int = Field(default=100, gt=0)
+    hash_code_length: int = Field(default=7, ge=4, le=16)
+    hash_code_alphabet: Literal["base62", "base58"] = Field(default="base62")
+    hash_code_max_length: int = Field(default=12, ge=4, le=16)
+    hash_collision_threshold: float = Field(default=0.01, gt=0, lt=1)
+    max_collision_retries: int = Field(default=3, ge=0)
+    mongo_legacy_expiration: bool = Field(default=False)
+    mongo_read_preference: Literal[
+        "primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"
+    ] = Field(default="primary")
+    mongo_max_staleness: Optional[int] = Field(default=None, ge=90)  # seconds
+    mongo_read_your_writes_window: float = Field(default=10, ge=0)  # seconds
+    mongo_hedged_reads: bool = Field(default=False)
+    mongo_hedge_delay_ms: int = Field(default=20, gt=0)
+    mongo_max_pool_size: int = Field(default=100, gt=0)
+    mongo_min_pool_size: int = Field(default=0, ge=0)
+    mongo_connect_timeout_ms: int = Field(default=20000, gt=0)
+    mongo_socket_timeout_ms: Optional[int] = Field(default=None, gt=0)
+    mongo_server_selection_timeout_ms: int = Field(default=30000, gt=0)
+    mongo_compressors: list[Literal["snappy", "zlib", "zstd"]] = Field(default=[])
+    mongo_shard_urls: list[str] = Field(default=[])
+    mongo_previous_shard_urls: list[str] = Field(default=[])
+    mongo_counter_shard_url: Optional[str] = Field(default=None)
+    shard_virtual_nodes: int = Field(default=100, gt=0)
+    bloom_filter_enabled: bool = Field(default=False)
+    bloom_capacity: int = Field(default=1000000, gt=0)
+    bloom_error_rate: float = Field(default=0.001, gt=0, lt=1)
+    bloom_path: Optional[str] = Field(default=None)
+    bloom_refresh_interval: int = Field(default=60, ge=0)
+    write_behind_durability: Literal["sync", "batched", "fire-and-forget"] = Field(
+        default="sync"
+    )
+    write_behind_batch_size: int = Field(default=500, gt=0)
+    write_behind_flush_interval: float = Field(default=0.05, gt=0)  # seconds
+    write_behind_max_pending: int = Field(default=10000, gt=0)
+    write_behind_max_retries: int = Field(default=3, ge=0)
+    daemon_socket: str = Field(default_factory=default_socket_path)
+    analytics_enabled: bool = Field(default=False)
+    analytics_flush_interval: float = Field(default=10, gt=0)  # seconds
+    analytics_max_keys: int = Field(default=50000, gt=0)
+    analytics_top_keys: int = Field(default=100, gt=0)
+    analytics_sketch_width: int = Field(default=65536, gt=0)
+    analytics_sketch_depth: int = Field(default=4, gt=0)
+    sliding_expiration_enabled: bool = Field(default=False)
+    sliding_expiration_refresh_interval: float = Field(default=10, gt=0)  # seconds
+    sliding_expiration_max_lifetime: int = Field(default=604800, gt=0)  # 7 days
+    sliding_expiration_max_pending: int = Field(default=100000, gt=0)
+    mongo_stats_collection: str = Field(default="url_stats")
+    key_pool_code_length: int = Field(default=7, ge=4, le=10)
+    key_pool_lease_size: int = Field(default=1000, gt=0)
+    key_pool_local_low_watermark: int = Field(default=250, ge=0)
+    key_pool_depth: int = Field(default=1000000, gt=0)
+    key_pool_low_watermark: int = Field(default=100000, ge=0)
+    key_pool_lease_ttl: int = Field(default=3600, gt=0)
+    mongo_key_pool_collection: str = Field(default="key_pool")
+    tracing_enabled: bool = Field(default=False)
+    tracing_sampler: Literal["head", "tail"] = Field(default="head")
+    tracing_sample_rate: float = Field(default=0.01, ge=0, le=1)
+    tracing_slow_threshold_ms: float = Field(default=100, ge=0)
+    tracing_max_traces: int = Field(default=1000, gt=0)
+    tracing_format: Literal["chrome", "otlp"] = Field(default="chrome")
+    tracing_path: str = Field(default="urlshortener-traces-{pid}.json")
+    tracing_flush_interval: float = Field(default=10, gt=0)  # seconds
@@ -0,0 +1,319 @@
+import gzip
+import json
+import logging
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum
+from itertools import chain
+from typing import BinaryIO, Iterator, NamedTuple
+
+from urlshortener.batch import chunked
+from urlshortener.repository.repository import (
+    ShortURLCollisionError,
+    URLMapping,
+    URLRepository,
+    current_date_in_seconds,
+)
+
+# binary snapshots are a header, zlib compressed blocks of records each prefixed
+# with its size and record count, an empty block, then an index of the blocks
+# (offset and record count) and a footer locating it. The footer tells a
+# complete snapshot from a truncated one
+_MAGIC = b"USSN"
+_FOOTER_MAGIC = b"USSE"
+_VERSION = 1
+_HEADER = struct.Struct("<4sBq")  # magic, version, creation time
+_BLOCK = struct.Struct("<II")  # compressed size, records
+_INDEX_ENTRY = struct.Struct("<QI")  # offset, records
+_FOOTER = struct.Struct("<QQ4s")  # index offset, records, magic
+# expiration time, creation time, then the sizes of the original url, short
+# url and algorithm, which follow as utf-8
+_RECORD = struct.Struct("<qqIIB")
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_NDJSON_FORMAT = "urlshortener-snapshot"
+
+
+class SnapshotFormat(str, Enum):
+    BINARY = "binary"
+    NDJSON = "ndjson"
+
+    def __str__(self) -> str:
+        return str(self.value)
+
+
+class SnapshotError(Exception):
+    """The file is not a complete snapshot."""
+
+
+class SnapshotImport(NamedTuple):
+    restored: int = 0
+    # expired between the export and the import
+    expired: int = 0
+    # their short url is mapped to another url in the store
+    collisions: int = 0
+
+    def merged(self, other: "SnapshotImport") -> "SnapshotImport":
+        return SnapshotImport(*(mine + theirs for mine, theirs in zip(self, other)))
+
+
+def _encode_block(mappings: list[URLMapping]) -> bytes:
+    parts = []
+    for mapping in mappings:
+        original_url = mapping.original_url.encode()
+        short_url = mapping.short_url.encode()
+        algorithm = mapping.algorithm.encode()
+        parts.append(
+            _RECORD.pack(
+                mapping.expiration_time,
+                mapping.creation_time,
+                len(original_url),
+                len(short_url),
+                len(algorithm),
+            )
+        )
+        parts += (original_url, short_url, algorithm)
+    return zlib.compress(b"".join(parts))
+
+
+def _decode_block(data: bytes, records: int) -> list[URLMapping]:
+    try:
+        data = zlib.decompress(data)
+    except zlib.error:
+        raise SnapshotError("Corrupted block")
+    mappings = []
+    offset = 0
+    try:
+        for _ in range(records):
+            (
+                expiration_time,
+                creation_time,
+                original_size,
+                short_size,
+                algorithm_size,
+            ) = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+            original_end = offset + original_size
+            short_end = original_end + short_size
+            algorithm_end = short_end + algorithm_size
+            mappings.append(
+                URLMapping(
+                    data[offset:original_end].decode(),
+                    data[original_end:short_end].decode(),
+                    data[short_end:algorithm_end].decode(),
+                    expiration_time,
+                    creation_time,
+                )
+            )
+            offset = algorithm_end
+    except (struct.error, UnicodeDecodeError):
+        raise SnapshotError("Corrupted block")
+    if offset != len(data):
+        raise SnapshotError("Corrupted block")
+    return mappings
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise SnapshotError("Truncated snapshot")
+    return data
+
+
+def _write_binary(
+    stream: BinaryIO, batches: Iterator[list[URLMapping]], created_at: int
+) -> int:
+    stream.write(_HEADER.pack(_MAGIC, _VERSION, created_at))
+    index = []
+    for mappings in batches:
+        block = _encode_block(mappings)
+        index.append((stream.tell(), len(mappings)))
+        stream.write(_BLOCK.pack(len(block), len(mappings)))
+        stream.write(block)
+    stream.write(_BLOCK.pack(0, 0))
+    index_offset = stream.tell()
+    for entry in index:
+        stream.write(_INDEX_ENTRY.pack(*entry))
+    count = sum(records for _, records in index)
+    stream.write(_FOOTER.pack(index_offset, count, _FOOTER_MAGIC))
+    return count
+
+
+def _read_binary(stream: BinaryIO) -> Iterator[list[URLMapping]]:
+    magic, version, _ = _HEADER.unpack(_read_exactly(stream, _HEADER.size))
+    if magic != _MAGIC:
+        raise SnapshotError("Not a snapshot")
+    if version != _VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {version}")
+    for offset, records in _read_index(stream):
+        stream.seek(offset)
+        size, _ = _BLOCK.unpack(_read_exactly(stream, _BLOCK.size))
+        yield _decode_block(_read_exactly(stream, size), records)
+
+
+def _read_index(stream: BinaryIO) -> list[tuple[int, int]]:
+    # the footer, the index and the block headers are checked before any block
+    # is decoded, so that nothing is restored from a truncated snapshot
+    end = stream.seek(0, os.SEEK_END)
+    if end < _HEADER.size + _BLOCK.size + _FOOTER.size:
+        raise SnapshotError("Truncated snapshot")
+    stream.seek(end - _FOOTER.size)
+    index_offset, count, magic = _FOOTER.unpack(_read_exactly(stream, _FOOTER.size))
+    if magic != _FOOTER_MAGIC:
+        raise SnapshotError("Truncated snapshot")
+    index_size = end - _FOOTER.size - index_offset
+    if index_offset < _HEADER.size + _BLOCK.size or index_size % _INDEX_ENTRY.size:
+        raise SnapshotError("Corrupted snapshot index")
+    stream.seek(index_offset)
+    data = _read_exactly(stream, index_size)
+    index = [
+        _INDEX_ENTRY.unpack_from(data, offset)
+        for offset in range(0, index_size, _INDEX_ENTRY.size)
+    ]
+    # the blocks follow each other from the header to the empty one ending them
+    offset = _HEADER.size
+    for block_offset, records in index:
+        stream.seek(offset)
+        size, block_records = _BLOCK.unpack(_read_exactly(stream, _BLOCK.size))
+        if block_offset != offset or not size or block_records != records:
+            raise SnapshotError("Corrupted snapshot index")
+        offset += _BLOCK.size + size
+    stream.seek(offset)
+    if (
+        offset + _BLOCK.size != index_offset
+        or _BLOCK.unpack(_read_exactly(stream, _BLOCK.size)) != (0, 0)
+        or count != sum(records for _, records in index)
+    ):
+        raise SnapshotError("Corrupted snapshot index")
+    return index
+
+
+def _write_ndjson(
+    stream: BinaryIO, batches: Iterator[list[URLMapping]], created_at: int
+) -> int:
+    count = 0
+    with gzip.open(stream, "wt", encoding="utf-8") as lines:
+        header = {"format": _NDJSON_FORMAT, "version": _VERSION, "created": created_at}
+        lines.write(f"{json.dumps(header)}\n")
+        for mappings in batches:
+            lines.writelines(
+                f"{json.dumps(mapping._asdict())}\n" for mapping in mappings
+            )
+            count += len(mappings)
+        lines.write(f"{json.dumps({'count': count})}\n")
+    return count
+
+
+def _check_ndjson(stream: BinaryIO):
+    # a first pass counts the records against the trailer, so that nothing is
+    # restored from a truncated snapshot
+    with gzip.open(stream, "rt", encoding="utf-8") as lines:
+        header = json.loads(next(lines, "{}"))
+        if header.get("format") != _NDJSON_FORMAT:
+            raise SnapshotError("Not a snapshot")
+        if header.get("version") != _VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {header['version']}")
+        count = -1
+        last = "{}"
+        for count, last in enumerate(lines):
+            pass
+        if json.loads(last).get("count") != count:
+            raise SnapshotError("Truncated snapshot")
+    stream.seek(0)
+
+
+def _read_ndjson(stream: BinaryIO, batch_size: int) -> Iterator[list[URLMapping]]:
+    _check_ndjson(stream)
+    with gzip.open(stream, "rt", encoding="utf-8") as lines:
+        next(lines)
+        records = (json.loads(line) for line in lines)
+        for chunk in chunked(records, batch_size):
+            if "count" in chunk[-1]:
+                chunk.pop()
+            if chunk:
+                yield [URLMapping(**record) for record in chunk]
+
+
+def export_snapshot(
+    repository: URLRepository,
+    path: str,
+    snapshot_format: SnapshotFormat = SnapshotFormat.BINARY,
+    batch_size: int = 1000,
+) -> int:
+    """Writes the live mappings of the repository to `path` and returns how many.
+
+    Mappings are read through `iter_url_mappings`, `batch_size` at a time, so the
+    memory used does not depend on the size of the store.
+    """
+    now = current_date_in_seconds()
+    live_mappings = (
+        mapping
+        for mapping in repository.iter_url_mappings(batch_size=batch_size)
+        if not mapping.is_expired(now)
+    )
+    write = _write_binary if snapshot_format == SnapshotFormat.BINARY else _write_ndjson
+    # written aside then renamed, an interrupted export leaves no partial snapshot
+    with open(f"{path}.tmp", "wb") as stream:
+        count = write(stream, chunked(live_mappings, batch_size), now)
+    os.replace(f"{path}.tmp", path)
+    logging.getLogger("Snapshot").debug("%s url mappings exported to %s", count, path)
+    return count
+
+
+def read_snapshot(path: str, batch_size: int = 1000) -> Iterator[list[URLMapping]]:
+    """The mappings of a snapshot of either format, in batches.
+
+    Raises SnapshotError before the first batch if the snapshot is truncated, or
+    when a corrupted block is read.
+    """
+    with open(path, "rb") as stream:
+        magic = stream.read(len(_MAGIC))
+        stream.seek(0)
+        if not magic.startswith(_GZIP_MAGIC):
+            yield from _read_binary(stream)
+            return
+        try:
+            yield from _read_ndjson(stream, batch_size)
+        except (EOFError, gzip.BadGzipFile, zlib.error, json.JSONDecodeError):
+            raise SnapshotError("Truncated snapshot")
+
+
+def _restore(repository: URLRepository, mappings: list[URLMapping]) -> SnapshotImport:
+    now = current_date_in_seconds()
+    live_mappings = [mapping for mapping in mappings if not mapping.is_expired(now)]
+    expired = len(mappings) - len(live_mappings)
+    try:
+        repository.restore_url_mappings(live_mappings)
+    except ShortURLCollisionError as e:
+        # the rest of the batch is stored
+        return SnapshotImport(
+            len(live_mappings) - len(e.original_urls), expired, len(e.original_urls)
+        )
+    return SnapshotImport(len(live_mappings), expired, 0)
+
+
+def import_snapshot(
+    repository: URLRepository, path: str, batch_size: int = 1000, write_workers: int = 4
+) -> SnapshotImport:
+    """Restores the mappings of a snapshot, times included, in bulk writes of
+    `batch_size` mappings issued by `write_workers` threads.
+
+    Mappings that expired since the export are skipped. Existing mappings of the
+    same original urls are replaced. A truncated snapshot is rejected before
+    anything is restored.
+    """
+    result = SnapshotImport()
+    batches = chunked(chain.from_iterable(read_snapshot(path, batch_size)), batch_size)
+    with ThreadPoolExecutor(max_workers=write_workers) as writers:
+        # a few batches ahead of the writers at most, the memory used stays flat
+        pending: deque[Future] = deque()
+        for mappings in batches:
+            if len(pending) >= 2 * write_workers:
+                result = result.merged(pending.popleft().result())
+            pending.append(writers.submit(_restore, repository, mappings))
+        for future in pending:
+            result = result.merged(future.result())
+    return result
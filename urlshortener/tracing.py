@@ -0,0 +1,351 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Literal
+
+from urlshortener.settings import ShortenerSettings
+
+# spans are recorded for the thread that opens them; the first span opened by
+# a thread is the root of a trace, which ends with it. Traces are sampled as a
+# whole: either when their root opens (head-based, one in `sample_rate`), or
+# when it closes, if it lasted at least `slow_threshold_ms` (tail-based)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Trace:
+    __slots__ = ("trace_id", "thread_id", "stack", "spans")
+
+    def __init__(self):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.thread_id = threading.get_native_id()
+        self.stack: list[Span] = []
+        self.spans: list[Span] = []
+
+
+class Span:
+    __slots__ = (
+        "_tracer",
+        "_trace",
+        "name",
+        "attributes",
+        "span_id",
+        "parent_id",
+        "start_ns",
+        "end_ns",
+    )
+
+    def __init__(self, tracer: "Tracer", trace: _Trace, name: str, attributes: dict):
+        self._tracer = tracer
+        self._trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = None
+
+    def __enter__(self):
+        stack = self._trace.stack
+        if stack:
+            self.parent_id = stack[-1].span_id
+        stack.append(self)
+        self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.end_ns = time.time_ns()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        trace = self._trace
+        trace.stack.pop()
+        trace.spans.append(self)
+        if not trace.stack:
+            self._tracer._end_trace(trace, self)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class _UnsampledRoot:
+    """The root span of a trace left out by head-based sampling: the spans
+    opened under it are not recorded either."""
+
+    __slots__ = ("_local",)
+
+    def __init__(self, local: threading.local):
+        self._local = local
+
+    def __enter__(self):
+        self._local.trace = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._local.trace = None
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+class Tracer:
+    """Records nested spans of the processing of each request.
+
+    While disabled, `span` returns a shared span that records nothing, so a
+    traced block costs one call. The latest `max_traces` sampled traces are kept
+    and exported with `export`.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._traces: deque[_Trace] = deque()
+        self._sampler = "head"
+        self._sample_rate = 0.0
+        self._slow_threshold_ns = 0
+        self.span = self._noop_span
+
+    @property
+    def enabled(self) -> bool:
+        return self.span != self._noop_span
+
+    def enable(
+        self,
+        sampler: Literal["head", "tail"] = "head",
+        sample_rate: float = 1.0,
+        slow_threshold_ms: float = 0,
+        max_traces: int = 1000,
+    ):
+        with self._lock:
+            self._sampler = sampler
+            self._sample_rate = sample_rate
+            self._slow_threshold_ns = int(slow_threshold_ms * 1_000_000)
+            self._traces = deque(self._traces, maxlen=max_traces)
+        self.span = self._recording_span
+
+    def disable(self):
+        self.span = self._noop_span
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+
+    @staticmethod
+    def _noop_span(name: str, **attributes) -> _NoopSpan:
+        return _NOOP_SPAN
+
+    def _recording_span(self, name: str, **attributes) -> Span | _NoopSpan:
+        trace = getattr(self._local, "trace", None)
+        if trace is None:
+            if self._sampler == "head" and random.random() >= self._sample_rate:
+                return _UnsampledRoot(self._local)
+            trace = self._local.trace = _Trace()
+        elif trace.__class__ is _UnsampledRoot:
+            return _NOOP_SPAN
+        return Span(self, trace, name, attributes)
+
+    def _end_trace(self, trace: _Trace, root: Span):
+        self._local.trace = None
+        if (
+            self._sampler == "tail"
+            and root.end_ns - root.start_ns < self._slow_threshold_ns
+        ):
+            return
+        with self._lock:
+            self._traces.append(trace)
+
+    def traces(self) -> list[list[Span]]:
+        """The spans of the kept traces, each in the order they ended."""
+        with self._lock:
+            return [trace.spans for trace in self._traces]
+
+    def export(self, path: str, trace_format: Literal["chrome", "otlp"] = "chrome"):
+        """Writes the kept traces to `path`, as Chrome trace events (for
+        chrome://tracing or Perfetto) or as OTLP JSON."""
+        with self._lock:
+            traces = list(self._traces)
+        if trace_format == "chrome":
+            document = _chrome_trace(traces)
+        else:
+            document = _otlp_trace(traces)
+        # written aside then renamed, readers never see a partial file
+        with open(f"{path}.tmp", "w", encoding="utf-8") as stream:
+            json.dump(document, stream)
+        os.replace(f"{path}.tmp", path)
+        return len(traces)
+
+
+def _chrome_trace(traces: list[_Trace]) -> dict:
+    pid = os.getpid()
+    return {
+        "traceEvents": [
+            {
+                "name": span.name,
+                "ph": "X",
+                "ts": span.start_ns / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "pid": pid,
+                "tid": trace.thread_id,
+                "args": {"trace_id": trace.trace_id, **span.attributes},
+            }
+            for trace in traces
+            for span in trace.spans
+        ],
+        "displayTimeUnit": "ms",
+    }
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # 64-bit integers are strings in OTLP JSON
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> list[dict]:
+    return [
+        {"key": key, "value": _otlp_value(value)} for key, value in attributes.items()
+    ]
+
+
+def _otlp_trace(traces: list[_Trace]) -> dict:
+    spans = []
+    for trace in traces:
+        for span in trace.spans:
+            otlp_span = {
+                "traceId": trace.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,  # internal
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": _otlp_attributes(
+                    {"thread.id": trace.thread_id, **span.attributes}
+                ),
+            }
+            if span.parent_id:
+                otlp_span["parentSpanId"] = span.parent_id
+            if "error" in span.attributes:
+                otlp_span["status"] = {"code": 2}  # error
+            spans.append(otlp_span)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": _otlp_attributes(
+                        {"service.name": "urlshortener", "process.pid": os.getpid()}
+                    )
+                },
+                "scopeSpans": [{"scope": {"name": "urlshortener"}, "spans": spans}],
+            }
+        ]
+    }
+
+
+TRACER = Tracer()
+
+
+class TraceRecorder:
+    """Enables the tracer for the lifetime of a process and exports its traces
+    to `path` every `flush_interval` seconds, then when the process stops.
+
+    `path` may hold a `{pid}` placeholder, so that the workers of a server each
+    write their own file.
+    """
+
+    def __init__(
+        self,
+        tracer: Tracer,
+        path: str,
+        trace_format: Literal["chrome", "otlp"],
+        flush_interval: float,
+        sampler: Literal["head", "tail"],
+        sample_rate: float,
+        slow_threshold_ms: float,
+        max_traces: int,
+    ):
+        self._tracer = tracer
+        self._path = path
+        self._trace_format = trace_format
+        self._flush_interval = flush_interval
+        self._options = dict(
+            sampler=sampler,
+            sample_rate=sample_rate,
+            slow_threshold_ms=slow_threshold_ms,
+            max_traces=max_traces,
+        )
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._closed = threading.Event()
+        self._flusher = None
+
+    def initialize(self):
+        self._tracer.enable(**self._options)
+        self._closed.clear()
+        self._flusher = threading.Thread(
+            target=self._run_flusher, name="trace-flusher", daemon=True
+        )
+        self._flusher.start()
+        return self
+
+    def finalize(self):
+        self._tracer.disable()
+        self._closed.set()
+        if self._flusher:
+            self._flusher.join()
+        self.flush()
+
+    def __enter__(self):
+        return self.initialize()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def flush(self):
+        path = self._path.format(pid=os.getpid())
+        try:
+            exported = self._tracer.export(path, self._trace_format)
+        except OSError as e:
+            self._log.error("could not export the traces to %s: %s", path, e)
+            return
+        self._log.debug("%d traces exported to %s", exported, path)
+
+    def _run_flusher(self):
+        while not self._closed.wait(self._flush_interval):
+            self.flush()
+
+
+def build_trace_recorder(settings: ShortenerSettings) -> TraceRecorder | None:
+    """The recorder of the process traces, None when tracing is disabled."""
+    if not settings.tracing_enabled:
+        return None
+    return TraceRecorder(
+        TRACER,
+        path=settings.tracing_path,
+        trace_format=settings.tracing_format,
+        flush_interval=settings.tracing_flush_interval,
+        sampler=settings.tracing_sampler,
+        sample_rate=settings.tracing_sample_rate,
+        slow_threshold_ms=settings.tracing_slow_threshold_ms,
+        max_traces=settings.tracing_max_traces,
+    )
@@ -1,14 +1,55 @@
 import logging
+from typing import TYPE_CHECKING
 from urllib.parse import urlparse
 
 from urlshortener.algorithms.shortening_algorithm import ShorteningAlgorithm
-from urlshortener.repository.repository import URLRepository
+from urlshortener.metrics import REGISTRY
+from urlshortener.repository.repository import (
+    ShortURLCollisionError,
+    URLMapping,
+    URLRepository,
+)
+from urlshortener.tracing import TRACER
+
+if TYPE_CHECKING:
+    from urlshortener.analytics import ClickAggregator
+    from urlshortener.expiry import ExpiryRefresher
+
+MINIFY_TOTAL = REGISTRY.counter(
+    "urlshortener_minify_total",
+    "Minified urls, by whether the mapping already existed or was created",
+    ("algorithm", "outcome"),
+)
+EXPAND_TOTAL = REGISTRY.counter(
+    "urlshortener_expand_total",
+    "Expanded short urls, by whether they were found, not found or expired",
+    ("algorithm", "outcome"),
+)
+
+
+def get_url_domain(url: str, fixed_domain: str = None) -> str:
+    if fixed_domain:
+        return fixed_domain
+    parsed = urlparse(url)
+    if not parsed.scheme or not parsed.netloc:
+        raise ValueError("Invalid url format")
+    return f"{parsed.scheme}://{parsed.netloc}/"
 
 
 class URLShortener:
-    def __init__(self, repository: URLRepository, fixed_domain: str = None):
+    def __init__(
+        self,
+        repository: URLRepository,
+        fixed_domain: str = None,
+        max_collision_retries: int = 3,
+        clicks: "ClickAggregator" = None,
+        expiry: "ExpiryRefresher" = None,
+    ):
         self._repository = repository
         self._fixed_domain = fixed_domain
+        self._max_collision_retries = max_collision_retries
+        self._clicks = clicks
+        self._expiry = expiry
         self._log = logging.getLogger(self.__class__.__name__)
 
     def minify(self, url: str, algorithm: ShorteningAlgorithm) -> str | None:
@@ -17,15 +58,44 @@ class URLShortener:
         if not url:
             raise ValueError("No URL specified")
 
-        self._log.debug(f"Minifying URL {url} using algorithm '{algorithm}'")
+        self._log.debug("Minifying URL %s using algorithm '%s'", url, algorithm)
 
-        existing_url = self._get_shortened_url(url=url, algorithm=algorithm.type())
-        if existing_url:
-            self._log.debug(f"URL {url} already minified. Returning it.")
-            return existing_url
+        with TRACER.span("minify", algorithm=algorithm.type().value) as span:
+            with TRACER.span("parse_domain"):
+                url_domain = self._get_url_domain(url)
+            for attempt in range(self._max_collision_retries + 1):
+                with TRACER.span("hash", attempt=attempt):
+                    if attempt:
+                        url_hash = algorithm.rehash(url=url, attempt=attempt)
+                    else:
+                        url_hash = algorithm.shorten(url=url)
+                try:
+                    # one atomic round trip: returns the existing short url, if
+                    # any, or stores the candidate one
+                    with TRACER.span("repository.get_or_create_short_url"):
+                        short_url, created = self._repository.get_or_create_short_url(
+                            original_url=url,
+                            short_url=f"{url_domain}{url_hash}",
+                            algorithm=algorithm.type().value,
+                        )
+                except ShortURLCollisionError:
+                    self._log.debug(
+                        "%s%s is taken, rehashing %s", url_domain, url_hash, url
+                    )
+                else:
+                    outcome = "created" if created else "existing"
+                    MINIFY_TOTAL.inc(algorithm.type().value, outcome)
+                    span.set(outcome=outcome)
+                    if not created:
+                        algorithm.release(url_hash)
+                        if self._expiry:
+                            self._expiry.record(url, short_url, algorithm.type().value)
+                    return short_url
 
-        self._log.debug(f"URL {url} not minified yet.")
-        return self._minify_save_url(url=url, algorithm=algorithm)
+        raise ShortURLCollisionError(
+            f"No free short url found for {url} after {attempt + 1} attempts",
+            original_urls=[url],
+        )
 
     def expand(self, short_url: str, algorithm: ShorteningAlgorithm) -> str | None:
         if not algorithm:
@@ -34,41 +104,141 @@ class URLShortener:
         if not short_url:
             raise ValueError("No URL specified")
 
-        # Check if the shortened URL is in the database and not expired
-        existing_url = self._repository.get_original_url(
-            short_url=short_url, algorithm=algorithm.type().value
-        )
-        if existing_url:
-            return existing_url
-        else:
-            return f"not found or expired"
-
-    def _get_shortened_url(
-        self, url: str, algorithm: ShorteningAlgorithm
-    ) -> str | None:
-        # Check if the URL is already in the database
-        existing_url = self._repository.get_short_url(
-            original_url=url,
-            algorithm=algorithm.value,
-        )
-        return existing_url
-
-    def _minify_save_url(self, url: str, algorithm: ShorteningAlgorithm) -> str:
-        url_domain = self._get_url_domain(url)
-        url_hash = algorithm.shorten(url=url)
-        short_url = f"{url_domain}{url_hash}"
-        self._log.debug(f"URL {url} minified {short_url}. Storing it.")
-        self._repository.save_url_mapping(
-            original_url=url,
-            short_url=short_url,
-            algorithm=algorithm.type().value,
+        with TRACER.span("expand", algorithm=algorithm.type().value) as span:
+            # Check if the shortened URL is in the database and not expired
+            with TRACER.span("repository.get_mapping_by_short_url"):
+                mapping = self._repository.get_mapping_by_short_url(
+                    short_url=short_url, algorithm=algorithm.type().value
+                )
+            if not mapping:
+                outcome = "not_found"
+            elif mapping.is_expired():
+                outcome = "expired"
+            else:
+                outcome = "found"
+                if self._clicks:
+                    self._clicks.record(short_url)
+                if self._expiry:
+                    self._expiry.record(
+                        mapping.original_url,
+                        short_url,
+                        mapping.algorithm,
+                        mapping.expiration_time,
+                    )
+            EXPAND_TOTAL.inc(algorithm.type().value, outcome)
+            span.set(outcome=outcome)
+        if outcome == "found":
+            return mapping.original_url
+        return f"not found or expired"
+
+    def resolve(
+        self, short_url: str, algorithm: ShorteningAlgorithm
+    ) -> URLMapping | None:
+        # like expand, but an expired mapping is returned too so that callers can
+        # tell apart urls that never existed from the ones that expired
+        if not algorithm:
+            raise ValueError("No algorithm specified")
+
+        if not short_url:
+            raise ValueError("No URL specified")
+
+        with TRACER.span("resolve", algorithm=algorithm.type().value):
+            with TRACER.span("repository.get_mapping_by_short_url"):
+                mapping = self._repository.get_mapping_by_short_url(
+                    short_url=short_url, algorithm=algorithm.type().value
+                )
+        if mapping and not mapping.is_expired():
+            if self._clicks:
+                self._clicks.record(short_url)
+            if self._expiry:
+                self._expiry.record(
+                    mapping.original_url,
+                    short_url,
+                    mapping.algorithm,
+                    mapping.expiration_time,
+                )
+        return mapping
+
+    def minify_batch(
+        self, urls: list[str], algorithm: ShorteningAlgorithm
+    ) -> dict[str, str]:
+        if not algorithm:
+            raise ValueError("No algorithm specified")
+
+        urls = list(dict.fromkeys(urls))
+        self._log.debug("Minifying %d URLs using algorithm '%s'", len(urls), algorithm)
+
+        with TRACER.span(
+            "minify_batch", algorithm=algorithm.type().value, urls=len(urls)
+        ):
+            # one lookup for the whole batch, then one bulk write for the misses
+            with TRACER.span("repository.get_short_urls"):
+                short_urls = self._repository.get_short_urls(
+                    original_urls=urls, algorithm=algorithm.type().value
+                )
+            MINIFY_TOTAL.inc(algorithm.type().value, "existing", amount=len(short_urls))
+            if self._expiry:
+                for url, short_url in short_urls.items():
+                    self._expiry.record(url, short_url, algorithm.type().value)
+            with TRACER.span("hash"):
+                new_mappings = {
+                    url: f"{self._get_url_domain(url)}{algorithm.shorten(url=url)}"
+                    for url in urls
+                    if url not in short_urls
+                }
+            if new_mappings:
+                self._log.debug(
+                    "%d URLs not minified yet. Storing them.", len(new_mappings)
+                )
+                retried_urls = []
+                try:
+                    with TRACER.span("repository.save_url_mappings"):
+                        self._repository.save_url_mappings(
+                            url_mappings=new_mappings, algorithm=algorithm.type().value
+                        )
+                except ShortURLCollisionError as e:
+                    # the rest of the batch is stored, colliding urls are retried
+                    # one by one with a rehashed code
+                    retried_urls = e.original_urls
+                    for url in retried_urls:
+                        new_mappings[url] = self.minify(url=url, algorithm=algorithm)
+                # the retried urls are counted by minify
+                MINIFY_TOTAL.inc(
+                    algorithm.type().value,
+                    "created",
+                    amount=len(new_mappings) - len(retried_urls),
+                )
+        short_urls.update(new_mappings)
+        return short_urls
+
+    def expand_batch(
+        self, short_urls: list[str], algorithm: ShorteningAlgorithm
+    ) -> dict[str, str]:
+        if not algorithm:
+            raise ValueError("No algorithm specified")
+
+        short_urls = list(dict.fromkeys(short_urls))
+        with TRACER.span(
+            "expand_batch", algorithm=algorithm.type().value, urls=len(short_urls)
+        ):
+            with TRACER.span("repository.get_original_urls"):
+                original_urls = self._repository.get_original_urls(
+                    short_urls=short_urls, algorithm=algorithm.type().value
+                )
+        # batch lookups do not return expired mappings, those count as not found
+        EXPAND_TOTAL.inc(algorithm.type().value, "found", amount=len(original_urls))
+        if self._clicks:
+            for short_url in original_urls:
+                self._clicks.record(short_url)
+        if self._expiry:
+            for short_url, original_url in original_urls.items():
+                self._expiry.record(original_url, short_url, algorithm.type().value)
+        EXPAND_TOTAL.inc(
+            algorithm.type().value,
+            "not_found",
+            amount=len(short_urls) - len(original_urls),
         )
-        return short_url
+        return original_urls
 
     def _get_url_domain(self, url: str) -> str:
-        if self._fixed_domain:
-            return self._fixed_domain
-        parsed = urlparse(url)
-        if not parsed.scheme or not parsed.netloc:
-            raise ValueError("Invalid url format")
-        return f"{parsed.scheme}://{parsed.netloc}/"
+        return get_url_domain(url, self._fixed_domain)